@@ -7,25 +7,123 @@
 #include <glm/glm.hpp>
 #include <string>
 #include <vector>
+#include <list>
+#include <map>
+#include <tuple>
+#include <unordered_map>
+#include <functional>
 #include <iostream>
+#include <chrono>
 #define GLM_ENABLE_EXPERIMENTAL
 #include <glm/gtx/string_cast.hpp>
 
 //#include "image.h"
 
+#define AOS_MAX_VIEWS_PER_PASS 128 // views accumulated per draw call in single-pass rendering (see MAX_VIEWS in the *_array shaders)
+#define AOS_READBACK_BUFFERS 3 // pixel buffers used for pipelined readbacks (renderBatch, renderFocalStack)
+#define AOS_ASYNC_READBACKS 4 // results of renderAsync that can be pending before they are overwritten
+#define AOS_INCREMENTAL_REBUILD 1024 // view updates after which the incremental integral is rebuilt (limits floating-point drift)
+#define AOS_DEM_CACHE_VERSION 1 // version of the binary mesh cache of raster DEMs (see loadDEMFromHeights)
+#define AOS_LIGHTFIELD_VERSION 1 // version of packed light fields (see loadLightField)
+#define AOS_TEXTURE_POOL 0 // default bytes of freed view textures kept for reuse, i.e., no pool (see setTexturePool)
+
 // predeclarations
 class Model;
 class Shader;
+struct __GLsync;
+
 
+// pixel types of interleaved (HWC) image buffers that can be uploaded directly
+enum PIXTYPE { PIX_UINT8, PIX_FLOAT16, PIX_FLOAT32 };
+// focus measures of autofocus: variance or mean squared gradient of the luminance of the integral
+enum FOCUSMETRIC { FOCUS_VARIANCE, FOCUS_GRADIENT };
 
 typedef struct {
 	//Image* img;
 	glm::mat4 corr; // correction applied on pose (e.g. compass corrections)
 	glm::mat4 pose; // pose (usually provided by pose file)
-	unsigned int ogl_id; // opengl texture id
+	unsigned int ogl_id; // opengl texture id (0 if the texture is not resident, see setTextureBudget)
+	int w, h, c; // texture size and channels
+	PIXTYPE type; // pixel type of the uploaded data
+	size_t gpu_bytes; // size of the texture on the GPU
+	std::vector<unsigned char> data; // CPU copy of the view (HWC) for uploads on demand, empty if the texture is pinned on the GPU
+	unsigned long long last_used; // residency clock of the last render that used the view
+	float scale; // scale applied to texture values when sampling (e.g. 255 for normalized 8-bit textures)
+	float adjust_scale, adjust_offset; // exposure adjustment of the colors: rgb * adjust_scale + adjust_offset (see setViewAdjustment)
+	unsigned int mask; // mask group of the view (see setMask)
+	unsigned int camera; // camera group of the view (see setCameraCalibration)
 	std::string name;
+	glm::vec3 footprint_min, footprint_max; // bounding box of the DEM region the view is projected on (see updateFootprints)
+	bool footprint_empty, footprint_valid;
 } View;
 
+// statistics of an integral (over all pixels with alpha > 0, rgb divided by alpha)
+typedef struct {
+	glm::vec4 min, max, mean;
+	unsigned int count = 0; // number of pixels with alpha > 0
+} IntegralStats;
+
+// texture residency of the views (see setTextureBudget)
+typedef struct {
+	size_t budget = 0; // 0 = unlimited
+	size_t resident_bytes = 0;
+	unsigned int resident_views = 0, views = 0;
+	unsigned long long uploads = 0, evictions = 0; // since the last reset
+	size_t upload_bytes = 0; // since the last reset
+	size_t group_bytes = 0; // shared masks and undistortion maps, pinned and part of resident_bytes
+	size_t pool_budget = 0, pooled_bytes = 0; // freed textures kept for reuse (see setTexturePool)
+	unsigned int pooled_textures = 0;
+	unsigned long long allocations = 0, reuses = 0; // view textures allocated and taken from the pool since the last reset
+} ResidencyStats;
+
+// integral cache of render (see setIntegralCache)
+typedef struct {
+	size_t budget = 0; // 0 = disabled
+	size_t bytes = 0;
+	unsigned int entries = 0;
+	unsigned long long hits = 0, misses = 0, evictions = 0; // since the last reset
+} IntegralCacheStats;
+
+// time spent in one pass of a profiled call (see setProfiling)
+typedef struct {
+	std::string name; // e.g., gbuffer, project, readback
+	double cpu_ms; // wall-clock time on the CPU (passes that wait for the GPU, like readbacks, include the waiting)
+	double gpu_ms; // time on the GPU measured with timer queries, -1 if not available
+	unsigned int query; // timer query of the pass (0 if none)
+} ProfileStage;
+
+// timings of the last profiled call and cumulative counters
+typedef struct {
+	std::string call; // render, renderForward, renderStats, autofocus, addView, addViews or getStats
+	double cpu_ms = 0.0; // wall-clock time of the call
+	std::vector<ProfileStage> stages;
+	// counted also if profiling is disabled (since construction or resetTimings)
+	unsigned long long views_projected = 0, bytes_uploaded = 0, bytes_read_back = 0;
+	unsigned long long dem_tiles_drawn = 0; // tiles of raster DEMs that passed frustum culling
+	unsigned long long dem_triangles_drawn = 0; // triangles of the drawn tiles on their levels of detail (without skirts)
+} Timings;
+
+// tile of a raster DEM with its levels of detail (see loadDEMFromHeights)
+typedef struct {
+	std::vector<int> surface, skirt; // meshes of each level in the DEM model (-1 if empty), starting with the finest level
+	glm::vec3 bounds_min, bounds_max; // in model coordinates, including the skirts
+	float cell_size; // grid spacing of the finest level
+} DEMTile;
+
+// pixel buffer for an asynchronous readback of an integral
+typedef struct {
+	unsigned int pbo = 0;
+	struct __GLsync* fence = NULL; // signaled when the transfer into the pixel buffer is done
+	long long ticket = -1; // ticket of the renderAsync call stored in the buffer
+} Readback;
+
+// pixel buffer mapped for writing the data of a view (see mapUploadBuffer)
+typedef struct {
+	unsigned int pbo = 0;
+	size_t size = 0;
+	void* mapped = NULL;
+} UploadBuffer;
+
 // Airborne Optical Sectioning light field renderer:
 class AOS
 {
@@ -39,38 +137,171 @@ private:
 	// digital elevation model or focal surface
 	Model *dem_model = NULL;
 	glm::mat4 dem_transf; // DEM transformation matrix
+	glm::vec3 dem_bounds_min, dem_bounds_max; // bounding box of the DEM (in model coordinates)
+	bool dem_is_plane = false; // the DEM is a rectangle with constant height (in model coordinates)
+	float dem_plane_z = 0.0f; glm::vec4 dem_plane_bounds; // height and extent (min x, min y, max x, max y) of the planar DEM
+	// raster DEMs: tiles with levels of detail, only the tiles in the view frustum are drawn (empty for DEMs from OBJ files)
+	std::vector<DEMTile> dem_tiles;
+	float dem_lod_error = 1.0f; // coarser levels are drawn if their grid cells are at most this many pixels large (0 = finest level only)
 
 	// FBOs
 	unsigned int fboIntegral, tIntegral; // fbo and texture for integral
 	unsigned int fboGBuffer, gPosition; // fbo and texture for deferred shading
-	unsigned int fboCount = 0; glm::vec4 fboMin; glm::vec4 fboMax;
+	unsigned int tMoments = 0; // second render target of fboIntegral: sum of the weighted squared colors and count of the views (renderStats)
+	unsigned int fboMoments = 0, tMeanCount = 0, tVarianceWeight = 0; // mean/count and variance/weight resolved from the integral and the moments
+	bool render_moments = false; // renderIntegral accumulates the moments into tMoments as well
+	IntegralStats fboStats; // statistics of the integral in fboIntegral, only valid if !fbo_stats_dirty
+	bool fbo_stats_dirty = true;
+	unsigned int statsSSBO = 0; // partial results of the statistics reduction
+	unsigned int gatherSSBO[2] = { 0, 0 }; // pixels and positions of pixelsToWorld
+	size_t gather_capacity = 0; // pixels that fit into gatherSSBO
+	unsigned int focusSSBO = 0; // partial sums of the focus measure per block of 16 x 16 pixels (see focus_measure.cs.glsl)
 	Image fboImg;
 	Image gBufImg;
+	unsigned int quadVAO = 0, quadVBO = 0; // full-screen quad
+
+	// culling of views that cannot contribute to the integral
+	bool view_culling = true;
+	glm::vec3 footprint_dem_min, footprint_dem_max; // DEM bounding box used for the view footprints
+
+	// single-pass rendering: copies of all views as layers of texture arrays, per-view data in a uniform buffer
+	bool single_pass = false;
+	bool view_arrays_dirty = true;
+	std::vector<unsigned int> view_arrays;
+	unsigned int view_array_layers = 0; // layers per texture array
+	unsigned int fboCopy = 0, viewUBO = 0;
+
+	// texture residency: with a budget, views keep a CPU copy and textures are uploaded on demand and evicted least-recently-used
+	size_t texture_budget = 0; // bytes, 0 = unlimited
+	size_t resident_bytes = 0;
+	unsigned long long residency_clock = 0;
+	ResidencyStats residency; // upload/eviction counters
+
+	// texture pool: freed view textures by size and format (width, height, channels, 8-bit), reused by addView and replaceView without allocating storage
+	std::map<std::tuple<int, int, int, bool>, std::vector<unsigned int>> texture_pool;
+	size_t texture_pool_budget = AOS_TEXTURE_POOL, texture_pool_bytes = 0;
+
+	// integral cache: images returned by render (most recently used first), keyed by the virtual camera, ids, roi, DEM and scene_version
+	struct CachedIntegral {
+		std::string key;
+		std::vector<glm::vec4> pixels;
+	};
+	std::list<CachedIntegral> integral_cache;
+	std::unordered_map<std::string, std::list<CachedIntegral>::iterator> integral_cache_index;
+	size_t integral_cache_budget = 0, integral_cache_bytes = 0; // bytes, 0 = disabled
+	IntegralCacheStats integral_cache_stats; // hit/miss/eviction counters
+	unsigned long long scene_version = 0; // incremented whenever the views, their poses, masks or the DEM change
+
+	// shared masks: the alpha of a view is multiplied with the mask texture of its group (0 = no mask)
+	std::vector<unsigned int> masks;
+	// lens undistortion: offsets from undistorted to distorted (raw) texture coordinates per camera group (0 = no undistortion)
+	std::vector<unsigned int> undistort_maps;
+	std::vector<size_t> mask_bytes, undistort_bytes; // sizes of the group textures, counted in resident_bytes
+
+	// incremental rendering: integral of all views for the last virtual camera and DEM, updated when views change
+	bool incremental = false, incremental_valid = false;
+	unsigned int fboIncremental = 0, tIncremental = 0, fboIncGBuffer = 0, gIncPosition = 0;
+	glm::mat4 inc_pose, inc_projection, inc_dem_transf;
+	unsigned int inc_updates = 0; // views added/removed since the last rebuild
+
+	// profiling: cpu timers and timer queries per pass, only if enabled
+	bool profiling = false, profile_active = false;
+	int stage_depth = 0; // passes nested in a pass (e.g., the uploads of addView in addViews) are timed as part of the outer one
+	int gpu_timers = -1; // timer queries are supported (-1 = not checked yet)
+	Timings timings;
+	std::chrono::steady_clock::time_point profile_start, stage_start;
+	std::vector<unsigned int> timer_queries; // reused across calls
+
+	// pixel buffers for asynchronous readbacks
+	Readback pboRing[AOS_READBACK_BUFFERS];
+	Readback pboAsync[AOS_ASYNC_READBACKS];
+	long long async_ticket = 0;
+
+	// pixel buffers for streaming uploads
+	std::vector<UploadBuffer> upload_buffers;
+	unsigned int upload_pbo = 0; // pixel buffer the next texture upload reads from (its data is an offset into the buffer)
 
 	// shaders
 	Shader* showFboShader; // ("../show_fbo.vs.glsl", "../show_fbo.fs.glsl");
 	Shader* projectShader; // ("../deferred_project_image.vs.glsl", "../deferred_project_image.fs.glsl");
 	Shader* demShader; // ("../project_image.vs.glsl", "../show_fbo.fs.glsl");
 	Shader* gBufferShader; // ("../g_buffer.vs.glsl", "../g_buffer.fs.glsl");
+	Shader* gBufferPlaneShader; // g-buffer of a planar DEM computed analytically
+	Shader* statsShader; // compute shader for the statistics of the integral
+	Shader* gatherShader; // compute shader gathering the positions of pixels from the g-buffer (pixelsToWorld)
+	Shader* momentsShader; // resolves the mean and variance from the integral and the moments (renderStats)
+	Shader* focusShader; // compute shader for the focus measure of the integral (autofocus)
 	Shader* forwardShader; // shader for rendering with forward rendering
+	Shader* projectArrayShader; // deferred shader for single-pass rendering with texture arrays
+	Shader* forwardArrayShader; // forward shader for single-pass rendering with texture arrays
+	Shader* copyLayerShader; // copies a view into a layer of a texture array
 
 public:
 	AOS(unsigned int width, unsigned int height, float fovDegree = 50.815436217896945f, int preallocate_images = -1);
 	~AOS();
 
 	void addView(Image img, glm::mat4 pose, std::string name = "");
+	// add a view from an interleaved (HWC, row-major) buffer without converting it to an Image first
+	void addView(const void* data, int w, int h, int c, PIXTYPE type, glm::mat4 pose, std::string name = "");
+	// add n views of the same size from a contiguous (N,H,W,C) buffer
+	void addViews(const void* data, unsigned int n, int w, int h, int c, PIXTYPE type, const std::vector<glm::mat4>& poses, const std::vector<std::string>& names = {});
+	// add the views of a packed light field (*.aoslf, e.g., written by LFR_utils.pack_light_field) with their names, pose corrections, adjustments and the shared mask (group 0).
+	// The file is memory-mapped and the interleaved images are uploaded straight from the mapping. Returns the number of added views.
+	unsigned int loadLightField(const std::string& file);
+	// streaming uploads: mapUploadBuffer maps a pixel buffer (slot) of at least bytes for writing. The memory can be filled by any thread 
+	// (e.g., decoding threads), OpenGL is only called on the thread of the context. addViewFromUploadBuffer adds a view from the filled 
+	// buffer without copying its data on the CPU. Mapping a slot again discards its previous data.
+	void* mapUploadBuffer(unsigned int slot, size_t bytes);
+	void addViewFromUploadBuffer(unsigned int slot, int w, int h, int c, PIXTYPE type, glm::mat4 pose, std::string name = "");
+	void releaseUploadBuffers();
 	//Image getImage(unsigned int idx);
 	glm::mat4 getPose(unsigned int idx) const { return ogl_imgs[idx].pose; }
-	glm::mat4 setPose(unsigned int idx, const glm::mat4 pose) { ogl_imgs[idx].pose = pose; return pose; }
+	glm::mat4 setPose(unsigned int idx, const glm::mat4 pose);
+	// sets the poses of the views ids (of all views if ids is empty), e.g., for pose optimization. 
+	// An incremental integral is rebuilt by the next render unless updating it view by view is cheaper.
+	void setPoses(const std::vector<glm::mat4>& poses, const std::vector<unsigned int>& ids = {});
 	const glm::vec3 getPosition(const unsigned int index) const { return glm::vec3(glm::inverse(getPose(index))[3]); }
 	const glm::vec3 getUp(const unsigned int index) const { return glm::vec3(glm::inverse(getPose(index))[1]); }
 	const glm::vec3 getForward(const unsigned int index) const { return glm::vec3(glm::inverse(getPose(index))[2]); }
 	std::string getName(unsigned int idx) const { return ogl_imgs[idx].name; }
+	// exposure adjustment applied to the colors of a view when rendering: rgb * scale + offset (alpha is not changed). Reset by replaceView.
+	void setViewAdjustment(unsigned int idx, float scale, float offset);
+	// value range of a view: its colors are divided by range (e.g., 255 renders 8-bit views in [0,1]), independent of the exposure adjustment. Reset by replaceView.
+	void setValueRange(unsigned int idx, float range);
+	glm::vec2 getViewAdjustment(unsigned int idx) const { return glm::vec2(ogl_imgs[idx].adjust_scale, ogl_imgs[idx].adjust_offset); }
+	// shared masks: instead of an alpha channel per view, the alpha of all views in a mask group (default 0) is multiplied with one single-channel mask.
+	// The mask is sampled like the views, so it can have a different size. Views without an alpha channel can be stored with 3 channels.
+	void setMask(Image mask, unsigned int group = 0);
+	void setMask(const void* data, int w, int h, PIXTYPE type, unsigned int group = 0);
+	void clearMask(unsigned int group = 0);
+	bool hasMask(unsigned int group = 0) const { return group < masks.size() && masks[group] != 0; }
+	void setViewMask(unsigned int idx, unsigned int group);
+	unsigned int getViewMask(unsigned int idx) const { return ogl_imgs[idx].mask; }
+	// lens undistortion: the views of a camera group (default 0) are raw frames that are undistorted when they are sampled.
+	// map: interleaved (x,y) pixel coordinates in the raw frames (of size src_w x src_h) for each pixel of the undistorted w x h image, like the maps of OpenCV's initUndistortRectifyMap
+	void setUndistortionMap(const float* map, int w, int h, int src_w, int src_h, unsigned int group = 0);
+	// builds the map from pinhole intrinsics and distortion coefficients (k1, k2, p1, p2[, k3[, k4, k5, k6]] like OpenCV) for frames of size w x h
+	void setCameraCalibration(float fx, float fy, float cx, float cy, const std::vector<float>& dist, int w, int h, unsigned int group = 0);
+	void clearUndistortion(unsigned int group = 0);
+	bool hasUndistortion(unsigned int group = 0) const { return group < undistort_maps.size() && undistort_maps[group] != 0; }
+	void setViewCamera(unsigned int idx, unsigned int group);
+	unsigned int getViewCamera(unsigned int idx) const { return ogl_imgs[idx].camera; }
 	void removeView(unsigned int idx);
+	// removes the views ids (in any order) in a single pass over the views
+	void removeViews(const std::vector<unsigned int>& ids);
+	void clearViews();
 	void replaceView(unsigned int idx, Image img, glm::mat4 pose, std::string name = "");
+	void replaceView(unsigned int idx, const void* data, int w, int h, int c, PIXTYPE type, glm::mat4 pose, std::string name = "");
 
 	// DEM functions
-	void loadDEM(std::string obj_file);
+	void loadDEM(std::string obj_file); // OBJ file (via Assimp) or a mesh cache of a raster DEM (*.aosdem)
+	// raster DEM from a grid of rows x cols heights: vertex (r,c) is at (origin.x + c * spacing.x, origin.y + r * spacing.y, heights[r * cols + c]), NaN heights are holes.
+	// The mesh is split into tiles of tile_size x tile_size cells with levels of detail. If a cache file is given, the meshes are loaded from it if it 
+	// was built from the same grid, otherwise they are built and written to it.
+	void loadDEMFromHeights(const float* heights, int rows, int cols, glm::vec2 origin, glm::vec2 spacing, int tile_size = 128, std::string cache_file = "");
+	void setDEMLODError(float pixels) { dem_lod_error = pixels; }
+	float getDEMLODError() const { return dem_lod_error; }
+	unsigned int getDEMTiles() const { return (unsigned int)dem_tiles.size(); }
 	Model* getDEM(void) { return dem_model; }
 	void setDEMTransformation(const glm::mat4 model) { dem_transf = model; }
 	void setDEMTransformation(const glm::vec3 translation, const glm::vec3 eulerAngles = glm::vec3(0));
@@ -80,12 +311,51 @@ public:
 	void setPoseCorrection( const unsigned int index,const glm::vec3 translation, const glm::vec3 eulerAngles = glm::vec3(0));
 	glm::mat4 getPoseCorrection( const unsigned int index ) const { return ogl_imgs[index].corr; }
 	void resetPoseCorrection( const unsigned int index ){setPoseCorrection(index, glm::vec3(0), glm::vec3(0));};
+	// sets the corrections of the views ids (of all views if ids is empty), see setPoses
+	void setPoseCorrections(const std::vector<glm::vec3>& translations, const std::vector<glm::vec3>& eulerAngles, const std::vector<unsigned int>& ids = {});
 
 
-	Image render(const glm::mat4 virtual_pose, const float virtual_fovDegree, const std::vector<unsigned int> ids = {});
+	// roi (x, y, width, height in framebuffer pixels, origin at the bottom left) restricts rendering and the readback to a sub-rectangle; 
+	// the returned image has the size of the roi. Pixels outside the roi are cleared (except with incremental rendering). An empty roi renders the whole image.
+	Image render(const glm::mat4 virtual_pose, const float virtual_fovDegree, const std::vector<unsigned int> ids = {}, const glm::ivec4 roi = glm::ivec4(0));
 	Image renderForward(const glm::mat4 virtual_pose, const float virtual_fovDegree, const std::vector<unsigned int> ids = {});
+	// renders integrals with the DEM translated by z_offsets (on top of the DEM transformation) into stack (Z x H x W x RGBA)
+	void renderFocalStack(const glm::mat4 virtual_pose, const float virtual_fovDegree, const std::vector<float>& z_offsets, const std::vector<unsigned int> ids, float* stack, bool flipX = false);
+	// renders one integral per virtual pose into frames (N x H x W x RGBA). virtual_fovDegrees has one entry for all poses or one per pose.
+	void renderBatch(const std::vector<glm::mat4>& virtual_poses, const std::vector<float>& virtual_fovDegrees, const std::vector<unsigned int> ids, float* frames, bool flipX = false);
+	// starts rendering an integral and returns a ticket for fetching it later. 
+	// At most AOS_ASYNC_READBACKS results can be pending, later calls overwrite the oldest one.
+	long long renderAsync(const glm::mat4 virtual_pose, const float virtual_fovDegree, const std::vector<unsigned int> ids = {});
+	// copies the integral of a renderAsync ticket to out (H x W x RGBA). Returns false if wait is false and the result is not ready yet.
+	bool fetch(long long ticket, float* out, bool flipX = false, bool wait = true);
+
+	// per-pixel statistics of the views (weighted by their alpha): mean (rgb) and number of contributing views (alpha) into mean_count, 
+	// variance (rgb) and sum of the weights (alpha, like the integral) into variance_weight (H x W x RGBA each).
+	// The sums of the colors, their squares and the count are accumulated with two render targets in a single projection pass.
+	void renderStats(const glm::mat4 virtual_pose, const float virtual_fovDegree, const std::vector<unsigned int> ids, float* mean_count, float* variance_weight, bool flipX = false);
+
+	// focus measures of the integrals with the DEM translated by z_offsets (like renderFocalStack) inside roi: variance (FOCUS_VARIANCE) or 
+	// mean squared gradient (FOCUS_GRADIENT) of the luminance of the pixels seen by any view. Only partial sums per block of 16 x 16 pixels are read back.
+	// With a tile_size (a multiple of 16), there is one measure per tile of the roi (row-major, tiles_x * tiles_y per offset, with flipX the tiles start at the right border of the roi),
+	// otherwise one per offset. The measure is NaN if no pixel is seen by any view.
+	std::vector<float> focusMeasures(const glm::mat4 virtual_pose, const float virtual_fovDegree, const std::vector<float>& z_offsets, const std::vector<unsigned int> ids = {},
+		const glm::ivec4 roi = glm::ivec4(0), FOCUSMETRIC metric = FOCUS_VARIANCE, int tile_size = 0, bool flipX = false);
+	// z offset of the DEM in [z_min, z_max] with the sharpest integral inside roi: the best of steps equidistant planes is refined with a golden-section search 
+	// until the bracket is smaller than tolerance. measure receives the focus measure of the returned offset.
+	float autofocus(const glm::mat4 virtual_pose, const float virtual_fovDegree, float z_min, float z_max, const std::vector<unsigned int> ids = {},
+		const glm::ivec4 roi = glm::ivec4(0), FOCUSMETRIC metric = FOCUS_VARIANCE, int steps = 9, float tolerance = 0.1f, float* measure = NULL);
+	// coarse depth map: the z offset with the sharpest integral per tile (see focusMeasures), i.e., the best of steps equidistant planes refined by 
+	// fitting a parabola to the measures of its neighbors. NaN for tiles without pixels seen by any view.
+	std::vector<float> autofocusTiles(const glm::mat4 virtual_pose, const float virtual_fovDegree, float z_min, float z_max, int tile_size, const std::vector<unsigned int> ids = {},
+		const glm::ivec4 roi = glm::ivec4(0), FOCUSMETRIC metric = FOCUS_VARIANCE, int steps = 17, bool flipX = false);
+
+	// min/max/mean/count of the last rendered integral. Computed on the GPU the first time it is requested after rendering.
+	const IntegralStats& getStats();
 
 	Image getXYZ();
+	// DEM positions seen by n pixels (x, y in framebuffer pixels) of the last rendered integral, w is 1 if the pixel shows the DEM (like getXYZ).
+	// The positions are gathered on the GPU, so only n positions are read back instead of the whole g-buffer.
+	void pixelsToWorld(const glm::vec2* pixels, size_t n, glm::vec4* xyz);
 	void display(bool normalize = true, bool flipX = true, bool flipY = true, bool use_colormap = false, glm::ivec3 colormap_rgb = {7, 5, 15});
 	//void display(int display_width, int display_height,  bool normalize = true);
 
@@ -98,13 +368,120 @@ public:
 	float setNearPlane(float np) { near_plane = np;  return near_plane; }
 	float setFarPlane(float fp) { far_plane = fp;  return far_plane; }
 
+	// views that contribute to the integral seen by the virtual camera (out of all views or ids).
+	// A view contributes if its footprint on the DEM's bounding box overlaps with the region seen by the virtual camera.
+	std::vector<unsigned int> queryViews(const glm::mat4 virtual_pose, const float virtual_fovDegree, const std::vector<unsigned int> ids = {});
+	// if enabled (default), views that cannot contribute to the integral are skipped when rendering
+	void setViewCulling(bool enable) { view_culling = enable; }
+	bool getViewCulling() const { return view_culling; }
+
+	// single-pass rendering: all views (of the same size) are accumulated per fragment in a single draw call instead of one draw call per view.
+	// Views of camera groups with an undistortion map are rendered per view (see setUndistortionMap).
+	// Note that this keeps an additional copy of the views in texture arrays on the GPU.
+	void setSinglePassRendering(bool enable) { single_pass = enable; if (!enable) deleteViewArrays(); }
+	bool getSinglePassRendering() const { return single_pass; }
+
+	// incremental rendering (e.g., for rolling windows over live streams): the integral of all views rendered for a virtual camera stays on the GPU.
+	// Views that are added, removed, replaced or moved afterwards are added to or subtracted from it, 
+	// so render (without ids) only projects the changed views. It is rebuilt if the virtual camera or the DEM changes.
+	void setIncrementalRendering(bool enable);
+	bool getIncrementalRendering() const { return incremental; }
+
+	// profiling of the render calls, the uploads (addView(s), loadLightField), getStats and pixelsToWorld: CPU and (if supported) GPU time of their passes.
+	// Disabled by default, the only overhead is then a check per pass.
+	void setProfiling(bool enable) { profiling = enable; }
+	bool getProfiling() const { return profiling; }
+	const Timings& getTimings() const { return timings; }
+	void resetTimings() { timings = Timings(); }
+
+	// limits the GPU memory used by view textures to bytes (0 = unlimited, default).
+	// With a budget, views added afterwards keep a CPU copy and are uploaded when a render needs them; the least recently used textures are evicted.
+	// Views added before the budget was set have no CPU copy and stay resident. Single-pass rendering is not used with a budget.
+	// Pooled textures (see setTexturePool) count against the budget and are deleted before views are evicted.
+	void setTextureBudget(size_t bytes);
+	size_t getTextureBudget() const { return texture_budget; }
+	ResidencyStats getResidencyStats() const;
+	void resetResidencyStats() { residency = ResidencyStats(); }
+	// textures of removed or replaced views are kept for reuse up to bytes (0 deletes them, the default), 
+	// so adding views of the same size and format (e.g., the next flight of the same camera) only uploads their data. setTexturePool(0) deletes the pooled textures.
+	void setTexturePool(size_t bytes);
+	size_t getTexturePool() const { return texture_pool_budget; }
+
+	// caches the images returned by render, the least recently used images are evicted if the cache exceeds bytes (0 disables the cache, the default).
+	// A render with the same virtual camera, ids, roi, DEM (transformation and level of detail) and scene version returns the cached image without rendering,
+	// so getStats, getXYZ, pixelsToWorld and display refer to the last integral that was actually rendered.
+	void setIntegralCache(size_t bytes);
+	size_t getIntegralCache() const { return integral_cache_budget; }
+	void clearIntegralCache();
+	IntegralCacheStats getIntegralCacheStats() const;
+	void resetIntegralCacheStats() { integral_cache_stats = IntegralCacheStats(); }
+	// incremented by every change of the views (adding, removing, replacing, poses, corrections, adjustments, masks, undistortion) and the DEM
+	unsigned long long getSceneVersion() const { return scene_version; }
+
 private:
 	unsigned int getOGLid(unsigned int idx) { return ogl_imgs[idx].ogl_id; }
-	unsigned int generateOGLTexture(Image img);
-	void uploadOGLTexture(unsigned int textureID, Image img);
+	unsigned int generateOGLTexture(const void* data, int w, int h, int c, PIXTYPE type);
+	void uploadOGLTexture(unsigned int textureID, const void* data, int w, int h, int c, PIXTYPE type, bool allocate = true);
+	unsigned int acquireTexture(const void* data, int w, int h, int c, PIXTYPE type);
+	void releaseTexture(unsigned int textureID, int w, int h, int c, PIXTYPE type);
+	void trimTexturePool(size_t bytes);
+	void updateViews(const std::vector<unsigned int>& ids, const std::function<void(View&, size_t)>& change);
+	static size_t getPixelSize(PIXTYPE type);
+	static void checkViewFormat(int c, PIXTYPE type);
+	static size_t getTextureSize(int w, int h, int c, PIXTYPE type) { return (size_t)w * h * c * (type == PIX_UINT8 ? 1 : 2); } // 8-bit or 16-bit float textures
+	void bindGroupTexture(Shader* shader, const std::vector<unsigned int>& textures, unsigned int group, unsigned int unit, const char* flag);
+	void uploadGroupTexture(std::vector<unsigned int>& textures, std::vector<size_t>& bytes, unsigned int group, const void* data, int w, int h, int c, PIXTYPE type);
+	void deleteGroupTexture(std::vector<unsigned int>& textures, std::vector<size_t>& bytes, unsigned int group);
+	void bindViewTextures(Shader* shader, const View& v, unsigned int mask_unit, unsigned int undistort_unit);
+	unsigned int residentTexture(unsigned int idx);
+	void evictTextures(size_t bytes);
+	std::string integralCacheKey(const glm::mat4& virtual_pose, const float virtual_fovDegree, const std::vector<unsigned int>& ids, const glm::ivec4& roi) const;
+	void cacheIntegral(const std::string& key, const float* data, size_t pixels);
+	void evictIntegrals(size_t bytes);
+	void updateResidency(View& v, const void* data, int w, int h, int c, PIXTYPE type);
 	void deleteOGLTexture(unsigned int textureID);
 	void initFrameBufferTexture(unsigned int* fbo, unsigned int* texture);
-	static unsigned int getMinMaxFromFBO(glm::vec4* fboData, const unsigned int fboSize, unsigned int& count, glm::vec4& minRGBA, glm::vec4& maxRGBA);
+	void attachRenderTarget(unsigned int fbo, unsigned int* texture, unsigned int attachment);
+	void renderQuad();
+	void renderIntegral(const glm::mat4 virtual_pose, const float virtual_fovDegree, const std::vector<unsigned int>& ids, const glm::mat4 dem_model_transf, bool analytic_plane = false, const glm::ivec4 roi = glm::ivec4(0));
+	void renderGBuffer(unsigned int fbo, const glm::mat4 virtual_pose, const float virtual_fovDegree, const glm::mat4 dem_model_transf, bool analytic_plane = false, const glm::ivec4 roi = glm::ivec4(0));
+	glm::ivec4 clampROI(const glm::ivec4 roi) const;
+	void setScissor(const glm::ivec4 roi);
+	void projectViews(unsigned int gbuffer, const std::vector<unsigned int>& ids, bool allow_single_pass);
+	bool beginProfile(const char* call);
+	void endProfile(bool profiled);
+	// profiles a call until the end of the scope, also if it throws
+	struct ProfileScope {
+		AOS* aos;
+		const bool profiled;
+		ProfileScope(AOS* aos, const char* call) : aos(aos), profiled(aos->beginProfile(call)) {}
+		~ProfileScope() { aos->endProfile(profiled); }
+	};
+	void beginStage(const char* name) { if (profile_active && stage_depth++ == 0) startStage(name); }
+	void endStage() { if (profile_active && --stage_depth == 0) stopStage(); }
+	void startStage(const char* name);
+	void stopStage();
+	void renderIncremental(const glm::mat4 virtual_pose, const float virtual_fovDegree);
+	void updateIncremental(unsigned int idx, bool subtract = false);
+	void analyzeDEM();
+	void buildDEMTiles(const float* heights, int rows, int cols, glm::vec2 origin, glm::vec2 spacing, int tile_size);
+	bool readDEMCache(const std::string& file, unsigned long long key);
+	void writeDEMCache(const std::string& file, unsigned long long key) const;
+	void drawDEM(Shader& shader, const glm::mat4& projection, const glm::mat4& view, const glm::mat4& model);
+	void getDEMBounds(const glm::mat4& model, glm::vec3& bounds_min, glm::vec3& bounds_max) const;
+	void updateFootprints(const glm::vec3& dem_min, const glm::vec3& dem_max);
+	std::vector<unsigned int> selectViews(const glm::mat4 virtual_pose, const float virtual_fovDegree, const std::vector<unsigned int>& ids, const glm::mat4 dem_from, const glm::mat4 dem_to);
+	void measureFocus(const glm::mat4& virtual_pose, const float virtual_fovDegree, const std::vector<unsigned int>& ids, float z_offset, const glm::ivec4& roi,
+		FOCUSMETRIC metric, int tile_size, bool flipX, float* measures);
+	void renderPipelined(unsigned int n, const std::function<void(unsigned int)>& renderFrame, float* out, bool flipX);
+	void startReadback(Readback& rb);
+	bool isReadbackReady(Readback& rb);
+	void finishReadback(Readback& rb, float* dst, bool flipX);
+	void deleteReadback(Readback& rb);
+	static void copyPixels(const glm::vec4* src, glm::vec4* dst, const unsigned int width, const unsigned int height, bool flipX);
+	bool updateViewArrays();
+	void deleteViewArrays();
+	void projectViewsSinglePass(Shader* shader, const std::vector<unsigned int>& ids, bool forward, const glm::mat4& projection = glm::mat4(1.0f), const glm::mat4& view = glm::mat4(1.0f));
 };
 
 
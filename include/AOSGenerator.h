@@ -5,6 +5,11 @@
 
 #include <string>
 #include <vector>
+#include <deque>
+#include <thread>
+#include <mutex>
+#include <condition_variable>
+#include <functional>
 #include <glm/glm.hpp>
 
 
@@ -14,11 +19,48 @@ class AOS;
 class AOSGenerator // Universal & Unstructured LF Generator: takes care of loading the light field
 {
 private:
+	// an image of the light field: decoded by a worker thread into a mapped upload buffer (slot) of AOS
+	struct Job {
+		std::string file, name;
+		glm::mat4 pose;
+		int w = 0, h = 0; // from the header of the image file
+		unsigned int slot = 0;
+		void* dst = NULL;
+		bool ok = false, done = false;
+	};
+
+	AOS* aos = NULL;
+	std::vector<Job> jobs;
+	size_t next_job = 0, next_view = 0; // next job handed to the workers / added to aos (in the order of the poses file)
+	size_t loaded = 0;
+	std::deque<size_t> queue; // jobs waiting for a worker
+	std::vector<unsigned int> free_slots;
+	std::vector<std::thread> workers;
+	std::mutex mutex;
+	std::condition_variable work_cv, done_cv;
+	bool stopping = false;
+	std::function<void(size_t, size_t)> progress;
+
+	void decodeLoop();
+	void dispatchJobs();
+	void joinWorkers();
 
 public:
 	AOSGenerator(void);
 	virtual ~AOSGenerator(void);
+	// loads the whole light field before returning
 	void Generate( AOS *aos, const std::string &jsonPoseFile, const std::string &imgFilePath = "", const std::string& maskFile = "", const bool replaceExtension = false);
-};
-
 
+	// streaming: Start parses the poses file and decodes the images on threads (0 = one per core), Poll adds the decoded views in the order of the
+	// poses file and has to be called on the thread of the OpenGL context (e.g., once per frame), so the application stays interactive while loading.
+	// progress is called (on the thread calling Poll) with the number of processed and all images after each image.
+	void Start( AOS *aos, const std::string &jsonPoseFile, const std::string &imgFilePath = "", const std::string& maskFile = "", const bool replaceExtension = false,
+		unsigned int threads = 0, std::function<void(size_t, size_t)> progress = nullptr);
+	// adds the views decoded so far (or waits for the next one if wait is set), returns the number of added views
+	size_t Poll(bool wait = false);
+	bool Done() const { return next_view >= jobs.size(); }
+	size_t Loaded() const { return loaded; } // processed images, including images that could not be read
+	size_t Total() const { return jobs.size(); }
+	// stops the workers without adding the remaining views
+	void Stop();
+};
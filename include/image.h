@@ -96,6 +96,9 @@ Image load_image_stb(const char* filename, int channels = 0);
 Image load_image_stb_resize(char *filename, int w, int h, int c);
 bool is_empty_image(Image img); // { return img.c == 0 || img.w == 0 || img.h == 0; }
 Image prepare_image_ogl(Image src, int channels = 0);
+bool load_image_info(const char* filename, int* w, int* h, int* c); // size and channels from the header of an image file
+unsigned char* load_image_interleaved(const char* filename, int* w, int* h, int channels); // 8-bit interleaved (HWC) pixels, NULL on failure
+void free_image_interleaved(unsigned char* data);
 //LIB_API Image load_image_color(char *filename, int w, int h);
 //Image **load_alphabet();
 
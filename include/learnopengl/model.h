@@ -38,6 +38,11 @@ public:
         loadModel(path);
     }
 
+    // empty model, the meshes are added by the caller (e.g., generated from a height map)
+    Model() : gammaCorrection(false)
+    {
+    }
+
     // draws the model, and thus all its meshes
     void Draw(Shader &shader)
     {
@@ -45,6 +45,21 @@ public:
         glDeleteShader(vertex);
         glDeleteShader(fragment);
     }
+    // constructor for a compute shader
+    // ------------------------------------------------------------------------
+    explicit Shader(const std::string computeSource)
+    {
+        const char* cShaderCode = computeSource.c_str();
+        unsigned int compute = glCreateShader(GL_COMPUTE_SHADER);
+        glShaderSource(compute, 1, &cShaderCode, NULL);
+        glCompileShader(compute);
+        checkCompileErrors(compute, "COMPUTE");
+        ID = glCreateProgram();
+        glAttachShader(ID, compute);
+        glLinkProgram(ID);
+        checkCompileErrors(ID, "PROGRAM");
+        glDeleteShader(compute);
+    }
     // activate the shader
     // ------------------------------------------------------------------------
     void use() 
@@ -95,6 +110,11 @@ public:
         glUniform3i(glGetUniformLocation(ID, name.c_str()), x, y, z);
     }
     // ------------------------------------------------------------------------
+    void setIVec4(const std::string& name, const glm::ivec4& value) const
+    {
+        glUniform4iv(glGetUniformLocation(ID, name.c_str()), 1, &value[0]);
+    }
+    // ------------------------------------------------------------------------
     void setVec4(const std::string &name, const glm::vec4 &value) const
     { 
         glUniform4fv(glGetUniformLocation(ID, name.c_str()), 1, &value[0]); 
@@ -94,6 +94,8 @@ int max_int_index(int *a, int n);
 //boxabs box_to_boxabs(const box* b, const int img_w, const int img_h, const int bounds_check);
 int make_directory(char *path, int mode);
 unsigned long custom_hash(char *str);
+void *map_file(const char *filename, size_t *size); // read-only mapping of a whole file, NULL on failure
+void unmap_file(void *data, size_t size);
 
 #define max_val_cmp(a,b) (((a) > (b)) ? (a) : (b))
 #define min_val_cmp(a,b) (((a) < (b)) ? (a) : (b))
@@ -0,0 +1,472 @@
+# %%
+"""CPU (NumPy) implementation of the light-field renderer.
+
+:class:`CpuAOS` mirrors :class:`pyaos.lfr.PyAOS` (same poses, DEM transformation, image orientation and
+alpha-premultiplied accumulation), but does not need an OpenGL context. It can be used on nodes without a GPU
+and as a reference for the OpenGL renderer.
+"""
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+
+def perspective(fovDegrees, aspect, near, far):
+    """ returns the projection matrix of glm::perspective (right-handed, depth from -1 to 1) """
+    f = 1.0 / np.tan(np.radians(fovDegrees) / 2.0)
+    return np.array([
+        [f / aspect, 0, 0, 0],
+        [0, f, 0, 0],
+        [0, 0, -(far + near) / (far - near), -2.0 * far * near / (far - near)],
+        [0, 0, -1, 0]])
+
+def euler_angle_xyz(angles):
+    """ returns the rotation matrix of glm::eulerAngleXYZ """
+    cx, cy, cz = np.cos(angles)
+    sx, sy, sz = np.sin(angles)
+    rx = np.array([[1, 0, 0, 0], [0, cx, -sx, 0], [0, sx, cx, 0], [0, 0, 0, 1]])
+    ry = np.array([[cy, 0, sy, 0], [0, 1, 0, 0], [-sy, 0, cy, 0], [0, 0, 0, 1]])
+    rz = np.array([[cz, -sz, 0, 0], [sz, cz, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]])
+    return rx @ ry @ rz
+
+def load_obj_triangles(obj_file):
+    """ reads the vertex positions and faces of an OBJ file and returns its triangles as array of shape (N,3,3) """
+    vertices, triangles = [], []
+    with open(obj_file) as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == 'v':
+                vertices.append([float(x) for x in parts[1:4]])
+            elif parts[0] == 'f':
+                idx = [int(p.split('/')[0]) for p in parts[1:]]
+                idx = [i - 1 if i > 0 else len(vertices) + i for i in idx] # OBJ indices start at 1, negative indices are relative
+                triangles.extend([idx[0], idx[k], idx[k+1]] for k in range(1, len(idx) - 1)) # triangle fan
+    return np.asarray(vertices, dtype=np.float64)[np.asarray(triangles, dtype=np.int64).reshape(-1,3)]
+
+def _texture(img):
+    """ returns an image like it is stored and sampled by OpenGL: float32 RGBA (HWC), the color scale and the number of channels """
+    img = np.asarray(img)
+    if img.ndim == 2:
+        img = img[:,:,np.newaxis]
+    if img.dtype == np.uint8:
+        tex, scale = img.astype(np.float32) / 255.0, 255.0 # normalized texture
+    else:
+        tex, scale = img.astype(np.float16).astype(np.float32), 1.0 # half-float texture
+    h, w, c = tex.shape
+    rgba = np.zeros((h, w, 4), dtype=np.float32)
+    rgba[:,:,3] = 1.0
+    if c == 1:
+        rgba[:,:,0] = tex[:,:,0]
+    else:
+        rgba[:,:,:c] = tex[:,:,:4]
+    return rgba, scale, c
+
+def undistortion_offsets(K, dist, size):
+    """ returns the offsets from the texture coordinates of the undistorted image to the raw frame (H,W,2) like AOS::setCameraCalibration,
+    rounded like the half-float texture they are stored in """
+    K = np.asarray(K, dtype=np.float64)
+    d = np.zeros(8)
+    dist = np.asarray(dist, dtype=np.float64).ravel()
+    if len(dist) > 8:
+        raise ValueError("at most 8 distortion coefficients (k1, k2, p1, p2, k3, k4, k5, k6) are supported!")
+    d[:len(dist)] = dist
+    k1, k2, p1, p2, k3, k4, k5, k6 = d
+    w, h = size
+    i, j = np.meshgrid(np.arange(w), np.arange(h))
+    x, y = (i - K[0,2]) / K[0,0], (j - K[1,2]) / K[1,1]
+    r2 = x * x + y * y
+    radial = (1 + k1 * r2 + k2 * r2**2 + k3 * r2**3) / (1 + k4 * r2 + k5 * r2**2 + k6 * r2**3)
+    xd = x * radial + 2 * p1 * x * y + p2 * (r2 + 2 * x * x)
+    yd = y * radial + p1 * (r2 + 2 * y * y) + 2 * p2 * x * y
+    offsets = np.stack(((K[0,0] * xd + K[0,2] - i) / w, (K[1,1] * yd + K[1,2] - j) / h), axis=-1) # the raw frames have the same size
+    return offsets.astype(np.float16).astype(np.float32)
+
+def _sample_bilinear(tex, u, v):
+    """ samples the texture at normalized coordinates like GL_LINEAR with GL_CLAMP_TO_EDGE """
+    h, w = tex.shape[:2]
+    x = u * w - 0.5
+    y = v * h - 0.5
+    x0 = np.floor(x)
+    y0 = np.floor(y)
+    fx = (x - x0)[:,np.newaxis]
+    fy = (y - y0)[:,np.newaxis]
+    x0 = x0.astype(np.int64); y0 = y0.astype(np.int64)
+    x1 = np.clip(x0 + 1, 0, w - 1); y1 = np.clip(y0 + 1, 0, h - 1)
+    x0 = np.clip(x0, 0, w - 1); y0 = np.clip(y0, 0, h - 1)
+    top = tex[y0, x0] * (1 - fx) + tex[y0, x1] * fx
+    bottom = tex[y1, x0] * (1 - fx) + tex[y1, x1] * fx
+    return top * (1 - fy) + bottom * fy
+
+def project_views(positions, projViewMatrices, textures, scales, offsets=None, masks=None, undistort_maps=None):
+    """ back-projects the views onto the positions (N,3) and returns the sum of the alpha-premultiplied colors (N,4).
+    The offsets are added to the scaled colors (a number or one per color channel).
+    The alpha of a view is multiplied with its mask (a texture like the views, or None).
+    Views with an undistortion map (see :func:`undistortion_offsets`, or None) are raw frames that are sampled at the distorted coordinates """
+    integral = np.zeros((len(positions), 4), dtype=np.float64)
+    hom = np.concatenate((positions, np.ones((len(positions), 1))), axis=1)
+    if offsets is None:
+        offsets = [0.0] * len(textures)
+    if masks is None:
+        masks = [None] * len(textures)
+    if undistort_maps is None:
+        undistort_maps = [None] * len(textures)
+    for m, tex, scale, offset, mask, umap in zip(projViewMatrices, textures, scales, offsets, masks, undistort_maps):
+        clip = hom @ m.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            proj = clip[:,:2] / clip[:,3:4] * 0.5 + 0.5
+        inside = np.all((proj >= 0.0) & (proj <= 1.0), axis=1)
+        if not np.any(inside):
+            continue
+        uv = 1.0 - proj[inside] # the images are flipped
+        if umap is not None: # like the shader, the mask is sampled at the raw coordinates too
+            uv = uv + _sample_bilinear(umap, uv[:,0], uv[:,1])
+            rgba = _sample_bilinear(tex, uv[:,0], uv[:,1])
+            rgba[~np.all((uv >= 0.0) & (uv <= 1.0), axis=1)] = 0.0
+        else:
+            rgba = _sample_bilinear(tex, uv[:,0], uv[:,1])
+        alpha = rgba[:,3:4]
+        if mask is not None:
+            alpha = alpha * _sample_bilinear(mask, uv[:,0], uv[:,1])[:,:1]
+        integral[inside,:3] += (rgba[:,:3] * scale + offset) * alpha
+        integral[inside,3:] += alpha
+    return integral
+
+def _share(array):
+    """ copies an array into a new shared memory block and returns the block and the reference (name, shape, dtype) the workers attach to """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+def _release(shared):
+    if shared is not None:
+        shared[0].close()
+        shared[0].unlink()
+
+def _shared_array(blocks, ref):
+    return None if ref is None else np.ndarray(ref[1], dtype=ref[2], buffer=blocks[ref[0]].buf)
+
+def _project_shared(frame, chunk, projViewMatrices, textures, scales, offsets, masks, undistort_maps):
+    """ worker of :meth:`CpuAOS.render`: projects views in shared memory (see :func:`project_views`).
+    The frame holds the positions (in slot 0) and the partial integrals of the chunks (in the following slots) """
+    blocks = {}
+    try:
+        for ref in [frame] + textures + masks + undistort_maps:
+            if ref is not None and ref[0] not in blocks:
+                blocks[ref[0]] = shared_memory.SharedMemory(name=ref[0]) # the workers share the resource tracker of the renderer, which unlinks the blocks
+        data = _shared_array(blocks, frame)
+        data[1 + chunk] = project_views(data[0,:,:3], projViewMatrices, [_shared_array(blocks, t) for t in textures], scales, offsets, [_shared_array(blocks, m) for m in masks], [_shared_array(blocks, u) for u in undistort_maps])
+        del data
+    finally:
+        for shm in blocks.values():
+            shm.close()
+
+
+class CpuAOS:
+    """Light-field renderer on the CPU with the same interface as :class:`pyaos.lfr.PyAOS` (a subset of it).
+
+    :param width: width of the rendered images
+    :type width: int
+    :param height: height of the rendered images
+    :type height: int
+    :param fovDegree: field of view of the views in degrees
+    :type fovDegree: number
+    :param workers: number of processes the views are spread across, defaults to None which renders in the calling process
+    :type workers: int, optional
+    """
+
+    near_plane = 1.0
+    far_plane = 1000.0
+
+    def __init__(self, width, height, fovDegree=50.815436217896945, workers=None):
+        self.width = width
+        self.height = height
+        self.projection_imgs = perspective(fovDegree, 1.0, self.near_plane, self.far_plane)
+        self.workers = workers
+        self._pool = None
+        self._views = [] # dicts with texture, scale, adjustment, mask group, camera group, pose, correction and name (and the shared texture of the workers)
+        self._masks = {} # shared masks (textures) of the mask groups
+        self._undistort_maps = {} # undistortion offsets of the camera groups
+        self._shared_groups = {} # masks and undistortion maps in shared memory for the workers
+        self._frame = None # positions and partial integrals in shared memory for the workers
+        self._triangles = None
+        self._dem_transf = np.eye(4)
+        self._xyz = np.zeros((height, width, 4), dtype=np.float32)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Shuts down the worker processes and frees the shared memory of the views."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        for v in self._views:
+            _release(v.pop('shared', None))
+        for key in list(self._shared_groups):
+            _release(self._shared_groups.pop(key))
+        _release(self._frame)
+        self._frame = None
+
+    def loadDEM(self, objmodelpath):
+        self._triangles = load_obj_triangles(objmodelpath)
+
+    def setDEMTransform(self, transl, euler=np.array([0,0,0])):
+        transf = euler_angle_xyz(np.asarray(euler, dtype=np.float64))
+        transf[:3,3] = transl
+        self._dem_transf = transf
+
+    def addView(self, readimage, camerapose, pyImagename):
+        tex, scale, channels = _texture(readimage)
+        self._views.append({'texture': tex, 'scale': scale, 'channels': channels, 'adjust': (1.0, 0.0), 'mask': 0, 'camera': 0, 'pose': np.asarray(camerapose, dtype=np.float32).copy(), 'corr': np.eye(4), 'name': pyImagename or str(len(self._views))})
+
+    def addViews(self, readimages, cameraposes, pyImagenames=None):
+        for i, (img, pose) in enumerate(zip(readimages, cameraposes)):
+            self.addView(img, pose, pyImagenames[i] if pyImagenames is not None else "")
+
+    def replaceView(self, cameraindex, replacingimage, replacingpose, replacename):
+        tex, scale, channels = _texture(replacingimage)
+        old = self._views[cameraindex]
+        _release(old.get('shared'))
+        self._views[cameraindex] = {'texture': tex, 'scale': scale, 'channels': channels, 'adjust': (1.0, 0.0), 'mask': old['mask'], 'camera': old['camera'], 'pose': np.asarray(replacingpose, dtype=np.float32).copy(), 'corr': old['corr'], 'name': replacename or str(cameraindex)}
+
+    def setViewAdjustment(self, cameraindex, scale, offset):
+        self._views[cameraindex]['adjust'] = (float(scale), float(offset))
+
+    def getViewAdjustment(self, cameraindex):
+        return self._views[cameraindex]['adjust']
+
+    def setMask(self, mask, group=0):
+        mask = np.asarray(mask)
+        if mask.ndim == 3 and mask.shape[2] == 1:
+            mask = mask[:,:,0]
+        if mask.ndim != 2:
+            raise ValueError("a mask needs to have the shape (H,W)!")
+        self._masks[group] = _texture(mask)[0]
+        _release(self._shared_groups.pop(('mask', group), None))
+
+    def clearMask(self, group=0):
+        self._masks.pop(group, None)
+        _release(self._shared_groups.pop(('mask', group), None))
+
+    def hasMask(self, group=0):
+        return group in self._masks
+
+    def setViewMask(self, cameraindex, group):
+        self._views[cameraindex]['mask'] = group
+
+    def getViewMask(self, cameraindex):
+        return self._views[cameraindex]['mask']
+
+    def setCameraCalibration(self, K, dist, size, group=0):
+        """Sets the calibration of a camera group, its views are raw frames that are undistorted when they are sampled (see :meth:`pyaos.lfr.PyAOS.setCameraCalibration`)."""
+        self._undistort_maps[group] = undistortion_offsets(K, dist, size)
+        _release(self._shared_groups.pop(('camera', group), None))
+
+    def clearUndistortion(self, group=0):
+        self._undistort_maps.pop(group, None)
+        _release(self._shared_groups.pop(('camera', group), None))
+
+    def hasUndistortion(self, group=0):
+        return group in self._undistort_maps
+
+    def setViewCamera(self, cameraindex, group):
+        self._views[cameraindex]['camera'] = group
+
+    def getViewCamera(self, cameraindex):
+        return self._views[cameraindex]['camera']
+
+    def removeView(self, cameraindex):
+        _release(self._views.pop(cameraindex).get('shared'))
+
+    def removeViews(self, cameraids):
+        removed = set(int(i) for i in np.asarray(cameraids).ravel())
+        for i in removed:
+            _release(self._views[i].get('shared'))
+        self._views = [v for i, v in enumerate(self._views) if i not in removed]
+
+    def clearViews(self):
+        for v in self._views:
+            _release(v.get('shared'))
+        self._views = []
+
+    def getPose(self, poseindex):
+        return self._views[poseindex]['pose'].copy()
+
+    def setPose(self, poseindex, camerapose):
+        self._views[poseindex]['pose'] = np.asarray(camerapose, dtype=np.float32).copy()
+        return self.getPose(poseindex)
+
+    def setPoses(self, cameraposes, cameraids=None):
+        cameraposes = np.asarray(cameraposes, dtype=np.float32).reshape(-1,4,4)
+        ids = range(len(self._views)) if cameraids is None else cameraids
+        if len(ids) != len(cameraposes):
+            raise ValueError('provide one pose per view')
+        for i, pose in zip(ids, cameraposes):
+            self.setPose(i, pose)
+
+    def setPoseCorrection(self, cameraindex, transl, euler=np.array([0,0,0])):
+        """Sets a correction (translation and euler angles) that is applied to the pose of a view."""
+        corr = euler_angle_xyz(np.asarray(euler, dtype=np.float64))
+        corr[:3,3] = transl
+        self._views[cameraindex]['corr'] = corr
+
+    def getPoseCorrection(self, cameraindex):
+        return self._views[cameraindex]['corr'].T.astype(np.float32) # memory layout of glm like the poses
+
+    def getPosition(self, cameraindex):
+        # the position of the uncorrected pose, like AOS::getPosition
+        return np.linalg.inv(np.asarray(self._views[cameraindex]['pose'], dtype=np.float64).T)[:3,3].astype(np.float32)
+
+    def getName(self, cameraindex):
+        return self._views[cameraindex]['name']
+
+    def getViews(self):
+        return len(self._views)
+
+    def getSize(self):
+        return self.getViews()
+
+    def _view_matrix(self, idx):
+        # poses are (like in PyAOS) transposed, i.e., numpy arrays in the memory layout of glm's column-major matrices
+        return self._views[idx]['corr'] @ np.asarray(self._views[idx]['pose'], dtype=np.float64).T
+
+    def _positions(self, virtualcamerapose, virtualcamerafieldofview):
+        """ computes the DEM positions seen by the pixels of the virtual camera (G-buffer) by ray casting.
+        Returns an array of shape (height, width, 4) with alpha 1 if the pixel shows the DEM (like AOS::getXYZ) """
+        xyz = np.zeros((self.height, self.width, 4), dtype=np.float64)
+        if self._triangles is None:
+            return xyz
+        projection = perspective(virtualcamerafieldofview, self.width / self.height, self.near_plane, self.far_plane)
+        view = np.asarray(virtualcamerapose, dtype=np.float64).T
+
+        # rays through the pixel centers in eye coordinates (row 0 is the bottom row, like in OpenGL)
+        ndc_x = (np.arange(self.width) + 0.5) / self.width * 2.0 - 1.0
+        ndc_y = (np.arange(self.height) + 0.5) / self.height * 2.0 - 1.0
+        all_dirs = np.stack(np.broadcast_arrays(ndc_x[np.newaxis,:] / projection[0,0], ndc_y[:,np.newaxis] / projection[1,1], -1.0), axis=-1) # z = -1: t is the eye depth
+        pixels = np.arange(self.width * self.height).reshape(self.height, self.width)
+
+        # triangles in eye coordinates
+        tris = self._triangles @ (view @ self._dem_transf)[:3,:3].T + (view @ self._dem_transf)[:3,3]
+        depth = np.full(self.width * self.height, np.inf)
+        hit = np.zeros((self.width * self.height, 3))
+        for a, b, c in tris:
+            # only test the pixels in the bounding box of the projected triangle (if it is in front of the camera)
+            if max(a[2], b[2], c[2]) < 0:
+                corners = np.array([a, b, c])
+                ndc = corners[:,:2] / -corners[:,2:] * np.array([projection[0,0], projection[1,1]])
+                x0, y0 = np.floor(((ndc.min(axis=0) + 1.0) / 2.0) * [self.width, self.height] - 0.5).astype(int)
+                x1, y1 = np.ceil(((ndc.max(axis=0) + 1.0) / 2.0) * [self.width, self.height] - 0.5).astype(int)
+                x0, y0 = max(x0, 0), max(y0, 0)
+                x1, y1 = min(x1, self.width - 1), min(y1, self.height - 1)
+                if x0 > x1 or y0 > y1:
+                    continue
+                dirs = all_dirs[y0:y1+1, x0:x1+1].reshape(-1,3)
+                idx = pixels[y0:y1+1, x0:x1+1].ravel()
+            else:
+                dirs = all_dirs.reshape(-1,3)
+                idx = pixels.ravel()
+
+            # ray (from the origin) - triangle intersection (Moeller-Trumbore)
+            e1, e2 = b - a, c - a
+            p = np.cross(dirs, e2)
+            det = p @ e1
+            valid = np.abs(det) > 1e-12
+            with np.errstate(divide='ignore', invalid='ignore'):
+                inv_det = 1.0 / det
+                s = -a
+                u = (p @ s) * inv_det
+                q = np.cross(s, e1)
+                v = (dirs @ q) * inv_det
+                t = (q @ e2) * inv_det
+            valid &= (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= self.near_plane) & (t <= self.far_plane) & (t < depth[idx])
+            depth[idx[valid]] = t[valid]
+            hit[idx[valid]] = dirs[valid] * t[valid,np.newaxis]
+
+        found = np.isfinite(depth)
+        world = np.linalg.inv(view) @ np.concatenate((hit, np.ones((len(hit),1))), axis=1).T
+        xyz.reshape(-1,4)[found,:3] = world.T[found,:3]
+        xyz.reshape(-1,4)[found,3] = 1.0
+        return xyz
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers)
+        return self._pool
+
+    def _shared_texture(self, idx):
+        # the texture is copied to shared memory once and attached by the workers in every render
+        v = self._views[idx]
+        if 'shared' not in v:
+            v['shared'] = _share(v['texture'])
+        return v['shared'][1]
+
+    def _shared_group(self, kind, textures, group):
+        # masks and undistortion maps of the groups, like the textures of the views
+        if group not in textures:
+            return None
+        if (kind, group) not in self._shared_groups:
+            self._shared_groups[(kind, group)] = _share(textures[group])
+        return self._shared_groups[(kind, group)][1]
+
+    def _shared_frame(self, positions, chunks):
+        shape = (1 + chunks, len(positions), 4)
+        if self._frame is None or self._frame[0].size < max(np.prod(shape) * 8, 1):
+            _release(self._frame)
+            self._frame = _share(np.zeros(shape))
+        ref = (self._frame[1][0], shape, '<f8')
+        np.ndarray(shape, dtype=np.float64, buffer=self._frame[0].buf)[0,:,:3] = positions
+        return ref
+
+    def render(self, virtualcamerapose, virtualcamerafieldofview, cameraids=[], flipHorizontal=True):
+        """Renders an AOS image with the specified parameters (see :meth:`pyaos.lfr.PyAOS.render`).
+
+        :param virtualcamerapose: pose of the virtual camera as 4 by 4 matrix
+        :type virtualcamerapose: array
+        :param virtualcamerafieldofview: field of view of the virtual camera in degrees
+        :type virtualcamerafieldofview: number
+        :param cameraids: view/camera ids used for rendering, defaults to [] which renders with all available views
+        :type cameraids: array, optional
+        :param flipHorizontal: if True, the rendered image is flipped horizontally like the images of PyAOS, defaults to True
+        :type flipHorizontal: bool, optional
+
+        :rtype: numpy.array
+        :return: Rendered image (float32 array of shape (height, width, 4))
+        """
+        ids = list(cameraids) if len(cameraids) > 0 else list(range(len(self._views)))
+        xyz = self._positions(virtualcamerapose, virtualcamerafieldofview)
+        self._xyz = xyz.astype(np.float32)
+        valid = xyz[:,:,3] >= 1.0
+        positions = xyz[valid][:,:3]
+
+        matrices = [self.projection_imgs @ self._view_matrix(i) for i in ids]
+        scales = [self._views[i]['scale'] * self._views[i]['adjust'][0] for i in ids]
+        offsets = [np.where(np.arange(3) < self._views[i]['channels'], self._views[i]['adjust'][1], 0.0) for i in ids] # only for the channels of the view
+        if self.workers is not None and self.workers > 1 and len(ids) > 1:
+            # spread the views across the worker processes and sum the partial integrals.
+            # Textures, masks and positions are passed in shared memory, only the references are sent per render
+            chunks = np.array_split(np.arange(len(ids)), min(self.workers, len(ids)))
+            textures = [self._shared_texture(i) for i in ids]
+            masks = [self._shared_group('mask', self._masks, self._views[i]['mask']) for i in ids]
+            undistort_maps = [self._shared_group('camera', self._undistort_maps, self._views[i]['camera']) for i in ids]
+            frame = self._shared_frame(positions, len(chunks))
+            futures = [self._get_pool().submit(_project_shared, frame, c, [matrices[i] for i in chunk], [textures[i] for i in chunk], [scales[i] for i in chunk], [offsets[i] for i in chunk],
+                [masks[i] for i in chunk], [undistort_maps[i] for i in chunk]) for c, chunk in enumerate(chunks)]
+            for f in futures:
+                f.result()
+            integral = np.ndarray(frame[1], dtype=np.float64, buffer=self._frame[0].buf)[1:].sum(axis=0)
+        else:
+            textures = [self._views[i]['texture'] for i in ids]
+            masks = [self._masks.get(self._views[i]['mask']) for i in ids]
+            undistort_maps = [self._undistort_maps.get(self._views[i]['camera']) for i in ids]
+            integral = project_views(positions, matrices, textures, scales, offsets, masks, undistort_maps)
+
+        img = np.zeros((self.height, self.width, 4), dtype=np.float32)
+        img[valid] = integral
+        if flipHorizontal:
+            img = img[:,::-1,:].copy() # flip the image horizontally like PyAOS
+        return img
+
+    def getXYZ(self):
+        """Returns the DEM positions seen by the pixels of the last rendered image, of shape (height, width, 4) (see :meth:`pyaos.lfr.PyAOS.getXYZ`)."""
+        return self._xyz
@@ -0,0 +1,472 @@
+"""Local render service: one process owns a loaded light field and renders for other processes.
+
+:class:`RenderServer` loads the light field once (into a headless OpenGL context, a hidden window on Windows) and serves render, getXYZ, pixelsToWorld
+and focal stack requests over a local socket with asyncio. Identical requests that are pending at the same time are rendered
+once, and renders that only differ in the virtual camera pose are rendered with a single :meth:`pyaos.lfr.PyAOS.renderBatch` call.
+The results are not sent over the socket: every client owns a shared memory block the server writes the results into.
+
+:class:`RenderClient` mirrors the rendering methods of :class:`pyaos.lfr.PyAOS`::
+
+    python -m pyaos.LFR_server flight.aoslf --dem dem.obj --socket /tmp/pyaos.sock
+
+    client = RenderClient('/tmp/pyaos.sock')
+    img = client.render(pose, 50.0)
+"""
+import asyncio
+import json
+import os
+import socket
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+_HEADER = struct.Struct('<I') # length of the JSON message that follows
+_ERRORS = {'ValueError': ValueError, 'IndexError': IndexError, 'KeyError': KeyError} # exceptions that are raised again by the client
+_owned_segments = set() # shared memory blocks created (and unlinked) by clients in this process
+
+
+def _encode(msg):
+    data = json.dumps(msg).encode()
+    return _HEADER.pack(len(data)) + data
+
+
+def _attach(name):
+    """Attaches the shared memory block of a client. The client unlinks it, so the resource tracker of this process must not."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python >= 3.13
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix' and name not in _owned_segments:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _pose(params):
+    return np.asarray(params['pose'], dtype=np.float32).reshape(4,4)
+
+
+class RenderServer:
+    """Renders with a single light field for many clients (see :class:`RenderClient`).
+
+    All OpenGL calls are made by one thread with its own context (headless, or a hidden GLFW window on Windows where EGL is not available), 
+    so the asyncio loop keeps accepting requests while rendering.
+    Requests that arrive while rendering are processed together afterwards (at most max_batch).
+
+    :param address: path of the Unix domain socket, or (host, port) for TCP (e.g., on Windows)
+    :type address: str or tuple
+    :param width: width of the rendered images
+    :type width: int
+    :param height: height of the rendered images
+    :type height: int
+    :param fovDegree: field of view of the views in degrees
+    :type fovDegree: number
+    :param light_field: packed light field (*.aoslf) that is loaded, defaults to None
+    :type light_field: str, optional
+    :param dem: DEM (*.obj or *.aosdem) that is loaded, defaults to None
+    :type dem: str, optional
+    :param dem_transform: translation of the DEM (see :meth:`pyaos.lfr.PyAOS.setDEMTransform`), defaults to None
+    :type dem_transform: array, optional
+    :param setup: function called with the PyAOS instance after loading, e.g., to add views (the integral cache is disabled afterwards), defaults to None
+    :type setup: callable, optional
+    :param backend: backend of the headless context (see :class:`pyaos.lfr.PyHeadlessContext`, not used on Windows), defaults to 'auto'
+    :type backend: str, optional
+    :param max_batch: maximum number of requests processed together, defaults to 16
+    :type max_batch: int, optional
+    """
+
+    def __init__(self, address, width=512, height=512, fovDegree=50.815436217896945, light_field=None, dem=None, dem_transform=None,
+                 setup=None, backend='auto', max_batch=16):
+        self.address = address
+        self.width = width
+        self.height = height
+        self.fovDegree = fovDegree
+        self.light_field = light_field
+        self.dem = dem
+        self.dem_transform = dem_transform
+        self.setup = setup
+        self.backend = backend
+        self.max_batch = max_batch
+        self.stats = {'requests': 0, 'coalesced': 0, 'rendered': 0, 'batches': 0, 'batched': 0, 'reused': 0}
+        self._executor = ThreadPoolExecutor(max_workers=1) # the thread of the OpenGL context
+        self._pending = {} # request key -> future of the result
+        self._loop = None
+        self._server = None
+        self._writers = set()
+        self._thread = None
+        self._info = None
+
+    # OpenGL thread
+    def _open(self):
+        import pyaos.lfr as LFR
+        self._context = LFR.createContext(self.width, self.height, 'AOS render server', headless=os.name != 'nt', backend=self.backend)
+        self._aos = LFR.PyAOS(self.width, self.height, self.fovDegree)
+        if self.dem is not None:
+            self._aos.loadDEM(self.dem)
+        if self.dem_transform is not None:
+            self._aos.setDEMTransform(self.dem_transform)
+        if self.light_field is not None:
+            self._aos.loadLightField(self.light_field)
+        if self.setup is not None:
+            self.setup(self._aos)
+        self._aos.setIntegralCache(0) # a cached render does not rasterize the G-buffer that xyz and pixels_to_world read
+        return {'width': self.width, 'height': self.height, 'fov': self.fovDegree, 'views': self._aos.getViews()}
+
+    def _close(self):
+        del self._aos
+        del self._context
+
+    def _run(self, method, params, rendered=False):
+        """Processes a request. If rendered, the last render used the virtual camera of the request and its G-buffer is reused."""
+        aos = self._aos
+        ids = params.get('ids', [])
+        if method == 'render':
+            return aos.render(_pose(params), params['fov'], ids, params.get('flip', True), roi=params.get('roi'))
+        if method == 'focal_stack':
+            return aos.renderFocalStack(_pose(params), params['fov'], params['z_offsets'], ids, params.get('flip', True))
+        if method == 'xyz':
+            if not rendered:
+                aos.render(_pose(params), params['fov'], ids)
+            return aos.getXYZ().copy()
+        if method == 'pixels_to_world':
+            if not rendered:
+                aos.render(_pose(params), params['fov'], ids)
+            return np.ascontiguousarray(aos.pixelsToWorld(params['points'], params.get('flip', True)))
+        raise ValueError(f'unknown method {method}')
+
+    def _run_jobs(self, jobs):
+        """Processes requests, renders that only differ in the pose are rendered with one renderBatch call.
+        The other requests with the same virtual camera (full renders, xyz and pixels_to_world) render the G-buffer once.
+        Returns the results (or exceptions), the number of batched renders and the number of reused G-buffers."""
+        results = [None] * len(jobs)
+        batches = {}
+        for i, (method, params) in enumerate(jobs):
+            if method == 'render' and params.get('roi') is None:
+                batches.setdefault((params['fov'], tuple(params.get('ids', [])), params.get('flip', True)), []).append(i)
+        batched = 0
+        for (fov, ids, flip), idx in batches.items():
+            if len(idx) < 2:
+                continue
+            try:
+                frames = self._aos.renderBatch([_pose(jobs[i][1]) for i in idx], fov, list(ids), flip)
+                for j, i in enumerate(idx):
+                    results[i] = frames[j]
+                batched += len(idx)
+            except Exception as e:
+                for i in idx:
+                    results[i] = e
+        cameras = {} # virtual camera (pose, fov and ids) -> requests that need its G-buffer
+        for i, (method, params) in enumerate(jobs):
+            if results[i] is not None:
+                continue
+            if method in ('xyz', 'pixels_to_world') or (method == 'render' and params.get('roi') is None):
+                key = (tuple(np.ravel(params['pose'])), params['fov'], tuple(params.get('ids', [])))
+            else:
+                key = i # roi renders and focal stacks do not leave a full G-buffer of the camera
+            cameras.setdefault(key, []).append(i)
+        reused = 0
+        for idx in cameras.values():
+            rendered = False
+            for i in sorted(idx, key=lambda i: jobs[i][0] != 'render'): # a full render first, its G-buffer is reused
+                method, params = jobs[i]
+                try:
+                    results[i] = self._run(method, params, rendered)
+                    reused += rendered
+                    rendered = True
+                except Exception as e:
+                    results[i] = e
+        return results, batched, reused
+
+    # asyncio loop
+    async def submit(self, method, params):
+        """Renders a request (in the loop of the server) and returns the result. Identical pending requests are rendered once.
+
+        :param method: 'render', 'focal_stack', 'xyz' or 'pixels_to_world'
+        :type method: str
+        :param params: 'pose' (16 numbers), 'fov', 'ids', 'flip' and 'roi' (render), 'z_offsets' (focal_stack) or 'points' (pixels_to_world)
+        :type params: dict
+        :rtype: numpy.array
+        """
+        key = json.dumps([method, params], sort_keys=True)
+        future = self._pending.get(key)
+        if future is None:
+            future = self._loop.create_future()
+            self._pending[key] = future
+            self._queue.put_nowait((key, method, params))
+            self.stats['requests'] += 1
+        else:
+            self.stats['coalesced'] += 1
+        return await asyncio.shield(future)
+
+    async def _work(self):
+        try:
+            while True:
+                jobs = [await self._queue.get()]
+                while not self._queue.empty() and len(jobs) < self.max_batch:
+                    jobs.append(self._queue.get_nowait())
+                results, batched, reused = await self._loop.run_in_executor(self._executor, self._run_jobs, [job[1:] for job in jobs])
+                self.stats['rendered'] += len(jobs)
+                self.stats['reused'] += reused
+                if batched > 0:
+                    self.stats['batches'] += 1
+                    self.stats['batched'] += batched
+                for (key, _, _), result in zip(jobs, results):
+                    future = self._pending.pop(key)
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        finally:
+            # the worker stopped (the server is closing): requests that are still pending must not wait forever
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(RuntimeError('the render server stopped'))
+            self._pending.clear()
+
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        shm = None
+        try:
+            while True:
+                try:
+                    size, = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+                    msg = json.loads(await reader.readexactly(size))
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                try:
+                    if msg['method'] == 'info':
+                        reply = dict(self._info)
+                    elif msg['method'] == 'stats':
+                        reply = dict(self.stats)
+                    else:
+                        result = np.ascontiguousarray(await self.submit(msg['method'], msg['params']), dtype=np.float32)
+                        if shm is None or shm.name != msg['shm']:
+                            if shm is not None:
+                                shm.close()
+                            shm = _attach(msg['shm'])
+                        if result.nbytes > shm.size:
+                            raise ValueError(f'the shared memory of the client is too small ({shm.size} < {result.nbytes} bytes)')
+                        dst = np.ndarray(result.shape, dtype=np.float32, buffer=shm.buf)
+                        dst[...] = result
+                        del dst
+                        reply = {'shape': list(result.shape)}
+                except Exception as e:
+                    reply = {'error': str(e), 'type': type(e).__name__}
+                writer.write(_encode(reply))
+                await writer.drain()
+        finally:
+            if shm is not None:
+                shm.close()
+            self._writers.discard(writer)
+            writer.close()
+
+    async def serve(self, ready=None):
+        """Loads the light field and serves requests until :meth:`stop` is called.
+
+        :param ready: event that is set when the server accepts connections, defaults to None
+        :type ready: threading.Event, optional
+        """
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._info = await self._loop.run_in_executor(self._executor, self._open)
+        if isinstance(self.address, (tuple, list)):
+            self._server = await asyncio.start_server(self._handle, *self.address)
+        else:
+            if os.path.exists(self.address):
+                os.unlink(self.address) # socket of a previous server
+            self._server = await asyncio.start_unix_server(self._handle, self.address)
+        worker = asyncio.create_task(self._work())
+        if ready is not None:
+            ready.set()
+        try:
+            await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            worker.cancel()
+            await self._loop.run_in_executor(self._executor, self._close)
+            self._executor.shutdown()
+            if not isinstance(self.address, (tuple, list)) and os.path.exists(self.address):
+                os.unlink(self.address)
+
+    def run(self):
+        """Serves requests in the calling thread (blocking)."""
+        asyncio.run(self.serve())
+
+    def start(self):
+        """Serves requests in a background thread and returns when the server accepts connections."""
+        ready = threading.Event()
+        errors = []
+        def main():
+            try:
+                asyncio.run(self.serve(ready))
+            except Exception as e:
+                errors.append(e)
+                ready.set()
+        self._thread = threading.Thread(target=main, daemon=True)
+        self._thread.start()
+        ready.wait()
+        if errors:
+            raise errors[0]
+        return self
+
+    def _shutdown(self):
+        for writer in list(self._writers):
+            writer.close()
+        self._server.close()
+
+    def stop(self):
+        """Stops a server started with :meth:`start` (or serving in another thread)."""
+        if self._server is not None:
+            self._loop.call_soon_threadsafe(self._shutdown)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class RenderClient:
+    """Client of a :class:`RenderServer` with the rendering methods of :class:`pyaos.lfr.PyAOS`.
+    Results are copied from a shared memory block of the client, which grows with the largest result.
+    A client must only be used by one thread at a time; use one client per thread.
+
+    :param address: path of the Unix domain socket, or (host, port) for TCP
+    :type address: str or tuple
+    :param timeout: timeout of the socket in seconds, defaults to None
+    :type timeout: number, optional
+    """
+
+    def __init__(self, address, timeout=None):
+        if isinstance(address, (tuple, list)):
+            self._socket = socket.create_connection(tuple(address), timeout=timeout)
+        else:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(timeout)
+            self._socket.connect(address)
+        self._shm = None
+        self._last_render = None # pose, fov and ids of the last render (for getXYZ and pixelsToWorld)
+        info = self._request({'method': 'info'})
+        self.width, self.height, self.fovDegree, self._views = info['width'], info['height'], info['fov'], info['views']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Closes the connection and frees the shared memory."""
+        if getattr(self, '_socket', None) is not None:
+            self._socket.close()
+            self._socket = None
+        if getattr(self, '_shm', None) is not None:
+            _owned_segments.discard(self._shm.name)
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def _recv(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('the render server closed the connection')
+            data += chunk
+        return bytes(data)
+
+    def _request(self, msg):
+        self._socket.sendall(_encode(msg))
+        size, = _HEADER.unpack(self._recv(_HEADER.size))
+        reply = json.loads(self._recv(size))
+        if 'error' in reply:
+            raise _ERRORS.get(reply['type'], RuntimeError)(reply['error'])
+        return reply
+
+    def _call(self, method, params, nbytes):
+        if self._shm is None or self._shm.size < nbytes:
+            if self._shm is not None:
+                _owned_segments.discard(self._shm.name)
+                self._shm.close()
+                self._shm.unlink()
+            self._shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+            _owned_segments.add(self._shm.name)
+        reply = self._request({'method': method, 'params': params, 'shm': self._shm.name})
+        return np.ndarray(reply['shape'], dtype=np.float32, buffer=self._shm.buf).copy()
+
+    def _params(self, pose, fov, cameraids):
+        return {'pose': np.asarray(pose, dtype=np.float32).ravel().tolist(), 'fov': float(fov), 'ids': [int(i) for i in cameraids]}
+
+    def render(self, virtualcamerapose, virtualcamerafieldofview, cameraids=[], flipHorizontal=True, roi=None):
+        """Renders an AOS image (see :meth:`pyaos.lfr.PyAOS.render`).
+
+        :rtype: numpy.array
+        :return: Rendered image
+        """
+        params = self._params(virtualcamerapose, virtualcamerafieldofview, cameraids)
+        params['flip'] = bool(flipHorizontal)
+        params['roi'] = None if roi is None else [int(v) for v in roi]
+        self._last_render = self._params(virtualcamerapose, virtualcamerafieldofview, cameraids)
+        w, h = (self.width, self.height) if roi is None else roi[2:]
+        return self._call('render', params, w * h * 16)
+
+    def renderFocalStack(self, virtualcamerapose, virtualcamerafieldofview, z_offsets, cameraids=[], flipHorizontal=True):
+        """Renders a focal stack (see :meth:`pyaos.lfr.PyAOS.renderFocalStack`).
+
+        :rtype: numpy.array
+        :return: Rendered focal stack of shape (len(z_offsets), height, width, 4)
+        """
+        params = self._params(virtualcamerapose, virtualcamerafieldofview, cameraids)
+        params['z_offsets'] = np.asarray(z_offsets, dtype=np.float32).ravel().tolist()
+        params['flip'] = bool(flipHorizontal)
+        return self._call('focal_stack', params, len(params['z_offsets']) * self.width * self.height * 16)
+
+    def getXYZ(self):
+        """Returns the DEM positions seen by the pixels of the last image rendered by this client (see :meth:`pyaos.lfr.PyAOS.getXYZ`)."""
+        if self._last_render is None:
+            raise RuntimeError('render an image first')
+        return self._call('xyz', self._last_render, self.width * self.height * 16)
+
+    def pixelsToWorld(self, points, flipHorizontal=True):
+        """Returns the positions on the DEM seen by pixels of the last image rendered by this client (see :meth:`pyaos.lfr.PyAOS.pixelsToWorld`)."""
+        if self._last_render is None:
+            raise RuntimeError('render an image first')
+        params = dict(self._last_render)
+        params['points'] = np.asarray(points, dtype=np.float32).reshape(-1,2).tolist()
+        params['flip'] = bool(flipHorizontal)
+        return self._call('pixels_to_world', params, len(params['points']) * 12)
+
+    def getViews(self):
+        return self._views
+
+    def getSize(self):
+        return self.getViews()
+
+    def getServerStats(self):
+        """Returns the counters of the server: 'requests' (distinct requests), 'coalesced' (requests answered with the result of an identical pending request),
+        'rendered', 'batches' (renderBatch calls) and 'batched' (renders in them)."""
+        return self._request({'method': 'stats'})
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Serves renders of a light field to other processes (see RenderClient).')
+    parser.add_argument('light_field', help='packed light field (*.aoslf)')
+    parser.add_argument('--dem', help='DEM (*.obj or *.aosdem)')
+    parser.add_argument('--dem-transform', type=float, nargs=3, metavar=('X', 'Y', 'Z'), help='translation of the DEM')
+    parser.add_argument('--size', type=int, nargs=2, default=[512, 512], metavar=('WIDTH', 'HEIGHT'), help='size of the rendered images (default: 512 512)')
+    parser.add_argument('--fov', type=float, default=50.815436217896945, help='field of view of the views in degrees')
+    parser.add_argument('--socket', default='/tmp/pyaos.sock', help='path of the Unix domain socket (default: /tmp/pyaos.sock)')
+    parser.add_argument('--port', type=int, help='serve on localhost:PORT (TCP) instead of a Unix domain socket')
+    parser.add_argument('--backend', default='auto', choices=['auto', 'device', 'software', 'surfaceless'], help='headless OpenGL backend')
+    args = parser.parse_args()
+    server = RenderServer(('127.0.0.1', args.port) if args.port else args.socket, args.size[0], args.size[1], args.fov,
+                          light_field=args.light_field, dem=args.dem, dem_transform=args.dem_transform, backend=args.backend)
+    print(f'serving {args.light_field} on {server.address}')
+    server.run()
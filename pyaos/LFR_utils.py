@@ -8,6 +8,9 @@ import os
 from pathlib import Path 
 import glm # PyGLM
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 import pyaos.lfr as LFR
 
 
@@ -48,15 +51,85 @@ def pose_to_virtualcamera( vpose ):
 
 
 
-def read_poses_and_images(aos,PosesFilePath,ImageLocation,mask=None, ud=None,replace_ext=None,adjust_mean=False):
+def _pose_from_m3x4( M3x4 ):
+    """ convert a 3x4 matrix from the poses file into a (column-major) 4x4 pose as used by PyAOS
+
+    """
+    PoseMatrixNumpyArray = np.vstack((np.asarray(M3x4,dtype=np.float32), np.asarray([0.0,0.0,0.0,1.0],dtype=np.float32)))
+    return PoseMatrixNumpyArray.transpose().copy()
+
+def _load_float_image( ImagePath, with_stats=False ):
+    """ load a single image as float32
+
+    If with_stats is True, (image, (min, max, median)) is returned, where the statistics are computed with image_stats.
+    """
+    CopiedImage = cv2.imread( ImagePath, -1 ) # np.array(PILImage)
+    FloatImage = CopiedImage.astype(np.float32) #/255.0
+    stats = image_stats( FloatImage ) if with_stats else None
+
+    return (FloatImage, stats) if with_stats else FloatImage
+
+def iter_images_prefetched( load_fn, items, workers=None, prefetch=None ):
+    """ apply load_fn to all items on a thread pool and yield the results in order
+
+    At most `prefetch` images are decoded ahead of the consumer, so the host memory stays bounded.
+    OpenCV releases the GIL while decoding, so threads scale across cores without pickling the images.
+
+    :param load_fn: function that loads a single item (e.g., an image file path)
+    :type load_fn: callable
+    :param items: items passed to load_fn
+    :type items: iterable
+    :param workers: number of decoding threads, defaults to os.cpu_count()
+    :type workers: int, optional
+    :param prefetch: maximum number of loaded/pending items, defaults to 2*workers
+    :type prefetch: int, optional
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if prefetch is None:
+        prefetch = 2 * workers
+    prefetch = max(1, prefetch)
+
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = deque( pool.submit(load_fn, item) for item in islice(items, prefetch) )
+        while pending:
+            result = pending.popleft().result()
+            for item in islice(items, 1): # keep the queue filled
+                pending.append(pool.submit(load_fn, item))
+            yield result
+
+def read_poses_and_images(aos,PosesFilePath,ImageLocation,mask=None, ud=None,replace_ext=None,adjust_mean=False,keep_images=True,workers=None,prefetch=None,exposure_stats=None,calibration=None):
     """ read images and poses from the json file and the image directory
 
+    Images are decoded on a thread pool and added to aos as they arrive.
+    If keep_images is False the images are not retained and None is returned instead of the image list,
+    so only a few images are held in memory at the same time.
+
+    With adjust_mean, the exposure statistics are computed while the images are decoded (see ExposureStats) and the adjustment of hdr_mean_adjust 
+    is set as per-view scale/offset (aos.setViewAdjustment) after all views are added. The returned images are not adjusted.
+
+    A mask is set once as shared mask of aos (aos.setMask) instead of being appended as alpha channel to every image, 
+    so the views and the returned images keep the channels of the image files. The shared mask applies to all views in mask group 0, 
+    so without a mask, a mask set by a previous call is removed (aos.clearMask).
+
+    With a calibration, the raw images are added and undistorted on the GPU (aos.setCameraCalibration) instead of calling ud.undistort for every image.
+
+    :param workers: number of decoding threads, defaults to os.cpu_count()
+    :type workers: int, optional
+    :param prefetch: number of images decoded ahead of aos.addView, defaults to 2*workers
+    :type prefetch: int, optional
+    :param keep_images: if True, the loaded images are returned as list, defaults to True
+    :type keep_images: bool, optional
+    :param exposure_stats: collects the statistics of the images if adjust_mean is used, defaults to None
+    :type exposure_stats: ExposureStats, optional
+    :param calibration: camera matrix K (3x3) and distortion coefficients of the camera (like OpenCV), defaults to None
+    :type calibration: tuple, optional
     """
     with open(PosesFilePath) as PoseFile:
         PoseFileData = json.load(PoseFile)
         NoofPoses = len(PoseFileData['images'])
         PoseFileImagesData = PoseFileData['images']
-        HalfValue = int(round(len(PoseFileData['images'])/2))
 
         if isinstance(mask,str):
             mask = cv2.imread(mask)[:,:,0]
@@ -70,53 +143,166 @@ def read_poses_and_images(aos,PosesFilePath,ImageLocation,mask=None, ud=None,rep
                 mask = mask.astype(np.float32) / 2**16
             #print(f'mask dtype {mask.dtype}, shape: {mask.shape}')
             #assert isinstance( mask, np.floating )
+            aos.setMask( ud.undistort( mask ) if ud and calibration is None else mask ) # shared by all views (mask group 0)
+        else:
+            aos.clearMask() # the mask of a previous call would mask these views as well
 
-        # read images first and put them in img_list
-        img_list = []
+        ImagePaths = []
         for i in range(0,NoofPoses): 
             LoadImageName = PoseFileImagesData[i]['imagefile']
             if replace_ext is not None:
                 LoadImageName = LoadImageName.replace('.tiff',replace_ext)
-            #PILImage = Image.open(os.path.join(ImageLocation,LoadImageName))
-            CopiedImage = cv2.imread( os.path.join(ImageLocation,LoadImageName), -1 ) # np.array(PILImage)
-            FloatImage = CopiedImage.astype(np.float32) #/255.0
-
-            if mask is not None:
-                channels = 1 if len(FloatImage.shape)==2 else FloatImage.shape[2]
-                rgb = np.zeros((*FloatImage.shape[:2],3))
-                rgb[:,:,:channels] = FloatImage
-                rgba = np.stack((rgb[:,:,0],rgb[:,:,1],rgb[:,:,2],mask),axis=-1)
-                FloatImage = rgba
-
-            img_list.append(FloatImage)
-
-
-        min_max_median = get_min_max_median( img_list )
+            ImagePaths.append( os.path.join(ImageLocation,LoadImageName) )
+        
+        # read poses matrices
+        poses = [ _pose_from_m3x4(PoseFileImagesData[i]['M3x4']) for i in range(0,NoofPoses) ]
+        load_fn = lambda path: _load_float_image(path, with_stats=adjust_mean) # the statistics are computed on the decoding threads
+        images = iter_images_prefetched( load_fn, ImagePaths, workers=workers, prefetch=prefetch )
+
+        img_list = [] if keep_images else None
+        if adjust_mean and exposure_stats is None:
+            exposure_stats = ExposureStats()
+        first_view = aos.getViews()
+
+        # add the views while the next images are decoded
+        for i, img in enumerate(images):
+            if adjust_mean:
+                img, stats = img
+                exposure_stats.append(stats)
+            if img_list is not None:
+                img_list.append(img)
+
+            if calibration is not None:
+                if i == 0: # the size of the frames is known after decoding the first one
+                    aos.setCameraCalibration(calibration[0], calibration[1], (img.shape[1], img.shape[0]))
+            elif ud:
+                img = ud.undistort( img )
+
+            aos.addView(img, poses[i], PoseFileImagesData[i]['imagefile'])
 
         if adjust_mean:
-            # adjust the mean
-            img_list = hdr_mean_adjust( img_list )
-
-        # read poses matrices and use the adjusted images
-        poses = []
-        if len(PoseFileData['images']) > 0:
-            for i in range (0,NoofPoses):
-                
-                PoseMatrix = PoseFileImagesData[i]['M3x4']
-                PoseMatrixNumpyArray = np.array([], dtype=np.float32)
-                for k in range(0,len(PoseMatrix)):
-                    PoseMatrixNumpyArray = np.append(PoseMatrixNumpyArray, np.asarray(PoseMatrix[k],dtype=np.float32))
-                PoseMatrixNumpyArray = np.append(PoseMatrixNumpyArray, np.asarray([0.0,0.0,0.0,1.0],dtype=np.float32))
-                PoseMatrixNumpyArray = PoseMatrixNumpyArray.reshape(4,4)
-                PoseMatrixNumpyArray = PoseMatrixNumpyArray.transpose()
-                poses.append(PoseMatrixNumpyArray.copy())
-
-                img = ud.undistort( img_list[i] ) if ud else img_list[i]
-
-
-                aos.addView(img, poses[i], PoseFileImagesData[i]['imagefile'])
+            exposure_stats.apply(aos, first_view)
     return img_list, poses
 
+LIGHTFIELD_VERSION = 1 # see AOS_LIGHTFIELD_VERSION
+_PIXTYPES = { np.dtype(np.uint8): 0, np.dtype(np.float16): 1, np.dtype(np.float32): 2 } # PIXTYPE of AOS.h
+_LIGHTFIELD_HEADER = np.dtype([('magic','S8'), ('version','<u4'), ('num_views','<u4'), ('width','<i4'), ('height','<i4'), ('channels','<i4'), 
+    ('pixel_type','<u4'), ('mask_width','<i4'), ('mask_height','<i4'), ('mask_type','<u4'), ('value_range','<f4'), 
+    ('views_offset','<u8'), ('names_offset','<u8'), ('mask_offset','<u8'), ('data_offset','<u8')])
+_LIGHTFIELD_VIEW = np.dtype([('pose','<f4',16), ('correction','<f4',6), ('adjustment','<f4',2), ('name_offset','<u4'), ('name_length','<u4')])
+
+def _align( offset, alignment=4096 ):
+    return (offset + alignment - 1) // alignment * alignment
+
+def _load_packed_image( ImagePath, size, dtype, with_stats=False ):
+    """ decode an image for pack_light_field: resized to size, channel order of OpenCV (like _load_float_image), converted to dtype.
+    Returns the image, its statistics and the value range of the image file (e.g., 255 for 8-bit images) """
+    img = cv2.imread( ImagePath, -1 )
+    if img is None:
+        raise IOError(f'Could not read {ImagePath}!')
+    value_range = float(np.iinfo(img.dtype).max) if np.issubdtype(img.dtype, np.integer) else 1.0
+    if size is not None and img.shape[1::-1] != tuple(size):
+        img = cv2.resize( img, tuple(size), interpolation=cv2.INTER_AREA )
+    if dtype == np.uint8 and img.dtype != np.uint8:
+        raise ValueError(f'{ImagePath} has {img.dtype} pixels, which cannot be packed as uint8 (use float16)!')
+    stats = image_stats( img ) if with_stats else None
+    if dtype == np.float16:
+        img = np.minimum( img, np.finfo(np.float16).max ) # avoid infinities
+    return img.astype(dtype, copy=False), stats, value_range
+
+def pack_light_field( LightFieldPath, PosesFilePath, ImageLocation, size=None, dtype=np.uint8, mask=None, replace_ext=None, corrections=None, adjust_mean=False, normalize=False, workers=None, prefetch=None ):
+    """ converts the poses file and the images of a light field into a packed light field (*.aoslf) that PyAOS.loadLightField (and the LFR application) 
+    load by memory-mapping the file instead of parsing JSON and decoding images.
+
+    The images are decoded on a thread pool and streamed into the file, so only a few images are held in memory at the same time.
+    They are stored interleaved with the channels in the order of OpenCV (BGR(A), like read_poses_and_images) and 
+    with the values of the image files, e.g., [0,255] for 8-bit images. With normalize, the value range of the image files is stored in the header 
+    and loadLightField divides the views by it (like the LFR application does with the images it decodes).
+
+    :param LightFieldPath: the packed light field that is written
+    :type LightFieldPath: str
+    :param size: (width, height) the images are resized to, defaults to None (size of the image files, which all need to have the same size)
+    :type size: tuple, optional
+    :param dtype: pixel type, numpy.uint8 (for 8-bit images) or numpy.float16, defaults to numpy.uint8
+    :type dtype: numpy.dtype, optional
+    :param mask: shared mask (file or single-channel image like in read_poses_and_images), defaults to None
+    :param corrections: pose corrections (translation and euler angles, see PyAOS.setPoseCorrection) with shape (N,6), defaults to None
+    :type corrections: numpy.array, optional
+    :param adjust_mean: stores the exposure adjustments of the images (see ExposureStats) as view adjustments, defaults to False
+    :type adjust_mean: bool, optional
+    :param normalize: the views are loaded in [0,1] instead of the value range of the image files (e.g., [0,255]), defaults to False
+    :type normalize: bool, optional
+    :return: number of packed views
+    :rtype: int
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in (np.dtype(np.uint8), np.dtype(np.float16)):
+        raise ValueError('light fields can be packed with uint8 or float16 pixels!')
+    with open(PosesFilePath) as PoseFile:
+        PoseFileImagesData = json.load(PoseFile)['images']
+    n = len(PoseFileImagesData)
+    names = [ img['imagefile'] for img in PoseFileImagesData ]
+    ImagePaths = [ os.path.join(ImageLocation, name if replace_ext is None else name.replace('.tiff',replace_ext)) for name in names ]
+
+    if isinstance(mask,str):
+        mask = cv2.imread(mask)[:,:,0]
+    if mask is not None:
+        mask = np.asarray(mask)
+        mask = mask.reshape(mask.shape[:2]) # single channel image
+        if mask.dtype == np.uint16:
+            mask = mask / 2**16
+        if mask.dtype != np.uint8: # 8-bit masks are normalized when they are uploaded
+            mask = mask.astype(np.float16)
+
+    records = np.zeros(n, dtype=_LIGHTFIELD_VIEW)
+    records['pose'] = [ _pose_from_m3x4(img['M3x4']).reshape(16) for img in PoseFileImagesData ]
+    records['adjustment'] = (1.0, 0.0)
+    if corrections is not None:
+        records['correction'] = np.asarray(corrections, dtype=np.float32).reshape(n,6)
+    encoded = [ name.encode() for name in names ]
+    records['name_length'] = [ len(e) for e in encoded ]
+    records['name_offset'] = np.cumsum([0] + records['name_length'][:-1].tolist()) if n else []
+    names_blob = b''.join(encoded)
+
+    header = np.zeros((), dtype=_LIGHTFIELD_HEADER)
+    header['magic'], header['version'], header['num_views'], header['pixel_type'] = b'AOSLF', LIGHTFIELD_VERSION, n, _PIXTYPES[dtype]
+    header['views_offset'] = _LIGHTFIELD_HEADER.itemsize
+    header['names_offset'] = header['views_offset'] + records.nbytes
+    header['mask_offset'] = _align( int(header['names_offset']) + len(names_blob), 16 )
+    if mask is not None:
+        header['mask_height'], header['mask_width'] = mask.shape
+        header['mask_type'] = _PIXTYPES[mask.dtype]
+    header['data_offset'] = _align( int(header['mask_offset']) + (mask.nbytes if mask is not None else 0) )
+
+    exposure_stats = ExposureStats() if adjust_mean else None
+    with open(LightFieldPath, 'wb') as f:
+        f.seek(int(header['data_offset']))
+        images = iter_images_prefetched( lambda path: _load_packed_image(path, size, dtype, adjust_mean), ImagePaths, workers=workers, prefetch=prefetch )
+        for i, (img, stats, value_range) in enumerate(images):
+            if i == 0:
+                header['height'], header['width'] = img.shape[:2]
+                header['channels'] = 1 if img.ndim == 2 else img.shape[2]
+                header['value_range'] = value_range if normalize else 0.0
+            elif img.shape[:2] != (header['height'], header['width']) or (1 if img.ndim == 2 else img.shape[2]) != header['channels']:
+                raise ValueError(f'{ImagePaths[i]} has a different size or number of channels than the first image (use size)!')
+            if exposure_stats is not None:
+                exposure_stats.append(stats)
+            f.write(np.ascontiguousarray(img).data)
+        if adjust_mean and n > 0:
+            records['adjustment'] = exposure_stats.adjustments()
+            if normalize: # the adjustments already map the values of the image files to [0,1]
+                records['adjustment'][:,0] *= header['value_range']
+        # the header is written last, so an interrupted conversion does not leave a valid file
+        f.seek(int(header['views_offset']))
+        f.write(records.tobytes())
+        f.write(names_blob)
+        if mask is not None:
+            f.seek(int(header['mask_offset']))
+            f.write(np.ascontiguousarray(mask).data)
+        f.seek(0)
+        f.write(header.tobytes())
+    return n
+
 def compute_K_matrix(new_size=(512,512),f_factor=.95):
     px = new_size[0]/2.0
     py = new_size[1]/2.0
@@ -133,47 +319,101 @@ def compute_K_matrix(new_size=(512,512),f_factor=.95):
 
     return new_K
 
-def get_min_max_median( image_list ):
-    """
-    adjusting the mean and min/max of float32 images
-    """
-    #print()
-    medians = np.zeros(len(image_list),dtype=np.float32)
-    for i in range(len(image_list)):
-        medians[i] = np.median(image_list[i])
-
-    overall_median = np.median(medians)
-
-    img_minmax = (math.inf,-math.inf)
-    adj_minmax = (math.inf,-math.inf)
-    for i in range(len(image_list)):
-        adj_value = overall_median - medians[i] # correction value to adjust the mean/median of all images
-        img_minmax = ( np.min([np.amin(image_list[i]),img_minmax[0]]), np.max([np.amax(image_list[i]),img_minmax[1]]) )
-        adj_minmax = ( np.min([np.amin(image_list[i])+adj_value,adj_minmax[0]]), np.max([np.amax(image_list[i])+adj_value,adj_minmax[1]]) )
+def image_stats( image, bins=4096 ):
+    """ minimum, maximum and median of all values of an image without sorting it
 
-    return { 'median': overall_median, 'min': img_minmax[0], 'max': img_minmax[1], 'adj_min': adj_minmax[0], 'adj_max': adj_minmax[1] }
+    The median is looked up in a histogram between minimum and maximum, so its error is at most (max-min)/(2*(bins-1)).
+    Minimum/maximum and the histogram are computed by OpenCV in two passes over the image.
 
-
-def hdr_mean_adjust( image_list ):
+    :param bins: bins of the histogram, defaults to 4096. None computes the exact median with np.median (which sorts the image)
+    :type bins: int, optional
+    :return: (min, max, median)
+    :rtype: tuple
     """
-    adjusting the mean and min/max of float32 images
+    values = np.ascontiguousarray(image, dtype=np.float32).reshape(-1,1)
+    lo, hi, _, _ = cv2.minMaxLoc(values)
+    if bins is None:
+        return lo, hi, float(np.median(values))
+    if hi <= lo:
+        return lo, hi, lo
+    width = (hi - lo) / (bins - 1) # bins are centered on lo, lo+width, ..., hi
+    hist = cv2.calcHist([values], [0], None, [bins], [lo - width/2, hi + width/2]).ravel()
+    k = int(np.searchsorted(np.cumsum(hist, dtype=np.float64), (values.shape[0] + 1) / 2)) # bin of the middle value
+    return lo, hi, lo + min(k, bins - 1) * width
+
+class ExposureStats:
+    """ exposure statistics (min, max and median) of a sequence of images, collected while the images stream through a loader
+
+    Used to align the medians of the images to the overall median and to normalize them to [0,1] like hdr_mean_adjust, 
+    but as per-view scale/offset (see PyAOS.setViewAdjustment) instead of modifying the images.
+
+    :param bins: bins of the histograms used for the medians (see image_stats), defaults to 4096
+    :type bins: int, optional
     """
-    #print()
-    medians = np.zeros(len(image_list),dtype=np.float32)
-    for i in range(len(image_list)):
-        medians[i] = np.median(image_list[i])
-
-    overall_median = np.median(medians)
+    def __init__( self, bins=4096 ):
+        self.bins = bins
+        self.stats = [] # (min, max, median) per image
+
+    def __len__( self ):
+        return len(self.stats)
+
+    def add( self, image ):
+        """ computes and appends the statistics of an image """
+        self.append( image_stats(image, self.bins) )
+
+    def append( self, stats ):
+        """ appends statistics (min, max, median) computed elsewhere, e.g., on loader threads """
+        self.stats.append( tuple(stats) )
+
+    def result( self ):
+        """ statistics of all images like get_min_max_median: overall median, min and max, and min/max after aligning the medians
+
+        :rtype: dict
+        """
+        s = np.asarray(self.stats, dtype=np.float64).reshape(-1,3)
+        overall_median = np.median(s[:,2])
+        adj_value = overall_median - s[:,2] # correction value to adjust the mean/median of all images
+        return { 'median': overall_median, 'min': s[:,0].min(), 'max': s[:,1].max(), 'adj_min': (s[:,0] + adj_value).min(), 'adj_max': (s[:,1] + adj_value).max() }
+
+    def adjustments( self ):
+        """ per-image scale and offset of hdr_mean_adjust: (image + overall_median - median - adj_min) / (adj_max - adj_min)
+
+        :rtype: numpy.array
+        :return: array of shape (N,2) with scale and offset
+        """
+        r = self.result()
+        s = np.asarray(self.stats, dtype=np.float64).reshape(-1,3)
+        scale = 1.0 / (r['adj_max'] - r['adj_min'])
+        offsets = (r['median'] - s[:,2] - r['adj_min']) * scale
+        return np.stack((np.full(len(s), scale), offsets), axis=-1)
+
+    def apply( self, aos, first_view=0 ):
+        """ sets the adjustments of the images as view adjustments of aos (the views first_view, first_view+1, ...) """
+        for i, (scale, offset) in enumerate(self.adjustments()):
+            aos.setViewAdjustment(first_view + i, float(scale), float(offset))
+
+
+def get_min_max_median( image_list, bins=4096 ):
+    """
+    min/max and median of float32 images (see ExposureStats.result)
+    """
+    stats = ExposureStats(bins)
+    for img in image_list:
+        stats.add(img)
+    return stats.result()
 
-    img_minmax = (math.inf,-math.inf)
-    for i in range(len(image_list)):
-        image_list[i] += overall_median - medians[i]
-        img_minmax = ( np.min([np.amin(image_list[i]),img_minmax[0]]), np.max([np.amax(image_list[i]),img_minmax[1]]) )
 
-    for i in range(len(image_list)):
-        image_list[i] -= img_minmax[0]
-        image_list[i] /= (img_minmax[1] - img_minmax[0])
-        #img_minmax = ( np.min([np.amin(image_list[i]),img_minmax[0]]), np.max([np.amax(image_list[i]),img_minmax[1]]) )
+def hdr_mean_adjust( image_list, bins=4096 ):
+    """
+    adjusting the mean and min/max of float32 images (in place).
+    Prefer ExposureStats with PyAOS.setViewAdjustment, which does not modify the images.
+    """
+    stats = ExposureStats(bins)
+    for img in image_list:
+        stats.add(img)
+    for img, (scale, offset) in zip(image_list, stats.adjustments()):
+        img *= scale
+        img += offset
 
     return image_list
 
@@ -187,3 +427,24 @@ def minmax_of_images_in_folder( folder ):
         img_minmax = ( np.min([np.amin(cv_image),img_minmax[0]]), np.max([np.amax(cv_image),img_minmax[1]]) )
     
     return img_minmax
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Tools for light fields.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('pack', help='convert a poses file and its images into a packed light field (see pack_light_field)')
+    p.add_argument('poses', help='poses in a json format')
+    p.add_argument('images', help='folder of the images in POSES')
+    p.add_argument('out', help='packed light field (*.aoslf) that is written')
+    p.add_argument('--size', type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'), help='size the images are resized to')
+    p.add_argument('--dtype', default='uint8', choices=['uint8', 'float16'], help='pixel type (default: uint8)')
+    p.add_argument('--mask', help='alpha mask image')
+    p.add_argument('--replace-ext', help="replaces .tiff in the names of the images, e.g., '.png'")
+    p.add_argument('--adjust-mean', action='store_true', help='store the exposure adjustments of the images')
+    p.add_argument('--normalize', action='store_true', help='load the views in [0,1] instead of the value range of the image files')
+    p.add_argument('--workers', type=int, help='decoding threads')
+    args = parser.parse_args()
+    n = pack_light_field(args.out, args.poses, args.images, size=args.size, dtype=args.dtype, mask=args.mask, replace_ext=args.replace_ext, 
+                         adjust_mean=args.adjust_mean, normalize=args.normalize, workers=args.workers)
+    print(f'{n} views packed into {args.out}')
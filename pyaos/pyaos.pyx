@@ -8,6 +8,7 @@ import numpy as np
 cimport numpy as np
 import json
 import os
+import sys
 #import cv2
 
 cdef extern from "glm/glm.hpp" namespace "glm":
@@ -15,29 +16,161 @@ cdef extern from "glm/glm.hpp" namespace "glm":
         pass
     ctypedef struct vec3:
         pass   
+    ctypedef struct vec2:
+        float x
+        float y
+    ctypedef struct vec4:
+        float x
+        float y
+        float z
+        float w
+    ctypedef struct ivec4:
+        int x
+        int y
+        int z
+        int w
 
 
 cdef extern from "../include/AOS.h": # defines the source C++ file
+    cdef enum PIXTYPE:
+        PIX_UINT8
+        PIX_FLOAT16
+        PIX_FLOAT32
+
+    cdef enum FOCUSMETRIC:
+        FOCUS_VARIANCE
+        FOCUS_GRADIENT
+
+    ctypedef struct IntegralStats:
+        vec4 min
+        vec4 max
+        vec4 mean
+        unsigned int count
+
+    ctypedef struct ProfileStage:
+        string name
+        double cpu_ms
+        double gpu_ms
+
+    ctypedef struct Timings:
+        string call
+        double cpu_ms
+        vector[ProfileStage] stages
+        unsigned long long views_projected
+        unsigned long long bytes_uploaded
+        unsigned long long bytes_read_back
+        unsigned long long dem_tiles_drawn
+        unsigned long long dem_triangles_drawn
+
+    ctypedef struct ResidencyStats:
+        size_t budget
+        size_t resident_bytes
+        unsigned int resident_views
+        unsigned int views
+        unsigned long long uploads
+        unsigned long long evictions
+        size_t upload_bytes
+        size_t group_bytes
+        size_t pool_budget
+        size_t pooled_bytes
+        unsigned int pooled_textures
+        unsigned long long allocations
+        unsigned long long reuses
+
+    ctypedef struct IntegralCacheStats:
+        size_t budget
+        size_t bytes
+        unsigned int entries
+        unsigned long long hits
+        unsigned long long misses
+        unsigned long long evictions
+
     cdef cppclass AOS:
         AOS(unsigned int width, unsigned int height, float fovDegree, int preallocate_images) except +
-        void loadDEM(string obj_file)
+        void loadDEM(string obj_file) except +
+        void loadDEMFromHeights(const float* heights, int rows, int cols, vec2 origin, vec2 spacing, int tile_size, string cache_file) except +
+        void setDEMLODError(float pixels)
+        float getDEMLODError()
+        unsigned int getDEMTiles()
         void setDEMTransformation(const vec3 translation, const vec3 eulerAngles)
         void addView(Image img, mat4 pose, string name)
+        void addView(const void* data, int w, int h, int c, PIXTYPE type, mat4 pose, string name) except +
+        void addViews(const void* data, unsigned int n, int w, int h, int c, PIXTYPE type, const vector[mat4]& poses, const vector[string]& names) except +
+        unsigned int loadLightField(string file) except +
         mat4 getPose(unsigned int idx)
         mat4 setPose(unsigned int idx, const mat4 pose)
+        void setPoses(const vector[mat4]& poses, const vector[unsigned int]& ids) except +
+        void setPoseCorrection(const unsigned int index, const vec3 translation, const vec3 eulerAngles)
+        void setPoseCorrections(const vector[vec3]& translations, const vector[vec3]& eulerAngles, const vector[unsigned int]& ids) except +
+        mat4 getPoseCorrection(const unsigned int index)
         const vec3 getPosition(const unsigned int index)
         const vec3 getUp(const unsigned int index)
         const vec3 getForward(const unsigned int index)
         string getName(unsigned int idx)
         void removeView(unsigned int idx)
+        void removeViews(const vector[unsigned int]& ids) except +
+        void clearViews()
+        void setViewAdjustment(unsigned int idx, float scale, float offset)
+        vec2 getViewAdjustment(unsigned int idx)
+        void setMask(const void* data, int w, int h, PIXTYPE type, unsigned int group) except +
+        void clearMask(unsigned int group)
+        bool hasMask(unsigned int group)
+        void setViewMask(unsigned int idx, unsigned int group)
+        unsigned int getViewMask(unsigned int idx)
+        void setUndistortionMap(const float* map, int w, int h, int src_w, int src_h, unsigned int group) except +
+        void setCameraCalibration(float fx, float fy, float cx, float cy, const vector[float]& dist, int w, int h, unsigned int group) except +
+        void clearUndistortion(unsigned int group)
+        bool hasUndistortion(unsigned int group)
+        void setViewCamera(unsigned int idx, unsigned int group)
+        unsigned int getViewCamera(unsigned int idx)
         void replaceView(unsigned int idx, Image img, mat4 pose, string name)
+        void replaceView(unsigned int idx, const void* data, int w, int h, int c, PIXTYPE type, mat4 pose, string name) except +
 
-        Image render(const mat4 virtual_pose, const float virtual_fovDegree, const vector[unsigned int] ids)
+        Image render(const mat4 virtual_pose, const float virtual_fovDegree, const vector[unsigned int] ids, const ivec4 roi) except +
+        void renderFocalStack(const mat4 virtual_pose, const float virtual_fovDegree, const vector[float]& z_offsets, const vector[unsigned int] ids, float* stack, bool flipX) except +
+        void renderBatch(const vector[mat4]& virtual_poses, const vector[float]& virtual_fovDegrees, const vector[unsigned int] ids, float* frames, bool flipX) except +
+        void renderStats(const mat4 virtual_pose, const float virtual_fovDegree, const vector[unsigned int] ids, float* mean_count, float* variance_weight, bool flipX) except +
+        long long renderAsync(const mat4 virtual_pose, const float virtual_fovDegree, const vector[unsigned int] ids) except +
+        bool fetch(long long ticket, float* out, bool flipX, bool wait) except +
+        vector[float] focusMeasures(const mat4 virtual_pose, const float virtual_fovDegree, const vector[float]& z_offsets, const vector[unsigned int] ids, const ivec4 roi, FOCUSMETRIC metric, int tile_size, bool flipX) except +
+        float autofocus(const mat4 virtual_pose, const float virtual_fovDegree, float z_min, float z_max, const vector[unsigned int] ids, const ivec4 roi, FOCUSMETRIC metric, int steps, float tolerance, float* measure) except +
+        vector[float] autofocusTiles(const mat4 virtual_pose, const float virtual_fovDegree, float z_min, float z_max, int tile_size, const vector[unsigned int] ids, const ivec4 roi, FOCUSMETRIC metric, int steps, bool flipX) except +
+        const IntegralStats& getStats() except +
         Image getXYZ()
+        void pixelsToWorld(const vec2* pixels, size_t n, vec4* xyz) except +
         void display(bool normalize)
 
         unsigned int getViews()
         unsigned int getSize()
+
+        vector[unsigned int] queryViews(const mat4 virtual_pose, const float virtual_fovDegree, const vector[unsigned int] ids)
+        void setViewCulling(bool enable)
+        bool getViewCulling()
+
+        void setSinglePassRendering(bool enable)
+        bool getSinglePassRendering()
+
+        void setIncrementalRendering(bool enable)
+        bool getIncrementalRendering()
+
+        void setProfiling(bool enable)
+        bool getProfiling()
+        const Timings& getTimings()
+        void resetTimings()
+
+        void setTextureBudget(size_t bytes)
+        size_t getTextureBudget()
+        ResidencyStats getResidencyStats()
+        void resetResidencyStats()
+        void setTexturePool(size_t bytes)
+        size_t getTexturePool()
+
+        void setIntegralCache(size_t bytes)
+        size_t getIntegralCache()
+        void clearIntegralCache()
+        IntegralCacheStats getIntegralCacheStats()
+        void resetIntegralCacheStats()
+        unsigned long long getSceneVersion()
     
 cdef extern from *:
     ctypedef struct Image:
@@ -65,13 +198,53 @@ cdef extern from "../src/py_utils.cpp":
     void py_copy_image_to_float(Image im, float *pdata)
     void py_free_image(Image m)
     Image py_float_to_image(int w, int h, int c, float *data)
+
+cdef extern from "../src/egl_utils.cpp":
+    ctypedef struct HeadlessContext:
+        pass
+    HeadlessContext* CreateHeadlessContext(const char* backend, int device) except +
+    void MakeHeadlessContextCurrent(HeadlessContext* ctx) except +
+    bool IsHeadlessContextCurrent(HeadlessContext* ctx)
+    string GetHeadlessBackend(HeadlessContext* ctx)
+    void DestroyHeadlessContext(HeadlessContext* ctx)
     
 
+def _as_hwc_buffer(image):
+    """ returns image as C-contiguous array that can be uploaded without conversion (uint8, float16 or float32); other types are converted to float32 """
+    arr = np.asarray(image)
+    if arr.dtype not in (np.uint8, np.float16, np.float32):
+        arr = arr.astype(np.float32)
+    return np.ascontiguousarray(arr) # no copy if already contiguous
+
+def _out_array(out, shape):
+    """ returns out if it can be rendered into (C-contiguous, writeable float32 array of the given shape), or a new array if out is None """
+    if out is None:
+        return np.empty(shape, dtype=np.float32)
+    if not isinstance(out, np.ndarray) or out.dtype != np.float32 or out.shape != shape or not out.flags['C_CONTIGUOUS'] or not out.flags['WRITEABLE']:
+        raise ValueError("out must be a writeable C-contiguous float32 array of shape {}".format(shape))
+    return out
+
+cdef PIXTYPE _pixtype(np.ndarray arr):
+    if arr.dtype == np.uint8:
+        return PIX_UINT8
+    elif arr.dtype == np.float16:
+        return PIX_FLOAT16
+    return PIX_FLOAT32
+
+cdef FOCUSMETRIC _focus_metric(metric) except *:
+    if metric == 'variance':
+        return FOCUS_VARIANCE
+    elif metric == 'gradient':
+        return FOCUS_GRADIENT
+    raise ValueError("metric must be 'variance' or 'gradient'")
+
+
 cdef class PyAOS: # defines a python wrapper to the C++ class
     cdef AOS* thisptr # thisptr is a pointer that will hold to the instance of the C++ class
     cdef float *pyfloatarray
     cdef unsigned int LFRResolutionHeight
     cdef unsigned int LFRResolutionWidth
+    cdef object profileCallback
     def __cinit__(self, unsigned int width, unsigned int height, float fovDegree, int preallocate_images=0): # defines the python wrapper class' init function
         self.LFRResolutionHeight = height  # destroys the reference to the C++ instance (which calls the C++ class destructor
         self.LFRResolutionWidth = width
@@ -79,7 +252,44 @@ cdef class PyAOS: # defines a python wrapper to the C++ class
     def __dealloc__(self): # defines the python wrapper class' deallocation function (python destructor)
         del self.thisptr # destroys the reference to the C++ instance (which calls the C++ class destructor
     def loadDEM(self, objmodelpath):
-        self.thisptr.loadDEM(objmodelpath.encode())
+        """Loads the DEM from an OBJ file or from the mesh cache of a raster DEM (*.aosdem, see :meth:`loadDEMFromArray`)."""
+        self.thisptr.loadDEM(os.fspath(objmodelpath).encode())
+
+    def loadDEMFromArray(self, heights, origin=(0.0, 0.0), spacing=(1.0, 1.0), tile_size=128, cache=None):
+        """Loads a raster DEM from a grid of heights without converting it to a mesh file first.
+        The grid is triangulated in tiles with levels of detail. Only the tiles in the view frustum of the virtual camera are drawn,
+        distant tiles with coarser levels (see :meth:`setDEMLODError`).
+
+        :param heights: heights with shape (rows, cols), height [r,c] is at x = origin[0] + c * spacing[0], y = origin[1] + r * spacing[1]. NaN heights are holes in the DEM
+        :type heights: numpy.array
+        :param origin: position (x, y) of height [0,0], defaults to (0,0)
+        :type origin: tuple, optional
+        :param spacing: distance (x, y) of neighboring heights (can be negative, e.g., for rasters with the first row in the north), defaults to (1,1)
+        :type spacing: tuple, optional
+        :param tile_size: grid cells per tile (in each direction), defaults to 128
+        :type tile_size: int, optional
+        :param cache: file (*.aosdem) the meshes are loaded from if it was built from the same grid, or written to otherwise, defaults to None (no cache). It can also be loaded with :meth:`loadDEM`
+        :type cache: str, optional
+        """
+        cdef np.ndarray h = np.ascontiguousarray(heights, dtype=np.float32)
+        if h.ndim != 2:
+            raise ValueError("heights need to have the shape (rows, cols)!")
+        cdef vec2 o, d
+        o.x, o.y = origin
+        d.x, d.y = spacing
+        self.thisptr.loadDEMFromHeights(<float*>np.PyArray_DATA(h), h.shape[0], h.shape[1], o, d, tile_size, os.fspath(cache).encode() if cache is not None else b"")
+
+    def setDEMLODError(self, pixels):
+        """Sets the level of detail of raster DEMs: tiles are drawn with the coarsest level whose grid cells are at most this many pixels large (default 1). 0 always draws the finest level."""
+        self.thisptr.setDEMLODError(pixels)
+
+    def getDEMLODError(self):
+        return self.thisptr.getDEMLODError()
+
+    def getDEMTiles(self):
+        """Returns the number of tiles of a raster DEM (0 for DEMs from OBJ files)."""
+        return self.thisptr.getDEMTiles()
+
     def setDEMTransform(self, transl, euler=np.array([0,0,0])):
         cdef vec3 translation
         translation = make_vec3_from_float(np.asarray(transl).astype(np.float32).tobytes())
@@ -87,25 +297,66 @@ cdef class PyAOS: # defines a python wrapper to the C++ class
         eulerAngles = make_vec3_from_float(np.asarray(euler).astype(np.float32).tobytes())
         self.thisptr.setDEMTransformation(translation, eulerAngles)
     def addView(self, readimage, camerapose, pyImagename):
-        cdef Image pyImage
+        """Adds a single view. The image is uploaded directly from its (HWC) buffer. 
+
+        :param readimage: image with shape (H,W) or (H,W,C) with C=1, 3 or 4. uint8, float16 and float32 images are not copied, other types are converted to float32. uint8 colors are not normalized (i.e., they are used like float values from 0 to 255), but an uint8 alpha channel is normalized to [0,1]
+        :type readimage: numpy.array
+        :param camerapose: pose of the view as 4 by 4 matrix
+        :type camerapose: array
+        :param pyImagename: name of the view
+        :type pyImagename: str
+        """
+        cdef np.ndarray img = _as_hwc_buffer(readimage)
         cdef mat4 pyPose
-        height = readimage.shape[0]
-        width = readimage.shape[1]
-        if len(readimage.shape) == 2 :
-            channels = 1
-        else :
-            channels = readimage.shape[2]
-        pyImage  = py_make_image(width, height,channels)
-        py_copy_image_from_float(pyImage , np.asarray(readimage).astype(np.float32).tobytes())
+        channels = 1 if img.ndim == 2 else img.shape[2]
         pyPose =  make_mat4_from_float(np.asarray(camerapose).astype(np.float32).tobytes())
-        self.thisptr.addView(pyImage, pyPose, pyImagename.encode())
-        py_free_image(pyImage)
+        self.thisptr.addView(np.PyArray_DATA(img), img.shape[1], img.shape[0], channels, _pixtype(img), pyPose, pyImagename.encode())
+        self._reportTimings()
+
+    def addViews(self, readimages, cameraposes, pyImagenames=None):
+        """Adds multiple views of the same size with a single call.
+
+        :param readimages: images with shape (N,H,W) or (N,H,W,C), see addView for supported types
+        :type readimages: numpy.array
+        :param cameraposes: poses of the views with shape (N,4,4)
+        :type cameraposes: array
+        :param pyImagenames: names of the views, defaults to None which uses the view index as name
+        :type pyImagenames: list of str, optional
+        """
+        cdef np.ndarray imgs = _as_hwc_buffer(readimages)
+        cdef float[:, ::1] posearr = np.ascontiguousarray(np.asarray(cameraposes, dtype=np.float32).reshape(-1,16))
+        cdef vector[mat4] pyPoses
+        cdef vector[string] pyNames
+        if imgs.ndim not in (3,4):
+            raise ValueError("images need to have the shape (N,H,W) or (N,H,W,C)!")
+        n = imgs.shape[0]
+        channels = 1 if imgs.ndim == 3 else imgs.shape[3]
+        for i in range(posearr.shape[0]):
+            pyPoses.push_back(make_mat4_from_float(<char*>&posearr[i,0]))
+        if pyImagenames is not None:
+            for name in pyImagenames:
+                pyNames.push_back(name.encode())
+        self.thisptr.addViews(np.PyArray_DATA(imgs), n, imgs.shape[2], imgs.shape[1], channels, _pixtype(imgs), pyPoses, pyNames)
+        self._reportTimings()
+
+    def loadLightField(self, path):
+        """Adds the views of a packed light field (*.aoslf, see LFR_utils.pack_light_field) with their names, pose corrections, 
+        adjustments and the shared mask. The file is memory-mapped and the images are uploaded without decoding or converting them.
+
+        :param path: path of the packed light field
+        :type path: str
+        :return: number of added views, which are appended after the existing views
+        :rtype: int
+        """
+        n = self.thisptr.loadLightField(os.fspath(path).encode())
+        self._reportTimings()
+        return n
     
     def getPose(self, poseindex):
         cdef mat4 pyPose
         cdef np.ndarray[float, ndim=1, mode='c'] floatarr
         floatarr = np.zeros((16,), dtype=np.float32)
-        pyPose = self.thisptr.getPose(poseindex)
+        pyPose = self.thisptr.getPose(self._viewIndex(poseindex))
         get_float_ptr_mat(&pyPose,&floatarr[0])
         return floatarr[:].reshape(4,4)
         #cdef float[::1] arr = <float [:16]> floatarr # see https://stackoverflow.com/questions/24764048/get-the-value-of-a-cython-pointer
@@ -117,17 +368,64 @@ cdef class PyAOS: # defines a python wrapper to the C++ class
         cdef np.ndarray[float, ndim=1, mode='c'] floatarr
         floatarr = np.zeros((16,), dtype=np.float32)
         pyPose =  make_mat4_from_float(camerapose.astype(np.float32).tobytes())
-        returnedpyPose = self.thisptr.setPose(poseindex, pyPose)
+        returnedpyPose = self.thisptr.setPose(self._viewIndex(poseindex), pyPose)
         get_float_ptr_mat(&pyPose,&floatarr[0])
         return floatarr[:].reshape(4,4)
         #cdef float[::1] arr = <float [:16]> floatarr # see https://stackoverflow.com/questions/24764048/get-the-value-of-a-cython-pointer
         #return np.asarray( arr ).reshape(4,4)
+
+    def setPoses(self, cameraposes, cameraids=None):
+        """Sets the poses of several views at once (e.g., for pose optimization), which is faster than calling :meth:`setPose` per view.
+
+        :param cameraposes: poses with shape (N,4,4)
+        :type cameraposes: array
+        :param cameraids: indices of the N views, defaults to None (all views)
+        :type cameraids: array, optional
+        """
+        cdef float[:, ::1] posearr = np.ascontiguousarray(np.asarray(cameraposes, dtype=np.float32).reshape(-1,16))
+        cdef vector[unsigned int] ids = self._viewIds(cameraids if cameraids is not None else [])
+        if posearr.shape[0] != (ids.size() if cameraids is not None else self.thisptr.getViews()):
+            raise ValueError("provide one pose per view!")
+        cdef vector[mat4] pyPoses
+        for i in range(posearr.shape[0]):
+            pyPoses.push_back(make_mat4_from_float(<char*>&posearr[i,0]))
+        self.thisptr.setPoses(pyPoses, ids)
+
+    def setPoseCorrection(self, cameraindex, transl, euler=np.array([0,0,0])):
+        """Sets a correction (translation and euler angles) that is applied to the pose of a view."""
+        cdef vec3 translation = make_vec3_from_float(np.asarray(transl).astype(np.float32).tobytes())
+        cdef vec3 eulerAngles = make_vec3_from_float(np.asarray(euler).astype(np.float32).tobytes())
+        self.thisptr.setPoseCorrection(self._viewIndex(cameraindex), translation, eulerAngles)
+
+    def setPoseCorrections(self, corrections, cameraids=None):
+        """Sets the corrections of several views at once (see :meth:`setPoseCorrection` and :meth:`setPoses`).
+
+        :param corrections: translations and euler angles with shape (N,6)
+        :type corrections: array
+        :param cameraids: indices of the N views, defaults to None (all views)
+        :type cameraids: array, optional
+        """
+        cdef float[:, ::1] corr = np.ascontiguousarray(np.asarray(corrections, dtype=np.float32).reshape(-1,6))
+        cdef vector[unsigned int] ids = self._viewIds(cameraids if cameraids is not None else [])
+        if corr.shape[0] != (ids.size() if cameraids is not None else self.thisptr.getViews()):
+            raise ValueError("provide one correction per view!")
+        cdef vector[vec3] translations, eulerAngles
+        for i in range(corr.shape[0]):
+            translations.push_back(make_vec3_from_float(<char*>&corr[i,0]))
+            eulerAngles.push_back(make_vec3_from_float(<char*>&corr[i,3]))
+        self.thisptr.setPoseCorrections(translations, eulerAngles, ids)
+
+    def getPoseCorrection(self, cameraindex):
+        cdef mat4 corr = self.thisptr.getPoseCorrection(self._viewIndex(cameraindex))
+        cdef np.ndarray[float, ndim=1, mode='c'] floatarr = np.zeros((16,), dtype=np.float32)
+        get_float_ptr_mat(&corr,&floatarr[0])
+        return floatarr[:].reshape(4,4)
     
     def getPosition(self, cameraindex):
         cdef vec3 pyPosition
         cdef np.ndarray[float, ndim=1, mode='c'] floatarr
         floatarr = np.zeros((3,), dtype=np.float32)
-        pyPosition = self.thisptr.getPosition(cameraindex)
+        pyPosition = self.thisptr.getPosition(self._viewIndex(cameraindex))
         get_float_ptr_vec(&pyPosition, &floatarr[0])
         return floatarr[:]
         #cdef float[::1] arr = <float [:3]>  floatarr# see https://stackoverflow.com/questions/24764048/get-the-value-of-a-cython-pointer
@@ -137,7 +435,7 @@ cdef class PyAOS: # defines a python wrapper to the C++ class
         cdef vec3 pyUp
         cdef np.ndarray[float, ndim=1, mode='c'] floatarr
         floatarr = np.zeros((3,), dtype=np.float32)
-        pyUp = self.thisptr.getUp(cameraindex)
+        pyUp = self.thisptr.getUp(self._viewIndex(cameraindex))
         get_float_ptr_vec(&pyUp, &floatarr[0])
         return floatarr[:]
     
@@ -145,40 +443,159 @@ cdef class PyAOS: # defines a python wrapper to the C++ class
         cdef vec3 pyForward
         cdef np.ndarray[float, ndim=1, mode='c'] floatarr
         floatarr = np.zeros((3,), dtype=np.float32)
-        pyForward = self.thisptr.getForward(cameraindex)
+        pyForward = self.thisptr.getForward(self._viewIndex(cameraindex))
         get_float_ptr_vec(&pyForward, &floatarr[0])
         return floatarr[:]
     
     def getName(self, cameraindex):
         cdef string pyname
-        pyname = self.thisptr.getName(cameraindex)
+        pyname = self.thisptr.getName(self._viewIndex(cameraindex))
         return pyname.decode()
 
     def clearViews(self):
-        while self.getViews()>0:
-            self.removeView(0)
-        assert self.getViews()==0
+        """Removes all views and deletes their textures, unless a texture pool keeps them for views of the same size and format (see :meth:`setTexturePool`)."""
+        self.thisptr.clearViews()
 
     def removeView(self, cameraindex):
-        self.thisptr.removeView(cameraindex)
+        self.thisptr.removeView(self._viewIndex(cameraindex))
+
+    def removeViews(self, cameraids):
+        """Removes several views at once (the indices refer to the views before removing any of them)."""
+        self.thisptr.removeViews(self._viewIds(cameraids))
+
+    def _viewIds(self, cameraids):
+        ids = np.asarray(cameraids, dtype=np.int64).ravel()
+        if ((ids < 0) | (ids >= self.thisptr.getViews())).any():
+            raise IndexError("view index out of range!")
+        return ids.astype(np.uintc)
+
+    def _viewIndex(self, cameraindex):
+        if not 0 <= cameraindex < self.thisptr.getViews():
+            raise IndexError("view index out of range!")
+        return cameraindex
+
+    def setViewAdjustment(self, cameraindex, scale, offset):
+        """Sets an exposure adjustment that is applied to the colors of a view when rendering: rgb * scale + offset (alpha is not changed).
+        The images are not modified. The adjustment is reset by :meth:`replaceView`. See :class:`pyaos.LFR_utils.ExposureStats` for computing adjustments.
+
+        :param cameraindex: index of the view
+        :type cameraindex: int
+        :param scale: factor of the colors
+        :type scale: float
+        :param offset: offset added to the scaled colors
+        :type offset: float
+        """
+        self.thisptr.setViewAdjustment(self._viewIndex(cameraindex), scale, offset)
+
+    def getViewAdjustment(self, cameraindex):
+        cdef vec2 adj = self.thisptr.getViewAdjustment(self._viewIndex(cameraindex))
+        return adj.x, adj.y
+
+    def setMask(self, mask, group=0):
+        """Sets a mask that is shared by all views of a mask group. The alpha of the views is multiplied with the mask when rendering,
+        so the views do not need an alpha channel (e.g., RGB images instead of RGBA images with the same mask in every view).
+        All views are in group 0 unless they are assigned to another group with :meth:`setViewMask`.
+
+        :param mask: mask with shape (H,W), it is sampled like the views and can have a different size. uint8 masks are normalized to [0,1], float16 and float32 masks are used as they are
+        :type mask: numpy.array
+        :param group: mask group, defaults to 0
+        :type group: int, optional
+        """
+        cdef np.ndarray m = _as_hwc_buffer(mask)
+        if m.ndim == 3 and m.shape[2] == 1:
+            m = m[:,:,0]
+        if m.ndim != 2:
+            raise ValueError("a mask needs to have the shape (H,W)!")
+        self.thisptr.setMask(np.PyArray_DATA(m), m.shape[1], m.shape[0], _pixtype(m), group)
+
+    def clearMask(self, group=0):
+        """Removes the mask of a group, i.e., the views of the group are rendered with their own alpha only."""
+        self.thisptr.clearMask(group)
+
+    def hasMask(self, group=0):
+        return self.thisptr.hasMask(group)
+
+    def setViewMask(self, cameraindex, group):
+        """Assigns a view to a mask group (see :meth:`setMask`). A group without a mask does not change the view."""
+        self.thisptr.setViewMask(self._viewIndex(cameraindex), group)
+
+    def getViewMask(self, cameraindex):
+        return self.thisptr.getViewMask(self._viewIndex(cameraindex))
+
+    def setCameraCalibration(self, K, dist, size, group=0):
+        """Sets the calibration of a camera group. The views of the group are raw (distorted) frames that are undistorted on the GPU when they are sampled,
+        so they can be added without remapping them on the CPU, and changing the calibration does not require adding them again.
+        All views are in group 0 unless they are assigned to another group with :meth:`setViewCamera`.
+
+        :param K: 3 by 3 camera matrix (fx, fy, cx, cy in pixels, like OpenCV)
+        :type K: array
+        :param dist: distortion coefficients (k1, k2, p1, p2[, k3[, k4, k5, k6]]) like OpenCV
+        :type dist: array
+        :param size: size (width, height) of the frames
+        :type size: tuple
+        :param group: camera group, defaults to 0
+        :type group: int, optional
+        """
+        K = np.asarray(K, dtype=np.float64)
+        cdef vector[float] coeffs = np.asarray(dist, dtype=np.float32).ravel()
+        self.thisptr.setCameraCalibration(K[0,0], K[1,1], K[0,2], K[1,2], coeffs, size[0], size[1], group)
+
+    def setUndistortionMap(self, map, src_size=None, group=0):
+        """Sets the undistortion of a camera group from a remap table (see :meth:`setCameraCalibration`).
+
+        :param map: pixel coordinates in the raw frames for each pixel of the undistorted image with shape (H,W,2), or the pair (map_x, map_y) of cv2.initUndistortRectifyMap (with m1type cv2.CV_32FC1)
+        :type map: numpy.array
+        :param src_size: size (width, height) of the raw frames, defaults to None which uses the size of the map
+        :type src_size: tuple, optional
+        :param group: camera group, defaults to 0
+        :type group: int, optional
+        """
+        if isinstance(map, (tuple, list)):
+            map = np.dstack(map)
+        cdef np.ndarray m = np.ascontiguousarray(map, dtype=np.float32)
+        if m.ndim != 3 or m.shape[2] != 2:
+            raise ValueError("the map needs to have the shape (H,W,2)!")
+        if src_size is None:
+            src_size = (m.shape[1], m.shape[0])
+        self.thisptr.setUndistortionMap(<float*>np.PyArray_DATA(m), m.shape[1], m.shape[0], src_size[0], src_size[1], group)
+
+    def clearUndistortion(self, group=0):
+        self.thisptr.clearUndistortion(group)
+
+    def hasUndistortion(self, group=0):
+        return self.thisptr.hasUndistortion(group)
+
+    def setViewCamera(self, cameraindex, group):
+        """Assigns a view to a camera group (see :meth:`setCameraCalibration`). A group without a calibration does not change the view."""
+        self.thisptr.setViewCamera(self._viewIndex(cameraindex), group)
+
+    def getViewCamera(self, cameraindex):
+        return self.thisptr.getViewCamera(self._viewIndex(cameraindex))
     
     def replaceView(self, cameraindex, replacingimage, replacingpose,replacename):
-        cdef Image pyImage
+        cdef np.ndarray img = _as_hwc_buffer(replacingimage)
         cdef mat4 pyPose
-        height = replacingimage.shape[0]
-        width = replacingimage.shape[1]
-        if len(replacingimage.shape) == 2 :
-            channels = 1
-        else :
-            channels = replacingimage.shape[2]
-        pyImage  = py_make_image(width, height,channels)
-        py_copy_image_from_float(pyImage , np.asarray(replacingimage).astype(np.float32).tobytes()) 
-        pyPose =  make_mat4_from_float(replacingpose.astype(np.float32).tobytes())
-        self.thisptr.replaceView(cameraindex, pyImage, pyPose, replacename.encode())
-        py_free_image(pyImage)
+        channels = 1 if img.ndim == 2 else img.shape[2]
+        pyPose =  make_mat4_from_float(np.asarray(replacingpose).astype(np.float32).tobytes())
+        self.thisptr.replaceView(self._viewIndex(cameraindex), np.PyArray_DATA(img), img.shape[1], img.shape[0], channels, _pixtype(img), pyPose, replacename.encode())
     
-    def render(self, virtualcamerapose, virtualcamerafieldofview, cameraids=[], flipHorizontal=True, copyImage=True):
+    cdef ivec4 _framebufferROI(self, roi, flipHorizontal) except *:
+        """ converts a roi (x, y, width, height) in pixels of the returned images to framebuffer pixels, None is the whole image """
+        cdef ivec4 rect
+        rect.x = rect.y = rect.z = rect.w = 0
+        if roi is not None:
+            x, y, w, h = (int(v) for v in roi)
+            if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > self.LFRResolutionWidth or y + h > self.LFRResolutionHeight:
+                raise ValueError('roi must be a non-empty rectangle inside the image')
+            rect.x = self.LFRResolutionWidth - x - w if flipHorizontal else x # the internal format is flipped
+            rect.y = y
+            rect.z = w
+            rect.w = h
+        return rect
+
+    def render(self, virtualcamerapose, virtualcamerafieldofview, cameraids=[], flipHorizontal=True, copyImage=True, roi=None):
         """Renders an AOS image with the specified parameters and returns an image.
+        With a region of interest, only the pixels inside it are rendered and read back (e.g., for crops around detections).
 
         :param pose: pose of the virtual camera as 4 by 4 matrix
         :type pose: array
@@ -190,19 +607,25 @@ cdef class PyAOS: # defines a python wrapper to the C++ class
         :type flipHorizontal: bool, optional
         :param copyImage: if True, the returned image is copied before returning, defaults to True
         :type copyImage: bool, optional
+        :param roi: region of interest (x, y, width, height) in pixels of the returned image, i.e., x is the column and y the row of its first pixel. 
+            Pixels outside of it are cleared (see :meth:`getStats` and :meth:`getXYZ`), unless incremental rendering is used. Defaults to None, which renders the whole image
+        :type roi: tuple, optional
 
         :rtype: numpy.array
-        :return: Rendered image
+        :return: Rendered image, of shape (height, width, 4) of the roi if one is specified
+        :raises ValueError: if the roi is empty or not inside the image
+        :raises RuntimeError: if rendering fails, e.g., for an unknown view id
         """
         cdef vector[unsigned int] ids = np.asarray(cameraids, dtype = np.uintc, order="C")
-
+        cdef ivec4 rect = self._framebufferROI(roi, flipHorizontal)
         cdef mat4 pyvirtualPose =  make_mat4_from_float(np.asarray(virtualcamerapose).astype(np.float32).tobytes())
-        img = self.thisptr.render(pyvirtualPose, virtualcamerafieldofview, ids)
+        img = self.thisptr.render(pyvirtualPose, virtualcamerafieldofview, ids, rect)
+        self._reportTimings()
         #cdef np.ndarray[float, ndim=3, mode='c'] floatarr
         #floatarr = np.zeros((self.LFRResolutionHeight,self.LFRResolutionWidth,4), dtype=np.float32)
         #py_copy_image_to_float(img, &floatarr[0,0,0])
         #return floatarr
-        tmp = np.asarray( <float [:(img.w*img.h*img.c)]>img.data ).reshape(img.w,img.h,img.c)  # see https://stackoverflow.com/questions/59666307/convert-c-vector-to-numpy-array-in-cython-without-copying
+        tmp = np.asarray( <float [:(img.w*img.h*img.c)]>img.data ).reshape(img.h,img.w,img.c)  # see https://stackoverflow.com/questions/59666307/convert-c-vector-to-numpy-array-in-cython-without-copying
         if flipHorizontal:
             tmp = tmp[:,::-1,:] # flip the image horicontally. This seems to be much faster than cv2.flip
         
@@ -211,14 +634,514 @@ cdef class PyAOS: # defines a python wrapper to the C++ class
 
         return tmp
     
+    def renderStats(self, virtualcamerapose, virtualcamerafieldofview, cameraids=[], flipHorizontal=True):
+        """Renders per-pixel statistics of the views instead of only their mean (e.g., for anomaly detection): the colors of the views are weighted by their alpha like in :meth:`render`.
+        The sums of the colors, of the squared colors and the number of views are accumulated on the GPU in a single projection pass (with two render targets).
+
+        :param virtualcamerapose: pose of the virtual camera as 4 by 4 matrix
+        :type virtualcamerapose: array
+        :param virtualcamerafieldofview: field of view of the virtual camera in degrees
+        :type virtualcamerafieldofview: number
+        :param cameraids: view/camera ids used for rendering, defaults to [] which renders with all available views
+        :type cameraids: array, optional
+        :param flipHorizontal: if True, the images are flipped horizontally (see :meth:`render`), defaults to True
+        :type flipHorizontal: bool, optional
+
+        :rtype: dict
+        :return: 'mean' and 'variance' (float32 arrays of shape (height, width, 3)), 'count' (number of views contributing to a pixel) 
+            and 'weight' (sum of their alpha, i.e., the alpha channel of :meth:`render`) of shape (height, width)
+        """
+        cdef vector[unsigned int] ids = np.asarray(cameraids, dtype = np.uintc, order="C")
+        cdef mat4 pyvirtualPose =  make_mat4_from_float(np.asarray(virtualcamerapose).astype(np.float32).tobytes())
+        cdef np.ndarray mean_count = np.empty((self.LFRResolutionHeight, self.LFRResolutionWidth, 4), dtype=np.float32)
+        cdef np.ndarray variance_weight = np.empty((self.LFRResolutionHeight, self.LFRResolutionWidth, 4), dtype=np.float32)
+        self.thisptr.renderStats(pyvirtualPose, virtualcamerafieldofview, ids, <float*>np.PyArray_DATA(mean_count), <float*>np.PyArray_DATA(variance_weight), <bint> flipHorizontal)
+        self._reportTimings()
+        return {
+            'mean': mean_count[:,:,:3],
+            'variance': variance_weight[:,:,:3],
+            'count': mean_count[:,:,3],
+            'weight': variance_weight[:,:,3],
+        }
+
+    def renderFocalStack(self, virtualcamerapose, virtualcamerafieldofview, z_offsets, cameraids=[], flipHorizontal=True, out=None):
+        """Renders a focal stack, i.e., one AOS image for each focal plane, in a single call.
+        Each focal plane is the DEM shifted by the corresponding offset along the z-axis (in addition to the DEM transformation).
+        The views and the G-buffer are reused across the planes and the readback of a plane overlaps with rendering the next one.
+        If the DEM is planar, the G-buffer is computed analytically instead of rasterizing the DEM.
+
+        :param virtualcamerapose: pose of the virtual camera as 4 by 4 matrix
+        :type virtualcamerapose: array
+        :param virtualcamerafieldofview: field of view of the virtual camera in degrees
+        :type virtualcamerafieldofview: number
+        :param z_offsets: offsets of the focal planes along the z-axis
+        :type z_offsets: array
+        :param cameraids: view/camera ids used for rendering, defaults to [] which renders with all available views
+        :type cameraids: array, optional
+        :param flipHorizontal: if True, the rendered images are flipped horizontally (see :meth:`render`), defaults to True
+        :type flipHorizontal: bool, optional
+        :param out: preallocated C-contiguous float32 array of shape (len(z_offsets), height, width, 4) to render into, defaults to None
+        :type out: numpy.array, optional
+
+        :rtype: numpy.array
+        :return: Rendered focal stack of shape (len(z_offsets), height, width, 4)
+        """
+        cdef vector[float] zs = np.asarray(z_offsets, dtype=np.float32).ravel()
+        cdef vector[unsigned int] ids = np.asarray(cameraids, dtype = np.uintc, order="C")
+        out = _out_array(out, (zs.size(), self.LFRResolutionHeight, self.LFRResolutionWidth, 4))
+        if zs.size() == 0:
+            return out
+
+        cdef np.ndarray stack = out
+        cdef mat4 pyvirtualPose =  make_mat4_from_float(np.asarray(virtualcamerapose).astype(np.float32).tobytes())
+        self.thisptr.renderFocalStack(pyvirtualPose, virtualcamerafieldofview, zs, ids, <float*>np.PyArray_DATA(stack), <bint> flipHorizontal)
+        self._reportTimings()
+        return out
+
+    def focusMeasures(self, virtualcamerapose, virtualcamerafieldofview, z_offsets, roi=None, metric='variance', cameraids=[], tile_size=None, flipHorizontal=True):
+        """Measures how sharp the AOS images of focal planes are (see :meth:`renderFocalStack`), e.g., to plot the focus curve of :meth:`autofocus`.
+        The measure is computed on the GPU from the luminance of the pixels seen by any view, only partial sums per block of 16 x 16 pixels are read back instead of the images.
+
+        :param virtualcamerapose: pose of the virtual camera as 4 by 4 matrix
+        :type virtualcamerapose: array
+        :param virtualcamerafieldofview: field of view of the virtual camera in degrees
+        :type virtualcamerafieldofview: number
+        :param z_offsets: offsets of the focal planes along the z-axis (in addition to the DEM transformation)
+        :type z_offsets: array
+        :param roi: region of interest (x, y, width, height) in pixels of the rendered images (see :meth:`render`), defaults to None which measures the whole image
+        :type roi: tuple, optional
+        :param metric: 'variance' (variance of the luminance) or 'gradient' (mean squared gradient of the luminance), defaults to 'variance'
+        :type metric: str, optional
+        :param cameraids: view/camera ids used for rendering, defaults to [] which renders with all available views
+        :type cameraids: array, optional
+        :param tile_size: if set, the roi is split into tiles of this size (a multiple of 16) which are measured separately, defaults to None
+        :type tile_size: int, optional
+        :param flipHorizontal: if True, the roi and the tiles refer to horizontally flipped images (see :meth:`render`), defaults to True
+        :type flipHorizontal: bool, optional
+
+        :rtype: numpy.array
+        :return: measures of shape (len(z_offsets),), or (len(z_offsets), tiles_y, tiles_x) with tiles. NaN if no pixel is seen by any view
+        """
+        if tile_size and (tile_size < 0 or tile_size % 16 != 0):
+            raise ValueError("tile_size must be a multiple of 16!")
+        cdef vector[float] zs = np.asarray(z_offsets, dtype=np.float32).ravel()
+        cdef vector[unsigned int] ids = np.asarray(cameraids, dtype = np.uintc, order="C")
+        cdef ivec4 rect = self._framebufferROI(roi, flipHorizontal)
+        cdef FOCUSMETRIC m = _focus_metric(metric)
+        cdef mat4 pyvirtualPose =  make_mat4_from_float(np.asarray(virtualcamerapose).astype(np.float32).tobytes())
+        measures = np.asarray(self.thisptr.focusMeasures(pyvirtualPose, virtualcamerafieldofview, zs, ids, rect, m, tile_size or 0, <bint> flipHorizontal), dtype=np.float32)
+        self._reportTimings()
+        if tile_size:
+            w = rect.z if roi is not None else self.LFRResolutionWidth
+            h = rect.w if roi is not None else self.LFRResolutionHeight
+            return measures.reshape(zs.size(), (h + tile_size - 1) // tile_size, (w + tile_size - 1) // tile_size)
+        return measures
+
+    def autofocus(self, virtualcamerapose, virtualcamerafieldofview, z_range, roi=None, metric='variance', cameraids=[], steps=9, tolerance=0.1, flipHorizontal=True):
+        """Searches the focal plane with the sharpest AOS image, e.g., to focus on the ground or on an object inside a region of interest.
+        The focus measure (see :meth:`focusMeasures`) of equidistant planes is evaluated first, then the best one is refined with a golden-section search.
+        Only scalars are read back from the GPU.
+
+        :param virtualcamerapose: pose of the virtual camera as 4 by 4 matrix
+        :type virtualcamerapose: array
+        :param virtualcamerafieldofview: field of view of the virtual camera in degrees
+        :type virtualcamerafieldofview: number
+        :param z_range: (min, max) offsets of the focal planes along the z-axis (in addition to the DEM transformation)
+        :type z_range: tuple
+        :param roi: region of interest (x, y, width, height) in pixels of the rendered images (see :meth:`render`), defaults to None which focuses the whole image
+        :type roi: tuple, optional
+        :param metric: 'variance' or 'gradient' (see :meth:`focusMeasures`), defaults to 'variance'
+        :type metric: str, optional
+        :param cameraids: view/camera ids used for rendering, defaults to [] which renders with all available views
+        :type cameraids: array, optional
+        :param steps: number of equidistant planes of the coarse search (at least 2), defaults to 9
+        :type steps: int, optional
+        :param tolerance: the search stops once the sharpest plane is known within this distance, defaults to 0.1
+        :type tolerance: float, optional
+        :param flipHorizontal: if True, the roi refers to horizontally flipped images (see :meth:`render`), defaults to True
+        :type flipHorizontal: bool, optional
+
+        :rtype: tuple
+        :return: z offset of the sharpest plane and its focus measure
+        """
+        if steps < 2 or tolerance <= 0 or z_range[1] < z_range[0]:
+            raise ValueError("autofocus needs z_range[0] <= z_range[1], at least 2 steps and a positive tolerance!")
+        cdef vector[unsigned int] ids = np.asarray(cameraids, dtype = np.uintc, order="C")
+        cdef ivec4 rect = self._framebufferROI(roi, flipHorizontal)
+        cdef FOCUSMETRIC m = _focus_metric(metric)
+        cdef mat4 pyvirtualPose =  make_mat4_from_float(np.asarray(virtualcamerapose).astype(np.float32).tobytes())
+        cdef float measure = 0
+        z = self.thisptr.autofocus(pyvirtualPose, virtualcamerafieldofview, z_range[0], z_range[1], ids, rect, m, steps, tolerance, &measure)
+        self._reportTimings()
+        return z, measure
+
+    def autofocusTiles(self, virtualcamerapose, virtualcamerafieldofview, z_range, tile_size=64, roi=None, metric='variance', cameraids=[], steps=17, flipHorizontal=True):
+        """Focuses each tile of the image separately, which gives a coarse depth map (e.g., of uneven terrain or of the canopy).
+        Per tile, the sharpest of equidistant planes is refined by fitting a parabola to the focus measures (see :meth:`focusMeasures`) of its neighbors.
+
+        :param virtualcamerapose: pose of the virtual camera as 4 by 4 matrix
+        :type virtualcamerapose: array
+        :param virtualcamerafieldofview: field of view of the virtual camera in degrees
+        :type virtualcamerafieldofview: number
+        :param z_range: (min, max) offsets of the focal planes along the z-axis (in addition to the DEM transformation)
+        :type z_range: tuple
+        :param tile_size: size of the tiles in pixels (a multiple of 16), defaults to 64
+        :type tile_size: int, optional
+        :param roi: region of interest (x, y, width, height) in pixels of the rendered images (see :meth:`render`), defaults to None which covers the whole image
+        :type roi: tuple, optional
+        :param metric: 'variance' or 'gradient' (see :meth:`focusMeasures`), defaults to 'variance'
+        :type metric: str, optional
+        :param cameraids: view/camera ids used for rendering, defaults to [] which renders with all available views
+        :type cameraids: array, optional
+        :param steps: number of equidistant planes (at least 2), defaults to 17
+        :type steps: int, optional
+        :param flipHorizontal: if True, the roi and the tiles refer to horizontally flipped images (see :meth:`render`), defaults to True
+        :type flipHorizontal: bool, optional
+
+        :rtype: numpy.array
+        :return: z offsets of the sharpest planes with shape (tiles_y, tiles_x), NaN for tiles without pixels seen by any view
+        """
+        if steps < 2 or z_range[1] < z_range[0] or tile_size <= 0 or tile_size % 16 != 0:
+            raise ValueError("autofocusTiles needs z_range[0] <= z_range[1], at least 2 steps and a tile_size that is a multiple of 16!")
+        cdef vector[unsigned int] ids = np.asarray(cameraids, dtype = np.uintc, order="C")
+        cdef ivec4 rect = self._framebufferROI(roi, flipHorizontal)
+        cdef FOCUSMETRIC m = _focus_metric(metric)
+        cdef mat4 pyvirtualPose =  make_mat4_from_float(np.asarray(virtualcamerapose).astype(np.float32).tobytes())
+        depth = np.asarray(self.thisptr.autofocusTiles(pyvirtualPose, virtualcamerafieldofview, z_range[0], z_range[1], tile_size, ids, rect, m, steps, <bint> flipHorizontal), dtype=np.float32)
+        self._reportTimings()
+        w = rect.z if roi is not None else self.LFRResolutionWidth
+        h = rect.w if roi is not None else self.LFRResolutionHeight
+        return depth.reshape((h + tile_size - 1) // tile_size, (w + tile_size - 1) // tile_size)
+
+    def renderBatch(self, virtualcameraposes, virtualcamerafieldofviews, cameraids=[], flipHorizontal=True, out=None):
+        """Renders one AOS image per virtual camera pose (e.g., the frames of a trajectory) in a single call.
+        The readback of a frame overlaps with rendering the next frames.
+
+        :param virtualcameraposes: poses of the virtual cameras as array of shape (N, 4, 4)
+        :type virtualcameraposes: array
+        :param virtualcamerafieldofviews: field of view in degrees, either a single number for all poses or one per pose
+        :type virtualcamerafieldofviews: number or array
+        :param cameraids: view/camera ids used for rendering, defaults to [] which renders with all available views
+        :type cameraids: array, optional
+        :param flipHorizontal: if True, the rendered images are flipped horizontally (see :meth:`render`), defaults to True
+        :type flipHorizontal: bool, optional
+        :param out: preallocated C-contiguous float32 array of shape (N, height, width, 4) to render into, defaults to None
+        :type out: numpy.array, optional
+
+        :rtype: numpy.array
+        :return: Rendered images of shape (N, height, width, 4)
+        """
+        poses = np.asarray(virtualcameraposes, dtype=np.float32).reshape(-1,4,4)
+        cdef vector[float] fovs = np.asarray(virtualcamerafieldofviews, dtype=np.float32).ravel()
+        cdef vector[unsigned int] ids = np.asarray(cameraids, dtype = np.uintc, order="C")
+        cdef vector[mat4] pyPoses
+        for pose in poses:
+            pyPoses.push_back(make_mat4_from_float(pose.tobytes()))
+        out = _out_array(out, (len(poses), self.LFRResolutionHeight, self.LFRResolutionWidth, 4))
+        if len(poses) == 0:
+            return out
+
+        cdef np.ndarray frames = out
+        self.thisptr.renderBatch(pyPoses, fovs, ids, <float*>np.PyArray_DATA(frames), <bint> flipHorizontal)
+        self._reportTimings()
+        return out
+
+    def render_async(self, virtualcamerapose, virtualcamerafieldofview, cameraids=[]):
+        """Starts rendering an AOS image without waiting for the result. Use :meth:`fetch` with the returned ticket to get the image.
+        Up to 4 results can be pending, later calls overwrite the oldest one.
+
+        :param virtualcamerapose: pose of the virtual camera as 4 by 4 matrix
+        :type virtualcamerapose: array
+        :param virtualcamerafieldofview: field of view of the virtual camera in degrees
+        :type virtualcamerafieldofview: number
+        :param cameraids: view/camera ids used for rendering, defaults to [] which renders with all available views
+        :type cameraids: array, optional
+
+        :rtype: int
+        :return: ticket for :meth:`fetch`
+        """
+        cdef vector[unsigned int] ids = np.asarray(cameraids, dtype = np.uintc, order="C")
+        cdef mat4 pyvirtualPose =  make_mat4_from_float(np.asarray(virtualcamerapose).astype(np.float32).tobytes())
+        ticket = self.thisptr.renderAsync(pyvirtualPose, virtualcamerafieldofview, ids)
+        self._reportTimings()
+        return ticket
+
+    def fetch(self, ticket, flipHorizontal=True, out=None, block=True):
+        """Returns the image of a :meth:`render_async` call. Each ticket can be fetched once.
+
+        :param ticket: ticket returned by :meth:`render_async`
+        :type ticket: int
+        :param flipHorizontal: if True, the rendered image is flipped horizontally (see :meth:`render`), defaults to True
+        :type flipHorizontal: bool, optional
+        :param out: preallocated C-contiguous float32 array of shape (height, width, 4), defaults to None
+        :type out: numpy.array, optional
+        :param block: if False, None is returned if the image is not ready yet (and it can be fetched later), defaults to True
+        :type block: bool, optional
+
+        :rtype: numpy.array
+        :return: Rendered image or None
+        :raises IndexError: if the ticket is unknown, was already fetched or was overwritten by later calls
+        """
+        out = _out_array(out, (self.LFRResolutionHeight, self.LFRResolutionWidth, 4))
+        cdef np.ndarray img = out
+        ready = self.thisptr.fetch(ticket, <float*>np.PyArray_DATA(img), <bint> flipHorizontal, <bint> block)
+        self._reportTimings()
+        return out if ready else None
+
+    def getStats(self):
+        """Returns statistics of the last rendered image over all pixels with alpha > 0 (colors divided by alpha).
+        The statistics are computed on the GPU when they are requested for the first time after rendering.
+
+        :rtype: dict
+        :return: 'min', 'max' and 'mean' (RGBA arrays) and 'count' (number of pixels with alpha > 0)
+        """
+        cdef IntegralStats stats = self.thisptr.getStats()
+        self._reportTimings()
+        return {
+            'min': np.array([stats.min.x, stats.min.y, stats.min.z, stats.min.w], dtype=np.float32),
+            'max': np.array([stats.max.x, stats.max.y, stats.max.z, stats.max.w], dtype=np.float32),
+            'mean': np.array([stats.mean.x, stats.mean.y, stats.mean.z, stats.mean.w], dtype=np.float32),
+            'count': stats.count,
+        }
+
     def getXYZ(self):
+        """Returns the DEM positions seen by the pixels of the last rendered image, of shape (height, width, 4) like :meth:`render` (but not flipped horizontally).
+        The alpha channel is positive for pixels that show the DEM."""
         demimage = self.thisptr.getXYZ()
-        return np.asarray( <float [:(demimage.w*demimage.h*demimage.c)]>demimage.data ).reshape(demimage.w,demimage.h,demimage.c)
+        return np.asarray( <float [:(demimage.w*demimage.h*demimage.c)]>demimage.data ).reshape(demimage.h,demimage.w,demimage.c)
+
+    def pixelsToWorld(self, points, flipHorizontal=True):
+        """Returns the positions on the DEM seen by pixels of the last rendered image. 
+        Only the positions of the pixels are read back from the GPU, not the positions of the whole image (see :meth:`getXYZ`).
+
+        :param points: pixels as array of shape (N, 2) with the column (x) and row (y) in the rendered image, fractional parts are ignored
+        :type points: array
+        :param flipHorizontal: must be the same as for :meth:`render`, defaults to True
+        :type flipHorizontal: bool, optional
+
+        :rtype: numpy.array
+        :return: positions (x, y, z) of shape (N, 3), NaN for pixels that do not show the DEM or are outside the image
+        """
+        cdef np.ndarray pixels = np.floor(np.asarray(points, dtype=np.float32).reshape(-1, 2))
+        if flipHorizontal:
+            pixels[:,0] = self.LFRResolutionWidth - 1 - pixels[:,0] # the internal format is flipped
+        cdef np.ndarray xyz = np.empty((len(pixels), 4), dtype=np.float32)
+        self.thisptr.pixelsToWorld(<const vec2*>np.PyArray_DATA(pixels), len(pixels), <vec4*>np.PyArray_DATA(xyz))
+        self._reportTimings()
+        xyz[xyz[:,3] <= 0, :3] = np.nan
+        return xyz[:,:3]
     
     def display(self, normalize):
         cdef bool normalizeoption = <bint> normalize
         self.thisptr.display(normalizeoption)
     
+    def queryViews(self, virtualcamerapose, virtualcamerafieldofview, cameraids=[]):
+        """Returns the ids of the views that can contribute to an AOS image rendered with the specified parameters.
+        A view contributes if its footprint on the bounding box of the DEM overlaps with the region seen by the virtual camera.
+
+        :param virtualcamerapose: pose of the virtual camera as 4 by 4 matrix
+        :type virtualcamerapose: array
+        :param virtualcamerafieldofview: field of view of the virtual camera in degrees
+        :type virtualcamerafieldofview: number
+        :param cameraids: view/camera ids to select from, defaults to [] which selects from all available views
+        :type cameraids: array, optional
+
+        :rtype: numpy.array
+        :return: ids of the contributing views
+        """
+        cdef vector[unsigned int] ids = np.asarray(cameraids, dtype = np.uintc, order="C")
+        cdef mat4 pyvirtualPose =  make_mat4_from_float(np.asarray(virtualcamerapose).astype(np.float32).tobytes())
+        return np.asarray(self.thisptr.queryViews(pyvirtualPose, virtualcamerafieldofview, ids), dtype=np.uintc)
+
+    def setViewCulling(self, enable):
+        """Enables or disables skipping views that cannot contribute to the rendered image (see :meth:`queryViews`). Culling is enabled by default.
+
+        :param enable: enable or disable view culling
+        :type enable: bool
+        """
+        self.thisptr.setViewCulling(<bint> enable)
+
+    def getViewCulling(self):
+        return self.thisptr.getViewCulling()
+
+    def setSinglePassRendering(self, enable):
+        """Enables single-pass rendering, where all views are accumulated per pixel in one draw call (instead of one draw call per view).
+        The result is the same, but rendering with many views is faster. Note that this keeps an additional copy of the views on the GPU.
+        If the views do not have the same size or raw frames are undistorted (see :meth:`setCameraCalibration`), the default (multi-pass) rendering is used.
+
+        :param enable: enable or disable single-pass rendering
+        :type enable: bool
+        """
+        self.thisptr.setSinglePassRendering(<bint> enable)
+
+    def getSinglePassRendering(self):
+        return self.thisptr.getSinglePassRendering()
+
+    def setIncrementalRendering(self, enable):
+        """Enables incremental rendering for rolling windows over live streams: the image of all views rendered for a virtual camera stays on the GPU.
+        Views that are added, removed, replaced or moved afterwards are added to or subtracted from it, so :meth:`render` without camera ids 
+        only projects the changed views. The image is rendered from scratch if the virtual camera or the DEM changes.
+
+        :param enable: enable or disable incremental rendering
+        :type enable: bool
+        """
+        self.thisptr.setIncrementalRendering(<bint> enable)
+
+    def getIncrementalRendering(self):
+        return self.thisptr.getIncrementalRendering()
+
+    def setProfiling(self, enable, callback=None):
+        """Enables profiling of the render calls (render, renderStats, renderFocalStack, renderBatch, render_async and fetch, the autofocus calls), 
+        of uploads (addView, addViews and loadLightField), getStats and pixelsToWorld. The CPU time and, if timer queries are supported (EXT_disjoint_timer_query), 
+        the GPU time of their passes (e.g., gbuffer, project and readback in render) are measured. Profiling waits for the GPU at the end of each call, 
+        so it should only be enabled while tuning. If disabled (default), it does not add any measurable overhead.
+
+        :param enable: enable or disable profiling
+        :type enable: bool
+        :param callback: function called with the timings (see :meth:`getTimings`) after each profiled call, defaults to None
+        :type callback: callable, optional
+        """
+        self.thisptr.setProfiling(<bint> enable)
+        self.profileCallback = callback if enable else None
+
+    def getProfiling(self):
+        return self.thisptr.getProfiling()
+
+    def _reportTimings(self):
+        # passes the timings of the last profiled call to the callback of setProfiling
+        if self.profileCallback is not None:
+            self.profileCallback(self.getTimings())
+
+    def getTimings(self, reset=False):
+        """Returns the timings of the last profiled call and cumulative counters (which are also counted if profiling is disabled).
+
+        :param reset: reset the timings and counters afterwards
+        :type reset: bool
+        :return: dict with the call name, its total CPU time 'cpu_ms', its passes 'stages' (dict of name -> {'cpu_ms', 'gpu_ms'}, gpu_ms is None if not measured,
+            passes with the same name, e.g., the readbacks of :meth:`renderBatch`, are summed),
+            and the counters 'views_projected', 'bytes_uploaded', 'bytes_read_back', 'dem_tiles_drawn' and 'dem_triangles_drawn'
+        :rtype: dict
+        """
+        cdef Timings t = self.thisptr.getTimings()
+        cdef ProfileStage s
+        if reset:
+            self.thisptr.resetTimings()
+        stages = {}
+        for s in t.stages:
+            stage = stages.setdefault(s.name.decode(), {'cpu_ms': 0.0, 'gpu_ms': 0.0})
+            stage['cpu_ms'] += s.cpu_ms
+            stage['gpu_ms'] = stage['gpu_ms'] + s.gpu_ms if stage['gpu_ms'] is not None and s.gpu_ms >= 0 else None
+        return {
+            'call': t.call.decode(),
+            'cpu_ms': t.cpu_ms,
+            'stages': stages,
+            'views_projected': t.views_projected,
+            'bytes_uploaded': t.bytes_uploaded,
+            'bytes_read_back': t.bytes_read_back,
+            'dem_tiles_drawn': t.dem_tiles_drawn,
+            'dem_triangles_drawn': t.dem_triangles_drawn,
+        }
+
+    def setTextureBudget(self, nbytes):
+        """Limits the GPU memory used by the textures of the views (0 means unlimited, the default).
+        With a budget, views added afterwards keep a copy in CPU memory and are uploaded when a render needs them. 
+        If the budget is exceeded, the least recently used textures are evicted. Views added before setting a budget stay on the GPU.
+        Shared masks and undistortion maps (see :meth:`setMask` and :meth:`setCameraCalibration`) always stay on the GPU, but count against the budget.
+        So do the textures kept for reuse (see :meth:`setTexturePool`), they are deleted before views are evicted.
+        Single-pass rendering is not used with a budget.
+
+        :param nbytes: budget in bytes (8-bit views use 1 byte, float views 2 bytes per channel and pixel)
+        :type nbytes: int
+        """
+        self.thisptr.setTextureBudget(<size_t> nbytes)
+
+    def getTextureBudget(self):
+        return self.thisptr.getTextureBudget()
+
+    def setTexturePool(self, nbytes):
+        """Keeps the textures of removed and replaced views up to nbytes for views of the same size and format added later,
+        e.g., when switching between flights of the same camera. Their data is then uploaded without allocating GPU memory.
+        0 deletes the textures instead (the default), setting it to 0 also deletes the textures kept so far.
+
+        :param nbytes: size of the pool in bytes
+        :type nbytes: int
+        """
+        self.thisptr.setTexturePool(<size_t> nbytes)
+
+    def getTexturePool(self):
+        return self.thisptr.getTexturePool()
+
+    def getResidencyStats(self, reset=False):
+        """Returns the texture residency of the views and the number of uploads/evictions (see :meth:`setTextureBudget`), 
+        the textures in the pool and the number of allocated and reused textures (see :meth:`setTexturePool`).
+
+        :param reset: reset the upload, eviction, allocation and reuse counters afterwards
+        :type reset: bool
+        :return: dict with budget, resident_bytes, resident_views, views, uploads, evictions, upload_bytes, group_bytes (shared masks and undistortion maps), 
+            pool_budget, pooled_bytes, pooled_textures, allocations and reuses
+        :rtype: dict
+        """
+        cdef ResidencyStats stats = self.thisptr.getResidencyStats()
+        if reset:
+            self.thisptr.resetResidencyStats()
+        return {
+            'budget': stats.budget,
+            'resident_bytes': stats.resident_bytes,
+            'resident_views': stats.resident_views,
+            'views': stats.views,
+            'uploads': stats.uploads,
+            'evictions': stats.evictions,
+            'upload_bytes': stats.upload_bytes,
+            'group_bytes': stats.group_bytes,
+            'pool_budget': stats.pool_budget,
+            'pooled_bytes': stats.pooled_bytes,
+            'pooled_textures': stats.pooled_textures,
+            'allocations': stats.allocations,
+            'reuses': stats.reuses,
+        }
+
+    def setIntegralCache(self, nbytes):
+        """Caches the images returned by :meth:`render` in CPU memory (0 disables the cache, the default). If the cache exceeds the budget, the least recently used images are evicted.
+        Rendering again with the same virtual camera pose, field of view, camera ids, roi and DEM returns the cached image, unless the views, their poses/corrections, 
+        adjustments, masks or the DEM changed in between (see :meth:`getSceneVersion`). A cached image is returned without rendering, 
+        so :meth:`getStats`, :meth:`getXYZ` and :meth:`pixelsToWorld` refer to the last image that was actually rendered.
+
+        :param nbytes: budget in bytes (an image uses width * height * 16 bytes)
+        :type nbytes: int
+        """
+        self.thisptr.setIntegralCache(<size_t> nbytes)
+
+    def getIntegralCache(self):
+        return self.thisptr.getIntegralCache()
+
+    def clearIntegralCache(self):
+        """Removes all images from the integral cache (see :meth:`setIntegralCache`)."""
+        self.thisptr.clearIntegralCache()
+
+    def getIntegralCacheStats(self, reset=False):
+        """Returns the size of the integral cache and the number of hits, misses and evictions (see :meth:`setIntegralCache`).
+
+        :param reset: reset the hit, miss and eviction counters afterwards
+        :type reset: bool
+        :return: dict with budget, bytes, entries, hits, misses and evictions
+        :rtype: dict
+        """
+        cdef IntegralCacheStats stats = self.thisptr.getIntegralCacheStats()
+        if reset:
+            self.thisptr.resetIntegralCacheStats()
+        return {
+            'budget': stats.budget,
+            'bytes': stats.bytes,
+            'entries': stats.entries,
+            'hits': stats.hits,
+            'misses': stats.misses,
+            'evictions': stats.evictions,
+        }
+
+    def getSceneVersion(self):
+        """Returns a counter that is incremented whenever the views (adding, removing, replacing, poses, corrections, adjustments, masks, undistortion) or the DEM change."""
+        return self.thisptr.getSceneVersion()
+
     def getViews(self):
         NoofViews = self.thisptr.getViews()
         return NoofViews
@@ -235,5 +1158,62 @@ cdef class PyGlfwWindow:
         DestroyGlfwWindow(self.windowPointer)
 #        del self.windowPointer # destroys the reference to the C++ instance (which calls the C++ class destructor
 
+cdef class PyHeadlessContext:
+    """OpenGL ES 3.1 context without a window (EGL), e.g., for rendering on servers or CI. Use it instead of :class:`PyGlfwWindow`.
+
+    Several contexts can be created in one process (e.g., one per worker thread). A context is current after construction;
+    call :meth:`makeCurrent` before using the PyAOS instances created with it if another context was made current in between.
+    A context can only be current in one thread at a time.
+
+    :param backend: 'auto' (GPU if available, otherwise the surfaceless platform), 'device' (GPU), 'software' (llvmpipe) or 'surfaceless', defaults to 'auto'
+    :type backend: str, optional
+    :param device: index of the EGL device for the 'device' and 'software' backends, defaults to -1 (first device)
+    :type device: int, optional
+    """
+    cdef HeadlessContext* contextPointer
+    def __cinit__(self, backend='auto', int device=-1):
+        self.contextPointer = NULL
+        if backend not in ('auto', 'device', 'software', 'surfaceless'):
+            raise ValueError("backend must be 'auto', 'device', 'software' or 'surfaceless'")
+        self.contextPointer = CreateHeadlessContext(backend.encode(), device)
+    def __dealloc__(self):
+        if self.contextPointer != NULL:
+            DestroyHeadlessContext(self.contextPointer)
+            self.contextPointer = NULL
+
+    def makeCurrent(self):
+        """Makes the context current in the calling thread."""
+        MakeHeadlessContextCurrent(self.contextPointer)
+
+    def isCurrent(self):
+        return IsHeadlessContextCurrent(self.contextPointer)
+
+    def getBackend(self):
+        """Returns the EGL platform that is used: 'device', 'software', 'surfaceless' or 'default'."""
+        return GetHeadlessBackend(self.contextPointer).decode()
+
+
+def createContext(width, height, appname='AOS', headless=None, backend='auto'):
+    """Creates an OpenGL context for rendering, either with a (hidden) GLFW window or headless.
+
+    :param width: width of the window
+    :type width: int
+    :param height: height of the window
+    :type height: int
+    :param appname: title of the window, defaults to 'AOS'
+    :type appname: str, optional
+    :param headless: if True, a :class:`PyHeadlessContext` is created. Defaults to None, which creates a headless context on Linux if no display is available (DISPLAY or WAYLAND_DISPLAY not set)
+    :type headless: bool, optional
+    :param backend: backend of the headless context (see :class:`PyHeadlessContext`), defaults to 'auto'
+    :type backend: str, optional
+
+    :rtype: PyGlfwWindow or PyHeadlessContext
+    """
+    if headless is None:
+        headless = sys.platform.startswith('linux') and not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+    if headless:
+        return PyHeadlessContext(backend)
+    return PyGlfwWindow(width, height, appname)
+
 
 # For documentation use python docstring in SPHINX style: https://betterprogramming.pub/the-guide-to-python-docstrings-3d40340e824b
\ No newline at end of file
@@ -0,0 +1,284 @@
+""" Benchmarks for the hot paths of the light-field renderer: loading, uploading and rendering views, getXYZ and clearViews
+
+The benchmarks run headless (EGL, llvmpipe software renderer by default; a hidden GLFW window on Windows, where EGL is not available)
+and write latency percentiles and throughputs as JSON.
+Each parameter (view count, render resolution, channels, DEM mesh size) is swept on its own around a base configuration.
+Run it from ./pyaos/ so that the bundled data is found (like pyaos_test.py):
+
+    python pyaos_bench.py run --out base.json
+    python pyaos_bench.py run --quick --out new.json
+    python pyaos_bench.py compare base.json new.json --threshold 0.1
+
+compare exits with 1 if a benchmark is slower than in the base run by more than the threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+import pyaos.lfr as LFR
+
+
+_dataDir = Path(__file__).resolve().parent / '..' / 'data'
+_conifer = _dataDir / '20210810_conifer_ex2_set2' / 'colmap'
+_fovDegrees = 50.0
+
+# base configuration and sweeps, each sweep varies a single parameter of the base configuration
+BASE = {'views': 100, 'resolution': 512, 'channels': 4, 'dem': 0, 'view_size': 256}
+SWEEPS = {
+    'views': [10, 100, 1000],
+    'resolution': [512, 1024, 2048, 4096],
+    'channels': [1, 3, 4],
+    'dem': [0, 64, 256], # quads per side of the DEM grid (0 is the bundled zero_plane.obj)
+}
+QUICK = {'views': 10, 'resolution': 256, 'channels': 4, 'dem': 0, 'view_size': 128}
+QUICK_SWEEPS = {'views': [10, 50], 'resolution': [256, 512], 'channels': [1, 4], 'dem': [0, 32]}
+
+
+def percentiles(samples):
+    """ summary of latency samples (in seconds) in milliseconds
+
+    :rtype: dict
+    """
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    return {
+        'n': int(ms.size),
+        'mean': float(ms.mean()),
+        'min': float(ms.min()),
+        'p50': float(np.percentile(ms, 50)),
+        'p90': float(np.percentile(ms, 90)),
+        'p99': float(np.percentile(ms, 99)),
+        'max': float(ms.max()),
+    }
+
+def measure(fn, repeat, warmup=1):
+    """ calls fn warmup + repeat times and returns the latencies (in seconds) of the last repeat calls """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+    return samples
+
+def synthetic_views(n, size, channels, seed=0, distinct=8):
+    """ random views looking down on a plane 100 units below, spread over a small area so that they overlap.
+    Only a few distinct images are generated (view i uses image i % distinct), so large flights fit into memory.
+
+    :return: images (distinct x H x W x C, float32) and poses (N x 4 x 4)
+    """
+    rng = np.random.default_rng(seed)
+    imgs = rng.random((min(n, distinct), size, size, channels), dtype=np.float32)
+    poses = np.stack([np.eye(4, dtype=np.float32)] * n)
+    poses[:, 3, :2] = rng.uniform(-20, 20, size=(n, 2))
+    return imgs, poses
+
+def grid_dem(path, quads, extent=1000.0, seed=0):
+    """ writes a DEM with quads x quads cells (2 triangles each) and a slightly rough surface as OBJ file """
+    rng = np.random.default_rng(seed)
+    coords = np.linspace(-extent, extent, quads + 1)
+    z = rng.uniform(-1, 1, size=(quads + 1, quads + 1))
+    with open(path, 'w') as f:
+        f.write('# OBJ file\n')
+        for j, y in enumerate(coords):
+            for i, x in enumerate(coords):
+                f.write(f'v {x:.3f} {y:.3f} {z[j, i]:.3f}\n')
+        for j in range(quads + 1):
+            for i in range(quads + 1):
+                f.write(f'vt {i / quads:.5f} {j / quads:.5f}\n')
+        for j in range(quads):
+            for i in range(quads):
+                a = j * (quads + 1) + i + 1 # obj indices start at 1
+                b, c, d = a + 1, a + quads + 1, a + quads + 2
+                f.write(f'f {a}/{a} {b}/{b} {c}/{c}\n')
+                f.write(f'f {b}/{b} {d}/{d} {c}/{c}\n')
+    return path
+
+def dem_file(quads, tmpdir):
+    if quads <= 0:
+        return str(_dataDir / 'zero_plane.obj')
+    return grid_dem(os.path.join(tmpdir, f'dem_{quads}.obj'), quads)
+
+def bench_synthetic(config, repeat, tmpdir):
+    """ uploads synthetic views and renders them with the configuration (views, resolution, channels, dem, view_size)
+
+    :return: results of addView, render, getXYZ and clearViews
+    :rtype: dict
+    """
+    n, res = config['views'], config['resolution']
+    imgs, poses = synthetic_views(n, config['view_size'], config['channels'])
+    aos = LFR.PyAOS(res, res, _fovDegrees)
+    aos.loadDEM(dem_file(config['dem'], tmpdir))
+    aos.setDEMTransform([0, 0, -100])
+
+    upload = []
+    for i in range(n):
+        t = time.perf_counter()
+        aos.addView(imgs[i % len(imgs)], poses[i], str(i))
+        upload.append(time.perf_counter() - t)
+    vpose = np.eye(4)
+    render = measure(lambda: aos.render(vpose, _fovDegrees), repeat)
+    xyz = measure(lambda: aos.getXYZ(), repeat)
+    t = time.perf_counter()
+    aos.clearViews()
+    clear = time.perf_counter() - t
+    del aos
+
+    return {
+        'addView': {'latency_ms': percentiles(upload), 'throughput': {'views/s': n / sum(upload), 'MB/s': n * imgs[0].nbytes / 2**20 / sum(upload)}},
+        'render': {'latency_ms': percentiles(render), 'throughput': {'frames/s': len(render) / sum(render), 'views/s': n * len(render) / sum(render)}},
+        'getXYZ': {'latency_ms': percentiles(xyz), 'throughput': {'frames/s': len(xyz) / sum(xyz)}},
+        'clearViews': {'latency_ms': percentiles([clear]), 'throughput': {'views/s': n / clear}},
+    }
+
+def bench_conifer(resolution, repeat, tmpdir, workers=None):
+    """ loads the bundled 20210810_conifer_ex2_set2 flight with read_poses_and_images and as packed light field (loadLightField), 
+    and renders it from the center view """
+    from pyaos.LFR_utils import read_poses_and_images, pose_to_virtualcamera, pack_light_field
+    fov = 32.3443
+    poses_file, images_dir = str(_conifer / 'poses' / 'RGB.json'), str(_conifer / 'images' / 'r1024')
+    aos = LFR.PyAOS(resolution, resolution, fov)
+    aos.loadDEM(str(_dataDir / 'zero_plane.obj'))
+    aos.setDEMTransform([0, 0, 51])
+
+    def load():
+        aos.clearViews()
+        return read_poses_and_images(aos, poses_file, images_dir, keep_images=False, workers=workers)
+    load_times = measure(load, repeat, warmup=0)
+    packed = os.path.join(tmpdir, 'conifer.aoslf')
+    pack_light_field(packed, poses_file, images_dir, workers=workers)
+    def load_packed():
+        aos.clearViews()
+        aos.loadLightField(packed)
+    packed_times = measure(load_packed, repeat, warmup=0)
+    _, poses = load()
+    n = aos.getViews()
+    vpose = pose_to_virtualcamera(poses[n // 2])
+    render = measure(lambda: aos.render(vpose, fov), repeat)
+    del aos
+
+    return {
+        'read_poses_and_images': {'latency_ms': percentiles(load_times), 'throughput': {'views/s': n * len(load_times) / sum(load_times)}},
+        'loadLightField': {'latency_ms': percentiles(packed_times), 'throughput': {'views/s': n * len(packed_times) / sum(packed_times)}},
+        'render': {'latency_ms': percentiles(render), 'throughput': {'frames/s': len(render) / sum(render)}},
+    }
+
+def run(args):
+    base, sweeps = (dict(QUICK), dict(QUICK_SWEEPS)) if args.quick else (dict(BASE), dict(SWEEPS))
+    for key in sweeps:
+        if getattr(args, key) is not None: # sweep given on the command line, its first value is used in the base configuration
+            sweeps[key] = getattr(args, key)
+            base[key] = sweeps[key][0]
+    if args.view_size is not None:
+        base['view_size'] = args.view_size
+
+    headless = os.name != 'nt' # no EGL on Windows
+    context = LFR.createContext(64, 64, 'AOS benchmark', headless=headless, backend=args.backend)
+    results = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'backend': context.getBackend() if headless else 'glfw',
+            'repeat': args.repeat,
+            'base': base,
+        },
+        'benchmarks': {},
+    }
+
+    def add(name, config, res):
+        for op, r in res.items():
+            results['benchmarks'][f'{name}/{op}'] = dict(r, config=config)
+            if not args.quiet:
+                print(f"{name}/{op:<22} p50 {r['latency_ms']['p50']:10.3f} ms  p90 {r['latency_ms']['p90']:10.3f} ms", file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        configs = {}
+        for key, values in sweeps.items():
+            for value in values:
+                config = dict(base, **{key: value})
+                configs[f"views={config['views']},res={config['resolution']},c={config['channels']},dem={config['dem']}"] = config
+        for name, config in configs.items(): # the base configuration is in every sweep, but only measured once
+            add(name, config, bench_synthetic(config, args.repeat, tmpdir))
+        if not args.no_conifer:
+            add(f'conifer,res={base["resolution"]}', {'resolution': base['resolution']}, bench_conifer(base['resolution'], args.repeat, tmpdir, args.workers))
+    del context
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    return results
+
+def compare(base, new, threshold=0.1, metric='p50'):
+    """ compares the latencies of two benchmark runs (dicts as written by run)
+
+    :param threshold: relative slowdown that is reported as regression, defaults to 0.1 (10%)
+    :type threshold: float, optional
+    :param metric: latency statistic that is compared (mean, p50, p90, ...), defaults to 'p50'
+    :type metric: str, optional
+    :return: rows (name, base ms, new ms, relative change, regression) of the benchmarks in both runs
+    :rtype: list
+    """
+    rows = []
+    for name, b in base['benchmarks'].items():
+        n = new['benchmarks'].get(name)
+        if n is None:
+            continue
+        b_ms, n_ms = b['latency_ms'][metric], n['latency_ms'][metric]
+        change = (n_ms - b_ms) / b_ms if b_ms > 0 else 0.0
+        rows.append((name, b_ms, n_ms, change, change > threshold))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks for loading, uploading and rendering views.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help='run the benchmarks and write the results as JSON')
+    p.add_argument('--out', help='JSON file for the results (default: stdout)')
+    p.add_argument('--backend', default='software', help="backend of the headless context ('auto', 'device', 'software', 'surfaceless', not used on Windows)")
+    p.add_argument('--repeat', type=int, default=10, help='measurements per benchmark')
+    p.add_argument('--quick', action='store_true', help='small sizes, e.g., for CI')
+    # the first value of a sweep is also used in the base configuration
+    p.add_argument('--views', type=int, nargs='+', help='view counts')
+    p.add_argument('--resolution', type=int, nargs='+', help='render resolutions')
+    p.add_argument('--channels', type=int, nargs='+', help='channels of the views')
+    p.add_argument('--dem', type=int, nargs='+', help='quads per side of synthetic DEMs (0 = zero_plane.obj)')
+    p.add_argument('--view-size', type=int, help='size of the synthetic views')
+    p.add_argument('--workers', type=int, help='decoding threads of read_poses_and_images')
+    p.add_argument('--no-conifer', action='store_true', help='skip the benchmarks with the bundled flight')
+    p.add_argument('--quiet', action='store_true')
+
+    p = sub.add_parser('compare', help='compare two runs and report regressions')
+    p.add_argument('base')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=0.1, help='relative slowdown reported as regression (default: 0.1)')
+    p.add_argument('--metric', default='p50', choices=['mean', 'min', 'p50', 'p90', 'p99', 'max'])
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        run(args)
+        return 0
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    rows = compare(base, new, args.threshold, args.metric)
+    for name, b_ms, n_ms, change, regression in rows:
+        print(f"{'REGRESSION' if regression else 'ok':<10} {name:<50} {b_ms:10.3f} ms -> {n_ms:10.3f} ms ({change:+.1%})")
+    return 1 if any(r[4] for r in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
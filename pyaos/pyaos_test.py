@@ -1,6 +1,7 @@
 import pyaos.lfr as LFR
 import cv2
 import os
+import tempfile
 import unittest
 import sys
 import glm
@@ -9,7 +10,10 @@ import numpy.testing
 from pathlib import Path
 
 
-class TestAOSRenderTwice(unittest.TestCase):
+class AOSTestCase(unittest.TestCase):
+    """ Base class of the tests that render with two PyAOS instances and the zero plane as DEM
+
+    """
 
     _window = None
     _aos1 = None
@@ -34,6 +38,9 @@ class TestAOSRenderTwice(unittest.TestCase):
         del self._window
         self._window = None
 
+
+class TestAOSRenderTwice(AOSTestCase):
+
     def test_render_twice(self):
         self.alpha_mask(self._aos1)
         self.color_image(self._aos1)
@@ -295,6 +302,1499 @@ class TestAOSRenderTwice(unittest.TestCase):
         self.assertFalse(np.allclose(glm.mat4(1),glm.mat4(2),atol=1.e-5)) # check the pose does not change!
 
 
+class TestUploads(AOSTestCase):
+    """ Test uploading numpy buffers with addView, replaceView and addViews
+
+    """
+
+    def test_upload_types(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        pose = np.eye(4)
+
+        # the same image as uint8, float16, float32 and float64 must render equally 
+        img = (np.random.rand(512,511,3) * 255).astype(np.uint8) # odd width to test row alignment
+        rimgs = []
+        for dtype in [np.uint8, np.float16, np.float32, np.float64]:
+            _aos.addView( img.astype(dtype), pose, str(dtype) )
+            rimgs.append( _aos.render(pose, self._fovDegrees) )
+            _aos.clearViews()
+        for rimg in rimgs[1:]:
+            self.assertTrue(np.allclose(rimgs[0], rimg, atol=2.0)) # 8-bit textures are interpolated with less precision
+
+        # replacing a float view with an uint8 view
+        _aos.addView( np.ones((512,512,4), dtype=np.float32), pose, "01" )
+        _aos.replaceView( 0, img, pose, "02" )
+        self.assertTrue(np.allclose(rimgs[0], _aos.render(pose, self._fovDegrees)))
+        _aos.clearViews()
+
+    def test_add_views(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        imgs = np.random.rand(3,512,512,4).astype(np.float32)
+        poses = np.stack([np.eye(4)]*3)
+        poses[:,3,0] = [0.0, 0.5, -0.5] # translated views
+
+        for i in range(3):
+            _aos.addView( imgs[i], poses[i], str(i) )
+        rimg = _aos.render(np.eye(4), self._fovDegrees)
+        _aos.clearViews()
+
+        _aos.addViews( imgs, poses, ["a","b","c"] )
+        self.assertTrue(_aos.getSize()==3)
+        self.assertEqual(_aos.getName(1), "b")
+        self.assertTrue(np.allclose(poses[2], _aos.getPose(2)))
+        self.assertTrue(np.allclose(rimg, _aos.render(np.eye(4), self._fovDegrees)))
+        _aos.clearViews()
+
+        # default names
+        _aos.addViews( imgs[:,:,:,0], poses )
+        self.assertEqual(_aos.getName(2), "2")
+        _aos.clearViews()
+
+
+class TestSinglePass(AOSTestCase):
+    """ Test single-pass rendering with texture arrays
+
+    """
+
+    def test_single_pass(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        n = 140 # more views than accumulated in one pass
+        imgs = np.random.rand(n,64,64,4).astype(np.float32)
+        imgs[:,:,:,3] = np.random.rand(n,1,1) # alpha
+        poses = np.stack([np.eye(4)]*n)
+        poses[:,3,0] = np.linspace(-10,10,n) # translated views
+        _aos.addViews( imgs, poses )
+
+        vpose = np.eye(4)
+        for ids in [[], [0, 5, 17], list(range(n-1,0,-2))]:
+            self.assertFalse(_aos.getSinglePassRendering())
+            rimg = _aos.render(vpose, self._fovDegrees, ids)
+            _aos.setSinglePassRendering(True)
+            simg = _aos.render(vpose, self._fovDegrees, ids)
+            _aos.setSinglePassRendering(False)
+            self.assertTrue(rimg[:,:,3].max() > 0)
+            self.assertTrue(np.allclose(rimg, simg, rtol=1.e-3, atol=1.e-2))
+
+        # views are updated after changes
+        _aos.setSinglePassRendering(True)
+        _aos.render(vpose, self._fovDegrees)
+        _aos.replaceView( 0, np.zeros((64,64,4), dtype=np.float32), poses[0], "0" )
+        _aos.removeView( 1 )
+        simg = _aos.render(vpose, self._fovDegrees)
+        _aos.setSinglePassRendering(False)
+        self.assertTrue(np.allclose(_aos.render(vpose, self._fovDegrees), simg, rtol=1.e-3, atol=1.e-2))
+
+        # fallback for views with different sizes
+        _aos.setSinglePassRendering(True)
+        _aos.addView( np.ones((32,32,3), dtype=np.float32), vpose, "small" )
+        simg = _aos.render(vpose, self._fovDegrees)
+        _aos.setSinglePassRendering(False)
+        self.assertTrue(np.allclose(_aos.render(vpose, self._fovDegrees), simg))
+        _aos.clearViews()
+
+        # 8-bit views are scaled 
+        _aos.addView( (imgs[0]*255).astype(np.uint8), vpose, "uint8" )
+        rimg = _aos.render(vpose, self._fovDegrees)
+        _aos.setSinglePassRendering(True)
+        simg = _aos.render(vpose, self._fovDegrees)
+        _aos.setSinglePassRendering(False)
+        self.assertTrue(np.allclose(rimg, simg, atol=2.0)) # 8-bit textures are interpolated with less precision
+        _aos.clearViews()
+
+
+class TestFocalStack(AOSTestCase):
+    """ Test rendering focal stacks (renderFocalStack)
+
+    """
+
+    def test_focal_stack(self):
+        _aos = self._aos1
+        n = 20
+        imgs = np.random.rand(n,64,64,4).astype(np.float32)
+        poses = np.stack([np.eye(4)]*n)
+        poses[:,3,0] = np.linspace(-10,10,n) # translated views
+        _aos.addViews( imgs, poses )
+
+        ztransl = -100
+        zs = [0, -20, 30, -60, 95]
+        vpose = np.eye(4)
+        vpose[:3,:3] = cv2.Rodrigues(np.array([0.2,-0.1,0.05]))[0] # slightly tilted virtual camera
+        for ids in [[], [1, 7, 8]]:
+            _aos.setDEMTransform( [0,0,ztransl] )
+            stack = _aos.renderFocalStack(vpose, self._fovDegrees, zs, ids)
+            self.assertEqual(stack.shape, (len(zs),512,512,4))
+            for z, simg in zip(zs, stack):
+                _aos.setDEMTransform( [0,0,ztransl+z] )
+                rimg = _aos.render(vpose, self._fovDegrees, ids)
+                self.assertTrue(rimg[:,:,3].max() > 0)
+                # the analytic and the rasterized G-buffer differ by rounding, which moves a few pixels across view borders
+                diff = np.abs(rimg - simg)
+                self.assertLess(diff.mean(), 1.e-2)
+                self.assertLess((diff > 0.1).mean(), 1.e-2)
+
+        # render into a preallocated array without flipping
+        _aos.setDEMTransform( [0,0,ztransl] )
+        out = np.zeros((2,512,512,4), dtype=np.float32)
+        self.assertIs(_aos.renderFocalStack(vpose, self._fovDegrees, zs[:2], ids, flipHorizontal=False, out=out), out)
+        self.assertTrue(np.allclose(out[:,:,::-1,:], stack[:2], rtol=1.e-3, atol=1.e-2))
+        with self.assertRaises(ValueError):
+            _aos.renderFocalStack(vpose, self._fovDegrees, zs, out=out)
+        self.assertEqual(_aos.renderFocalStack(vpose, self._fovDegrees, []).shape, (0,512,512,4))
+        _aos.clearViews()
+
+
+class TestRenderBatch(AOSTestCase):
+    """ Test batched and asynchronous rendering (renderBatch, render_async and fetch)
+
+    """
+
+    def test_render_batch(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        n = 10
+        imgs = np.random.rand(n,64,64,4).astype(np.float32)
+        poses = np.stack([np.eye(4)]*n)
+        poses[:,3,0] = np.linspace(-10,10,n) # translated views
+        _aos.addViews( imgs, poses )
+
+        vposes = np.stack([np.eye(4)]*7)
+        vposes[:,3,1] = np.linspace(-20,20,len(vposes)) # trajectory
+        fovs = np.linspace(30,60,len(vposes))
+        refs = [_aos.render(vpose, fov, [0,2,4]) for vpose, fov in zip(vposes, fovs)]
+        frames = _aos.renderBatch(vposes, fovs, [0,2,4])
+        self.assertEqual(frames.shape, (len(vposes),512,512,4))
+        for ref, frame in zip(refs, frames):
+            self.assertTrue(ref[:,:,3].max() > 0)
+            self.assertTrue(np.array_equal(ref, frame))
+        frames = _aos.renderBatch(vposes, self._fovDegrees, flipHorizontal=False, out=frames)
+        self.assertTrue(np.array_equal(_aos.render(vposes[3], self._fovDegrees, flipHorizontal=False), frames[3]))
+        with self.assertRaises(ValueError):
+            _aos.renderBatch(vposes, fovs[:2])
+
+        # asynchronous rendering
+        tickets = [_aos.render_async(vpose, fov, [0,2,4]) for vpose, fov in zip(vposes[:4], fovs)]
+        self.assertTrue(np.array_equal(_aos.fetch(tickets[1]), refs[1]))
+        img = np.zeros((512,512,4), dtype=np.float32)
+        self.assertIs(_aos.fetch(tickets[0], out=img), img)
+        self.assertTrue(np.array_equal(img, refs[0]))
+        with self.assertRaises(IndexError):
+            _aos.fetch(tickets[0]) # already fetched
+        _aos.render(vposes[0], self._fovDegrees) # synchronous rendering does not affect pending results
+        img = None
+        while img is None:
+            img = _aos.fetch(tickets[3], block=False)
+        self.assertTrue(np.array_equal(img, refs[3]))
+        tickets += [_aos.render_async(vposes[0], self._fovDegrees) for i in range(4)]
+        with self.assertRaises(IndexError):
+            _aos.fetch(tickets[2]) # overwritten
+        with self.assertRaises(IndexError):
+            _aos.fetch(-1)
+        _aos.clearViews()
+
+
+class TestStats(AOSTestCase):
+    """ Test the statistics of the integral (getStats)
+
+    """
+
+    def test_stats(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        n = 10
+        imgs = np.random.rand(n,64,64,4).astype(np.float32)
+        poses = np.stack([np.eye(4)]*n)
+        poses[:,3,0] = np.linspace(-30,30,n) # translated views
+        _aos.addViews( imgs, poses )
+
+        for ids in [[], [3], [0,9]]:
+            rimg = _aos.render(np.eye(4), self._fovDegrees, ids)
+            valid = rimg[rimg[:,:,3] > 0]
+            valid[:,:3] /= valid[:,3:]
+            stats = _aos.getStats()
+            self.assertEqual(stats['count'], len(valid))
+            self.assertTrue(np.allclose(stats['min'], valid.min(axis=0)))
+            self.assertTrue(np.allclose(stats['max'], valid.max(axis=0)))
+            self.assertTrue(np.allclose(stats['mean'], valid.mean(axis=0), rtol=1.e-4))
+
+        _aos.clearViews()
+        _aos.render(np.eye(4), self._fovDegrees)
+        self.assertEqual(_aos.getStats()['count'], 0)
+
+
+class TestViewCulling(AOSTestCase):
+    """ Test culling views by their footprints on the DEM
+
+    """
+
+    def test_view_culling(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        rng = np.random.default_rng(0)
+        n = 200
+        imgs = rng.random((n,32,32,4), dtype=np.float32)
+        poses = np.stack([np.eye(4)]*n)
+        for i in range(n):
+            poses[i,:3,:3] = cv2.Rodrigues(rng.normal(scale=0.6, size=3))[0].T # tilted views
+        poses[:,3,:2] = rng.uniform(-400, 400, size=(n,2)) # spread over a large area
+        poses[-1,:3,:3] = np.diag([1,-1,-1]) # looking away from the DEM
+        _aos.addViews( imgs, poses )
+        self.assertTrue(_aos.getViewCulling())
+
+        vpose = np.eye(4)
+        for fov, ids in [(20, []), (self._fovDegrees, []), (20, list(range(0,n,3)))]:
+            cids = _aos.queryViews(vpose, fov, ids)
+            self.assertTrue(0 < len(cids) < (len(ids) or n))
+            self.assertTrue(set(cids) <= set(ids or range(n)))
+            cimg = _aos.render(vpose, fov, ids)
+            _aos.setViewCulling(False)
+            self.assertTrue(np.array_equal(_aos.queryViews(vpose, fov, ids), ids or range(n)))
+            rimg = _aos.render(vpose, fov, ids)
+            _aos.setViewCulling(True)
+            self.assertTrue(rimg[:,:,3].max() > 0)
+            self.assertTrue(np.allclose(rimg, cimg, atol=1.e-4))
+            self.assertTrue(np.allclose(_aos.render(vpose, fov, cids), cimg, atol=1.e-4))
+
+        # footprints follow pose changes
+        cids = _aos.queryViews(vpose, 20)
+        idx = next(i for i in range(n) if i not in cids)
+        _aos.setPose(idx, np.eye(4))
+        self.assertIn(idx, _aos.queryViews(vpose, 20))
+        _aos.clearViews()
+
+
+class TestTextureBudget(AOSTestCase):
+    """ Test uploading views on demand under a texture budget (setTextureBudget)
+
+    """
+
+    def test_texture_budget(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        rng = np.random.default_rng(1)
+        n = 12
+        imgs = rng.random((n,32,32,4), dtype=np.float32)
+        poses = np.stack([np.eye(4)]*n)
+        poses[:,3,:2] = rng.uniform(-5, 5, size=(n,2))
+        _aos.addViews( imgs, poses )
+        ref = _aos.render(np.eye(4), self._fovDegrees)
+        _aos.clearViews()
+
+        view_bytes = 32*32*4*2 # RGBA16F
+        _aos.setTextureBudget(4 * view_bytes)
+        self.assertEqual(_aos.getTextureBudget(), 4 * view_bytes)
+        _aos.addViews( imgs, poses )
+        stats = _aos.getResidencyStats(reset=True)
+        self.assertEqual((stats['views'], stats['resident_views'], stats['uploads']), (n, 0, 0)) # uploaded on demand
+        # views with an unsupported format are rejected when they are added, not when they are uploaded
+        with self.assertRaises(RuntimeError):
+            _aos.addView(np.zeros((16,16,5), dtype=np.float32), np.eye(4), "invalid")
+        self.assertEqual(_aos.getViews(), n)
+
+        img = _aos.render(np.eye(4), self._fovDegrees)
+        self.assertTrue(np.allclose(img, ref, atol=1.e-4))
+        stats = _aos.getResidencyStats()
+        self.assertEqual(stats['uploads'], n)
+        self.assertEqual(stats['evictions'], n - 4)
+        self.assertEqual(stats['upload_bytes'], n * view_bytes)
+        self.assertLessEqual(stats['resident_bytes'], 4 * view_bytes)
+        self.assertEqual(stats['resident_views'], 4)
+
+        # the most recently used views stay resident
+        _aos.getResidencyStats(reset=True)
+        _aos.render(np.eye(4), self._fovDegrees, [n-1, n-2])
+        self.assertEqual(_aos.getResidencyStats()['uploads'], 0)
+
+        # replaced views are uploaded again, unlimited budget uploads all views
+        _aos.replaceView(n-1, imgs[0], poses[0], '')
+        self.assertEqual(_aos.getResidencyStats()['resident_views'], 3)
+        _aos.setTextureBudget(0)
+        stats = _aos.getResidencyStats()
+        self.assertEqual((stats['resident_views'], stats['resident_bytes']), (n, n * view_bytes))
+        _aos.clearViews()
+        self.assertEqual(_aos.getResidencyStats()['resident_bytes'], 0)
+
+        # shared masks stay on the GPU, but count against the budget
+        _aos.setTextureBudget(4 * view_bytes)
+        _aos.addViews( imgs, poses )
+        _aos.setMask(np.ones((32,32), dtype=np.float32)) # R16F
+        _aos.render(np.eye(4), self._fovDegrees)
+        stats = _aos.getResidencyStats()
+        self.assertEqual(stats['group_bytes'], 32*32*2)
+        self.assertLessEqual(stats['resident_bytes'], 4 * view_bytes)
+        self.assertEqual(stats['resident_views'], 3)
+        _aos.clearMask()
+        self.assertEqual(_aos.getResidencyStats()['group_bytes'], 0)
+        _aos.setTextureBudget(0)
+        _aos.clearViews()
+        self.assertEqual(_aos.getResidencyStats()['resident_bytes'], 0)
+
+
+class TestIncremental(AOSTestCase):
+    """ Test incremental rendering of a rolling window of views
+
+    """
+
+    def test_incremental(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        rng = np.random.default_rng(2)
+        n, window = 10, 4
+        imgs = rng.random((n,32,32,4), dtype=np.float32)
+        poses = np.stack([np.eye(4)]*n)
+        poses[:,3,:2] = rng.uniform(-10, 10, size=(n,2))
+        vpose = np.eye(4)
+
+        def reference(): # renders all views from scratch
+            return _aos.render(vpose, self._fovDegrees, list(range(_aos.getViews())))
+
+        _aos.setIncrementalRendering(True)
+        self.assertTrue(_aos.getIncrementalRendering())
+        _aos.addViews( imgs[:window], poses[:window] )
+        _aos.render(vpose, self._fovDegrees)
+        for i in range(window, n): # rolling window
+            _aos.addView(imgs[i], poses[i], str(i))
+            _aos.removeView(0)
+            img = _aos.render(vpose, self._fovDegrees)
+            self.assertEqual(_aos.getStats()['count'], (img[:,:,3] > 0).sum())
+            self.assertTrue(np.allclose(img, reference(), atol=1.e-4))
+
+        # moved and replaced views, other virtual cameras
+        _aos.setPose(0, poses[0])
+        _aos.replaceView(1, imgs[0], poses[1], '')
+        self.assertTrue(np.allclose(_aos.render(vpose, self._fovDegrees), reference(), atol=1.e-4))
+        vpose[3,0] = 5
+        self.assertTrue(np.allclose(_aos.render(vpose, self._fovDegrees), reference(), atol=1.e-4))
+        self.assertTrue(np.allclose(_aos.render(vpose, self._fovDegrees, [1,2]), _aos.render(vpose, self._fovDegrees, [2,1])))
+
+        # views out of range raise instead of being projected
+        m = _aos.getViews()
+        for change in [lambda: _aos.setPose(m, poses[0]), lambda: _aos.setPoseCorrection(m, [1,0,0]), lambda: _aos.removeView(m),
+                       lambda: _aos.replaceView(m, imgs[0], poses[0], ''), lambda: _aos.getPose(-1)]:
+            with self.assertRaises(IndexError):
+                change()
+        self.assertEqual(_aos.getViews(), m)
+        _aos.setIncrementalRendering(False)
+        _aos.clearViews()
+
+
+class TestProfiling(AOSTestCase):
+    """ Test profiling the passes of the calls (setProfiling and getTimings)
+
+    """
+
+    def test_profiling(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        imgs = np.random.default_rng(3).random((5,32,32,4), dtype=np.float32)
+        poses = np.stack([np.eye(4)]*5)
+        _aos.getTimings(reset=True)
+        self.assertFalse(_aos.getProfiling())
+        _aos.addViews( imgs, poses )
+        ref = _aos.render(np.eye(4), self._fovDegrees)
+        timings = _aos.getTimings()
+        self.assertEqual(timings['stages'], {}) # nothing is timed, but the counters are updated
+        self.assertEqual((timings['views_projected'], timings['bytes_uploaded'], timings['bytes_read_back']), (5, imgs.nbytes, ref.nbytes))
+
+        calls = []
+        _aos.setProfiling(True, calls.append)
+        img = _aos.render(np.eye(4), self._fovDegrees)
+        self.assertTrue(np.array_equal(img, ref))
+        self.assertEqual([t['call'] for t in calls], ['render'])
+        timings = _aos.getTimings()
+        self.assertEqual(list(timings['stages']), ['gbuffer', 'project', 'readback'])
+        for stage in timings['stages'].values():
+            self.assertGreaterEqual(stage['cpu_ms'], 0)
+            self.assertTrue(stage['gpu_ms'] is None or stage['gpu_ms'] >= 0)
+        self.assertGreaterEqual(timings['cpu_ms'], sum(s['cpu_ms'] for s in timings['stages'].values()))
+
+        _aos.addViews( imgs, poses )
+        self.assertEqual(calls[-1]['call'], 'addViews')
+        self.assertEqual(list(calls[-1]['stages']), ['upload'])
+        _aos.render(np.eye(4), self._fovDegrees)
+        _aos.getStats()
+        self.assertEqual(list(_aos.getTimings()['stages']), ['stats'])
+
+        # a call that throws in a pass ends its profile
+        with self.assertRaises(RuntimeError):
+            _aos.addView(np.zeros((8,8,5), dtype=np.float32), np.eye(4), "invalid")
+        _aos.render(np.eye(4), self._fovDegrees)
+        self.assertEqual(calls[-1]['call'], 'render')
+        self.assertEqual(list(calls[-1]['stages']), ['gbuffer', 'project', 'readback'])
+
+        # the batched and asynchronous calls, the readbacks of the frames are summed
+        _aos.renderBatch(np.stack([np.eye(4)]*3), self._fovDegrees)
+        self.assertEqual((calls[-1]['call'], list(calls[-1]['stages'])), ('renderBatch', ['gbuffer', 'project', 'readback']))
+        _aos.renderFocalStack(np.eye(4), self._fovDegrees, [-1.0, 0.0, 1.0])
+        self.assertEqual(calls[-1]['call'], 'renderFocalStack')
+        ticket = _aos.render_async(np.eye(4), self._fovDegrees)
+        self.assertEqual((calls[-1]['call'], list(calls[-1]['stages'])), ('renderAsync', ['gbuffer', 'project', 'readback']))
+        _aos.fetch(ticket)
+        self.assertEqual((calls[-1]['call'], list(calls[-1]['stages'])), ('fetch', ['readback']))
+        _aos.pixelsToWorld([[0, 0], [16, 16]])
+        self.assertEqual((calls[-1]['call'], list(calls[-1]['stages'])), ('pixelsToWorld', ['gather', 'readback']))
+        _aos.setProfiling(False)
+        _aos.clearViews()
+
+
+class TestViewAdjustment(AOSTestCase):
+    """ Test the exposure adjustments of the views (setViewAdjustment)
+
+    """
+
+    def test_view_adjustment(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        rng = np.random.default_rng(4)
+        imgs = rng.random((4,32,32,4), dtype=np.float32)
+        imgs[...,3] = rng.random((4,32,32)) > 0.3 # masked pixels
+        poses = np.stack([np.eye(4)]*4)
+        poses[:,3,:2] = rng.uniform(-5, 5, size=(4,2))
+        adj = [(2.0, 0.5), (0.5, -0.25), (1.0, 0.0), (3.0, 1.0)]
+        adjusted = imgs.copy()
+        for i, (scale, offset) in enumerate(adj):
+            adjusted[i,...,:3] = imgs[i,...,:3] * scale + offset
+
+        _aos.addViews( adjusted, poses )
+        ref = _aos.render(np.eye(4), self._fovDegrees)
+        _aos.clearViews()
+        _aos.addViews( imgs, poses )
+        for i, (scale, offset) in enumerate(adj):
+            _aos.setViewAdjustment(i, scale, offset)
+        self.assertEqual(_aos.getViewAdjustment(1), (0.5, -0.25))
+        # the adjusted images are rounded to half floats on the GPU, the adjustment is applied to the sampled views
+        self.assertTrue(np.allclose(_aos.render(np.eye(4), self._fovDegrees), ref, atol=1.e-2))
+        _aos.setSinglePassRendering(True)
+        self.assertTrue(np.allclose(_aos.render(np.eye(4), self._fovDegrees), ref, atol=1.e-2))
+        _aos.setSinglePassRendering(False)
+        _aos.replaceView(0, imgs[0], poses[0], '')
+        self.assertEqual(_aos.getViewAdjustment(0), (1.0, 0.0))
+        with self.assertRaises(IndexError):
+            _aos.setViewAdjustment(4, 2.0, 0.0)
+        with self.assertRaises(IndexError):
+            _aos.getViewAdjustment(-1)
+        _aos.clearViews()
+
+        # the offset is only added to the channels a view has
+        _aos.addViews( np.ascontiguousarray(adjusted[...,0]), poses )
+        ref = _aos.render(np.eye(4), self._fovDegrees)
+        _aos.clearViews()
+        _aos.addViews( np.ascontiguousarray(imgs[...,0]), poses )
+        for i, (scale, offset) in enumerate(adj):
+            _aos.setViewAdjustment(i, scale, offset)
+        for single_pass in (False, True):
+            _aos.setSinglePassRendering(single_pass)
+            img = _aos.render(np.eye(4), self._fovDegrees)
+            self.assertTrue(np.allclose(img[...,1:3], 0.0))
+            self.assertTrue(np.allclose(img, ref, atol=1.e-2))
+        _aos.setSinglePassRendering(False)
+        _aos.clearViews()
+
+
+class TestSharedMask(AOSTestCase):
+    """ Test masks shared by the views of a mask group (setMask)
+
+    """
+
+    def test_shared_mask(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        rng = np.random.default_rng(5)
+        rgb = rng.random((4,32,32,3), dtype=np.float32)
+        mask = np.clip(cv2.GaussianBlur(rng.random((32,32), dtype=np.float32), (0,0), 2) * 4 - 1.5, 0, 1) # smooth, texture filtering is not exact
+        mask = np.round(mask * 255).astype(np.float32) / 255 # the same as an 8-bit mask
+        poses = np.stack([np.eye(4)]*4)
+        poses[:,3,:2] = rng.uniform(-5, 5, size=(4,2))
+        rgba = np.concatenate((rgb, np.broadcast_to(mask[...,np.newaxis], (4,32,32,1))), axis=-1)
+
+        _aos.addViews( rgba, poses )
+        ref = _aos.render(np.eye(4), self._fovDegrees)
+        _aos.clearViews()
+        _aos.addViews( rgb, poses ) # 3 channels, the alpha comes from the shared mask
+        unmasked = _aos.render(np.eye(4), self._fovDegrees)
+        _aos.setMask( mask )
+        self.assertTrue(_aos.hasMask())
+        self.assertTrue(np.allclose(_aos.render(np.eye(4), self._fovDegrees), ref, atol=1.e-2))
+        _aos.setSinglePassRendering(True)
+        self.assertTrue(np.allclose(_aos.render(np.eye(4), self._fovDegrees), ref, atol=1.e-2))
+        _aos.setSinglePassRendering(False)
+
+        # views in a group without a mask are not masked
+        for i in range(4):
+            _aos.setViewMask(i, 1)
+        self.assertEqual(_aos.getViewMask(0), 1)
+        with self.assertRaises(IndexError):
+            _aos.setViewMask(4, 1)
+        self.assertTrue(np.allclose(_aos.render(np.eye(4), self._fovDegrees), unmasked, atol=1.e-2))
+        _aos.setMask( np.round(mask * 255).astype(np.uint8), 1 ) # normalized, but filtered with less precision than the half-float alpha
+        self.assertTrue(np.allclose(_aos.render(np.eye(4), self._fovDegrees), ref, atol=2.e-2))
+        _aos.clearMask(1)
+        _aos.clearMask(0)
+        self.assertFalse(_aos.hasMask(0))
+        self.assertTrue(np.allclose(_aos.render(np.eye(4), self._fovDegrees), unmasked, atol=1.e-2))
+        _aos.clearViews()
+
+
+class TestUndistortion(AOSTestCase):
+    """ Test undistorting raw frames on the GPU (setCameraCalibration and setUndistortionMap)
+
+    """
+
+    def test_undistortion(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        rng = np.random.default_rng(6)
+        raw = cv2.GaussianBlur(rng.random((64,64,3), dtype=np.float32), (0,0), 3) # smooth, so resampling does not matter
+        K = np.array([[60.0, 0, 31.5], [0, 60.0, 32.5], [0, 0, 1]])
+        dist = np.array([-0.2, 0.05, 0.001, -0.002])
+        undistorted = cv2.undistort(raw, K, dist)
+
+        def masked_rgb(img):
+            valid = img[:,:,3] > 0.99 # pixels covered by the (undistorted) view
+            return img[valid][:,:3] / img[valid][:,3:]
+
+        _aos.addView( undistorted, np.eye(4), "ref" )
+        ref = _aos.render(np.eye(4), self._fovDegrees)
+        _aos.clearViews()
+        _aos.addView( raw, np.eye(4), "raw" )
+        _aos.setCameraCalibration(K, dist, (64,64))
+        self.assertTrue(_aos.hasUndistortion())
+        img = _aos.render(np.eye(4), self._fovDegrees)
+        # pixels that are not seen by the raw frame are transparent instead of black
+        self.assertLess(np.abs(masked_rgb(img) - masked_rgb(np.where(img[:,:,3:] > 0.99, ref, 0))).mean(), 1.e-2)
+        # undistorted views are rendered per view (the layers of single-pass rendering would filter them twice)
+        _aos.setSinglePassRendering(True)
+        self.assertTrue(np.array_equal(_aos.render(np.eye(4), self._fovDegrees), img))
+        _aos.setSinglePassRendering(False)
+
+        # the same remap table as OpenCV
+        _aos.setUndistortionMap(cv2.initUndistortRectifyMap(K, dist, None, K, (64,64), cv2.CV_32FC1))
+        self.assertTrue(np.allclose(_aos.render(np.eye(4), self._fovDegrees), img, atol=1.e-2))
+        _aos.setViewCamera(0, 1)
+        self.assertEqual(_aos.getViewCamera(0), 1)
+        with self.assertRaises(IndexError):
+            _aos.setViewCamera(1, 1)
+        self.assertFalse(np.allclose(_aos.render(np.eye(4), self._fovDegrees), img, atol=1.e-2))
+        _aos.clearUndistortion()
+        _aos.clearViews()
+
+
+class TestRasterDEM(AOSTestCase):
+    """ Test raster DEMs with tiled LOD meshes (loadDEMFromArray)
+
+    """
+
+    def test_raster_dem(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        rng = np.random.default_rng(7)
+        imgs = rng.random((4,64,64,4), dtype=np.float32)
+        poses = np.stack([np.eye(4)]*4)
+        poses[:,3,:2] = rng.uniform(-10, 10, size=(4,2))
+        _aos.addViews( imgs, poses )
+        ref = _aos.render(np.eye(4), self._fovDegrees)
+        self.assertEqual(_aos.getDEMTiles(), 0)
+
+        # a flat raster covering zero_plane.obj
+        _aos.loadDEMFromArray(np.zeros((201,201)), (-1000,-1000), (10,10), tile_size=32)
+        self.assertEqual(_aos.getDEMTiles(), 49)
+        self.assertTrue(np.allclose(_aos.render(np.eye(4), self._fovDegrees), ref, atol=1.e-3))
+
+        x, y = np.meshgrid(np.arange(201) * 10.0 - 1000, np.arange(201) * 10.0 - 1000)
+        heights = 5 * np.sin(x / 40) * np.cos(y / 30)
+        _aos.loadDEMFromArray(heights, (-1000,-1000), (10,10), tile_size=32)
+        _aos.getTimings(reset=True)
+        img = _aos.render(np.eye(4), self._fovDegrees)
+        self.assertFalse(np.allclose(img, ref, atol=1.e-2))
+        self.assertLess(_aos.getTimings()['dem_tiles_drawn'], 49) # only the tiles in the view frustum
+
+        # coarser levels for distant tiles
+        def triangles_per_tile(pose):
+            _aos.getTimings(reset=True)
+            _aos.render(pose, self._fovDegrees)
+            t = _aos.getTimings()
+            return t['dem_triangles_drawn'] / t['dem_tiles_drawn']
+        vpose = np.eye(4)
+        vpose[3,2] = -600
+        _aos.setDEMLODError(0)
+        fine = _aos.render(vpose, self._fovDegrees)
+        self.assertEqual(triangles_per_tile(vpose), 32*32*2) # finest level only
+        _aos.setDEMLODError(16)
+        self.assertLess(np.abs(_aos.render(vpose, self._fovDegrees) - fine).mean(), 1.e-3)
+        self.assertEqual(triangles_per_tile(np.eye(4)), 32*32*2) # close tiles
+        self.assertLess(triangles_per_tile(vpose), 32*32*2 / 2) # distant tiles
+        _aos.setDEMLODError(1)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = os.path.join(tmpdir, 'dem.aosdem')
+            _aos.loadDEMFromArray(heights, (-1000,-1000), (10,10), tile_size=32, cache=cache) # writes the cache
+            self.assertTrue(os.path.exists(cache))
+            _aos.loadDEMFromArray(heights, (-1000,-1000), (10,10), tile_size=32, cache=cache) # reads the cache
+            self.assertTrue(np.array_equal(_aos.render(np.eye(4), self._fovDegrees), img))
+            _aos.loadDEM(cache)
+            self.assertEqual(_aos.getDEMTiles(), 49)
+            self.assertTrue(np.array_equal(_aos.render(np.eye(4), self._fovDegrees), img))
+            _aos.loadDEMFromArray(heights + 1, (-1000,-1000), (10,10), tile_size=32, cache=cache) # other heights rebuild it
+            raised = _aos.render(np.eye(4), self._fovDegrees)
+            self.assertFalse(np.allclose(raised, img, atol=1.e-2))
+            # a truncated or corrupt cache is rebuilt
+            with open(cache, 'r+b') as f:
+                f.truncate(os.path.getsize(cache) // 2)
+            _aos.loadDEMFromArray(heights + 1, (-1000,-1000), (10,10), tile_size=32, cache=cache)
+            self.assertEqual(_aos.getDEMTiles(), 49)
+            self.assertTrue(np.array_equal(_aos.render(np.eye(4), self._fovDegrees), raised))
+            with open(cache, 'r+b') as f:
+                f.seek(8 + 4 + 8)
+                f.write(np.uint32(0xffffffff).tobytes()) # number of tiles
+            _aos.loadDEMFromArray(heights + 1, (-1000,-1000), (10,10), tile_size=32, cache=cache)
+            self.assertEqual(_aos.getDEMTiles(), 49)
+            self.assertTrue(np.array_equal(_aos.render(np.eye(4), self._fovDegrees), raised))
+            # the first tile without levels, or with an empty mesh on the finest level (vertices and indices of its surface)
+            for offset, value in [(8 + 4 + 8 + 4, np.uint32(0)), (8 + 4 + 8 + 4 + 4 + 4 + 2*12, np.zeros(2, dtype=np.uint32))]:
+                with open(cache, 'r+b') as f:
+                    f.seek(offset)
+                    f.write(value.tobytes())
+                _aos.loadDEMFromArray(heights + 1, (-1000,-1000), (10,10), tile_size=32, cache=cache)
+                self.assertEqual(_aos.getDEMTiles(), 49)
+                self.assertTrue(np.array_equal(_aos.render(np.eye(4), self._fovDegrees), raised))
+            # loading a corrupt cache fails and keeps the previous DEM
+            _aos.loadDEM("../data/zero_plane.obj")
+            version = _aos.getSceneVersion()
+            with open(cache, 'r+b') as f:
+                f.truncate(os.path.getsize(cache) // 2)
+            with self.assertRaises(RuntimeError):
+                _aos.loadDEM(cache)
+            self.assertEqual(_aos.getDEMTiles(), 0)
+            self.assertEqual(_aos.getSceneVersion(), version)
+            self.assertTrue(np.allclose(_aos.render(np.eye(4), self._fovDegrees), ref, atol=1.e-3))
+
+        # NaN heights are holes
+        heights[99:102,99:102] = np.nan
+        _aos.loadDEMFromArray(heights, (-1000,-1000), (10,10), tile_size=32)
+        hole = _aos.render(np.eye(4), self._fovDegrees)[:,:,3] == 0
+        self.assertTrue(hole.any() and not hole.all())
+        with self.assertRaises(ValueError):
+            _aos.loadDEMFromArray(np.zeros(10))
+        _aos.loadDEM("../data/zero_plane.obj")
+        _aos.clearViews()
+
+
+class TestROI(AOSTestCase):
+    """ Test rendering regions of interest and gathering the positions of pixels (pixelsToWorld)
+
+    """
+
+    def test_roi(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        rng = np.random.default_rng(3)
+        imgs = rng.random((4,64,64,4), dtype=np.float32)
+        poses = np.stack([np.eye(4)]*4)
+        poses[:,3,:2] = rng.uniform(-10, 10, size=(4,2))
+        _aos.addViews( imgs, poses )
+        vpose = np.eye(4)
+        vpose[3,:2] = [5, -3]
+        full = _aos.render(vpose, self._fovDegrees)
+        fullxyz = _aos.getXYZ().copy()
+
+        for flip in [True, False]:
+            ref = _aos.render(vpose, self._fovDegrees, flipHorizontal=flip)
+            for x, y, w, h in [(0,0,512,512), (10,300,64,32), (448,0,64,100)]:
+                _aos.getTimings(reset=True)
+                crop = _aos.render(vpose, self._fovDegrees, flipHorizontal=flip, roi=(x,y,w,h))
+                self.assertEqual(crop.shape, (h,w,4))
+                self.assertTrue(np.allclose(crop, ref[y:y+h,x:x+w], atol=1.e-5))
+                self.assertEqual(_aos.getTimings()['bytes_read_back'], w * h * 16)
+            # only the roi is rendered
+            self.assertEqual(_aos.getStats()['count'], (ref[0:100,448:512,3] > 0).sum())
+        for roi in [(0,0,0,10), (-1,0,10,10), (500,0,20,10)]:
+            with self.assertRaises(ValueError):
+                _aos.render(vpose, self._fovDegrees, roi=roi)
+        with self.assertRaises(RuntimeError): # a failing render raises instead of aborting
+            _aos.render(vpose, self._fovDegrees, [4], roi=(0,0,16,16))
+
+        # positions of single pixels of the rendered image
+        _aos.render(vpose, self._fovDegrees)
+        points = np.array([[0,0], [511,511], [100,200], [256.7,3.2]])
+        _aos.getTimings(reset=True)
+        xyz = _aos.pixelsToWorld(points)
+        self.assertEqual(xyz.shape, (4,3))
+        self.assertEqual(_aos.getTimings()['bytes_read_back'], 4 * 16)
+        cols, rows = 511 - np.floor(points[:,0]).astype(int), np.floor(points[:,1]).astype(int) # getXYZ is not flipped
+        self.assertTrue(np.allclose(xyz, fullxyz[rows, cols, :3]))
+        self.assertTrue(np.allclose(_aos.pixelsToWorld(np.stack([cols, rows], axis=1), flipHorizontal=False), xyz))
+        self.assertTrue(np.isnan(_aos.pixelsToWorld([[-1,0], [0,512]])).all())
+        self.assertEqual(_aos.pixelsToWorld(np.zeros((0,2))).shape, (0,3))
+        self.assertTrue(np.allclose(full, _aos.render(vpose, self._fovDegrees)))
+        _aos.clearViews()
+
+        # the positions of non-square images have the layout of the rendered images
+        aos = LFR.PyAOS(128, 96, self._fovDegrees)
+        aos.loadDEM("../data/zero_plane.obj")
+        aos.setDEMTransform( [0,0,-100] )
+        aos.addViews( imgs, poses )
+        self.assertEqual(aos.render(vpose, self._fovDegrees, flipHorizontal=False).shape, (96,128,4))
+        xyz = aos.getXYZ()
+        self.assertEqual(xyz.shape, (96,128,4))
+        points = np.array([[0,0], [127,95], [100,20]])
+        self.assertTrue(np.allclose(aos.pixelsToWorld(points, flipHorizontal=False), xyz[points[:,1], points[:,0], :3]))
+        del aos
+
+
+class TestRenderStats(AOSTestCase):
+    """ Test rendering mean, variance and count of the views (renderStats)
+
+    """
+
+    def test_render_stats(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        n = 6
+        rng = np.random.default_rng(5)
+        imgs = rng.random((n,64,64,4), dtype=np.float32)
+        imgs[:,:,:,3] = rng.uniform(0.2, 1.0, size=(n,1,1)) # alpha
+        poses = np.stack([np.eye(4)]*n)
+        poses[:,3,0] = np.linspace(-60,60,n) # translated views, so the number of views differs across the image
+        _aos.addViews( imgs, poses )
+
+        # reference from the integrals of the single views
+        singles = np.stack([_aos.render(np.eye(4), self._fovDegrees, [i]) for i in range(n)])
+        weight = singles[:,:,:,3].sum(axis=0)
+        colors = np.divide(singles[:,:,:,:3], singles[:,:,:,3:], out=np.zeros_like(singles[:,:,:,:3]), where=singles[:,:,:,3:] > 0)
+        valid = weight > 0
+        mean = np.where(valid[:,:,None], (singles[:,:,:,:3].sum(axis=0)) / np.maximum(weight, 1.e-9)[:,:,None], 0)
+        variance = np.where(valid[:,:,None], (singles[:,:,:,3:] * colors**2).sum(axis=0) / np.maximum(weight, 1.e-9)[:,:,None] - mean**2, 0)
+        count = (singles[:,:,:,3] > 0).sum(axis=0)
+        self.assertTrue(count.min() < count.max())
+
+        stats = _aos.renderStats(np.eye(4), self._fovDegrees)
+        self.assertEqual(stats['mean'].shape, (512,512,3))
+        self.assertTrue(np.array_equal(stats['count'], count))
+        self.assertTrue(np.allclose(stats['weight'], weight, atol=1.e-5))
+        self.assertTrue(np.allclose(stats['mean'], mean, atol=1.e-5))
+        self.assertTrue(np.allclose(stats['variance'], np.maximum(variance, 0), atol=1.e-4))
+        # the integral is rendered as well
+        self.assertTrue(np.allclose(_aos.render(np.eye(4), self._fovDegrees), singles.sum(axis=0), atol=1.e-5))
+
+        _aos.setSinglePassRendering(True)
+        sstats = _aos.renderStats(np.eye(4), self._fovDegrees)
+        _aos.setSinglePassRendering(False)
+        self.assertTrue(np.array_equal(sstats['count'], count))
+        for key in ['mean', 'variance', 'weight']:
+            self.assertTrue(np.allclose(sstats[key], stats[key], rtol=1.e-3, atol=1.e-2)) # the texture arrays have less precision
+
+        flipped = _aos.renderStats(np.eye(4), self._fovDegrees, [1, 2], flipHorizontal=False)
+        self.assertTrue(np.array_equal(flipped['count'], (singles[1:3,:,::-1,3] > 0).sum(axis=0)))
+        _aos.clearViews()
+
+
+class TestIntegralCache(AOSTestCase):
+    """ Test caching rendered integrals (setIntegralCache)
+
+    """
+
+    def test_integral_cache(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        imgs = np.random.rand(4,64,64,4).astype(np.float32)
+        poses = np.stack([np.eye(4)]*4)
+        poses[:,3,0] = [-5, 0, 5, 10]
+        _aos.addViews( imgs, poses )
+        image_bytes = 512 * 512 * 16
+        _aos.setIntegralCache(3 * image_bytes)
+        self.assertEqual(_aos.getIntegralCache(), 3 * image_bytes)
+
+        ref = _aos.render(np.eye(4), self._fovDegrees)
+        _aos.getTimings(reset=True)
+        self.assertTrue(np.array_equal(_aos.render(np.eye(4), self._fovDegrees), ref))
+        self.assertEqual(_aos.getTimings()['views_projected'], 0) # not rendered again
+        stats = _aos.getIntegralCacheStats(reset=True)
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries'], stats['bytes']), (1, 1, 1, image_bytes))
+
+        # other ids, roi or DEM transformation are other images
+        self.assertFalse(np.array_equal(_aos.render(np.eye(4), self._fovDegrees, [0]), ref))
+        _aos.setDEMTransform( [0,0,-50] )
+        self.assertFalse(np.array_equal(_aos.render(np.eye(4), self._fovDegrees), ref))
+        _aos.setDEMTransform( [0,0,-100] )
+        self.assertTrue(np.array_equal(_aos.render(np.eye(4), self._fovDegrees), ref))
+        self.assertEqual(_aos.render(np.eye(4), self._fovDegrees, roi=(0,0,32,16)).shape, (16,32,4)) # evicts the least recently used image
+        stats = _aos.getIntegralCacheStats(reset=True)
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (1, 3, 1))
+        self.assertLessEqual(stats['bytes'], 3 * image_bytes)
+
+        # changing the views invalidates the cached images
+        for change in [lambda: _aos.setPose(1, poses[2]), lambda: _aos.setViewAdjustment(0, 2.0, 0.0), lambda: _aos.removeView(3)]:
+            version = _aos.getSceneVersion()
+            change()
+            self.assertGreater(_aos.getSceneVersion(), version)
+            img = _aos.render(np.eye(4), self._fovDegrees)
+            self.assertEqual(_aos.getIntegralCacheStats(reset=True)['misses'], 1)
+            self.assertFalse(np.array_equal(img, ref))
+            ref = img
+        _aos.loadDEM("../data/zero_plane.obj")
+        self.assertTrue(np.array_equal(_aos.render(np.eye(4), self._fovDegrees), ref)) # rendered again
+        self.assertEqual(_aos.getIntegralCacheStats(reset=True)['misses'], 1)
+
+        _aos.setIntegralCache(0)
+        self.assertEqual(_aos.getIntegralCacheStats()['entries'], 0)
+        _aos.render(np.eye(4), self._fovDegrees)
+        self.assertEqual(_aos.getIntegralCacheStats()['misses'], 0)
+        _aos.clearViews()
+
+
+class TestAutofocus(AOSTestCase):
+    """ Test searching the focal plane on the GPU (focusMeasures, autofocus and autofocusTiles)
+
+    """
+
+    def test_autofocus(self):
+        _aos = self._aos1
+        # views of a textured plane 100 below the cameras, rendered from a single view
+        rng = np.random.default_rng(3)
+        texture = np.repeat(np.repeat(rng.random((64,64), dtype=np.float32), 8, axis=0), 8, axis=1)
+        _aos.setDEMTransform( [0,0,-100] )
+        _aos.addView( np.dstack([texture]*3 + [np.ones_like(texture)]), np.eye(4), "texture" )
+        n = 8
+        poses = np.stack([np.eye(4)]*n)
+        poses[:,3,0] = np.linspace(-8,8,n)
+        poses[:,3,1] = np.linspace(5,-5,n)
+        views = np.stack([_aos.render(p, self._fovDegrees, flipHorizontal=False) for p in poses])
+        _aos.clearViews()
+        poses[:,3,:3] *= -1 # camera poses of the rendered views
+        _aos.addViews( views, poses )
+        _aos.setDEMTransform( [0,0,-90] ) # the plane is in focus with an offset of -10
+
+        zs = np.linspace(-30, 10, 9)
+        for metric in ['variance', 'gradient']:
+            measures = _aos.focusMeasures(np.eye(4), self._fovDegrees, zs, metric=metric)
+            self.assertEqual(measures.shape, (9,))
+            self.assertEqual(np.argmax(measures), 4)
+            z, measure = _aos.autofocus(np.eye(4), self._fovDegrees, (-30, 10), metric=metric)
+            self.assertAlmostEqual(z, -10, delta=0.5)
+            self.assertGreaterEqual(measure, measures.max())
+
+        # only scalars are read back
+        _aos.getTimings(reset=True)
+        z, _ = _aos.autofocus(np.eye(4), self._fovDegrees, (-30, 10), roi=(100,150,200,100), metric='gradient')
+        self.assertAlmostEqual(z, -10, delta=0.5)
+        self.assertLess(_aos.getTimings()['bytes_read_back'], 512 * 512 * 16)
+
+        depth = _aos.autofocusTiles(np.eye(4), self._fovDegrees, (-30, 10), tile_size=128)
+        self.assertEqual(depth.shape, (4,4))
+        self.assertTrue(np.allclose(depth, -10, atol=0.5))
+        depth = _aos.autofocusTiles(np.eye(4), self._fovDegrees, (-30, 10), tile_size=96, roi=(10,20,300,200), flipHorizontal=False)
+        self.assertEqual(depth.shape, (3,4))
+        self.assertEqual(_aos.focusMeasures(np.eye(4), self._fovDegrees, zs, tile_size=128).shape, (9,4,4))
+
+        # planes without any views are never in focus
+        self.assertTrue(np.isnan(_aos.focusMeasures(np.eye(4), self._fovDegrees, [0], cameraids=[0], roi=(0,0,16,16))[0]))
+        with self.assertRaises(ValueError):
+            _aos.autofocus(np.eye(4), self._fovDegrees, (-30, 10), metric='contrast')
+        with self.assertRaises(ValueError):
+            _aos.autofocusTiles(np.eye(4), self._fovDegrees, (-30, 10), tile_size=50)
+        _aos.clearViews()
+
+
+class TestBulkViews(AOSTestCase):
+    """ Test setting poses and corrections of several views and removing several views at once
+
+    """
+
+    def add_views(self):
+        rng = np.random.default_rng(2)
+        n = 6
+        imgs = rng.random((n,32,32,4), dtype=np.float32)
+        poses = np.stack([np.eye(4)]*n)
+        poses[:,3,:2] = rng.uniform(-5, 5, size=(n,2))
+        names = [str(i) for i in range(n)]
+        for _aos in [self._aos1, self._aos2]:
+            _aos.setDEMTransform( [0,0,-100] )
+            _aos.addViews( imgs, poses, names )
+        return imgs, poses
+
+    def test_bulk_views(self):
+        imgs, poses = self.add_views()
+        n = len(poses)
+        rng = np.random.default_rng(3)
+
+        # bulk operations match the operations per view
+        moved = poses.copy()
+        moved[:,3,:2] += rng.uniform(-2, 2, size=(n,2))
+        corrections = rng.uniform(-0.05, 0.05, size=(n,6)).astype(np.float32)
+        self._aos1.setPoses(moved)
+        self._aos1.setPoseCorrections(corrections[:2], [4, 1])
+        for i in range(n):
+            self._aos2.setPose(i, moved[i])
+        self._aos2.setPoseCorrection(4, corrections[0,:3], corrections[0,3:])
+        self._aos2.setPoseCorrection(1, corrections[1,:3], corrections[1,3:])
+        self.assertTrue(np.allclose(self._aos1.getPose(3), moved[3]))
+        self.assertTrue(np.allclose(self._aos1.getPoseCorrection(1), self._aos2.getPoseCorrection(1)))
+        self.assertTrue(np.array_equal(self._aos1.render(np.eye(4), self._fovDegrees), self._aos2.render(np.eye(4), self._fovDegrees)))
+
+        self._aos1.removeViews([3, 1])
+        self._aos2.removeView(3)
+        self._aos2.removeView(1)
+        self.assertEqual([self._aos1.getName(i) for i in range(self._aos1.getViews())], ['0', '2', '4', '5'])
+        self.assertTrue(np.array_equal(self._aos1.render(np.eye(4), self._fovDegrees), self._aos2.render(np.eye(4), self._fovDegrees)))
+        with self.assertRaises(ValueError):
+            self._aos1.setPoses(moved)
+        with self.assertRaises(ValueError):
+            self._aos1.setPoseCorrections(corrections)
+        with self.assertRaises(IndexError):
+            self._aos1.removeViews([4])
+        with self.assertRaises(IndexError):
+            self._aos1.setPoses(poses[:1], [4])
+        self._aos1.clearViews()
+        self._aos2.clearViews()
+
+    def test_incremental(self):
+        imgs, poses = self.add_views()
+        moved = poses.copy()
+        moved[:,3,:2] += 1
+
+        # an incremental integral is updated view by view or rebuilt
+        _aos = self._aos1
+        _aos.setIncrementalRendering(True)
+        _aos.render(np.eye(4), self._fovDegrees)
+        for ids in [[2], None]:
+            _aos.setPoses(moved[[2]] if ids else moved, ids)
+            self._aos2.setPoses(moved[[2]] if ids else moved, ids)
+            self.assertTrue(np.allclose(_aos.render(np.eye(4), self._fovDegrees), self._aos2.render(np.eye(4), self._fovDegrees), atol=1.e-5))
+        _aos.setIncrementalRendering(False)
+        _aos.clearViews()
+        self._aos2.clearViews()
+
+
+class TestTexturePool(AOSTestCase):
+    """ Test reusing the textures of removed views (setTexturePool)
+
+    """
+
+    view_bytes = 32*32*4*2 # RGBA16F
+
+    def test_reuse(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        rng = np.random.default_rng(2)
+        n = 6
+        imgs = rng.random((n,32,32,4), dtype=np.float32)
+        poses = np.stack([np.eye(4)]*n)
+        poses[:,3,:2] = rng.uniform(-5, 5, size=(n,2))
+
+        # without a pool (the default), the textures of removed views are deleted
+        self.assertEqual(_aos.getTexturePool(), 0)
+        _aos.addViews( imgs, poses )
+        _aos.removeView(0)
+        _aos.clearViews()
+        self.assertEqual(_aos.getResidencyStats()['pooled_textures'], 0)
+
+        # with a pool, they are reused for views of the same size
+        _aos.setTexturePool(n * self.view_bytes)
+        _aos.addViews( imgs, poses )
+        ref = _aos.render(np.eye(4), self._fovDegrees, [0])
+        _aos.clearViews()
+        self.assertEqual(_aos.getViews(), 0)
+        stats = _aos.getResidencyStats(reset=True)
+        self.assertEqual((stats['pooled_textures'], stats['pooled_bytes']), (n, n * self.view_bytes))
+        _aos.addViews( imgs, poses )
+        stats = _aos.getResidencyStats(reset=True)
+        self.assertEqual((stats['allocations'], stats['reuses'], stats['pooled_textures']), (0, n, 0))
+        self.assertTrue(np.array_equal(_aos.render(np.eye(4), self._fovDegrees, [0]), ref))
+        _aos.replaceView(1, imgs[1,:16,:16], poses[1], '') # allocates a smaller texture, the texture of the view goes to the pool
+        stats = _aos.getResidencyStats()
+        self.assertEqual((stats['allocations'], stats['reuses'], stats['pooled_textures']), (1, 0, 1))
+        _aos.addView( imgs[2], poses[2], '' )
+        self.assertEqual(_aos.getResidencyStats()['reuses'], 1)
+
+        # clearing the pool deletes the textures
+        _aos.clearViews()
+        _aos.setTexturePool(0)
+        self.assertEqual(_aos.getTexturePool(), 0)
+        self.assertEqual(_aos.getResidencyStats()['pooled_textures'], 0)
+
+    def test_texture_budget(self):
+        _aos = self._aos1
+        _aos.setDEMTransform( [0,0,-100] )
+        rng = np.random.default_rng(2)
+        n = 6
+        imgs = rng.random((n,32,32,4), dtype=np.float32)
+        poses = np.stack([np.eye(4)]*n)
+        poses[:,3,:2] = rng.uniform(-5, 5, size=(n,2))
+
+        # pooled textures count against a texture budget, removed views are released once
+        _aos.setTexturePool(n * self.view_bytes)
+        _aos.addViews( imgs, poses )
+        _aos.clearViews()
+        _aos.setTextureBudget(4 * self.view_bytes)
+        self.assertLessEqual(_aos.getResidencyStats()['pooled_bytes'], 4 * self.view_bytes)
+        _aos.addViews( imgs, poses )
+        _aos.setIncrementalRendering(True)
+        _aos.render(np.eye(4), self._fovDegrees)
+        _aos.removeViews([0, 1])
+        _aos.render(np.eye(4), self._fovDegrees)
+        stats = _aos.getResidencyStats()
+        self.assertEqual(stats['resident_bytes'], stats['resident_views'] * self.view_bytes)
+        self.assertLessEqual(stats['resident_bytes'] + stats['pooled_bytes'], 4 * self.view_bytes)
+        _aos.setIncrementalRendering(False)
+        _aos.setTextureBudget(0)
+        _aos.setTexturePool(0)
+        _aos.clearViews()
+
+
+class TestReadPosesAndImages(unittest.TestCase):
+    """ Test the (streaming) light-field loader in LFR_utils
+
+    """
+
+    _fovDegrees = 32.3443
+    _posesFile = "../data/20210810_conifer_ex2_set2/colmap/poses/RGB.json"
+    _imagesDir = "../data/20210810_conifer_ex2_set2/colmap/images/r1024"
+
+    def setUp(self):
+        self._window = LFR.PyGlfwWindow(512,512,'AOS') # make sure there is an OpenGL context
+
+    def tearDown(self):
+        del self._window
+
+    def load_and_render(self, **kwargs):
+        from pyaos.LFR_utils import read_poses_and_images, pose_to_virtualcamera
+        aos = LFR.PyAOS(512,512,self._fovDegrees)
+        aos.loadDEM("../data/zero_plane.obj")
+        aos.setDEMTransform([0,0,51])
+        img_list, poses = read_poses_and_images(aos, self._posesFile, self._imagesDir, **kwargs)
+        self.assertTrue(aos.getViews()==len(poses))
+        names = [aos.getName(i) for i in range(aos.getViews())]
+        rimg = aos.render(pose_to_virtualcamera(poses[len(poses)//2]), self._fovDegrees)
+        del aos
+        return img_list, poses, names, rimg
+
+    def test_streaming(self):
+        img_list, poses, names, rimg = self.load_and_render(workers=1, prefetch=1)
+        self.assertTrue(len(img_list)==len(poses))
+        
+        # multi threaded and without keeping the images must give the same light field
+        s_list, s_poses, s_names, s_rimg = self.load_and_render(workers=4, prefetch=3, keep_images=False)
+        self.assertIsNone(s_list)
+        self.assertEqual(names, s_names)
+        self.assertTrue(np.allclose(np.asarray(poses), np.asarray(s_poses)))
+        self.assertTrue(np.allclose(rimg, s_rimg))
+
+    def test_views_projected(self):
+        # the views are uploaded directly from the decoded buffers and seen by the virtual camera of the center view
+        img_list, poses, names, rimg = self.load_and_render()
+        self.assertTrue(rimg[:,:,3].max() > 0)
+
+    def test_mask(self):
+        from pyaos.LFR_utils import read_poses_and_images
+        aos = LFR.PyAOS(512,512,self._fovDegrees)
+        read_poses_and_images(aos, self._posesFile, self._imagesDir, mask="../data/mask.png", keep_images=False)
+        self.assertTrue(aos.hasMask())
+        aos.clearViews()
+        # the shared mask of a flight does not mask the views of the next one
+        read_poses_and_images(aos, self._posesFile, self._imagesDir, keep_images=False)
+        self.assertFalse(aos.hasMask())
+        del aos
+
+    def test_adjust_mean(self):
+        from pyaos.LFR_utils import image_stats, get_min_max_median, hdr_mean_adjust, ExposureStats
+        rng = np.random.default_rng(5)
+        img = rng.normal(100, 20, size=(64,48,3)).astype(np.float32)
+        lo, hi, median = image_stats(img)
+        self.assertEqual((lo, hi), (img.min(), img.max()))
+        self.assertLessEqual(abs(median - np.median(img)), (hi - lo) / 4095)
+        self.assertEqual(image_stats(img, bins=None)[2], np.median(img))
+        self.assertEqual(image_stats(np.full((4,4), 2.0)), (2.0, 2.0, 2.0))
+
+        # the view adjustments render like the adjusted images of hdr_mean_adjust
+        img_list, poses, names, rimg = self.load_and_render()
+        stats = ExposureStats()
+        _, _, _, s_rimg = self.load_and_render(adjust_mean=True, exposure_stats=stats)
+        self.assertEqual(len(stats), len(poses))
+        self.assertEqual(stats.result(), get_min_max_median(img_list))
+        adjusted = hdr_mean_adjust([img.copy() for img in img_list])
+        scale, offset = stats.adjustments()[0]
+        self.assertTrue(np.allclose(adjusted[0], img_list[0] * scale + offset, atol=1.e-5))
+        self.assertLessEqual(max(a.max() for a in adjusted), 1.0 + 1.e-5)
+        # a = rimg[:,:,3:] views per pixel, the adjusted integral is scale * sum + a * mean offset
+        a = rimg[:,:,3]
+        self.assertTrue(np.all(s_rimg[:,:,3] == a))
+        valid = a > 0
+        self.assertTrue(np.all(s_rimg[valid][:,:3] / a[valid][:,None] <= 1.0 + 1.e-3))
+        self.assertTrue(np.all(s_rimg[valid][:,:3] >= -1.e-3))
+
+
+    def test_packed_light_field(self):
+        from pyaos.LFR_utils import pack_light_field, pose_to_virtualcamera
+        _, poses, names, rimg = self.load_and_render(mask="../data/mask.png", adjust_mean=True)
+        vpose = pose_to_virtualcamera(poses[len(poses)//2])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            packed = os.path.join(tmpdir, 'lf.aoslf')
+            self.assertEqual(pack_light_field(packed, self._posesFile, self._imagesDir, mask="../data/mask.png", adjust_mean=True, workers=2), len(poses))
+            corrections = np.zeros((len(poses),6))
+            corrections[1,:3] = (0.5, -0.2, 0.1)
+            resized = os.path.join(tmpdir, 'lf_f16.aoslf')
+            pack_light_field(resized, self._posesFile, self._imagesDir, size=(256,192), dtype=np.float16, corrections=corrections)
+
+            aos = LFR.PyAOS(512,512,self._fovDegrees)
+            aos.loadDEM("../data/zero_plane.obj")
+            aos.setDEMTransform([0,0,51])
+            self.assertEqual(aos.loadLightField(packed), len(poses))
+            self.assertEqual([aos.getName(i) for i in range(aos.getViews())], names)
+            self.assertTrue(np.allclose([aos.getPose(i) for i in range(aos.getViews())], poses))
+            self.assertTrue(aos.hasMask())
+            # single-channel images, so the channel order does not matter (8-bit textures are filtered with less precision)
+            self.assertTrue(np.allclose(aos.render(vpose, self._fovDegrees), rimg, rtol=1.e-2, atol=1.e-2))
+
+            aos.clearViews()
+            aos.clearMask()
+            self.assertEqual(aos.loadLightField(resized), len(poses))
+            self.assertTrue(np.allclose(aos.getPoseCorrection(1)[3,:3], corrections[1,:3]))
+            self.assertTrue(np.allclose(aos.getPoseCorrection(0), np.eye(4)))
+            self.assertTrue(aos.render(vpose, self._fovDegrees)[:,:,3].max() > 0)
+            with open(resized, 'r+b') as f:
+                f.truncate(os.path.getsize(resized) // 2)
+            with self.assertRaises(RuntimeError):
+                aos.loadLightField(resized)
+            with self.assertRaises(RuntimeError):
+                aos.loadLightField(self._posesFile)
+            del aos
+
+    def test_packed_light_field_rgb(self):
+        import json
+        from pyaos.LFR_utils import pack_light_field, read_poses_and_images, _LIGHTFIELD_HEADER
+        rng = np.random.default_rng(11)
+        n = 4
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # 3-channel images with different values per channel, so a swapped channel order renders differently
+            records = []
+            for i in range(n):
+                img = np.clip(rng.normal((200, 100, 20), 10, size=(48,64,3)), 0, 255).astype(np.uint8)
+                cv2.imwrite(os.path.join(tmpdir, f'{i}.png'), img)
+                records.append({'imagefile': f'{i}.png', 'M3x4': [[1,0,0,rng.uniform(-5,5)], [0,1,0,rng.uniform(-5,5)], [0,0,1,0]]})
+            posesFile = os.path.join(tmpdir, 'poses.json')
+            with open(posesFile, 'w') as f:
+                json.dump({'images': records}, f)
+
+            aos = LFR.PyAOS(128,128,self._fovDegrees)
+            aos.loadDEM("../data/zero_plane.obj")
+            aos.setDEMTransform([0,0,-100])
+            read_poses_and_images(aos, posesFile, tmpdir)
+            ref = aos.render(np.eye(4), self._fovDegrees)
+            self.assertTrue(ref[:,:,3].max() > 0)
+
+            packed = os.path.join(tmpdir, 'lf.aoslf')
+            pack_light_field(packed, posesFile, tmpdir)
+            aos.clearViews()
+            self.assertEqual(aos.loadLightField(packed), n)
+            # sums of up to 4 views in [0,255] (8-bit textures are filtered with less precision)
+            self.assertTrue(np.allclose(aos.render(np.eye(4), self._fovDegrees), ref, atol=4.0))
+
+            # the value range of the image files is stored in the file and applied when loading it
+            normalized = os.path.join(tmpdir, 'lf_normalized.aoslf')
+            pack_light_field(normalized, posesFile, tmpdir, normalize=True)
+            aos.clearViews()
+            aos.loadLightField(normalized)
+            img = aos.render(np.eye(4), self._fovDegrees)
+            self.assertTrue(np.allclose(img[:,:,:3], ref[:,:,:3] / 255, atol=4.0 / 255))
+            self.assertTrue(np.array_equal(img[:,:,3], ref[:,:,3]))
+
+            # sizes and offsets that do not fit into the file
+            for field, value in [('width', -64), ('channels', 7), ('data_offset', 2**63), ('num_views', 2**31), ('names_offset', 2**40)]:
+                header = np.fromfile(packed, dtype=_LIGHTFIELD_HEADER, count=1)[0]
+                header[field] = value
+                corrupt = os.path.join(tmpdir, 'corrupt.aoslf')
+                with open(packed, 'rb') as f:
+                    data = bytearray(f.read())
+                data[:_LIGHTFIELD_HEADER.itemsize] = header.tobytes()
+                with open(corrupt, 'wb') as f:
+                    f.write(data)
+                with self.assertRaises(RuntimeError):
+                    aos.loadLightField(corrupt)
+            self.assertEqual(aos.getViews(), n)
+            del aos
+
+
+class TestCpuRenderer(unittest.TestCase):
+    """ Compare the CPU (NumPy) renderer with the OpenGL renderer
+
+    """
+
+    def setUp(self):
+        self._window = LFR.PyGlfwWindow(512,512,'AOS') # make sure there is an OpenGL context
+
+    def tearDown(self):
+        del self._window
+
+    def test_render(self):
+        from pyaos.LFR_cpu import CpuAOS
+        rng = np.random.default_rng(1)
+        n = 12
+        imgs = rng.random((n,48,48,4), dtype=np.float32)
+        poses = np.stack([np.eye(4)]*n)
+        for i in range(n):
+            poses[i,:3,:3] = cv2.Rodrigues(rng.normal(scale=0.2, size=3))[0].T # tilted views
+        poses[:,3,:2] = rng.uniform(-20, 20, size=(n,2))
+        vpose = np.eye(4)
+        vpose[:3,:3] = cv2.Rodrigues(np.array([0.2,-0.1,0.05]))[0]
+
+        gpu = LFR.PyAOS(128,96,40) # non-square, the images and positions have the same layout
+        cpu = CpuAOS(128,96,40)
+        for aos in (gpu, cpu):
+            aos.loadDEM("../data/zero_plane.obj")
+            aos.setDEMTransform([0,0,-100], [0.1,0,0.2])
+            aos.addViews(imgs, poses)
+
+        for ids in [[], [1,4,5]]:
+            gimg = gpu.render(vpose, 45, ids)
+            cimg = cpu.render(vpose, 45, ids)
+            self.assertEqual(gpu.getXYZ().shape, (96,128,4))
+            self.assertTrue(np.allclose(gpu.getXYZ(), cpu.getXYZ(), atol=1.e-3))
+            self.assertTrue(cimg[:,:,3].max() > 0)
+            # texture filtering on the GPU is less precise and pixels on the borders of views may differ
+            diff = np.abs(gimg - cimg)
+            self.assertLess(diff.mean(), 1.e-2)
+            self.assertLess((diff > 0.1).mean(), 1.e-2)
+
+        # views spread across processes
+        cimg = cpu.render(vpose, 45)
+        cpu.workers = 2
+        self.assertTrue(np.allclose(cpu.render(vpose, 45), cimg))
+
+        # pose corrections
+        uncorrected = cpu.render(vpose, 45, [1,4,5])
+        for aos in (gpu, cpu):
+            aos.setPoseCorrection(4, [3,-2,0.5], [0.05,-0.03,0.1])
+        self.assertTrue(np.allclose(gpu.getPoseCorrection(4), cpu.getPoseCorrection(4), atol=1.e-6))
+        self.assertTrue(np.allclose(gpu.getPosition(4), cpu.getPosition(4), atol=1.e-4))
+        cimg = cpu.render(vpose, 45, [1,4,5])
+        self.assertGreater(np.abs(cimg - uncorrected).mean(), 1.e-2)
+        diff = np.abs(gpu.render(vpose, 45, [1,4,5]) - cimg)
+        self.assertLess(diff.mean(), 1.e-2)
+        self.assertLess((diff > 0.1).mean(), 1.e-2)
+        cpu.workers = None
+        self.assertTrue(np.allclose(cpu.render(vpose, 45, [1,4,5]), cimg))
+        cpu.close()
+
+        # exposure adjustments
+        for aos in (gpu, cpu):
+            aos.setViewAdjustment(4, 0.5, 0.25)
+        diff = np.abs(gpu.render(vpose, 45, [1,4,5]) - cpu.render(vpose, 45, [1,4,5]))
+        self.assertLess(diff.mean(), 1.e-2)
+
+        # shared mask of a different size than the views
+        mask = rng.random((24,24), dtype=np.float32)
+        for aos in (gpu, cpu):
+            aos.setMask(mask)
+        diff = np.abs(gpu.render(vpose, 45, [1,4,5]) - cpu.render(vpose, 45, [1,4,5]))
+        self.assertLess(diff.mean(), 1.e-2)
+
+        # raw frames that are undistorted when they are sampled
+        K = np.array([[40.0,0,23.5],[0,40.0,24.5],[0,0,1]])
+        for aos in (gpu, cpu):
+            aos.clearMask()
+            aos.setCameraCalibration(K, [-0.2, 0.05, 0.002, -0.001], (48,48))
+            self.assertTrue(aos.hasUndistortion())
+        cimg = cpu.render(vpose, 45, [1,4,5])
+        diff = np.abs(gpu.render(vpose, 45, [1,4,5]) - cimg)
+        self.assertLess(diff.mean(), 1.e-2)
+        self.assertLess((diff > 0.1).mean(), 1.e-2)
+        cpu.workers = 2
+        self.assertTrue(np.allclose(cpu.render(vpose, 45, [1,4,5]), cimg))
+        cpu.close()
+        cpu.workers = None
+        for aos in (gpu, cpu):
+            aos.clearUndistortion()
+
+        # 8-bit views
+        for aos in (gpu, cpu):
+            aos.clearViews()
+            aos.addView((imgs[0]*255).astype(np.uint8), poses[0], "uint8")
+        diff = np.abs(gpu.render(vpose, 45) - cpu.render(vpose, 45))
+        self.assertLess(np.median(diff), 1.0)
+
+
+@unittest.skipIf(sys.platform == 'win32', 'headless contexts (EGL) are not supported on Windows')
+class TestHeadlessContext(unittest.TestCase):
+    """ Test rendering without a window
+
+    """
+
+    _fovDegrees = 50
+
+    def render(self, value):
+        aos = LFR.PyAOS(64,64,self._fovDegrees)
+        aos.loadDEM("../data/zero_plane.obj")
+        aos.setDEMTransform([0,0,-100])
+        aos.addView(np.full((64,64,1), value, dtype=np.float32), np.eye(4), "view")
+        rimg = aos.render(np.eye(4), self._fovDegrees)
+        return aos, rimg
+
+    def test_multiple_contexts(self):
+        ctx1 = LFR.PyHeadlessContext()
+        self.assertTrue(ctx1.isCurrent())
+        self.assertIn(ctx1.getBackend(), ['device', 'software', 'surfaceless', 'default'])
+        aos1, rimg1 = self.render(1.0)
+        ctx2 = LFR.PyHeadlessContext()
+        self.assertFalse(ctx1.isCurrent())
+        aos2, rimg2 = self.render(2.0)
+        self.assertTrue(np.allclose(rimg1[:,:,0], 1.0) and np.allclose(rimg2[:,:,0], 2.0))
+
+        ctx1.makeCurrent()
+        self.assertTrue(np.allclose(aos1.render(np.eye(4), self._fovDegrees), rimg1))
+        del aos1, ctx1
+        ctx2.makeCurrent()
+        self.assertTrue(np.allclose(aos2.render(np.eye(4), self._fovDegrees), rimg2))
+        del aos2, ctx2
+
+        with self.assertRaises(ValueError):
+            LFR.PyHeadlessContext('glfw')
+
+    def test_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        def worker(value):
+            ctx = LFR.PyHeadlessContext() # one context per thread
+            aos, rimg = self.render(value)
+            del aos, ctx
+            return rimg
+        with ThreadPoolExecutor(3) as pool:
+            rimgs = list(pool.map(worker, [1.0, 2.0, 3.0]))
+        for value, rimg in zip([1.0, 2.0, 3.0], rimgs):
+            self.assertTrue(np.allclose(rimg[:,:,0], value))
+
+
+class TestRenderServer(unittest.TestCase):
+    """ Test rendering through pyaos.LFR_server
+
+    """
+
+    _fovDegrees = 50
+
+    @staticmethod
+    def add_views(aos):
+        rng = np.random.default_rng(11)
+        imgs = rng.random((4,64,64,4), dtype=np.float32)
+        poses = np.stack([np.eye(4)]*4)
+        poses[:,3,0] = [-6, -2, 2, 6]
+        aos.addViews( imgs, poses )
+
+    @staticmethod
+    def pose(x):
+        pose = np.eye(4)
+        pose[3,:2] = [x, -2]
+        return pose
+
+    def test_render_server(self):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        from pyaos.LFR_server import RenderServer, RenderClient
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            address = os.path.join(tmpdir, 'aos.sock')
+            if os.name == 'nt': # no Unix domain sockets, use a free TCP port
+                import socket
+                with socket.socket() as s:
+                    s.bind(('127.0.0.1', 0))
+                    address = s.getsockname()
+            def setup(aos):
+                self.add_views(aos)
+                aos.setIntegralCache(1 << 24) # disabled by the server, positions are read from the G-buffer of the render
+            server = RenderServer(address, 128, 128, self._fovDegrees, dem="../data/zero_plane.obj", dem_transform=[0,0,-100], setup=setup).start()
+            try:
+                ctx = LFR.createContext(128, 128, headless=os.name != 'nt')
+                aos = LFR.PyAOS(128,128,self._fovDegrees)
+                aos.loadDEM("../data/zero_plane.obj")
+                aos.setDEMTransform([0,0,-100])
+                self.add_views(aos)
+                vpose = self.pose(3)
+
+                with RenderClient(address) as client:
+                    self.assertEqual(client.getViews(), 4)
+                    self.assertTrue(np.allclose(client.render(vpose, self._fovDegrees), aos.render(vpose, self._fovDegrees), atol=1.e-5))
+                    crop = client.render(vpose, self._fovDegrees, [1,2], roi=(5,10,32,16))
+                    self.assertEqual(crop.shape, (16,32,4))
+                    self.assertTrue(np.allclose(crop, aos.render(vpose, self._fovDegrees, [1,2], roi=(5,10,32,16)), atol=1.e-5))
+                    stack = client.renderFocalStack(vpose, self._fovDegrees, [0, 10])
+                    self.assertTrue(np.allclose(stack, aos.renderFocalStack(vpose, self._fovDegrees, [0, 10]), atol=1.e-5))
+
+                    client.render(vpose, self._fovDegrees)
+                    aos.render(vpose, self._fovDegrees)
+                    self.assertTrue(np.allclose(client.getXYZ(), aos.getXYZ()))
+                    points = [[0,0], [64,100]]
+                    self.assertTrue(np.allclose(client.pixelsToWorld(points), aos.pixelsToWorld(points)))
+                    with self.assertRaises(ValueError):
+                        client.render(vpose, self._fovDegrees, roi=(0,0,200,10))
+
+                # identical pending requests are rendered once, renders with other poses in one batch
+                async def burst():
+                    params = lambda x: {'pose': self.pose(x).ravel().tolist(), 'fov': float(self._fovDegrees), 'ids': [], 'flip': True, 'roi': None}
+                    return await asyncio.gather(*[server.submit('render', params(x)) for x in [0, 0, 0, 1, 2]])
+                before = dict(server.stats)
+                imgs = asyncio.run_coroutine_threadsafe(burst(), server._loop).result()
+                self.assertEqual(server.stats['coalesced'] - before['coalesced'], 2)
+                self.assertEqual(server.stats['batches'] - before['batches'], 1)
+                self.assertEqual(server.stats['batched'] - before['batched'], 3)
+                for x, img in zip([0, 0, 0, 1, 2], imgs):
+                    self.assertTrue(np.allclose(img, aos.render(self.pose(x), self._fovDegrees), atol=1.e-5))
+
+                # positions of the same virtual camera are read from the G-buffer of its render
+                async def positions():
+                    params = {'pose': self.pose(3).ravel().tolist(), 'fov': float(self._fovDegrees), 'ids': [], 'flip': True}
+                    return await asyncio.gather(server.submit('render', dict(params, roi=None)), server.submit('xyz', params),
+                                                server.submit('pixels_to_world', dict(params, points=points)))
+                before = dict(server.stats)
+                img, xyz, world = asyncio.run_coroutine_threadsafe(positions(), server._loop).result()
+                self.assertEqual(server.stats['reused'] - before['reused'], 2)
+                self.assertTrue(np.allclose(img, aos.render(vpose, self._fovDegrees), atol=1.e-5))
+                self.assertTrue(np.allclose(xyz, aos.getXYZ()))
+                self.assertTrue(np.allclose(world, aos.pixelsToWorld(points)))
+
+                # several clients
+                def work(x):
+                    with RenderClient(address) as client:
+                        return client.render(self.pose(x), self._fovDegrees)
+                with ThreadPoolExecutor(4) as pool:
+                    imgs = list(pool.map(work, [0, 1, 0, 1]))
+                for x, img in zip([0, 1, 0, 1], imgs):
+                    self.assertTrue(np.allclose(img, aos.render(self.pose(x), self._fovDegrees), atol=1.e-5))
+                del aos, ctx
+            finally:
+                server.stop()
+            self.assertFalse(isinstance(address, str) and os.path.exists(address))
+
+
+class TestBenchmark(unittest.TestCase):
+    """ Run the benchmark suite with tiny sizes and compare runs
+
+    """
+
+    def test_run_and_compare(self):
+        import json, tempfile
+        from pyaos import pyaos_bench
+        with tempfile.TemporaryDirectory() as tmpdir:
+            out = os.path.join(tmpdir, 'base.json')
+            args = ['run', '--quick', '--repeat', '2', '--views', '3', '--resolution', '64', '--channels', '1', '4', '--dem', '4', '--view-size', '16', '--quiet', '--out', out]
+            self.assertEqual(pyaos_bench.main(args), 0)
+            with open(out) as f:
+                base = json.load(f)
+            names = base['benchmarks'].keys()
+            for op in ['addView', 'render', 'getXYZ', 'clearViews']:
+                self.assertIn(f'views=3,res=64,c=1,dem=4/{op}', names)
+            self.assertIn('conifer,res=64/read_poses_and_images', names)
+            self.assertGreater(base['benchmarks']['views=3,res=64,c=4,dem=4/render']['latency_ms']['p50'], 0)
+
+            # a slower render is flagged
+            self.assertFalse(any(r[4] for r in pyaos_bench.compare(base, base)))
+            slow = json.loads(json.dumps(base))
+            slow['benchmarks']['views=3,res=64,c=4,dem=4/render']['latency_ms']['p50'] *= 2
+            rows = pyaos_bench.compare(base, slow, threshold=0.5)
+            self.assertEqual([r[0] for r in rows if r[4]], ['views=3,res=64,c=4,dem=4/render'])
+            with open(os.path.join(tmpdir, 'new.json'), 'w') as f:
+                json.dump(slow, f)
+            self.assertEqual(pyaos_bench.main(['compare', out, os.path.join(tmpdir, 'new.json')]), 1)
+
+
 class TestAOSInit(unittest.TestCase):
     """ Test different scenarios for initialization
 
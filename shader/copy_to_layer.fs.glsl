@@ -0,0 +1,27 @@
+R"(
+#version 310 es
+#extension GL_EXT_shader_io_blocks : enable
+precision highp float;
+precision highp int;
+precision mediump image2DArray;
+
+
+out vec4 FragColor;
+
+in vec2 TexCoords;
+
+uniform sampler2D imageTexture;
+uniform float viewScale; // scale of the color values (e.g. 255 for 8-bit textures)
+uniform vec3 viewOffset; // offset added to the scaled color values (exposure adjustment), zero for the channels the view does not have
+uniform sampler2D maskTexture; // shared mask of the view's mask group, multiplied with alpha
+uniform bool useMask;
+
+void main()
+{
+	// copy texel by texel (no interpolation)
+	vec4 rgba = texelFetch(imageTexture, ivec2(gl_FragCoord.xy), 0);
+	if (useMask) // sampled at the texel center, like the view is sampled when it is projected
+		rgba.a *= texture(maskTexture, gl_FragCoord.xy / vec2(textureSize(imageTexture, 0))).r;
+	FragColor = vec4( rgba.rgb * viewScale + viewOffset, rgba.a );
+}
+)"
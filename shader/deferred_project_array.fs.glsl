@@ -0,0 +1,65 @@
+R"(
+#version 310 es
+#extension GL_EXT_shader_io_blocks : enable
+precision highp float;
+precision highp int;
+precision mediump image2DArray;
+precision highp sampler2DArray;
+
+#define MAX_VIEWS 128 // has to match AOS_MAX_VIEWS_PER_PASS
+
+
+layout (location = 0) out vec4 FragColor;
+layout (location = 1) out vec4 FragMoments; // squared colors and count of the views (see deferred_project_image.fs.glsl)
+
+in vec2 TexCoords;
+
+uniform sampler2D gPosition;
+uniform sampler2DArray imageTextures; // all views as layers
+uniform int numViews;
+
+layout (std140) uniform ViewBlock {
+	mat4 projViewMatrices[MAX_VIEWS];
+	vec4 viewLayers[MAX_VIEWS]; // layer of the view in imageTextures (x)
+};
+
+
+// returns the color and alpha (not premultiplied) of the view at the fragment
+vec4 ProjectImage(vec4 fragPosLightSpace, float layer)
+{
+    // perform perspective divide
+    vec3 projCoords = fragPosLightSpace.xyz / fragPosLightSpace.w;
+    // transform to [0,1] range
+    projCoords = projCoords * 0.5 + 0.5;
+	if (projCoords.x>=0.0f && projCoords.x <= 1.0f && projCoords.y >= 0.0f && projCoords.y <= 1.0f)
+	{
+		// the images need to be flipped!
+		return texture(imageTextures, vec3(1.0f-projCoords.x,1.0f-projCoords.y,layer)); // colors are already scaled in the array
+	}
+	else
+	{
+		return vec4(0.0f);
+	}
+       
+}
+
+void main()
+{           
+	// retrieve data from gbuffer
+    vec4 FragPos = texture(gPosition, TexCoords).rgba;
+	if( FragPos.a < 1.0 ) discard; // outside of DEM!
+
+	// accumulate all views in a single pass
+	vec4 sum = vec4(0.0f), moments = vec4(0.0f);
+	for (int i = 0; i < numViews; i++)
+	{
+		vec4 FragPosLightSpace = projViewMatrices[i] * vec4(FragPos.xyz, 1.0);
+		vec4 color = ProjectImage(FragPosLightSpace, viewLayers[i].x);
+		sum += vec4(color.rgb, 1.0f) * color.a; // premultiplied
+		moments += vec4(color.rgb * color.rgb * color.a, color.a > 0.0f ? 1.0f : 0.0f);
+	}
+    
+    FragColor = sum;
+    FragMoments = moments;
+}
+)"
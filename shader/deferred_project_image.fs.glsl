@@ -6,17 +6,25 @@ precision highp int;
 precision mediump image2DArray;
 
 
-out vec4 FragColor;
+layout (location = 0) out vec4 FragColor;
+layout (location = 1) out vec4 FragMoments; // squared colors and count of the view (only written if a second render target is attached, see AOS::renderStats)
 
 in vec2 TexCoords;
 
 uniform sampler2D gPosition;
 uniform sampler2D imageTexture;
+uniform float viewScale; // scale of the color values (e.g. 255 for 8-bit textures)
+uniform vec3 viewOffset; // offset added to the scaled color values (exposure adjustment), zero for the channels the view does not have
+uniform sampler2D maskTexture; // shared mask of the view's mask group, multiplied with alpha
+uniform bool useMask;
+uniform sampler2D undistortMap; // offsets from undistorted to raw texture coordinates of the view's camera group
+uniform bool useUndistortion;
 //uniform sampler2D shadowMap;
 
 uniform mat4 projViewMatrix;
 
 
+// returns the color and alpha (not premultiplied) of the view at the fragment
 vec4 ProjectImage(vec4 fragPosLightSpace)
 {
     // perform perspective divide
@@ -27,9 +35,17 @@ vec4 ProjectImage(vec4 fragPosLightSpace)
 	if (projCoords.x>=0.0f && projCoords.x <= 1.0f && projCoords.y >= 0.0f && projCoords.y <= 1.0f)
 	{
 		// the images need to be flipped!
-		vec4 rgba = vec4(texture(imageTexture, vec2(1.0f-projCoords.x,1.0f-projCoords.y)).rgba);
+		vec2 uv = vec2(1.0f-projCoords.x,1.0f-projCoords.y);
+		vec4 rgba;
+		if (useUndistortion) { // the view is a raw frame
+			uv += texture(undistortMap, uv).rg;
+			rgba = all(greaterThanEqual(uv, vec2(0.0f))) && all(lessThanEqual(uv, vec2(1.0f))) ? texture(imageTexture, uv) : vec4(0.0f);
+		}
+		else
+			rgba = texture(imageTexture, uv);
 		float alpha = rgba.a;
-		return vec4( rgba.rgb, 1.0f ) * alpha; // premultiplied
+		if (useMask) alpha *= texture(maskTexture, uv).r;
+		return vec4( rgba.rgb * viewScale + viewOffset, alpha );
 	}
 	else
 	{
@@ -46,6 +62,8 @@ void main()
 
     vec4 FragPosLightSpace = projViewMatrix * vec4(FragPos.xyz, 1.0);
     
-    FragColor = vec4(ProjectImage(FragPosLightSpace));
+    vec4 color = ProjectImage(FragPosLightSpace);
+    FragColor = vec4(color.rgb, 1.0f) * color.a; // premultiplied
+    FragMoments = vec4(color.rgb * color.rgb * color.a, color.a > 0.0f ? 1.0f : 0.0f);
 }
 )"
\ No newline at end of file
@@ -0,0 +1,89 @@
+R"(
+#version 310 es
+precision highp float;
+precision highp int;
+
+#define GROUP_SIZE 16u
+layout (local_size_x = 16, local_size_y = 16) in;
+
+// focus measure of the pixels of one work group (only pixels with alpha > 0, luminance of rgb divided by alpha)
+struct Partial {
+    vec4 moments; // sum and sum of squares of the luminance, count of pixels
+    vec4 gradient; // sum of the squared gradients and count of gradients
+};
+
+layout (std430, binding = 0) writeonly buffer PartialBlock {
+    Partial partials[];
+};
+
+uniform highp sampler2D integral;
+uniform ivec4 roi; // x, y, width, height
+uniform bool flipX; // the work groups start at the right border of the roi
+
+shared float sSum[GROUP_SIZE * GROUP_SIZE];
+shared float sSqr[GROUP_SIZE * GROUP_SIZE];
+shared float sCount[GROUP_SIZE * GROUP_SIZE];
+shared float sGrad[GROUP_SIZE * GROUP_SIZE];
+shared float sGradCount[GROUP_SIZE * GROUP_SIZE];
+
+// luminance at pos, false if the pixel is outside the roi or not covered by any view
+bool luminance(ivec2 pos, out float lum)
+{
+    lum = 0.0f;
+    if (any(lessThan(pos, roi.xy)) || any(greaterThanEqual(pos, roi.xy + roi.zw)))
+        return false;
+    vec4 px = texelFetch(integral, pos, 0);
+    if (px.a <= 0.0f)
+        return false;
+    lum = dot(px.rgb / px.a, vec3(1.0f / 3.0f));
+    return true;
+}
+
+void main()
+{
+    uint i = gl_LocalInvocationIndex;
+    ivec2 id = ivec2(gl_GlobalInvocationID.xy);
+    ivec2 pos = ivec2(flipX ? roi.x + roi.z - 1 - id.x : roi.x + id.x, roi.y + id.y);
+
+    sSum[i] = 0.0f;
+    sSqr[i] = 0.0f;
+    sCount[i] = 0.0f;
+    sGrad[i] = 0.0f;
+    sGradCount[i] = 0.0f;
+    float lum, lumX, lumY;
+    if (id.x < roi.z && luminance(pos, lum))
+    {
+        sSum[i] = lum;
+        sSqr[i] = lum * lum;
+        sCount[i] = 1.0f;
+        if (luminance(pos + ivec2(1, 0), lumX) && luminance(pos + ivec2(0, 1), lumY))
+        {
+            sGrad[i] = (lumX - lum) * (lumX - lum) + (lumY - lum) * (lumY - lum);
+            sGradCount[i] = 1.0f;
+        }
+    }
+    memoryBarrierShared();
+    barrier();
+
+    // tree reduction in shared memory
+    for (uint s = GROUP_SIZE * GROUP_SIZE / 2u; s > 0u; s >>= 1)
+    {
+        if (i < s)
+        {
+            sSum[i] += sSum[i + s];
+            sSqr[i] += sSqr[i + s];
+            sCount[i] += sCount[i + s];
+            sGrad[i] += sGrad[i + s];
+            sGradCount[i] += sGradCount[i + s];
+        }
+        memoryBarrierShared();
+        barrier();
+    }
+
+    if (i == 0u)
+    {
+        uint group = gl_WorkGroupID.y * gl_NumWorkGroups.x + gl_WorkGroupID.x;
+        partials[group] = Partial(vec4(sSum[0], sSqr[0], sCount[0], 0.0f), vec4(sGrad[0], sGradCount[0], 0.0f, 0.0f));
+    }
+}
+)"
@@ -0,0 +1,40 @@
+R"(
+#version 310 es
+#extension GL_EXT_shader_io_blocks : enable
+precision highp float;
+precision highp int;
+precision mediump image2DArray;
+
+
+out vec4 gPosition;
+
+
+in vec2 TexCoords;
+
+uniform mat4 invProjection; // inverse of the virtual camera's projection
+uniform mat4 modelViewInv; // inverse of view * model
+uniform mat4 model;
+uniform vec4 planeBounds; // min x, min y, max x, max y of the plane (model coordinates)
+uniform float planeZ; // height of the plane (model coordinates)
+
+void main()
+{    
+    // ray through the pixel from the near to the far plane in model coordinates
+    vec2 ndc = TexCoords * 2.0f - 1.0f;
+    vec4 nearPos = modelViewInv * invProjection * vec4(ndc, -1.0f, 1.0f);
+    vec4 farPos = modelViewInv * invProjection * vec4(ndc, 1.0f, 1.0f);
+    vec3 from = nearPos.xyz / nearPos.w;
+    vec3 to = farPos.xyz / farPos.w;
+
+    float dz = to.z - from.z;
+    if (abs(dz) < 1e-12f)
+        discard;
+    float t = (planeZ - from.z) / dz;
+    vec3 pos = mix(from, to, t);
+    if (t < 0.0f || t > 1.0f || any(lessThan(pos.xy, planeBounds.xy)) || any(greaterThan(pos.xy, planeBounds.zw)))
+        discard; // clipped like the mesh
+
+    // store the fragment position vector in the first gbuffer texture
+    gPosition = vec4((model * vec4(pos.xy, planeZ, 1.0f)).xyz, 1.0f);
+}
+)"
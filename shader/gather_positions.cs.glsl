@@ -0,0 +1,32 @@
+R"(
+#version 310 es
+precision highp float;
+precision highp int;
+
+layout (local_size_x = 64) in;
+
+// pixels (x, y in framebuffer pixels) whose positions are gathered from the g-buffer
+layout (std430, binding = 0) readonly buffer PixelBlock {
+    vec2 pixels[];
+};
+
+layout (std430, binding = 1) writeonly buffer PositionBlock {
+    vec4 positions[];
+};
+
+uniform highp sampler2D gPosition;
+uniform int count;
+
+void main()
+{
+    int i = int(gl_GlobalInvocationID.x);
+    if (i >= count)
+        return;
+
+    ivec2 pos = ivec2(floor(pixels[i]));
+    if (all(greaterThanEqual(pos, ivec2(0))) && all(lessThan(pos, textureSize(gPosition, 0))))
+        positions[i] = texelFetch(gPosition, pos, 0);
+    else
+        positions[i] = vec4(0.0f);
+}
+)"
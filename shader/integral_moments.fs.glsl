@@ -0,0 +1,32 @@
+R"(
+#version 310 es
+precision highp float;
+precision highp int;
+
+// mean and variance of the views from the integral (sum of the premultiplied colors and the weights) and the moments (sum of the weighted squared colors and the count)
+layout (location = 0) out vec4 MeanCount;
+layout (location = 1) out vec4 VarianceWeight;
+
+in vec2 TexCoords;
+
+uniform highp sampler2D integral;
+uniform highp sampler2D moments;
+
+void main()
+{
+    ivec2 pos = ivec2(gl_FragCoord.xy);
+    vec4 sum = texelFetch(integral, pos, 0);
+    vec4 sqr = texelFetch(moments, pos, 0);
+    if (sum.a > 0.0f)
+    {
+        vec3 mean = sum.rgb / sum.a;
+        MeanCount = vec4(mean, sqr.a);
+        VarianceWeight = vec4(max(sqr.rgb / sum.a - mean * mean, vec3(0.0f)), sum.a);
+    }
+    else
+    {
+        MeanCount = vec4(0.0f, 0.0f, 0.0f, sqr.a);
+        VarianceWeight = vec4(0.0f);
+    }
+}
+)"
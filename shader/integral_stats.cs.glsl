@@ -0,0 +1,72 @@
+R"(
+#version 310 es
+precision highp float;
+precision highp int;
+
+#define GROUP_SIZE 16u
+layout (local_size_x = 16, local_size_y = 16) in;
+
+// statistics of the pixels of one work group (only pixels with alpha > 0, rgb divided by alpha)
+struct Partial {
+    vec4 minRGBA;
+    vec4 maxRGBA;
+    vec4 sumRGBA;
+    vec4 count; // count in x
+};
+
+layout (std430, binding = 0) writeonly buffer PartialBlock {
+    Partial partials[];
+};
+
+uniform highp sampler2D integral;
+
+shared vec4 sMin[GROUP_SIZE * GROUP_SIZE];
+shared vec4 sMax[GROUP_SIZE * GROUP_SIZE];
+shared vec4 sSum[GROUP_SIZE * GROUP_SIZE];
+shared float sCount[GROUP_SIZE * GROUP_SIZE];
+
+void main()
+{
+    uint i = gl_LocalInvocationIndex;
+    ivec2 pos = ivec2(gl_GlobalInvocationID.xy);
+
+    sMin[i] = vec4(3.402823466e+38);
+    sMax[i] = vec4(-3.402823466e+38);
+    sSum[i] = vec4(0.0f);
+    sCount[i] = 0.0f;
+    if (all(lessThan(pos, textureSize(integral, 0))))
+    {
+        vec4 px = texelFetch(integral, pos, 0);
+        if (px.a > 0.0f)
+        {
+            px.rgb /= px.a;
+            sMin[i] = px;
+            sMax[i] = px;
+            sSum[i] = px;
+            sCount[i] = 1.0f;
+        }
+    }
+    memoryBarrierShared();
+    barrier();
+
+    // tree reduction in shared memory
+    for (uint s = GROUP_SIZE * GROUP_SIZE / 2u; s > 0u; s >>= 1)
+    {
+        if (i < s)
+        {
+            sMin[i] = min(sMin[i], sMin[i + s]);
+            sMax[i] = max(sMax[i], sMax[i + s]);
+            sSum[i] += sSum[i + s];
+            sCount[i] += sCount[i + s];
+        }
+        memoryBarrierShared();
+        barrier();
+    }
+
+    if (i == 0u)
+    {
+        uint group = gl_WorkGroupID.y * gl_NumWorkGroups.x + gl_WorkGroupID.x;
+        partials[group] = Partial(sMin[0], sMax[0], sSum[0], vec4(sCount[0], 0.0f, 0.0f, 0.0f));
+    }
+}
+)"
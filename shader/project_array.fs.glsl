@@ -0,0 +1,62 @@
+R"(
+#version 310 es
+#extension GL_EXT_shader_io_blocks : enable
+precision highp float;
+precision highp int;
+precision mediump image2DArray;
+precision highp sampler2DArray;
+
+#define MAX_VIEWS 128 // has to match AOS_MAX_VIEWS_PER_PASS
+
+
+out vec4 FragColor;
+
+in VS_OUT {
+    vec3 FragPos;
+    vec3 Normal;
+    vec2 TexCoords;
+    vec4 FragPosLightSpace;
+} fs_in;
+
+uniform sampler2DArray imageTextures; // all views as layers
+uniform int numViews;
+
+layout (std140) uniform ViewBlock {
+	mat4 projViewMatrices[MAX_VIEWS];
+	vec4 viewLayers[MAX_VIEWS]; // layer of the view in imageTextures (x)
+};
+
+
+vec4 ProjectImage(vec4 fragPosLightSpace, float layer)
+{
+    // perform perspective divide
+    vec3 projCoords = fragPosLightSpace.xyz / fragPosLightSpace.w;
+    // transform to [0,1] range
+    projCoords = projCoords * 0.5 + 0.5;
+    if (projCoords.x>=0.0f && projCoords.x <= 1.0f && projCoords.y >= 0.0f && projCoords.y <= 1.0f)
+    {
+        // for some reason the images need to be flipped!
+        vec4 rgba = vec4(texture(imageTextures, vec3(1.0f-projCoords.x,1.0f-projCoords.y,layer)).rgba);
+		float alpha = rgba.a;
+		return vec4( rgba.rgb, 1.0f ) * alpha; // premultiplied (colors are already scaled in the array)
+    }
+    else
+    {
+        return vec4(0.0f);
+    }
+       
+}
+
+void main()
+{           
+	// accumulate all views in a single pass
+	vec4 color = vec4(0.0f);
+	for (int i = 0; i < numViews; i++)
+	{
+		vec4 FragPosLightSpace = projViewMatrices[i] * vec4(fs_in.FragPos, 1.0);
+		color += ProjectImage(FragPosLightSpace, viewLayers[i].x);
+	}
+
+    FragColor = color;
+}
+)"
@@ -16,6 +16,12 @@ in VS_OUT {
 } fs_in;
 
 uniform sampler2D imageTexture;
+uniform float viewScale; // scale of the color values (e.g. 255 for 8-bit textures)
+uniform vec3 viewOffset; // offset added to the scaled color values (exposure adjustment), zero for the channels the view does not have
+uniform sampler2D maskTexture; // shared mask of the view's mask group, multiplied with alpha
+uniform bool useMask;
+uniform sampler2D undistortMap; // offsets from undistorted to raw texture coordinates of the view's camera group
+uniform bool useUndistortion;
 //uniform sampler2D shadowMap;
 
 
@@ -29,9 +35,17 @@ vec4 ProjectImage(vec4 fragPosLightSpace)
     if (projCoords.x>=0.0f && projCoords.x <= 1.0f && projCoords.y >= 0.0f && projCoords.y <= 1.0f)
     {
         // for some reason the images need to be flipped!
-        vec4 rgba = vec4(texture(imageTexture, vec2(1.0f-projCoords.x,1.0f-projCoords.y)).rgba);
+        vec2 uv = vec2(1.0f-projCoords.x,1.0f-projCoords.y);
+        vec4 rgba;
+        if (useUndistortion) { // the view is a raw frame
+            uv += texture(undistortMap, uv).rg;
+            rgba = all(greaterThanEqual(uv, vec2(0.0f))) && all(lessThanEqual(uv, vec2(1.0f))) ? texture(imageTexture, uv) : vec4(0.0f);
+        }
+        else
+            rgba = texture(imageTexture, uv);
 		float alpha = rgba.a;
-		return vec4( rgba.rgb, 1.0f ) * alpha; // premultiplied
+		if (useMask) alpha *= texture(maskTexture, uv).r;
+		return vec4( rgba.rgb * viewScale + viewOffset, 1.0f ) * alpha; // premultiplied
     }
     else
     {
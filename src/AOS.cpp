@@ -2,13 +2,26 @@
 #include "gl_utils.h"
 #include "AOS.h"
 #include "image.h"
+#include "utils.h"
 #include "learnopengl/model.h"
 #define GLM_ENABLE_EXPERIMENTAL
 #include <glm/gtx/string_cast.hpp>
 #include <glm/gtx/euler_angles.hpp>
-
-
-void renderQuad();
+#include <glm/gtx/component_wise.hpp>
+#include <glm/gtc/type_ptr.hpp>
+#include <stdexcept>
+#include <algorithm>
+#include <cstring>
+#include <cmath>
+#include <fstream>
+#include <memory>
+
+// timer queries: extension in OpenGL ES (EXT_disjoint_timer_query), core in desktop OpenGL
+#if defined(GL_TIME_ELAPSED_EXT)
+#define AOS_TIME_ELAPSED GL_TIME_ELAPSED_EXT
+#elif defined(GL_TIME_ELAPSED)
+#define AOS_TIME_ELAPSED GL_TIME_ELAPSED
+#endif
 
 
 AOS::AOS(unsigned int width, unsigned int height, float fovDegree, int preallocate_images)
@@ -49,11 +62,45 @@ AOS::AOS(unsigned int width, unsigned int height, float fovDegree, int prealloca
 		, 
 		#include "../shader/g_buffer.fs.glsl"
 	);
+	statsShader = new Shader(
+		#include "../shader/integral_stats.cs.glsl"
+	);
+	gatherShader = new Shader(
+		#include "../shader/gather_positions.cs.glsl"
+	);
+	focusShader = new Shader(
+		#include "../shader/focus_measure.cs.glsl"
+	);
+	momentsShader = new Shader(
+		#include "../shader/deferred_project_image.vs.glsl"
+		,
+		#include "../shader/integral_moments.fs.glsl"
+	);
+	gBufferPlaneShader = new Shader(
+		#include "../shader/deferred_project_image.vs.glsl"
+		, 
+		#include "../shader/g_buffer_plane.fs.glsl"
+	);
 	forwardShader = new Shader(
 		#include "../shader/project_image.vs.glsl"
 		,
 		#include "../shader/project_image.fs.glsl"
 	);
+	projectArrayShader = new Shader(
+		#include "../shader/deferred_project_image.vs.glsl"
+		,
+		#include "../shader/deferred_project_array.fs.glsl"
+	);
+	forwardArrayShader = new Shader(
+		#include "../shader/project_image.vs.glsl"
+		,
+		#include "../shader/project_array.fs.glsl"
+	);
+	copyLayerShader = new Shader(
+		#include "../shader/deferred_project_image.vs.glsl"
+		,
+		#include "../shader/copy_to_layer.fs.glsl"
+	);
 	// Shaders are now included as strings and thus compiled into the application. So it is not important to have a relative shader folder after compilation!
 	// The idea is from https://stackoverflow.com/questions/20443560/how-to-practically-ship-glsl-shaders-with-your-c-software
 	CHECK_GL_ERROR
@@ -66,10 +113,24 @@ AOS::AOS(unsigned int width, unsigned int height, float fovDegree, int prealloca
 	projectShader->use();
 	projectShader->setInt("gPosition", 0);
 	projectShader->setInt("imageTexture", 1);
+	projectShader->setInt("maskTexture", 2);
+	projectShader->setInt("undistortMap", 3);
 	showFboShader->use();
 	showFboShader->setInt("fboTexture", 0);
 	forwardShader->use();
 	forwardShader->setInt("imageTexture", 0);
+	forwardShader->setInt("maskTexture", 1);
+	forwardShader->setInt("undistortMap", 2);
+	projectArrayShader->use();
+	projectArrayShader->setInt("gPosition", 0);
+	projectArrayShader->setInt("imageTextures", 1);
+	glUniformBlockBinding(projectArrayShader->ID, glGetUniformBlockIndex(projectArrayShader->ID, "ViewBlock"), 0);
+	forwardArrayShader->use();
+	forwardArrayShader->setInt("imageTextures", 0);
+	glUniformBlockBinding(forwardArrayShader->ID, glGetUniformBlockIndex(forwardArrayShader->ID, "ViewBlock"), 0);
+	copyLayerShader->use();
+	copyLayerShader->setInt("imageTexture", 0);
+	copyLayerShader->setInt("maskTexture", 1);
 
 	// configure global opengl state
 	// -----------------------------
@@ -97,50 +158,242 @@ AOS::AOS(unsigned int width, unsigned int height, float fovDegree, int prealloca
 #endif
 }
 
-Image AOS::render(const glm::mat4 virtual_pose, const float virtualFovDegrees, const std::vector<unsigned int> ids)
+Image AOS::render(const glm::mat4 virtual_pose, const float virtualFovDegrees, const std::vector<unsigned int> ids, const glm::ivec4 roi)
 {
-	glViewport(0, 0, render_width, render_height);
-	gBufferShader->use();
-	auto projection = glm::perspective(glm::radians(virtualFovDegrees), (float)render_width / (float)render_height, near_plane, far_plane);
-	// set uniforms that do no change
-	gBufferShader->setMat4("projection", projection);
-	gBufferShader->setMat4("view", virtual_pose);
+	ProfileScope profile(this, "render");
+	const glm::ivec4 rect = clampROI(roi);
+	std::string key;
+	if (integral_cache_budget > 0)
+	{
+		key = integralCacheKey(virtual_pose, virtualFovDegrees, ids, rect);
+		auto hit = integral_cache_index.find(key);
+		if (hit != integral_cache_index.end())
+		{
+			beginStage("cache");
+			integral_cache.splice(integral_cache.begin(), integral_cache, hit->second); // most recently used
+			std::copy(hit->second->pixels.begin(), hit->second->pixels.end(), (glm::vec4*)fboImg.data);
+			endStage();
+			integral_cache_stats.hits++;
+			Image img = fboImg;
+			img.w = rect.z;
+			img.h = rect.w;
+			return img;
+		}
+		integral_cache_stats.misses++;
+	}
 
-	// 1. geometry pass: render scene's geometry/color data into gbuffer
-	// -----------------------------------------------------------------
-	glBindFramebuffer(GL_FRAMEBUFFER, fboGBuffer);
-	glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT);
+	if (incremental && ids.empty())
+		renderIncremental(virtual_pose, virtualFovDegrees); // only the readback is restricted to the roi, the incremental integral covers the whole image
+	else
+		renderIntegral(virtual_pose, virtualFovDegrees, selectViews(virtual_pose, virtualFovDegrees, ids, dem_transf, dem_transf), dem_transf, false, rect);
+
+	// read framebuffer (or the roi) to CPU
+	beginStage("readback");
+	glReadBuffer(GL_COLOR_ATTACHMENT0);
+	glReadPixels(rect.x, rect.y, rect.z, rect.w, GL_RGBA, GL_FLOAT, fboImg.data);
+	// to access a single pixel use indexing like (j)width+i, where j is the row
+	// minimum and maximum are computed on the GPU when needed (see getStats)
+	endStage();
+	timings.bytes_read_back += (size_t)rect.z * rect.w * sizeof(glm::vec4);
+	if (integral_cache_budget > 0)
+		cacheIntegral(key, fboImg.data, (size_t)rect.z * rect.w);
+
+	glBindFramebuffer(GL_FRAMEBUFFER, 0); // disable framebuffer
+
+#ifdef DEBUG_OUTPUT
+	// DEBUG
+	std::cout << "---------------------------------------" << std::endl;
+	std::cout << ">> AOS::render << " << std::endl;
+	std::cout << "fov(in degrees): " << virtualFovDegrees << ", virtual view: " << glm::to_string(virtual_pose) << ",  # single images: " << (ids.empty() ? ogl_imgs.size() : ids.size()) << std::endl;
+	std::cout << "---------------------------------------" << std::endl;
+
+#endif
 
-	//glm::mat4 model = glm::mat4(1.0f);
-	gBufferShader->setMat4("model", dem_transf);
-	dem_model->Draw(*gBufferShader);
+
+	Image img = fboImg;
+	img.w = rect.z;
+	img.h = rect.w;
+	return img;
+}
+
+// key of an image in the integral cache: everything that render depends on besides the views (which are covered by scene_version)
+std::string AOS::integralCacheKey(const glm::mat4& virtual_pose, const float virtualFovDegrees, const std::vector<unsigned int>& ids, const glm::ivec4& roi) const
+{
+	std::string key;
+	auto append = [&key](const void* data, size_t size) { key.append((const char*)data, size); };
+	append(&scene_version, sizeof(scene_version));
+	append(&virtual_pose, sizeof(virtual_pose));
+	append(&dem_transf, sizeof(dem_transf));
+	const float params[] = { virtualFovDegrees, near_plane, far_plane, dem_lod_error };
+	append(params, sizeof(params));
+	append(&roi, sizeof(roi));
+	append(ids.data(), ids.size() * sizeof(unsigned int));
+	return key;
+}
+
+// stores an image in the integral cache, images larger than the budget are not cached
+void AOS::cacheIntegral(const std::string& key, const float* data, size_t pixels)
+{
+	const size_t bytes = pixels * sizeof(glm::vec4);
+	if (bytes > integral_cache_budget)
+		return;
+	evictIntegrals(integral_cache_budget - bytes);
+	integral_cache.push_front({ key, std::vector<glm::vec4>((const glm::vec4*)data, (const glm::vec4*)data + pixels) });
+	integral_cache_index[key] = integral_cache.begin();
+	integral_cache_bytes += bytes;
+}
+
+// evicts the least recently used images until the cache has at most bytes
+void AOS::evictIntegrals(size_t bytes)
+{
+	while (integral_cache_bytes > bytes && !integral_cache.empty())
+	{
+		integral_cache_bytes -= integral_cache.back().pixels.size() * sizeof(glm::vec4);
+		integral_cache_index.erase(integral_cache.back().key);
+		integral_cache.pop_back();
+		integral_cache_stats.evictions++;
+	}
+}
+
+void AOS::setIntegralCache(size_t bytes)
+{
+	integral_cache_budget = bytes;
+	evictIntegrals(bytes);
+}
+
+void AOS::clearIntegralCache()
+{
+	integral_cache.clear();
+	integral_cache_index.clear();
+	integral_cache_bytes = 0;
+}
+
+IntegralCacheStats AOS::getIntegralCacheStats() const
+{
+	IntegralCacheStats stats = integral_cache_stats;
+	stats.budget = integral_cache_budget;
+	stats.bytes = integral_cache_bytes;
+	stats.entries = (unsigned int)integral_cache.size();
+	return stats;
+}
+
+// intersects roi (x, y, width, height) with the framebuffer, an empty roi is the whole framebuffer
+glm::ivec4 AOS::clampROI(const glm::ivec4 roi) const
+{
+	if (roi.z <= 0 || roi.w <= 0)
+		return glm::ivec4(0, 0, render_width, render_height);
+	const glm::ivec2 size(render_width, render_height);
+	const glm::ivec2 lo = glm::clamp(glm::ivec2(roi.x, roi.y), glm::ivec2(0), size);
+	const glm::ivec2 hi = glm::clamp(glm::ivec2(roi.x + roi.z, roi.y + roi.w), lo, size);
+	return glm::ivec4(lo, hi - lo);
+}
+
+// restricts the following draw calls (and clears) to roi, or disables the restriction if roi is empty or covers the whole framebuffer
+void AOS::setScissor(const glm::ivec4 roi)
+{
+	if (roi.z > 0 && roi.w > 0 && roi != glm::ivec4(0, 0, render_width, render_height)) {
+		glEnable(GL_SCISSOR_TEST);
+		glScissor(roi.x, roi.y, roi.z, roi.w);
+	}
+	else
+		glDisable(GL_SCISSOR_TEST);
+}
+
+// renders the integral of the views ids into fboIntegral (without reading it back). fboIntegral stays bound.
+void AOS::renderIntegral(const glm::mat4 virtual_pose, const float virtualFovDegrees, const std::vector<unsigned int>& ids, const glm::mat4 dem_model_transf, bool analytic_plane, const glm::ivec4 roi)
+{
+	beginStage("gbuffer");
+	renderGBuffer(fboGBuffer, virtual_pose, virtualFovDegrees, dem_model_transf, analytic_plane, roi);
+	endStage();
 
 	// 2. render scene deferred and project views
 	// -----------------------------------------------------------------
+	beginStage("project");
 	glBindFramebuffer(GL_FRAMEBUFFER, fboIntegral); // enable results framebuffer
+	const GLenum buffers[] = { GL_COLOR_ATTACHMENT0, GL_COLOR_ATTACHMENT1 };
+	if (render_moments)
+		glDrawBuffers(2, buffers); // the integral and the moments (see renderStats)
+	setScissor(glm::ivec4(0)); // clear the whole integral, so getStats only sees the roi
 	glClear(GL_DEPTH_BUFFER_BIT | GL_COLOR_BUFFER_BIT);
+	fbo_stats_dirty = true;
+
+	setScissor(roi);
+	projectViews(gPosition, ids, single_pass);
+	setScissor(glm::ivec4(0));
+	if (render_moments)
+		glDrawBuffers(1, buffers);
+	endStage();
+}
+
+// geometry pass: renders the positions on the DEM seen by the virtual camera into the g-buffer fbo
+void AOS::renderGBuffer(unsigned int fbo, const glm::mat4 virtual_pose, const float virtualFovDegrees, const glm::mat4 dem_model_transf, bool analytic_plane, const glm::ivec4 roi)
+{
+	glViewport(0, 0, render_width, render_height);
+	auto projection = glm::perspective(glm::radians(virtualFovDegrees), (float)render_width / (float)render_height, near_plane, far_plane);
+
+	glBindFramebuffer(GL_FRAMEBUFFER, fbo);
+	glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT);
+	setScissor(roi); // the projection is the same as without roi, only the fragments outside of it are discarded
+
+	if (analytic_plane && dem_is_plane)
+	{
+		// intersect the rays of the virtual camera with the plane instead of drawing the mesh
+		gBufferPlaneShader->use();
+		gBufferPlaneShader->setMat4("invProjection", glm::inverse(projection));
+		gBufferPlaneShader->setMat4("modelViewInv", glm::inverse(virtual_pose * dem_model_transf));
+		gBufferPlaneShader->setMat4("model", dem_model_transf);
+		gBufferPlaneShader->setVec4("planeBounds", dem_plane_bounds);
+		gBufferPlaneShader->setFloat("planeZ", dem_plane_z);
+		renderQuad();
+	}
+	else 
+	{
+		gBufferShader->use();
+		// set uniforms that do no change
+		gBufferShader->setMat4("projection", projection);
+		gBufferShader->setMat4("view", virtual_pose);
+		gBufferShader->setMat4("model", dem_model_transf);
+		drawDEM(*gBufferShader, projection, virtual_pose, dem_model_transf);
+	}
+}
+
+// offset of the exposure adjustment of a view, only added to the color channels it has (e.g., only red for single-channel views)
+static glm::vec3 viewOffset(const View& v)
+{
+	return glm::vec3(v.adjust_offset, v.c > 1 ? v.adjust_offset : 0.0f, v.c > 2 ? v.adjust_offset : 0.0f);
+}
+
+// projects the views ids onto the positions in gbuffer and blends them into the bound framebuffer
+void AOS::projectViews(unsigned int gbuffer, const std::vector<unsigned int>& ids, bool allow_single_pass)
+{
+	std::vector<unsigned int> _ids(ids); // views that are projected
+	timings.views_projected += ids.size();
+
+	if (allow_single_pass && updateViewArrays()) 
+	{
+		projectArrayShader->use();
+		// bind g-Buffer textures
+		glActiveTexture(GL_TEXTURE0);
+		glBindTexture(GL_TEXTURE_2D, gbuffer);
+		projectViewsSinglePass(projectArrayShader, _ids, false);
+		_ids.clear(); // all views are projected
+	}
 
 	projectShader->use();
 	// bind g-Buffer textures
 	glActiveTexture(GL_TEXTURE0);
-	glBindTexture(GL_TEXTURE_2D, gPosition);
-
-	// if empty create an ids array running from 0 to size
-	std::vector<unsigned int> _ids;
-	if (ids.empty()) {
-		for (unsigned int i = 0; i < ogl_imgs.size(); i++)
-			_ids.push_back(i);
-	}
-	else // otherwise use specified ids!
-		_ids= std::vector<unsigned int>(ids);
+	glBindTexture(GL_TEXTURE_2D, gbuffer);
 
 	//unsigned int counter = 0;
 	for (unsigned int idx : _ids)
 	{
 		auto projViewMatrix = projection_imgs * ogl_imgs[idx].corr * ogl_imgs[idx].pose ;
 		projectShader->setMat4("projViewMatrix", projViewMatrix);
+		projectShader->setFloat("viewScale", ogl_imgs[idx].scale * ogl_imgs[idx].adjust_scale);
+		projectShader->setVec3("viewOffset", viewOffset(ogl_imgs[idx]));
+		bindViewTextures(projectShader, ogl_imgs[idx], 2, 3);
 		glActiveTexture(GL_TEXTURE1);
-		glBindTexture(GL_TEXTURE_2D, ogl_imgs[idx].ogl_id);
+		glBindTexture(GL_TEXTURE_2D, residentTexture(idx));
 		
 		renderQuad(); //render quad
 
@@ -148,35 +401,543 @@ Image AOS::render(const glm::mat4 virtual_pose, const float virtualFovDegrees, c
 	}
 
 	//std::cout << "RENDER: projected " << counter << " images " << std::endl;
+}
 
-	// read framebuffer to CPU
-	glReadBuffer(GL_COLOR_ATTACHMENT0);
-	glReadPixels(0, 0, render_width, render_height, GL_RGBA, GL_FLOAT, fboImg.data);
-	// to access a single pixel use indexing like (j)width+i, where j is the row
-	// calculate minimum and maximum of FBO. Note this is very slow!
-	// if it takes too long, do not do this every frame! e.g. only once every second or so
-	
-	getMinMaxFromFBO((glm::vec4 *)fboImg.data, render_width * render_height, fboCount, fboMin, fboMax);
-	//std::cout << "fbo_min: " << glm::to_string(fboMin).c_str() << std::endl;
-	//std::cout << "fbo_max: " << glm::to_string(fboMax).c_str() << std::endl;
+// renders the integral of all views into fboIntegral using the incremental integral.
+// The incremental integral is only rebuilt if the virtual camera or the DEM changed (or after AOS_INCREMENTAL_REBUILD updates), 
+// otherwise it already contains all views (see updateIncremental) and is just copied.
+void AOS::renderIncremental(const glm::mat4 virtual_pose, const float virtualFovDegrees)
+{
+	auto projection = glm::perspective(glm::radians(virtualFovDegrees), (float)render_width / (float)render_height, near_plane, far_plane);
+	if (!incremental_valid || inc_updates >= AOS_INCREMENTAL_REBUILD || virtual_pose != inc_pose || projection != inc_projection || dem_transf != inc_dem_transf)
+	{
+		if (fboIncremental == 0) {
+			initFrameBufferTexture(&fboIncremental, &tIncremental);
+			initFrameBufferTexture(&fboIncGBuffer, &gIncPosition);
+		}
+		beginStage("gbuffer");
+		renderGBuffer(fboIncGBuffer, virtual_pose, virtualFovDegrees, dem_transf);
+		endStage();
+		beginStage("project");
+		glBindFramebuffer(GL_FRAMEBUFFER, fboIncremental);
+		glClear(GL_COLOR_BUFFER_BIT);
+		projectViews(gIncPosition, selectViews(virtual_pose, virtualFovDegrees, {}, dem_transf, dem_transf), single_pass);
+		endStage();
+		inc_pose = virtual_pose;
+		inc_projection = projection;
+		inc_dem_transf = dem_transf;
+		inc_updates = 0;
+		incremental_valid = true;
+	}
 
-	glBindFramebuffer(GL_FRAMEBUFFER, 0); // disable framebuffer
+	// copy to the integral and g-buffer used by getStats, display and getXYZ
+	beginStage("copy");
+	for (auto fbos : { glm::uvec2(fboIncremental, fboIntegral), glm::uvec2(fboIncGBuffer, fboGBuffer) })
+	{
+		glBindFramebuffer(GL_READ_FRAMEBUFFER, fbos.x);
+		glBindFramebuffer(GL_DRAW_FRAMEBUFFER, fbos.y);
+		glBlitFramebuffer(0, 0, render_width, render_height, 0, 0, render_width, render_height, GL_COLOR_BUFFER_BIT, GL_NEAREST);
+	}
+	endStage();
+	glBindFramebuffer(GL_FRAMEBUFFER, fboIntegral);
+	fbo_stats_dirty = true;
+}
 
-#ifdef DEBUG_OUTPUT
-	// DEBUG
-	std::cout << "---------------------------------------" << std::endl;
-	std::cout << ">> AOS::render << " << std::endl;
-	std::cout << "fov(in degrees): " << virtualFovDegrees << ", virtual view: " << glm::to_string(virtual_pose) << ",  # single images: " << _ids.size() << std::endl;
-	std::cout << "---------------------------------------" << std::endl;
+// adds (or subtracts) the contribution of a view to the incremental integral
+// called before and after every change of a view, also if incremental rendering is disabled
+void AOS::updateIncremental(unsigned int idx, bool subtract)
+{
+	scene_version++;
+	if (!incremental || !incremental_valid)
+		return;
+	glViewport(0, 0, render_width, render_height);
+	glBindFramebuffer(GL_FRAMEBUFFER, fboIncremental);
+	if (subtract)
+		glBlendEquation(GL_FUNC_REVERSE_SUBTRACT); // integral - view
+	projectViews(gIncPosition, { idx }, false);
+	glBlendEquation(GL_FUNC_ADD);
+	glBindFramebuffer(GL_FRAMEBUFFER, 0);
+	inc_updates++;
+}
 
+// timer queries are an extension in OpenGL ES and core since desktop OpenGL 3.3 (ARB_timer_query)
+static bool timerQueriesSupported()
+{
+#ifdef AOS_TIME_ELAPSED
+	GLint n = 0;
+	glGetIntegerv(GL_NUM_EXTENSIONS, &n);
+	for (GLint i = 0; i < n; i++)
+	{
+		auto ext = (const char*)glGetStringi(GL_EXTENSIONS, i);
+		if (ext && (strcmp(ext, "GL_EXT_disjoint_timer_query") == 0 || strcmp(ext, "GL_ARB_timer_query") == 0))
+			return true;
+	}
 #endif
+	return false;
+}
 
+static double elapsedMs(std::chrono::steady_clock::time_point start)
+{
+	return std::chrono::duration<double, std::milli>(std::chrono::steady_clock::now() - start).count();
+}
 
-	return fboImg;
+// starts profiling a call if profiling is enabled and no other call is profiled (e.g., render calling addView). 
+// Returns true if the call is profiled and endProfile has to finish it.
+bool AOS::beginProfile(const char* call)
+{
+	if (!profiling || profile_active)
+		return false;
+	if (gpu_timers < 0)
+		gpu_timers = timerQueriesSupported() ? 1 : 0;
+#ifdef GL_GPU_DISJOINT_EXT
+	if (gpu_timers > 0) {
+		GLint disjoint;
+		glGetIntegerv(GL_GPU_DISJOINT_EXT, &disjoint); // resets the disjoint flag
+	}
+#endif
+	profile_active = true;
+	stage_depth = 0;
+	timings.call = call;
+	timings.stages.clear();
+	profile_start = std::chrono::steady_clock::now();
+	return true;
+}
+
+// waits for the timer queries of the profiled call. Passes must not overlap, only one timer query can be active at a time.
+void AOS::endProfile(bool profiled)
+{
+	if (!profiled)
+		return;
+	if (stage_depth > 0) { // the call threw in a pass
+		stage_depth = 0;
+		stopStage();
+	}
+	timings.cpu_ms = elapsedMs(profile_start);
+	profile_active = false;
+
+	for (auto& stage : timings.stages)
+	{
+		if (stage.query == 0)
+			continue;
+		GLuint ns = 0; // 32 bits are enough for passes up to 4 seconds
+		glGetQueryObjectuiv(stage.query, GL_QUERY_RESULT, &ns);
+		stage.gpu_ms = ns / 1.0e6;
+		if (stage.gpu_ms > elapsedMs(profile_start)) // cannot take longer than the call (e.g., first query of llvmpipe)
+			stage.gpu_ms = -1.0;
+	}
+#ifdef GL_GPU_DISJOINT_EXT
+	GLint disjoint = 0;
+	if (gpu_timers > 0)
+		glGetIntegerv(GL_GPU_DISJOINT_EXT, &disjoint);
+	if (disjoint) // e.g., the GPU changed its frequency, the measured times are not valid
+		for (auto& stage : timings.stages)
+			stage.gpu_ms = -1.0;
+#endif
+}
+
+void AOS::startStage(const char* name)
+{
+	ProfileStage stage = { name, 0.0, -1.0, 0 };
+#ifdef AOS_TIME_ELAPSED
+	if (gpu_timers > 0)
+	{
+		const size_t i = timings.stages.size();
+		if (i >= timer_queries.size()) {
+			timer_queries.push_back(0);
+			glGenQueries(1, &timer_queries.back());
+		}
+		stage.query = timer_queries[i];
+		glBeginQuery(AOS_TIME_ELAPSED, stage.query);
+	}
+#endif
+	timings.stages.push_back(stage);
+	stage_start = std::chrono::steady_clock::now();
+}
+
+void AOS::stopStage()
+{
+	auto& stage = timings.stages.back();
+#ifdef AOS_TIME_ELAPSED
+	if (stage.query)
+		glEndQuery(AOS_TIME_ELAPSED);
+#endif
+	stage.cpu_ms = elapsedMs(stage_start);
+}
+
+void AOS::setIncrementalRendering(bool enable)
+{
+	incremental = enable;
+	incremental_valid = false;
+	if (!enable && fboIncremental)
+	{
+		glDeleteFramebuffers(1, &fboIncremental);
+		glDeleteFramebuffers(1, &fboIncGBuffer);
+		glDeleteTextures(1, &tIncremental);
+		glDeleteTextures(1, &gIncPosition);
+		fboIncremental = tIncremental = fboIncGBuffer = gIncPosition = 0;
+	}
+}
+
+void AOS::renderFocalStack(const glm::mat4 virtual_pose, const float virtualFovDegrees, const std::vector<float>& z_offsets, const std::vector<unsigned int> ids, float* stack, bool flipX)
+{
+	ProfileScope profile(this, "renderFocalStack");
+	if (z_offsets.empty())
+		return;
+	// views contributing to any of the planes
+	auto z_range = std::minmax_element(z_offsets.begin(), z_offsets.end());
+	auto _ids = selectViews(virtual_pose, virtualFovDegrees, ids, 
+		glm::translate(glm::mat4(1.0f), glm::vec3(0, 0, *z_range.first)) * dem_transf, glm::translate(glm::mat4(1.0f), glm::vec3(0, 0, *z_range.second)) * dem_transf);
+
+	renderPipelined((unsigned int)z_offsets.size(), [&](unsigned int i) {
+		auto model = glm::translate(glm::mat4(1.0f), glm::vec3(0, 0, z_offsets[i])) * dem_transf;
+		renderIntegral(virtual_pose, virtualFovDegrees, _ids, model, true);
+	}, stack, flipX);
+}
+
+void AOS::renderBatch(const std::vector<glm::mat4>& virtual_poses, const std::vector<float>& virtualFovDegrees, const std::vector<unsigned int> ids, float* frames, bool flipX)
+{
+	ProfileScope profile(this, "renderBatch");
+	if (virtualFovDegrees.size() != 1 && virtualFovDegrees.size() != virtual_poses.size())
+		throw std::invalid_argument("renderBatch: provide a single field of view or one per pose");
+
+	renderPipelined((unsigned int)virtual_poses.size(), [&](unsigned int i) {
+		const float fov = virtualFovDegrees[virtualFovDegrees.size() == 1 ? 0 : i];
+		renderIntegral(virtual_poses[i], fov, selectViews(virtual_poses[i], fov, ids, dem_transf, dem_transf), dem_transf);
+	}, frames, flipX);
+}
+
+// renders n integrals with renderFrame(i) and copies them to out (n x H x W x RGBA). 
+// The readbacks go through a ring of pixel buffers, so the transfer of frame i overlaps with rendering the next frames.
+void AOS::renderPipelined(unsigned int n, const std::function<void(unsigned int)>& renderFrame, float* out, bool flipX)
+{
+	const size_t frame_size = (size_t)render_width * render_height * 4;
+	const unsigned int lag = AOS_READBACK_BUFFERS - 1;
+	for (unsigned int i = 0; i < n + lag; i++)
+	{
+		if (i < n)
+		{
+			renderFrame(i);
+			startReadback(pboRing[i % AOS_READBACK_BUFFERS]);
+		}
+		if (i >= lag)
+		{
+			const unsigned int j = i - lag;
+			beginStage("readback");
+			finishReadback(pboRing[j % AOS_READBACK_BUFFERS], out + j * frame_size, flipX);
+			endStage();
+		}
+	}
+	glBindFramebuffer(GL_FRAMEBUFFER, 0); // disable framebuffer
+}
+
+void AOS::renderStats(const glm::mat4 virtual_pose, const float virtualFovDegrees, const std::vector<unsigned int> ids, float* mean_count, float* variance_weight, bool flipX)
+{
+	ProfileScope profile(this, "renderStats");
+	if (fboMoments == 0) {
+		attachRenderTarget(fboIntegral, &tMoments, GL_COLOR_ATTACHMENT1);
+		initFrameBufferTexture(&fboMoments, &tMeanCount);
+		attachRenderTarget(fboMoments, &tVarianceWeight, GL_COLOR_ATTACHMENT1);
+	}
+	render_moments = true;
+	try {
+		renderIntegral(virtual_pose, virtualFovDegrees, selectViews(virtual_pose, virtualFovDegrees, ids, dem_transf, dem_transf), dem_transf);
+	}
+	catch (...) {
+		render_moments = false; // later renders must not accumulate moments
+		throw;
+	}
+	render_moments = false;
+
+	// mean and variance from the sums (without blending)
+	beginStage("resolve");
+	const GLenum buffers[] = { GL_COLOR_ATTACHMENT0, GL_COLOR_ATTACHMENT1 };
+	glBindFramebuffer(GL_FRAMEBUFFER, fboMoments);
+	glDrawBuffers(2, buffers);
+	glDisable(GL_BLEND);
+	momentsShader->use();
+	glActiveTexture(GL_TEXTURE0);
+	glBindTexture(GL_TEXTURE_2D, tIntegral);
+	momentsShader->setInt("integral", 0);
+	glActiveTexture(GL_TEXTURE1);
+	glBindTexture(GL_TEXTURE_2D, tMoments);
+	momentsShader->setInt("moments", 1);
+	renderQuad();
+	glEnable(GL_BLEND);
+	endStage();
+
+	beginStage("readback");
+	float* outs[] = { mean_count, variance_weight };
+	for (int i = 0; i < 2; i++) 
+	{
+		glReadBuffer(buffers[i]);
+		glReadPixels(0, 0, render_width, render_height, GL_RGBA, GL_FLOAT, flipX ? fboImg.data : outs[i]);
+		if (flipX)
+			copyPixels((const glm::vec4*)fboImg.data, (glm::vec4*)outs[i], render_width, render_height, true);
+	}
+	endStage();
+	timings.bytes_read_back += 2 * (size_t)render_width * render_height * sizeof(glm::vec4);
+
+	glBindFramebuffer(GL_FRAMEBUFFER, 0); // disable framebuffer
+}
+
+// renders the integral with the DEM translated by z_offset inside roi and reduces it to the focus measure of each tile (or of the whole roi if tile_size is 0) on the GPU
+void AOS::measureFocus(const glm::mat4& virtual_pose, const float virtualFovDegrees, const std::vector<unsigned int>& ids, float z_offset, const glm::ivec4& roi,
+	FOCUSMETRIC metric, int tile_size, bool flipX, float* measures)
+{
+	renderIntegral(virtual_pose, virtualFovDegrees, ids, glm::translate(glm::mat4(1.0f), glm::vec3(0, 0, z_offset)) * dem_transf, true, roi);
+
+	beginStage("focus");
+	const unsigned int groups_x = (roi.z + 15) / 16, groups_y = (roi.w + 15) / 16; // see local_size in focus_measure.cs.glsl
+	const size_t partials_size = (size_t)groups_x * groups_y * 2 * sizeof(glm::vec4);
+	if (focusSSBO == 0) {
+		glGenBuffers(1, &focusSSBO);
+		glBindBuffer(GL_SHADER_STORAGE_BUFFER, focusSSBO);
+		glBufferData(GL_SHADER_STORAGE_BUFFER, (size_t)((render_width + 15) / 16) * ((render_height + 15) / 16) * 2 * sizeof(glm::vec4), NULL, GL_DYNAMIC_READ); // any roi fits
+	}
+
+	focusShader->use();
+	glActiveTexture(GL_TEXTURE0);
+	glBindTexture(GL_TEXTURE_2D, tIntegral);
+	focusShader->setInt("integral", 0);
+	focusShader->setIVec4("roi", roi);
+	focusShader->setBool("flipX", flipX);
+	glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 0, focusSSBO);
+	glDispatchCompute(groups_x, groups_y, 1);
+	glMemoryBarrier(GL_BUFFER_UPDATE_BARRIER_BIT);
+
+	// sum up the partial results of the work groups per tile
+	const unsigned int tile_groups = tile_size > 0 ? tile_size / 16 : std::max(std::max(groups_x, groups_y), 1u);
+	const unsigned int tiles_x = (groups_x + tile_groups - 1) / tile_groups, tiles_y = (groups_y + tile_groups - 1) / tile_groups;
+	std::vector<glm::dvec4> sums(tile_size > 0 ? (size_t)tiles_x * tiles_y : 1, glm::dvec4(0.0)); // sum, sum of squares, count, squared gradients
+	std::vector<double> gradients(sums.size(), 0.0);
+	if (partials_size > 0) {
+		glBindBuffer(GL_SHADER_STORAGE_BUFFER, focusSSBO);
+		auto partials = (const glm::vec4*)glMapBufferRange(GL_SHADER_STORAGE_BUFFER, 0, partials_size, GL_MAP_READ_BIT);
+		for (unsigned int gy = 0; gy < groups_y; gy++)
+			for (unsigned int gx = 0; gx < groups_x; gx++)
+			{
+				const glm::vec4* p = partials + 2 * ((size_t)gy * groups_x + gx); // moments, gradient
+				const size_t t = (size_t)(gy / tile_groups) * tiles_x + gx / tile_groups;
+				sums[t] += glm::dvec4(p[0].x, p[0].y, p[0].z, p[1].x);
+				gradients[t] += p[1].y;
+			}
+		glUnmapBuffer(GL_SHADER_STORAGE_BUFFER);
+		glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0);
+	}
+	endStage();
+	timings.bytes_read_back += partials_size;
+
+	for (size_t t = 0; t < sums.size(); t++)
+	{
+		const glm::dvec4& s = sums[t];
+		if (metric == FOCUS_GRADIENT)
+			measures[t] = gradients[t] > 0 ? (float)(s.w / gradients[t]) : numeric_limits<float>::quiet_NaN();
+		else
+			measures[t] = s.z > 0 ? (float)std::max(s.y / s.z - (s.x / s.z) * (s.x / s.z), 0.0) : numeric_limits<float>::quiet_NaN();
+	}
+}
+
+std::vector<float> AOS::focusMeasures(const glm::mat4 virtual_pose, const float virtualFovDegrees, const std::vector<float>& z_offsets, const std::vector<unsigned int> ids,
+	const glm::ivec4 roi, FOCUSMETRIC metric, int tile_size, bool flipX)
+{
+	if (tile_size < 0 || tile_size % 16 != 0)
+		throw std::runtime_error("Error: the tile size has to be a multiple of 16!");
+	const glm::ivec4 rect = clampROI(roi);
+	const size_t tiles = tile_size > 0 ? (size_t)((rect.z + tile_size - 1) / tile_size) * ((rect.w + tile_size - 1) / tile_size) : 1;
+	std::vector<float> measures(z_offsets.size() * tiles);
+	if (z_offsets.empty())
+		return measures;
+
+	ProfileScope profile(this, "focusMeasures");
+	auto z_range = std::minmax_element(z_offsets.begin(), z_offsets.end());
+	auto _ids = selectViews(virtual_pose, virtualFovDegrees, ids,
+		glm::translate(glm::mat4(1.0f), glm::vec3(0, 0, *z_range.first)) * dem_transf, glm::translate(glm::mat4(1.0f), glm::vec3(0, 0, *z_range.second)) * dem_transf);
+	for (size_t i = 0; i < z_offsets.size(); i++)
+		measureFocus(virtual_pose, virtualFovDegrees, _ids, z_offsets[i], rect, metric, tile_size, flipX, measures.data() + i * tiles);
+	glBindFramebuffer(GL_FRAMEBUFFER, 0); // disable framebuffer
+	return measures;
+}
+
+float AOS::autofocus(const glm::mat4 virtual_pose, const float virtualFovDegrees, float z_min, float z_max, const std::vector<unsigned int> ids,
+	const glm::ivec4 roi, FOCUSMETRIC metric, int steps, float tolerance, float* measure)
+{
+	if (steps < 2 || tolerance <= 0 || z_max < z_min)
+		throw std::runtime_error("Error: autofocus needs z_min <= z_max, at least 2 steps and a positive tolerance!");
+	ProfileScope profile(this, "autofocus");
+	const glm::ivec4 rect = clampROI(roi);
+	auto _ids = selectViews(virtual_pose, virtualFovDegrees, ids,
+		glm::translate(glm::mat4(1.0f), glm::vec3(0, 0, z_min)) * dem_transf, glm::translate(glm::mat4(1.0f), glm::vec3(0, 0, z_max)) * dem_transf);
+
+	// the sharpest plane evaluated so far, planes without any pixel are never the sharpest
+	float best_z = z_min, best = -numeric_limits<float>::infinity();
+	auto evaluate = [&](float z) {
+		float m;
+		measureFocus(virtual_pose, virtualFovDegrees, _ids, z, rect, metric, 0, false, &m);
+		if (std::isnan(m))
+			m = -numeric_limits<float>::infinity();
+		if (m > best) {
+			best = m;
+			best_z = z;
+		}
+		return m;
+	};
+
+	// coarse: equidistant planes
+	const float step = (z_max - z_min) / (steps - 1);
+	for (int i = 0; i < steps; i++)
+		evaluate(z_min + i * step);
+
+	// fine: golden-section search between the neighbors of the best plane
+	const float ratio = 0.5f * (std::sqrt(5.0f) - 1.0f);
+	float a = std::max(best_z - step, z_min), b = std::min(best_z + step, z_max);
+	float c = b - ratio * (b - a), d = a + ratio * (b - a);
+	float fc = evaluate(c), fd = evaluate(d);
+	while (b - a > tolerance)
+	{
+		if (fc >= fd) {
+			b = d; d = c; fd = fc;
+			c = b - ratio * (b - a);
+			fc = evaluate(c);
+		}
+		else {
+			a = c; c = d; fc = fd;
+			d = a + ratio * (b - a);
+			fd = evaluate(d);
+		}
+	}
+	glBindFramebuffer(GL_FRAMEBUFFER, 0); // disable framebuffer
+
+	if (measure)
+		*measure = std::isinf(best) ? numeric_limits<float>::quiet_NaN() : best;
+	return best_z;
+}
+
+std::vector<float> AOS::autofocusTiles(const glm::mat4 virtual_pose, const float virtualFovDegrees, float z_min, float z_max, int tile_size, const std::vector<unsigned int> ids,
+	const glm::ivec4 roi, FOCUSMETRIC metric, int steps, bool flipX)
+{
+	if (steps < 2 || z_max < z_min || tile_size <= 0)
+		throw std::runtime_error("Error: autofocusTiles needs z_min <= z_max, at least 2 steps and a positive tile size!");
+	ProfileScope profile(this, "autofocusTiles");
+	const float step = (z_max - z_min) / (steps - 1);
+	std::vector<float> z_offsets(steps);
+	for (int i = 0; i < steps; i++)
+		z_offsets[i] = z_min + i * step;
+	const std::vector<float> measures = focusMeasures(virtual_pose, virtualFovDegrees, z_offsets, ids, roi, metric, tile_size, flipX);
+
+	const size_t tiles = measures.size() / steps;
+	std::vector<float> depth(tiles, numeric_limits<float>::quiet_NaN());
+	for (size_t t = 0; t < tiles; t++)
+	{
+		auto m = [&](int i) { return measures[i * tiles + t]; };
+		int best = -1;
+		for (int i = 0; i < steps; i++)
+			if (!std::isnan(m(i)) && (best < 0 || m(i) > m(best)))
+				best = i;
+		if (best < 0)
+			continue;
+		// vertex of the parabola through the best plane and its neighbors
+		float offset = 0.0f;
+		if (best > 0 && best < steps - 1 && !std::isnan(m(best - 1)) && !std::isnan(m(best + 1))) {
+			const float curvature = m(best - 1) - 2.0f * m(best) + m(best + 1);
+			if (curvature < 0)
+				offset = glm::clamp(0.5f * (m(best - 1) - m(best + 1)) / curvature, -0.5f, 0.5f);
+		}
+		depth[t] = z_offsets[best] + offset * step;
+	}
+	return depth;
+}
+
+long long AOS::renderAsync(const glm::mat4 virtual_pose, const float virtualFovDegrees, const std::vector<unsigned int> ids)
+{
+	ProfileScope profile(this, "renderAsync");
+	auto& rb = pboAsync[async_ticket % AOS_ASYNC_READBACKS]; // overwrites the oldest unfetched result
+	renderIntegral(virtual_pose, virtualFovDegrees, selectViews(virtual_pose, virtualFovDegrees, ids, dem_transf, dem_transf), dem_transf);
+	beginStage("readback");
+	startReadback(rb);
+	endStage();
+	rb.ticket = async_ticket;
+	glBindFramebuffer(GL_FRAMEBUFFER, 0); // disable framebuffer
+	return async_ticket++;
+}
+
+bool AOS::fetch(long long ticket, float* out, bool flipX, bool wait)
+{
+	ProfileScope profile(this, "fetch");
+	if (ticket < 0 || pboAsync[ticket % AOS_ASYNC_READBACKS].ticket != ticket)
+		throw std::out_of_range("fetch: unknown render ticket (already fetched or overwritten by later renders)");
+	auto& rb = pboAsync[ticket % AOS_ASYNC_READBACKS];
+	if (!wait && !isReadbackReady(rb))
+		return false;
+	beginStage("readback");
+	finishReadback(rb, out, flipX);
+	endStage();
+	rb.ticket = -1;
+	return true;
+}
+
+// starts copying the integral into the pixel buffer (without waiting for the GPU)
+void AOS::startReadback(Readback& rb)
+{
+	if (rb.pbo == 0) {
+		glGenBuffers(1, &rb.pbo);
+		glBindBuffer(GL_PIXEL_PACK_BUFFER, rb.pbo);
+		glBufferData(GL_PIXEL_PACK_BUFFER, (size_t)render_width * render_height * sizeof(glm::vec4), NULL, GL_STREAM_READ);
+	}
+	glBindFramebuffer(GL_FRAMEBUFFER, fboIntegral);
+	glReadBuffer(GL_COLOR_ATTACHMENT0);
+	glBindBuffer(GL_PIXEL_PACK_BUFFER, rb.pbo);
+	glReadPixels(0, 0, render_width, render_height, GL_RGBA, GL_FLOAT, 0); // asynchronous
+	glBindBuffer(GL_PIXEL_PACK_BUFFER, 0);
+	if (rb.fence)
+		glDeleteSync(rb.fence);
+	rb.fence = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0);
+	glFlush(); // make sure the fence is signaled eventually
+}
+
+bool AOS::isReadbackReady(Readback& rb)
+{
+	if (!rb.fence)
+		return true;
+	return glClientWaitSync(rb.fence, 0, 0) != GL_TIMEOUT_EXPIRED;
+}
+
+// waits for the transfer into the pixel buffer and copies it to dst
+void AOS::finishReadback(Readback& rb, float* dst, bool flipX)
+{
+	glBindBuffer(GL_PIXEL_PACK_BUFFER, rb.pbo);
+	auto pixels = (const glm::vec4*)glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, (size_t)render_width * render_height * sizeof(glm::vec4), GL_MAP_READ_BIT);
+	copyPixels(pixels, (glm::vec4*)dst, render_width, render_height, flipX);
+	glUnmapBuffer(GL_PIXEL_PACK_BUFFER);
+	timings.bytes_read_back += (size_t)render_width * render_height * sizeof(glm::vec4);
+	glBindBuffer(GL_PIXEL_PACK_BUFFER, 0);
+	if (rb.fence) {
+		glDeleteSync(rb.fence);
+		rb.fence = NULL;
+	}
+}
+
+void AOS::deleteReadback(Readback& rb)
+{
+	if (rb.pbo) glDeleteBuffers(1, &rb.pbo);
+	if (rb.fence) glDeleteSync(rb.fence);
+	rb = Readback();
+}
+
+// copy (and optionally flip) rows of pixels 
+void AOS::copyPixels(const glm::vec4* src, glm::vec4* dst, const unsigned int width, const unsigned int height, bool flipX)
+{
+	if (!flipX) {
+		memcpy(dst, src, (size_t)width * height * sizeof(glm::vec4));
+		return;
+	}
+	for (unsigned int j = 0; j < height; j++)
+		std::reverse_copy(src + j * width, src + (j + 1) * width, dst + j * width);
 }
 
 Image AOS::renderForward(const glm::mat4 virtual_pose, const float virtualFovDegrees, const std::vector<unsigned int> ids)
 {
+	ProfileScope profile(this, "renderForward");
+	beginStage("forward");
 	glViewport(0, 0, render_width, render_height);
 	forwardShader->use();
 	auto projection = glm::perspective(glm::radians(virtualFovDegrees), (float)render_width / (float)render_height, near_plane, far_plane);
@@ -188,99 +949,697 @@ Image AOS::renderForward(const glm::mat4 virtual_pose, const float virtualFovDeg
 	// -----------------------------------------------------------------
 	glBindFramebuffer(GL_FRAMEBUFFER, fboIntegral); // enable results framebuffer
 	glClear(GL_DEPTH_BUFFER_BIT | GL_COLOR_BUFFER_BIT);
+	fbo_stats_dirty = true;
 
-	// if empty create an ids array running from 0 to size
-	std::vector<unsigned int> _ids;
-	if (ids.empty()) {
-		for (unsigned int i = 0; i < ogl_imgs.size(); i++)
-			_ids.push_back(i);
-	}
-	else // otherwise use specified ids!
-		_ids = std::vector<unsigned int>(ids);
+	auto _ids = selectViews(virtual_pose, virtualFovDegrees, ids, dem_transf, dem_transf);
+	timings.views_projected += _ids.size();
 
 	forwardShader->setMat4("model", dem_transf);
 
+	if (single_pass && updateViewArrays())
+	{
+		forwardArrayShader->use();
+		forwardArrayShader->setMat4("projection", projection);
+		forwardArrayShader->setMat4("view", virtual_pose);
+		forwardArrayShader->setMat4("model", dem_transf);
+		projectViewsSinglePass(forwardArrayShader, _ids, true, projection, virtual_pose);
+		_ids.clear(); // all views are projected
+	}
 
 	//unsigned int counter = 0;
 	for (unsigned int idx : _ids)
 	{
 		auto projViewMatrix = projection_imgs * ogl_imgs[idx].corr * ogl_imgs[idx].pose  ;
 		forwardShader->setMat4("projViewMatrix", projViewMatrix);
+		forwardShader->setFloat("viewScale", ogl_imgs[idx].scale * ogl_imgs[idx].adjust_scale);
+		forwardShader->setVec3("viewOffset", viewOffset(ogl_imgs[idx]));
+		bindViewTextures(forwardShader, ogl_imgs[idx], 1, 2);
 		glActiveTexture(GL_TEXTURE0);
-		glBindTexture(GL_TEXTURE_2D, ogl_imgs[idx].ogl_id);
+		glBindTexture(GL_TEXTURE_2D, residentTexture(idx));
 
-		dem_model->Draw(*forwardShader); // render the model
+		drawDEM(*forwardShader, projection, virtual_pose, dem_transf); // render the model
 	}
+	endStage();
 
 
 	// read framebuffer to CPU
+	beginStage("readback");
 	glReadBuffer(GL_COLOR_ATTACHMENT0);
 	glReadPixels(0, 0, render_width, render_height, GL_RGBA, GL_FLOAT, fboImg.data);
 	// to access a single pixel use indexing like (j)width+i, where j is the row
-	// calculate minimum and maximum of FBO. Note this is very slow!
-	// if it takes too long, do not do this every frame! e.g. only once every second or so
-
-	getMinMaxFromFBO((glm::vec4*)fboImg.data, render_width * render_height, fboCount, fboMin, fboMax);
-	//std::cout << "fbo_min: " << glm::to_string(fboMin).c_str() << std::endl;
-	//std::cout << "fbo_max: " << glm::to_string(fboMax).c_str() << std::endl;
+	// minimum and maximum are computed on the GPU when needed (see getStats)
+	endStage();
+	timings.bytes_read_back += (size_t)render_width * render_height * sizeof(glm::vec4);
 
 
 	glBindFramebuffer(GL_FRAMEBUFFER, 0); // disable framebuffer
 
 
-	return fboImg;
+	return fboImg;
+}
+
+AOS::~AOS()
+{
+	if (dem_model) {
+		delete dem_model;
+		dem_model = NULL;
+	}
+	if (quadVAO) {
+		glDeleteVertexArrays(1, &quadVAO);
+		glDeleteBuffers(1, &quadVBO);
+	}
+	deleteViewArrays();
+	clearViews();
+	setTexturePool(0); // deletes the textures of the views
+	for (unsigned int m : masks) if (m) deleteOGLTexture(m);
+	for (unsigned int m : undistort_maps) if (m) deleteOGLTexture(m);
+	setIncrementalRendering(false);
+	if (fboCopy) glDeleteFramebuffers(1, &fboCopy);
+	if (viewUBO) glDeleteBuffers(1, &viewUBO);
+	if (statsSSBO) glDeleteBuffers(1, &statsSSBO);
+	if (gatherSSBO[0]) glDeleteBuffers(2, gatherSSBO);
+	if (focusSSBO) glDeleteBuffers(1, &focusSSBO);
+	if (fboMoments) {
+		glDeleteFramebuffers(1, &fboMoments);
+		glDeleteTextures(1, &tMoments);
+		glDeleteTextures(1, &tMeanCount);
+		glDeleteTextures(1, &tVarianceWeight);
+	}
+	if (!timer_queries.empty()) glDeleteQueries((GLsizei)timer_queries.size(), timer_queries.data());
+	for (auto& rb : pboRing) deleteReadback(rb);
+	for (auto& rb : pboAsync) deleteReadback(rb);
+	releaseUploadBuffers();
+	delete showFboShader;
+	delete projectShader;
+	delete demShader;
+	delete gBufferShader;
+	delete gBufferPlaneShader;
+	delete statsShader;
+	delete gatherShader;
+	delete momentsShader;
+	delete focusShader;
+	delete projectArrayShader;
+	delete forwardArrayShader;
+	delete copyLayerShader;
+
+	free_image(gBufImg);
+	free_image(fboImg);
+}
+
+void AOS::loadDEM(std::string obj_file)
+{
+	// the previous DEM is only replaced if the new one could be read
+	Model* previous = dem_model;
+	std::vector<DEMTile> previous_tiles;
+	previous_tiles.swap(dem_tiles);
+	const std::string ext = ".aosdem";
+	if (obj_file.size() > ext.size() && obj_file.compare(obj_file.size() - ext.size(), ext.size(), ext) == 0)
+	{
+		dem_model = new Model();
+		if (!readDEMCache(obj_file, 0)) {
+			delete dem_model;
+			dem_model = previous;
+			dem_tiles.swap(previous_tiles);
+			throw std::runtime_error("Error: could not read the DEM cache " + obj_file + "!");
+		}
+	}
+	else
+		dem_model = new Model(obj_file);
+	if (previous)
+		delete previous;
+	analyzeDEM();
+	incremental_valid = false;
+	scene_version++;
+}
+
+// FNV-1a hash, used as key of the DEM cache
+static unsigned long long hashBytes(const void* data, size_t size, unsigned long long hash = 14695981039346656037ULL)
+{
+	const unsigned char* bytes = (const unsigned char*)data;
+	for (size_t i = 0; i < size; i++)
+		hash = (hash ^ bytes[i]) * 1099511628211ULL;
+	return hash;
+}
+
+void AOS::loadDEMFromHeights(const float* heights, int rows, int cols, glm::vec2 origin, glm::vec2 spacing, int tile_size, std::string cache_file)
+{
+	if (rows < 2 || cols < 2 || tile_size < 1)
+		throw std::runtime_error("Error: a raster DEM needs at least 2 x 2 heights and tiles with at least one cell!");
+
+	if (dem_model)
+		delete dem_model;
+	dem_model = new Model();
+	dem_tiles.clear();
+
+	unsigned long long key = 0;
+	if (!cache_file.empty()) {
+		const int header[] = { AOS_DEM_CACHE_VERSION, rows, cols, tile_size };
+		const float grid[] = { origin.x, origin.y, spacing.x, spacing.y };
+		key = hashBytes(heights, (size_t)rows * cols * sizeof(float), hashBytes(grid, sizeof(grid), hashBytes(header, sizeof(header))));
+	}
+	if (cache_file.empty() || !readDEMCache(cache_file, key))
+	{
+		buildDEMTiles(heights, rows, cols, origin, spacing, tile_size);
+		if (!cache_file.empty())
+			writeDEMCache(cache_file, key);
+	}
+	analyzeDEM();
+	incremental_valid = false;
+	scene_version++;
+}
+
+// samples a to b (inclusive) with a stride
+static std::vector<int> gridSamples(int a, int b, int stride)
+{
+	std::vector<int> samples;
+	for (int i = a; i < b; i += stride)
+		samples.push_back(i);
+	samples.push_back(b);
+	return samples;
+}
+
+// builds the meshes of the tiles: a surface per level of detail (every 2^level-th height) 
+// and, for coarser levels, skirts along the tile borders that hide the cracks to neighboring tiles of other levels
+void AOS::buildDEMTiles(const float* heights, int rows, int cols, glm::vec2 origin, glm::vec2 spacing, int tile_size)
+{
+	auto position = [&](int r, int c) { return glm::vec3(origin.x + c * spacing.x, origin.y + r * spacing.y, heights[(size_t)r * cols + c]); };
+	auto valid = [&](int r, int c) { return std::isfinite(heights[(size_t)r * cols + c]); };
+	auto addMesh = [&](std::vector<Vertex>& vertices, std::vector<unsigned int>& indices) {
+		if (indices.empty())
+			return -1;
+		dem_model->meshes.push_back(Mesh(vertices, indices, {}));
+		return (int)dem_model->meshes.size() - 1;
+	};
+
+	for (int r0 = 0; r0 < rows - 1; r0 += tile_size)
+		for (int c0 = 0; c0 < cols - 1; c0 += tile_size)
+		{
+			const int r1 = glm::min(r0 + tile_size, rows - 1), c1 = glm::min(c0 + tile_size, cols - 1);
+			DEMTile tile;
+			tile.cell_size = glm::max(glm::abs(spacing.x), glm::abs(spacing.y));
+			tile.bounds_min = glm::vec3(numeric_limits<float>::max());
+			tile.bounds_max = glm::vec3(-numeric_limits<float>::max());
+
+			// the borders of the tile (as pairs of start and end vertex) sampled at each level, and their maximum deviation from the finest level
+			std::vector<std::vector<int>> rs_levels, cs_levels;
+			std::vector<float> deviation;
+			for (int stride = 1; ; stride *= 2)
+			{
+				rs_levels.push_back(gridSamples(r0, r1, stride));
+				cs_levels.push_back(gridSamples(c0, c1, stride));
+				float dev = 0.0f;
+				for (int side = 0; side < 4; side++)
+				{
+					const bool horizontal = side < 2; // rows r0 and r1, otherwise columns c0 and c1
+					const std::vector<int>& samples = horizontal ? cs_levels.back() : rs_levels.back();
+					const int fixed = horizontal ? (side == 0 ? r0 : r1) : (side == 2 ? c0 : c1);
+					for (size_t k = 0; k + 1 < samples.size(); k++)
+						for (int i = samples[k] + 1; i < samples[k + 1]; i++)
+						{
+							const float t = (float)(i - samples[k]) / (samples[k + 1] - samples[k]);
+							const float a = horizontal ? heights[(size_t)fixed * cols + samples[k]] : heights[(size_t)samples[k] * cols + fixed];
+							const float b = horizontal ? heights[(size_t)fixed * cols + samples[k + 1]] : heights[(size_t)samples[k + 1] * cols + fixed];
+							const float h = horizontal ? heights[(size_t)fixed * cols + i] : heights[(size_t)i * cols + fixed];
+							const float d = glm::abs(a + t * (b - a) - h);
+							if (std::isfinite(d))
+								dev = glm::max(dev, d);
+						}
+				}
+				deviation.push_back(dev);
+				if (stride >= r1 - r0 && stride >= c1 - c0)
+					break; // only the corners are left
+			}
+			const float max_deviation = *std::max_element(deviation.begin(), deviation.end());
+
+			for (size_t level = 0; level < rs_levels.size(); level++)
+			{
+				const std::vector<int>& rs = rs_levels[level], & cs = cs_levels[level];
+				std::vector<Vertex> vertices;
+				std::vector<unsigned int> indices;
+				std::vector<int> index(rs.size() * cs.size(), -1); // vertex of each sample, -1 for holes
+				for (size_t i = 0; i < rs.size(); i++)
+					for (size_t j = 0; j < cs.size(); j++)
+						if (valid(rs[i], cs[j])) {
+							Vertex v = {};
+							v.Position = position(rs[i], cs[j]);
+							v.TexCoords = glm::vec2((float)cs[j] / (cols - 1), (float)rs[i] / (rows - 1));
+							v.Normal = glm::vec3(0, 0, 1);
+							index[i * cs.size() + j] = (int)vertices.size();
+							vertices.push_back(v);
+							tile.bounds_min = glm::min(tile.bounds_min, v.Position);
+							tile.bounds_max = glm::max(tile.bounds_max, v.Position);
+						}
+				for (size_t i = 0; i + 1 < rs.size(); i++)
+					for (size_t j = 0; j + 1 < cs.size(); j++)
+					{
+						const int a = index[i * cs.size() + j], b = index[i * cs.size() + j + 1], c = index[(i + 1) * cs.size() + j], d = index[(i + 1) * cs.size() + j + 1];
+						if (a >= 0 && b >= 0 && d >= 0)
+							indices.insert(indices.end(), { (unsigned int)a, (unsigned int)b, (unsigned int)d });
+						if (a >= 0 && d >= 0 && c >= 0)
+							indices.insert(indices.end(), { (unsigned int)a, (unsigned int)d, (unsigned int)c });
+					}
+				tile.surface.push_back(addMesh(vertices, indices));
+
+				// skirts hang down far enough to cover the cracks to a neighboring tile on any level
+				std::vector<Vertex> skirt_vertices;
+				std::vector<unsigned int> skirt_indices;
+				const float depth = deviation[level] > 0.0f ? deviation[level] + max_deviation : 0.0f;
+				for (int side = 0; level > 0 && depth > 0.0f && side < 4; side++)
+				{
+					const bool horizontal = side < 2;
+					const size_t n = horizontal ? cs.size() : rs.size();
+					for (size_t k = 0; k + 1 < n; k++)
+					{
+						const size_t i0 = horizontal ? (side == 0 ? 0 : rs.size() - 1) : k, j0 = horizontal ? k : (side == 2 ? 0 : cs.size() - 1);
+						const size_t i1 = horizontal ? i0 : k + 1, j1 = horizontal ? k + 1 : j0;
+						const int a = index[i0 * cs.size() + j0], b = index[i1 * cs.size() + j1];
+						if (a < 0 || b < 0)
+							continue;
+						const unsigned int base = (unsigned int)skirt_vertices.size();
+						for (int v : { a, b }) {
+							skirt_vertices.push_back(vertices[v]);
+							skirt_vertices.push_back(vertices[v]);
+							skirt_vertices.back().Position.z -= depth;
+						}
+						skirt_indices.insert(skirt_indices.end(), { base, base + 2, base + 3, base, base + 3, base + 1 });
+						tile.bounds_min.z = glm::min(tile.bounds_min.z, skirt_vertices.back().Position.z);
+					}
+				}
+				tile.skirt.push_back(addMesh(skirt_vertices, skirt_indices));
+			}
+			if (tile.surface[0] >= 0)
+				dem_tiles.push_back(tile);
+		}
+}
+
+// binary mesh cache: key, tiles with their bounds and the positions/indices of the meshes of each level
+bool AOS::readDEMCache(const std::string& file, unsigned long long key)
+{
+	std::ifstream in(file, std::ios::binary | std::ios::ate);
+	if (!in)
+		return false;
+	const unsigned long long file_size = (unsigned long long)in.tellg();
+	in.seekg(0);
+	char magic[8] = { 0 };
+	int version = 0;
+	unsigned long long file_key = 0;
+	unsigned int num_tiles = 0;
+	in.read(magic, sizeof(magic));
+	in.read((char*)&version, sizeof(version));
+	in.read((char*)&file_key, sizeof(file_key));
+	in.read((char*)&num_tiles, sizeof(num_tiles));
+	if (!in || std::memcmp(magic, "AOSDEM\0\0", sizeof(magic)) != 0 || version != AOS_DEM_CACHE_VERSION || (key != 0 && file_key != key))
+		return false;
+
+	// the counts are checked against the rest of the file before allocating anything (the cache may be truncated or corrupt)
+	auto remaining = [&]() { return file_size - (unsigned long long)in.tellg(); };
+	const unsigned long long tile_header = sizeof(unsigned int) + sizeof(float) + 2 * sizeof(glm::vec3), mesh_header = 2 * sizeof(unsigned int);
+	if ((unsigned long long)num_tiles * tile_header > remaining())
+		return false;
+
+	// the meshes are only created (with their OpenGL buffers) after the whole cache was read
+	std::vector<std::pair<std::vector<glm::vec3>, std::vector<unsigned int>>> meshes;
+	auto readMesh = [&]() {
+		unsigned int nv = 0, ni = 0;
+		in.read((char*)&nv, sizeof(nv));
+		in.read((char*)&ni, sizeof(ni));
+		if (!in || (unsigned long long)nv * sizeof(glm::vec3) + (unsigned long long)ni * sizeof(unsigned int) > remaining()) {
+			in.setstate(std::ios::failbit);
+			return -1;
+		}
+		if (ni == 0 && nv == 0)
+			return -1; // empty level
+		std::vector<glm::vec3> positions(nv);
+		std::vector<unsigned int> indices(ni);
+		in.read((char*)positions.data(), nv * sizeof(glm::vec3));
+		in.read((char*)indices.data(), ni * sizeof(unsigned int));
+		if (ni == 0 || std::any_of(indices.begin(), indices.end(), [nv](unsigned int i) { return i >= nv; })) {
+			in.setstate(std::ios::failbit);
+			return -1;
+		}
+		meshes.emplace_back(std::move(positions), std::move(indices));
+		return (int)(dem_model->meshes.size() + meshes.size()) - 1;
+	};
+
+	std::vector<DEMTile> tiles(num_tiles);
+	for (auto& tile : tiles)
+	{
+		unsigned int levels = 0;
+		in.read((char*)&levels, sizeof(levels));
+		in.read((char*)&tile.cell_size, sizeof(tile.cell_size));
+		in.read((char*)&tile.bounds_min, sizeof(tile.bounds_min));
+		in.read((char*)&tile.bounds_max, sizeof(tile.bounds_max));
+		if (!in || levels == 0 || (unsigned long long)levels * 2 * mesh_header > remaining())
+			return false;
+		for (unsigned int l = 0; l < levels && in; l++) {
+			tile.surface.push_back(readMesh());
+			tile.skirt.push_back(readMesh());
+		}
+		// like buildDEMTiles, every tile has a surface on the finest level (see analyzeDEM and drawDEM)
+		if (!in || tile.surface.size() != levels || tile.skirt.size() != levels || tile.surface[0] < 0)
+			return false;
+	}
+
+	for (auto& mesh : meshes) {
+		std::vector<Vertex> vertices(mesh.first.size(), Vertex{});
+		for (size_t i = 0; i < vertices.size(); i++) {
+			vertices[i].Position = mesh.first[i];
+			vertices[i].Normal = glm::vec3(0, 0, 1);
+		}
+		dem_model->meshes.push_back(Mesh(vertices, mesh.second, {}));
+	}
+	dem_tiles = tiles;
+	return true;
+}
+
+void AOS::writeDEMCache(const std::string& file, unsigned long long key) const
+{
+	std::ofstream out(file, std::ios::binary);
+	const int version = AOS_DEM_CACHE_VERSION;
+	const unsigned int num_tiles = (unsigned int)dem_tiles.size();
+	out.write("AOSDEM\0\0", 8);
+	out.write((const char*)&version, sizeof(version));
+	out.write((const char*)&key, sizeof(key));
+	out.write((const char*)&num_tiles, sizeof(num_tiles));
+
+	auto writeMesh = [&](int m) {
+		const unsigned int nv = m < 0 ? 0 : (unsigned int)dem_model->meshes[m].vertices.size();
+		const unsigned int ni = m < 0 ? 0 : (unsigned int)dem_model->meshes[m].indices.size();
+		out.write((const char*)&nv, sizeof(nv));
+		out.write((const char*)&ni, sizeof(ni));
+		for (unsigned int i = 0; i < nv; i++)
+			out.write((const char*)&dem_model->meshes[m].vertices[i].Position, sizeof(glm::vec3));
+		if (ni > 0)
+			out.write((const char*)dem_model->meshes[m].indices.data(), ni * sizeof(unsigned int));
+	};
+
+	for (const auto& tile : dem_tiles)
+	{
+		const unsigned int levels = (unsigned int)tile.surface.size();
+		out.write((const char*)&levels, sizeof(levels));
+		out.write((const char*)&tile.cell_size, sizeof(tile.cell_size));
+		out.write((const char*)&tile.bounds_min, sizeof(tile.bounds_min));
+		out.write((const char*)&tile.bounds_max, sizeof(tile.bounds_max));
+		for (unsigned int l = 0; l < levels; l++) {
+			writeMesh(tile.surface[l]);
+			writeMesh(tile.skirt[l]);
+		}
+	}
+	if (!out)
+		std::cout << "Could not write the DEM cache " << file << std::endl;
+}
+
+// draws the DEM; of raster DEMs only the tiles in the view frustum, each on the coarsest level with grid cells of at most dem_lod_error pixels.
+// The depth test is disabled, so the skirts are drawn before all surfaces and only fill the cracks between them.
+void AOS::drawDEM(Shader& shader, const glm::mat4& projection, const glm::mat4& view, const glm::mat4& model)
+{
+	if (dem_tiles.empty()) {
+		dem_model->Draw(shader);
+		return;
+	}
+
+	const glm::mat4 mvp = projection * view * model;
+	const glm::vec3 eye = glm::vec3(glm::inverse(view * model)[3]); // camera position in model coordinates
+	const float focal_pixels = projection[1][1] * render_height * 0.5f;
+	std::vector<int> surfaces, skirts;
+	for (const auto& tile : dem_tiles)
+	{
+		// frustum culling: the tile is outside if all corners of its bounding box are outside of the same clipping plane
+		glm::vec4 corners[8];
+		for (int i = 0; i < 8; i++)
+			corners[i] = mvp * glm::vec4((i & 1) ? tile.bounds_max.x : tile.bounds_min.x, (i & 2) ? tile.bounds_max.y : tile.bounds_min.y, (i & 4) ? tile.bounds_max.z : tile.bounds_min.z, 1.0f);
+		bool outside = false;
+		for (int plane = 0; plane < 6 && !outside; plane++) {
+			outside = true;
+			for (int i = 0; i < 8 && outside; i++)
+				outside = (plane % 2 == 0 ? corners[i][plane / 2] + corners[i].w : corners[i].w - corners[i][plane / 2]) < 0.0f;
+		}
+		if (outside)
+			continue;
+		timings.dem_tiles_drawn++;
+
+		// level of detail from the distance to the closest point of the tile
+		const float distance = glm::length(eye - glm::clamp(eye, tile.bounds_min, tile.bounds_max));
+		size_t level = 0;
+		while (level + 1 < tile.surface.size() && tile.surface[level + 1] >= 0 && tile.cell_size * (float)(2 << level) * focal_pixels <= dem_lod_error * distance)
+			level++;
+		surfaces.push_back(tile.surface[level]);
+		if (tile.surface[level] >= 0)
+			timings.dem_triangles_drawn += dem_model->meshes[tile.surface[level]].indices.size() / 3;
+		if (tile.skirt[level] >= 0)
+			skirts.push_back(tile.skirt[level]);
+	}
+	for (int m : skirts)
+		dem_model->meshes[m].Draw(shader);
+	for (int m : surfaces)
+		if (m >= 0)
+			dem_model->meshes[m].Draw(shader);
+}
+
+// computes the bounding box of the DEM and checks if it is an axis-aligned rectangle with a constant height (e.g., zero_plane.obj)
+// such a DEM can be intersected analytically instead of drawing the mesh
+void AOS::analyzeDEM()
+{
+	dem_is_plane = false;
+	glm::vec3& minv = dem_bounds_min, & maxv = dem_bounds_max;
+	minv = glm::vec3(numeric_limits<float>::max()); maxv = glm::vec3(-numeric_limits<float>::max());
+	double area = 0.0;
+	std::vector<const Mesh*> meshes; // of raster DEMs only the finest level without skirts
+	for (const auto& tile : dem_tiles)
+		meshes.push_back(&dem_model->meshes[tile.surface[0]]);
+	if (dem_tiles.empty())
+		for (const auto& mesh : dem_model->meshes)
+			meshes.push_back(&mesh);
+	for (const Mesh* m : meshes)
+	{
+		const Mesh& mesh = *m;
+		for (const auto& v : mesh.vertices) {
+			minv = glm::min(minv, v.Position);
+			maxv = glm::max(maxv, v.Position);
+		}
+		for (size_t i = 0; i + 2 < mesh.indices.size(); i += 3) {
+			auto a = mesh.vertices[mesh.indices[i]].Position, b = mesh.vertices[mesh.indices[i + 1]].Position, c = mesh.vertices[mesh.indices[i + 2]].Position;
+			area += 0.5 * std::abs((double)(b.x - a.x) * (c.y - a.y) - (double)(c.x - a.x) * (b.y - a.y));
+		}
+	}
+	const double bbox_area = (double)(maxv.x - minv.x) * (maxv.y - minv.y);
+	if (maxv.z - minv.z <= 1e-6f * glm::max(1.0f, glm::abs(maxv.z)) && bbox_area > 0.0 && std::abs(area - bbox_area) <= 1e-6 * bbox_area)
+	{
+		dem_is_plane = true;
+		dem_plane_z = minv.z;
+		dem_plane_bounds = glm::vec4(minv.x, minv.y, maxv.x, maxv.y);
+	}
+}
+
+void AOS::setDEMTransformation(const glm::vec3 translation, const glm::vec3 eulerAngles)
+{
+	glm::mat4 trans_mat = glm::translate(glm::mat4(1.0f), translation);
+	auto rot_mat = glm::eulerAngleXYZ(eulerAngles.x,eulerAngles.y,eulerAngles.z); // should be similar to legacy renderer! 
+	dem_transf = trans_mat * rot_mat;
+
+	//std::cout << "AOS.cpp: setDEMTransformation with transl: " << glm::to_string(translation) << " rotation: "<< glm::to_string(eulerAngles) <<std::endl;
+}
+
+static glm::mat4 correctionMatrix(const glm::vec3 translation, const glm::vec3 eulerAngles)
+{
+	glm::mat4 trans_mat = glm::translate(glm::mat4(1.0f), translation);
+	auto rot_mat = glm::eulerAngleXYZ(eulerAngles.x,eulerAngles.y,eulerAngles.z); // should be similar to legacy renderer! 
+	return trans_mat * rot_mat;
+}
+
+void AOS::setPoseCorrection( const unsigned int index,const glm::vec3 translation, const glm::vec3 eulerAngles)
+{
+	updateIncremental(index, true);
+	ogl_imgs[index].corr = correctionMatrix(translation, eulerAngles);
+	ogl_imgs[index].footprint_valid = false;
+	updateIncremental(index);
+}
+
+void AOS::setPoseCorrections(const std::vector<glm::vec3>& translations, const std::vector<glm::vec3>& eulerAngles, const std::vector<unsigned int>& ids)
+{
+	if (translations.size() != (ids.empty() ? ogl_imgs.size() : ids.size()) || eulerAngles.size() != translations.size())
+		throw std::runtime_error("Error: number of corrections does not match the number of views!");
+	updateViews(ids, [&](View& v, size_t i) { v.corr = correctionMatrix(translations[i], eulerAngles[i]); });
+}
+
+glm::mat4 AOS::setPose(unsigned int idx, const glm::mat4 pose)
+{
+	updateIncremental(idx, true);
+	ogl_imgs[idx].pose = pose;
+	ogl_imgs[idx].footprint_valid = false;
+	updateIncremental(idx);
+	return pose;
+}
+
+void AOS::setPoses(const std::vector<glm::mat4>& poses, const std::vector<unsigned int>& ids)
+{
+	if (poses.size() != (ids.empty() ? ogl_imgs.size() : ids.size()))
+		throw std::runtime_error("Error: number of poses does not match the number of views!");
+	updateViews(ids, [&](View& v, size_t i) { v.pose = poses[i]; });
+}
+
+// applies change(view, i) to the i-th of the views ids (or of all views if ids is empty). 
+// An incremental integral is updated view by view only if that projects fewer views than rebuilding it.
+void AOS::updateViews(const std::vector<unsigned int>& ids, const std::function<void(View&, size_t)>& change)
+{
+	for (unsigned int idx : ids)
+		if (idx >= ogl_imgs.size())
+			throw std::runtime_error("Error: view index " + std::to_string(idx) + " is out of range!");
+	const size_t n = ids.empty() ? ogl_imgs.size() : ids.size();
+	const bool update = incremental && incremental_valid && 2 * n < ogl_imgs.size();
+	for (size_t i = 0; i < n; i++)
+	{
+		const unsigned int idx = ids.empty() ? (unsigned int)i : ids[i];
+		if (update)
+			updateIncremental(idx, true);
+		change(ogl_imgs[idx], i);
+		ogl_imgs[idx].footprint_valid = false;
+		if (update)
+			updateIncremental(idx);
+	}
+	if (!update) {
+		incremental_valid = false;
+		scene_version++;
+	}
+}
+
+// half-spaces (dot(plane, vec4(p,1)) >= 0) of the region where clip = clip_from_world * vec4(p,1) satisfies |x|,|y| <= w (and |z| <= w if clip_z)
+// if back is set, the region behind the camera (w < 0) is returned instead
+static std::vector<glm::dvec4> clipPlanes(const glm::mat4& clip_from_world, bool clip_z, bool back = false)
+{
+	const glm::dmat4 m = glm::transpose(glm::dmat4(clip_from_world)); // rows of the matrix
+	const double sign = back ? -1.0 : 1.0;
+	std::vector<glm::dvec4> planes;
+	for (int i = 0; i < (clip_z ? 3 : 2); i++) {
+		planes.push_back(sign * (m[3] - m[i]));
+		planes.push_back(sign * (m[3] + m[i]));
+	}
+	return planes;
 }
 
-AOS::~AOS()
+// bounding box of the intersection of a box with a convex region bounded by half-spaces
+// the vertices of the intersection are found by intersecting all triples of planes. returns false if the intersection is empty.
+static bool clipBox(const glm::vec3 box_min, const glm::vec3 box_max, std::vector<glm::dvec4> planes, glm::vec3& clip_min, glm::vec3& clip_max)
 {
-	if (dem_model) {
-		delete dem_model;
-		dem_model = NULL;
+	for (int a = 0; a < 3; a++) {
+		glm::dvec4 lo(0.0), hi(0.0);
+		lo[a] = 1.0; lo.w = -box_min[a];
+		hi[a] = -1.0; hi.w = box_max[a];
+		planes.push_back(lo); planes.push_back(hi);
 	}
-	delete showFboShader;
-	delete projectShader;
-	delete demShader;
-	delete gBufferShader;
+	for (auto& pl : planes) {
+		const double len = glm::length(glm::dvec3(pl));
+		if (len > 0.0) pl /= len; // distances in world units
+	}
+	const double eps = 1e-5 * (1.0 + glm::compMax(glm::abs(glm::dvec3(box_min))) + glm::compMax(glm::abs(glm::dvec3(box_max))));
 
-	free_image(gBufImg);
-	free_image(fboImg);
+	glm::dvec3 rmin(numeric_limits<double>::max()), rmax(-numeric_limits<double>::max());
+	bool empty = true;
+	const size_t n = planes.size();
+	for (size_t i = 0; i < n; i++) for (size_t j = i + 1; j < n; j++) for (size_t k = j + 1; k < n; k++)
+	{
+		const glm::dmat3 a = glm::transpose(glm::dmat3(glm::dvec3(planes[i]), glm::dvec3(planes[j]), glm::dvec3(planes[k])));
+		if (std::abs(glm::determinant(a)) < 1e-12)
+			continue; // planes do not meet in a single point
+		const glm::dvec3 p = glm::inverse(a) * -glm::dvec3(planes[i].w, planes[j].w, planes[k].w);
+		bool inside = true;
+		for (const auto& pl : planes)
+			if (glm::dot(glm::dvec3(pl), p) + pl.w < -eps) { inside = false; break; }
+		if (inside) {
+			rmin = glm::min(rmin, p);
+			rmax = glm::max(rmax, p);
+			empty = false;
+		}
+	}
+	clip_min = glm::vec3(rmin - eps);
+	clip_max = glm::vec3(rmax + eps);
+	return !empty;
 }
 
-void AOS::loadDEM(std::string obj_file)
+// bounding box of the DEM with the model transformation in world coordinates
+void AOS::getDEMBounds(const glm::mat4& model, glm::vec3& bounds_min, glm::vec3& bounds_max) const
 {
-	if (dem_model)
-		delete dem_model;
-	dem_model = new Model(obj_file);
+	bounds_min = glm::vec3(numeric_limits<float>::max());
+	bounds_max = glm::vec3(-numeric_limits<float>::max());
+	for (int i = 0; i < 8; i++) {
+		const glm::vec3 corner((i & 1) ? dem_bounds_max.x : dem_bounds_min.x, (i & 2) ? dem_bounds_max.y : dem_bounds_min.y, (i & 4) ? dem_bounds_max.z : dem_bounds_min.z);
+		const glm::vec3 p = glm::vec3(model * glm::vec4(corner, 1.0f));
+		bounds_min = glm::min(bounds_min, p);
+		bounds_max = glm::max(bounds_max, p);
+	}
 }
 
-void AOS::setDEMTransformation(const glm::vec3 translation, const glm::vec3 eulerAngles)
+// updates the footprints of the views, i.e., the bounding boxes of the DEM region that the views can be projected on.
+// The deferred shaders only check that the projection is inside the image, so the region behind a view counts as well.
+void AOS::updateFootprints(const glm::vec3& dem_min, const glm::vec3& dem_max)
 {
-	glm::mat4 trans_mat = glm::translate(glm::mat4(1.0f), translation);
-	auto rot_mat = glm::eulerAngleXYZ(eulerAngles.x,eulerAngles.y,eulerAngles.z); // should be similar to legacy renderer! 
-	dem_transf = trans_mat * rot_mat;
+	const bool dem_changed = dem_min != footprint_dem_min || dem_max != footprint_dem_max;
+	footprint_dem_min = dem_min; footprint_dem_max = dem_max;
+	for (auto& view : ogl_imgs)
+	{
+		if (view.footprint_valid && !dem_changed)
+			continue;
+		const glm::mat4 m = projection_imgs * view.corr * view.pose;
+		glm::vec3 front_min, front_max, back_min, back_max;
+		const bool front = clipBox(dem_min, dem_max, clipPlanes(m, false), front_min, front_max);
+		const bool back = clipBox(dem_min, dem_max, clipPlanes(m, false, true), back_min, back_max);
+		view.footprint_empty = !front && !back;
+		view.footprint_min = front ? (back ? glm::min(front_min, back_min) : front_min) : back_min;
+		view.footprint_max = front ? (back ? glm::max(front_max, back_max) : front_max) : back_max;
+		view.footprint_valid = true;
+	}
+}
 
-	//std::cout << "AOS.cpp: setDEMTransformation with transl: " << glm::to_string(translation) << " rotation: "<< glm::to_string(eulerAngles) <<std::endl;
+// returns the views that are rendered: all or the specified ids and, if culling is enabled, only those that overlap with the
+// region of the DEM seen by the virtual camera. The DEM is placed anywhere between the model transformations dem_from and dem_to.
+std::vector<unsigned int> AOS::selectViews(const glm::mat4 virtual_pose, const float virtualFovDegrees, const std::vector<unsigned int>& ids, const glm::mat4 dem_from, const glm::mat4 dem_to)
+{
+	std::vector<unsigned int> _ids;
+	if (ids.empty()) {
+		for (unsigned int i = 0; i < ogl_imgs.size(); i++)
+			_ids.push_back(i);
+	}
+	else // otherwise use specified ids!
+		_ids = std::vector<unsigned int>(ids);
+	for (unsigned int idx : _ids)
+		if (idx >= ogl_imgs.size())
+			throw std::runtime_error("Error: view index " + std::to_string(idx) + " is out of range!");
+
+	if (!view_culling || !dem_model)
+		return _ids;
+
+	glm::vec3 dem_min, dem_max, to_min, to_max;
+	getDEMBounds(dem_from, dem_min, dem_max);
+	getDEMBounds(dem_to, to_min, to_max);
+	dem_min = glm::min(dem_min, to_min); dem_max = glm::max(dem_max, to_max);
+	updateFootprints(dem_min, dem_max);
+
+	// DEM region inside the frustum of the virtual camera
+	auto projection = glm::perspective(glm::radians(virtualFovDegrees), (float)render_width / (float)render_height, near_plane, far_plane);
+	glm::vec3 visible_min, visible_max;
+	if (!clipBox(dem_min, dem_max, clipPlanes(projection * virtual_pose, true), visible_min, visible_max))
+		return {};
+
+	std::vector<unsigned int> culled;
+	for (auto idx : _ids) {
+		const View& view = ogl_imgs[idx];
+		if (!view.footprint_empty && glm::all(glm::lessThanEqual(view.footprint_min, visible_max)) && glm::all(glm::lessThanEqual(visible_min, view.footprint_max)))
+			culled.push_back(idx);
+	}
+	return culled;
 }
 
-void AOS::setPoseCorrection( const unsigned int index,const glm::vec3 translation, const glm::vec3 eulerAngles)
+std::vector<unsigned int> AOS::queryViews(const glm::mat4 virtual_pose, const float virtualFovDegrees, const std::vector<unsigned int> ids)
 {
-	glm::mat4 trans_mat = glm::translate(glm::mat4(1.0f), translation);
-	auto rot_mat = glm::eulerAngleXYZ(eulerAngles.x,eulerAngles.y,eulerAngles.z); // should be similar to legacy renderer! 
-	ogl_imgs[index].corr = trans_mat * rot_mat;
+	return selectViews(virtual_pose, virtualFovDegrees, ids, dem_transf, dem_transf);
 }
 
 
 void AOS::addView(Image img, glm::mat4 pose, std::string name)
 {
-	View view;
-	view.corr = glm::mat4(1); // identity
-	view.pose = pose;
-	view.name = name.empty() ? std::to_string(ogl_imgs.size()) : name;
-	//float pixelvalue = get_pixel(img,1,1,0);
-	//std::cout << "Image Value Loaded " << pixelvalue << " image properties "<< img.h << img.w << img.c <<std::endl;
-	//save_image_png(img, "Image"); //for checking if image is loaded
-	view.ogl_id = generateOGLTexture(img);
-	ogl_imgs.push_back(view);
+	auto oglimg = prepare_image_ogl(img); // convert to interleaved format
+	addView(oglimg.data, img.w, img.h, img.c, PIX_FLOAT32, pose, name);
+	free_image(oglimg);
 #ifdef DEBUG_OUTPUT
 	// DEBUG
 	auto w = img.w-1;
@@ -299,20 +1658,437 @@ void AOS::addView(Image img, glm::mat4 pose, std::string name)
 #endif
 }
 
+void AOS::addView(const void* data, int w, int h, int c, PIXTYPE type, glm::mat4 pose, std::string name)
+{
+	checkViewFormat(c, type); // views under a texture budget are uploaded later, so the format is checked here
+	View view;
+	view.corr = glm::mat4(1); // identity
+	view.pose = pose;
+	view.name = name.empty() ? std::to_string(ogl_imgs.size()) : name;
+	view.scale = type == PIX_UINT8 ? 255.0f : 1.0f; // 8-bit textures are normalized by OpenGL, so scale the colors back (alpha stays normalized)!
+	view.adjust_scale = 1.0f; view.adjust_offset = 0.0f;
+	view.mask = 0;
+	view.camera = 0;
+	view.footprint_valid = false;
+	view.ogl_id = 0;
+	view.last_used = 0;
+	ProfileScope profile(this, "addView");
+	beginStage("upload");
+	updateResidency(view, data, w, h, c, type);
+	endStage();
+	ogl_imgs.push_back(view);
+	view_arrays_dirty = true;
+	updateIncremental((unsigned int)ogl_imgs.size() - 1);
+}
+
+void AOS::addViews(const void* data, unsigned int n, int w, int h, int c, PIXTYPE type, const std::vector<glm::mat4>& poses, const std::vector<std::string>& names)
+{
+	if (poses.size() != n || !(names.empty() || names.size() == n))
+		throw std::runtime_error("Error: number of poses/names does not match the number of views!");
+
+	const size_t view_bytes = (size_t)w * h * c * getPixelSize(type);
+	ProfileScope profile(this, "addViews");
+	beginStage("upload");
+	ogl_imgs.reserve(ogl_imgs.size() + n);
+	for (unsigned int i = 0; i < n; i++)
+		addView((const char*)data + i * view_bytes, w, h, c, type, poses[i], names.empty() ? "" : names[i]);
+	endStage();
+}
+
+// packed light field (little endian): header, view records, names, mask and the images of all views (aligned to 4096 bytes), 
+// each with width x height x channels interleaved pixels of pixel_type. Offsets are relative to the start of the file.
+struct LightFieldHeader {
+	char magic[8]; // "AOSLF\0\0\0"
+	unsigned int version, num_views;
+	int width, height, channels;
+	unsigned int pixel_type; // PIXTYPE
+	int mask_width, mask_height; // 0 without mask
+	unsigned int mask_type; // PIXTYPE
+	float value_range; // the views are divided by it when they are loaded (see setValueRange), 0 keeps the values of the image files
+	unsigned long long views_offset, names_offset, mask_offset, data_offset;
+};
+struct LightFieldView {
+	float pose[16]; // column-major
+	float correction[6]; // translation and euler angles (see setPoseCorrection)
+	float adjustment[2]; // scale and offset (see setViewAdjustment)
+	unsigned int name_offset, name_length; // relative to names_offset
+};
+static_assert(sizeof(LightFieldHeader) == 80 && sizeof(LightFieldView) == 104, "unexpected padding of the light field records");
+
+unsigned int AOS::loadLightField(const std::string& file)
+{
+	ProfileScope profile(this, "loadLightField"); // the views are uploaded in the stages of addViews
+	size_t size = 0;
+	const char* bytes = (const char*)map_file(file.c_str(), &size);
+	if (!bytes)
+		throw std::runtime_error("Error: could not map the light field " + file + "!");
+	// unmaps the file also if an exception is thrown
+	std::unique_ptr<const char, std::function<void(const char*)>> mapping(bytes, [size](const char* p) { unmap_file((void*)p, size); });
+
+	LightFieldHeader header = {};
+	if (size >= sizeof(header))
+		std::memcpy(&header, bytes, sizeof(header));
+	if (size < sizeof(header) || std::memcmp(header.magic, "AOSLF\0\0\0", sizeof(header.magic)) != 0 || header.version != AOS_LIGHTFIELD_VERSION)
+		throw std::runtime_error("Error: " + file + " is not a packed light field (version " + std::to_string(AOS_LIGHTFIELD_VERSION) + ")!");
+	// all sizes and offsets are checked against the file (without overflows), so a corrupt file cannot be read out of bounds
+	auto fits = [size](unsigned long long offset, unsigned long long count, unsigned long long item_bytes) {
+		return offset <= size && (item_bytes == 0 || count <= (size - offset) / item_bytes);
+	};
+	auto validType = [](unsigned int type) { return type == PIX_UINT8 || type == PIX_FLOAT16 || type == PIX_FLOAT32; };
+	const bool has_mask = header.mask_width > 0 && header.mask_height > 0;
+	if (header.width <= 0 || header.height <= 0 || header.channels < 1 || header.channels > 4 || !validType(header.pixel_type) 
+		|| header.mask_width < 0 || header.mask_height < 0 || (has_mask && !validType(header.mask_type)) || !(header.value_range >= 0.0f)
+		|| (unsigned long long)header.width * header.height > size || (unsigned long long)header.mask_width * header.mask_height > size) // the byte counts cannot overflow
+		throw std::runtime_error("Error: the light field " + file + " has an invalid image format!");
+	const size_t view_bytes = (size_t)header.width * header.height * header.channels * getPixelSize((PIXTYPE)header.pixel_type);
+	const size_t mask_bytes = has_mask ? (size_t)header.mask_width * header.mask_height * getPixelSize((PIXTYPE)header.mask_type) : 0;
+	if (!fits(header.views_offset, header.num_views, sizeof(LightFieldView)) || !fits(header.names_offset, 0, 1) || !fits(header.mask_offset, mask_bytes, 1)
+		|| !fits(header.data_offset, header.num_views, view_bytes))
+		throw std::runtime_error("Error: the light field " + file + " is truncated!");
+
+	std::vector<LightFieldView> records(header.num_views); // copied, the records do not need to be aligned in the file
+	std::memcpy(records.data(), bytes + header.views_offset, records.size() * sizeof(LightFieldView));
+	std::vector<glm::mat4> poses(header.num_views);
+	std::vector<std::string> names(header.num_views);
+	for (unsigned int i = 0; i < header.num_views; i++) {
+		poses[i] = glm::make_mat4(records[i].pose);
+		if (!fits(header.names_offset + records[i].name_offset, records[i].name_length, 1))
+			throw std::runtime_error("Error: the light field " + file + " is truncated!");
+		names[i].assign(bytes + header.names_offset + records[i].name_offset, records[i].name_length);
+	}
+
+	if (has_mask)
+		setMask(bytes + header.mask_offset, header.mask_width, header.mask_height, (PIXTYPE)header.mask_type);
+	const unsigned int first = (unsigned int)ogl_imgs.size();
+	addViews(bytes + header.data_offset, header.num_views, header.width, header.height, header.channels, (PIXTYPE)header.pixel_type, poses, names);
+	for (unsigned int i = 0; i < header.num_views; i++) {
+		const float* corr = records[i].correction;
+		if (glm::vec3(corr[0], corr[1], corr[2]) != glm::vec3(0) || glm::vec3(corr[3], corr[4], corr[5]) != glm::vec3(0))
+			setPoseCorrection(first + i, glm::vec3(corr[0], corr[1], corr[2]), glm::vec3(corr[3], corr[4], corr[5]));
+		if (records[i].adjustment[0] != 1.0f || records[i].adjustment[1] != 0.0f)
+			setViewAdjustment(first + i, records[i].adjustment[0], records[i].adjustment[1]);
+		if (header.value_range > 0.0f && header.value_range != 1.0f)
+			setValueRange(first + i, header.value_range);
+	}
+	return header.num_views;
+}
+
+void* AOS::mapUploadBuffer(unsigned int slot, size_t bytes)
+{
+	if (slot >= upload_buffers.size())
+		upload_buffers.resize(slot + 1);
+	UploadBuffer& ub = upload_buffers[slot];
+	if (!ub.pbo)
+		glGenBuffers(1, &ub.pbo);
+	glBindBuffer(GL_PIXEL_UNPACK_BUFFER, ub.pbo);
+	if (ub.mapped)
+		glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER);
+	if (bytes > ub.size) {
+		glBufferData(GL_PIXEL_UNPACK_BUFFER, bytes, NULL, GL_STREAM_DRAW);
+		ub.size = bytes;
+	}
+	// invalidating lets the driver hand out new memory while a previous upload from the buffer is still pending
+	ub.mapped = glMapBufferRange(GL_PIXEL_UNPACK_BUFFER, 0, bytes, GL_MAP_WRITE_BIT | GL_MAP_INVALIDATE_BUFFER_BIT);
+	glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0);
+	if (!ub.mapped)
+		throw std::runtime_error("Error: could not map an upload buffer!");
+	return ub.mapped;
+}
+
+void AOS::addViewFromUploadBuffer(unsigned int slot, int w, int h, int c, PIXTYPE type, glm::mat4 pose, std::string name)
+{
+	if (slot >= upload_buffers.size() || !upload_buffers[slot].mapped || (size_t)w * h * c * getPixelSize(type) > upload_buffers[slot].size)
+		throw std::runtime_error("Error: the upload buffer is not mapped or too small!");
+	UploadBuffer& ub = upload_buffers[slot];
+	glBindBuffer(GL_PIXEL_UNPACK_BUFFER, ub.pbo);
+	glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER);
+	ub.mapped = NULL;
+	if (texture_budget > 0) { // views under a texture budget keep a CPU copy, the write-only mapping cannot be read, so the buffer is mapped again for reading
+		const void* pixels = glMapBufferRange(GL_PIXEL_UNPACK_BUFFER, 0, (size_t)w * h * c * getPixelSize(type), GL_MAP_READ_BIT);
+		glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0);
+		if (!pixels)
+			throw std::runtime_error("Error: could not read an upload buffer!");
+		auto unmap = [&ub]() {
+			glBindBuffer(GL_PIXEL_UNPACK_BUFFER, ub.pbo);
+			glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER);
+			glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0);
+		};
+		try {
+			addView(pixels, w, h, c, type, pose, name);
+		}
+		catch (...) {
+			unmap();
+			throw;
+		}
+		unmap();
+		return;
+	}
+	glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0);
+	upload_pbo = ub.pbo;
+	try {
+		addView(NULL, w, h, c, type, pose, name); // the texture is uploaded from offset 0 of the buffer
+	}
+	catch (...) {
+		upload_pbo = 0;
+		throw;
+	}
+}
+
+void AOS::releaseUploadBuffers()
+{
+	for (auto& ub : upload_buffers) {
+		if (ub.mapped) {
+			glBindBuffer(GL_PIXEL_UNPACK_BUFFER, ub.pbo);
+			glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER);
+			glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0);
+		}
+		glDeleteBuffers(1, &ub.pbo);
+	}
+	upload_buffers.clear();
+}
+
+void AOS::setValueRange(unsigned int idx, float range)
+{
+	if (idx >= ogl_imgs.size())
+		throw std::runtime_error("Error: view index " + std::to_string(idx) + " is out of range!");
+	updateIncremental(idx, true);
+	ogl_imgs[idx].scale = (ogl_imgs[idx].type == PIX_UINT8 ? 255.0f : 1.0f) / range;
+	updateIncremental(idx);
+	view_arrays_dirty = true;
+}
+
+void AOS::setViewAdjustment(unsigned int idx, float scale, float offset)
+{
+	updateIncremental(idx, true);
+	ogl_imgs[idx].adjust_scale = scale;
+	ogl_imgs[idx].adjust_offset = offset;
+	updateIncremental(idx);
+	view_arrays_dirty = true; // the colors are adjusted when copying the views into the arrays
+}
+
+void AOS::setMask(Image mask, unsigned int group)
+{
+	if (mask.c != 1)
+		throw std::runtime_error("Error: a mask needs to have a single channel!");
+	setMask(mask.data, mask.w, mask.h, PIX_FLOAT32, group); // a single channel is the same in planar and interleaved format
+}
+
+void AOS::setMask(const void* data, int w, int h, PIXTYPE type, unsigned int group)
+{
+	uploadGroupTexture(masks, mask_bytes, group, data, w, h, 1, type); // 8-bit masks are normalized to [0,1] by OpenGL
+	view_arrays_dirty = true; // the masks are applied when copying the views into the arrays
+	incremental_valid = false; // affects all views of the group
+	scene_version++;
+}
+
+void AOS::clearMask(unsigned int group)
+{
+	if (!hasMask(group))
+		return;
+	deleteGroupTexture(masks, mask_bytes, group);
+	view_arrays_dirty = true;
+	incremental_valid = false;
+	scene_version++;
+}
+
+void AOS::setViewMask(unsigned int idx, unsigned int group)
+{
+	updateIncremental(idx, true);
+	ogl_imgs[idx].mask = group;
+	updateIncremental(idx);
+	view_arrays_dirty = true;
+}
+
+void AOS::setUndistortionMap(const float* map, int w, int h, int src_w, int src_h, unsigned int group)
+{
+	// store offsets to the texture coordinates of the undistorted image, which are small enough for a (filterable) half-float texture
+	std::vector<float> offsets((size_t)w * h * 2);
+	for (int j = 0; j < h; j++)
+		for (int i = 0; i < w; i++)
+		{
+			const size_t k = ((size_t)j * w + i) * 2;
+			offsets[k] = (map[k] + 0.5f) / src_w - (i + 0.5f) / w;
+			offsets[k + 1] = (map[k + 1] + 0.5f) / src_h - (j + 0.5f) / h;
+		}
+	uploadGroupTexture(undistort_maps, undistort_bytes, group, offsets.data(), w, h, 2, PIX_FLOAT32);
+	view_arrays_dirty = true; // the views are undistorted when copying them into the arrays
+	incremental_valid = false; // affects all views of the group
+	scene_version++;
+}
+
+void AOS::setCameraCalibration(float fx, float fy, float cx, float cy, const std::vector<float>& dist, int w, int h, unsigned int group)
+{
+	if (dist.size() > 8)
+		throw std::runtime_error("Error: at most 8 distortion coefficients (k1, k2, p1, p2, k3, k4, k5, k6) are supported!");
+	float d[8] = { 0 };
+	std::copy(dist.begin(), dist.end(), d);
+	const float k1 = d[0], k2 = d[1], p1 = d[2], p2 = d[3], k3 = d[4], k4 = d[5], k5 = d[6], k6 = d[7];
+
+	// distort the pixels of the undistorted image (with the same intrinsics), like cv::initUndistortRectifyMap
+	std::vector<float> map((size_t)w * h * 2);
+	for (int j = 0; j < h; j++)
+		for (int i = 0; i < w; i++)
+		{
+			const float x = (i - cx) / fx, y = (j - cy) / fy;
+			const float r2 = x * x + y * y, r4 = r2 * r2, r6 = r4 * r2;
+			const float radial = (1.0f + k1 * r2 + k2 * r4 + k3 * r6) / (1.0f + k4 * r2 + k5 * r4 + k6 * r6);
+			const float xd = x * radial + 2.0f * p1 * x * y + p2 * (r2 + 2.0f * x * x);
+			const float yd = y * radial + p1 * (r2 + 2.0f * y * y) + 2.0f * p2 * x * y;
+			const size_t k = ((size_t)j * w + i) * 2;
+			map[k] = fx * xd + cx;
+			map[k + 1] = fy * yd + cy;
+		}
+	setUndistortionMap(map.data(), w, h, w, h, group);
+}
+
+void AOS::clearUndistortion(unsigned int group)
+{
+	if (!hasUndistortion(group))
+		return;
+	deleteGroupTexture(undistort_maps, undistort_bytes, group);
+	view_arrays_dirty = true;
+	incremental_valid = false;
+	scene_version++;
+}
+
+void AOS::setViewCamera(unsigned int idx, unsigned int group)
+{
+	updateIncremental(idx, true);
+	ogl_imgs[idx].camera = group;
+	updateIncremental(idx);
+	view_arrays_dirty = true;
+}
+
+// uploads the mask or undistortion map of a group. The texture stays resident, but it is counted against the texture budget
+void AOS::uploadGroupTexture(std::vector<unsigned int>& textures, std::vector<size_t>& bytes, unsigned int group, const void* data, int w, int h, int c, PIXTYPE type)
+{
+	if (group >= textures.size()) {
+		textures.resize(group + 1, 0);
+		bytes.resize(group + 1, 0);
+	}
+	const size_t gpu_bytes = getTextureSize(w, h, c, type);
+	resident_bytes -= bytes[group];
+	bytes[group] = 0;
+	evictTextures(gpu_bytes); // makes room for it like for the views
+	if (textures[group] == 0)
+		glGenTextures(1, &textures[group]);
+	uploadOGLTexture(textures[group], data, w, h, c, type);
+	bytes[group] = gpu_bytes;
+	resident_bytes += gpu_bytes;
+}
+
+void AOS::deleteGroupTexture(std::vector<unsigned int>& textures, std::vector<size_t>& bytes, unsigned int group)
+{
+	deleteOGLTexture(textures[group]);
+	textures[group] = 0;
+	resident_bytes -= bytes[group];
+	bytes[group] = 0;
+}
+
+// binds the texture of a group (if there is one) to a texture unit and tells the shader whether to use it
+void AOS::bindGroupTexture(Shader* shader, const std::vector<unsigned int>& textures, unsigned int group, unsigned int unit, const char* flag)
+{
+	const bool use = group < textures.size() && textures[group] != 0;
+	shader->setBool(flag, use);
+	if (use) {
+		glActiveTexture(GL_TEXTURE0 + unit);
+		glBindTexture(GL_TEXTURE_2D, textures[group]);
+	}
+}
+
+// binds the shared mask and undistortion map of a view
+void AOS::bindViewTextures(Shader* shader, const View& v, unsigned int mask_unit, unsigned int undistort_unit)
+{
+	bindGroupTexture(shader, masks, v.mask, mask_unit, "useMask");
+	bindGroupTexture(shader, undistort_maps, v.camera, undistort_unit, "useUndistortion");
+}
+
 void AOS::removeView(unsigned int idx)
 {
-	View v = ogl_imgs[idx];
-	deleteOGLTexture(v.ogl_id);
+	updateIncremental(idx, true);
+	View& v = ogl_imgs[idx];
+	if (v.ogl_id) {
+		releaseTexture(v.ogl_id, v.w, v.h, v.c, v.type);
+		resident_bytes -= v.gpu_bytes;
+	}
 	ogl_imgs.erase(ogl_imgs.begin() + idx);
+	view_arrays_dirty = true;
+}
+
+void AOS::removeViews(const std::vector<unsigned int>& ids)
+{
+	std::vector<bool> removed(ogl_imgs.size(), false);
+	for (unsigned int idx : ids) {
+		if (idx >= ogl_imgs.size())
+			throw std::runtime_error("Error: view index " + std::to_string(idx) + " is out of range!");
+		removed[idx] = true;
+	}
+	const size_t n = std::count(removed.begin(), removed.end(), true);
+	if (n == 0)
+		return;
+	// subtract the views from an incremental integral only if that projects fewer views than rebuilding it.
+	// This is done before any texture is released, the projections can upload and evict textures of the views.
+	const bool update = incremental && incremental_valid && 2 * n < ogl_imgs.size();
+	if (update)
+		for (size_t i = 0; i < ogl_imgs.size(); i++)
+			if (removed[i])
+				updateIncremental((unsigned int)i, true);
+	size_t kept = 0;
+	for (size_t i = 0; i < ogl_imgs.size(); i++)
+	{
+		View& v = ogl_imgs[i];
+		if (removed[i]) {
+			if (v.ogl_id) {
+				releaseTexture(v.ogl_id, v.w, v.h, v.c, v.type);
+				resident_bytes -= v.gpu_bytes;
+				v.ogl_id = 0;
+			}
+			continue;
+		}
+		if (kept != i)
+			ogl_imgs[kept] = std::move(v);
+		kept++;
+	}
+	ogl_imgs.erase(ogl_imgs.begin() + kept, ogl_imgs.end());
+	if (!update)
+		incremental_valid = false;
+	scene_version++;
+	view_arrays_dirty = true;
+}
+
+void AOS::clearViews()
+{
+	for (auto& v : ogl_imgs)
+		if (v.ogl_id) {
+			releaseTexture(v.ogl_id, v.w, v.h, v.c, v.type);
+			resident_bytes -= v.gpu_bytes;
+		}
+	ogl_imgs.clear();
+	incremental_valid = false;
+	scene_version++;
+	view_arrays_dirty = true;
 }
 
 void AOS::replaceView(unsigned int idx, Image img, glm::mat4 pose, std::string name)
 {
-	View v = ogl_imgs[idx];
+	auto oglimg = prepare_image_ogl(img); // convert to interleaved format
+	replaceView(idx, oglimg.data, img.w, img.h, img.c, PIX_FLOAT32, pose, name);
+	free_image(oglimg);
+}
+
+void AOS::replaceView(unsigned int idx, const void* data, int w, int h, int c, PIXTYPE type, glm::mat4 pose, std::string name)
+{
+	checkViewFormat(c, type);
+	updateIncremental(idx, true);
+	View& v = ogl_imgs[idx];
 	v.pose = pose;
+	v.footprint_valid = false;
 	v.name = name.empty() ? std::to_string(idx) : name;
-	uploadOGLTexture(v.ogl_id, img);
-	ogl_imgs[idx] = v; // update in vector
+	v.scale = type == PIX_UINT8 ? 255.0f : 1.0f;
+	v.adjust_scale = 1.0f; v.adjust_offset = 0.0f;
+	updateResidency(v, data, w, h, c, type);
+	updateIncremental(idx);
+	view_arrays_dirty = true;
 }
 
 void AOS::display(bool normalize, bool flipX, bool flipY, bool use_colormap, glm::ivec3 rgb_colormap)
@@ -324,11 +2100,13 @@ void AOS::display(bool normalize, bool flipX, bool flipY, bool use_colormap, glm
 
 	// display framebuffer
 	// ---------------------------------------------
+	if (normalize)
+		getStats();
 	showFboShader->use();
-	if (normalize && fboCount > 0 && fboMax.a > 0)
+	if (normalize && fboStats.count > 0 && fboStats.max.a > 0)
 	{
-		showFboShader->setFloat("fbo_min", fboMin.r);
-		showFboShader->setFloat("fbo_max", fboMax.r);
+		showFboShader->setFloat("fbo_min", fboStats.min.r);
+		showFboShader->setFloat("fbo_max", fboStats.max.r);
 	}
 	else
 	{
@@ -353,43 +2131,108 @@ Image AOS::getXYZ()
 	// read framebuffer to CPU
 	glReadBuffer(GL_COLOR_ATTACHMENT0);
 	glReadPixels(0, 0, render_width, render_height, GL_RGBA, GL_FLOAT, gBufImg.data);
+	timings.bytes_read_back += (size_t)render_width * render_height * sizeof(glm::vec4);
 
 	glBindFramebuffer(GL_FRAMEBUFFER, 0);
 
 	return gBufImg;
 }
 
-unsigned int AOS::generateOGLTexture(Image img)
+void AOS::pixelsToWorld(const glm::vec2* pixels, size_t n, glm::vec4* xyz)
+{
+	ProfileScope profile(this, "pixelsToWorld");
+	if (n == 0)
+		return;
+	if (n > gather_capacity) {
+		if (gatherSSBO[0] == 0)
+			glGenBuffers(2, gatherSSBO);
+		gather_capacity = std::max(n, (size_t)256);
+		glBindBuffer(GL_SHADER_STORAGE_BUFFER, gatherSSBO[0]);
+		glBufferData(GL_SHADER_STORAGE_BUFFER, gather_capacity * sizeof(glm::vec2), NULL, GL_DYNAMIC_DRAW);
+		glBindBuffer(GL_SHADER_STORAGE_BUFFER, gatherSSBO[1]);
+		glBufferData(GL_SHADER_STORAGE_BUFFER, gather_capacity * sizeof(glm::vec4), NULL, GL_DYNAMIC_READ);
+	}
+	glBindBuffer(GL_SHADER_STORAGE_BUFFER, gatherSSBO[0]);
+	glBufferSubData(GL_SHADER_STORAGE_BUFFER, 0, n * sizeof(glm::vec2), pixels);
+	timings.bytes_uploaded += n * sizeof(glm::vec2);
+
+	beginStage("gather");
+	gatherShader->use();
+	glActiveTexture(GL_TEXTURE0);
+	glBindTexture(GL_TEXTURE_2D, gPosition);
+	gatherShader->setInt("gPosition", 0);
+	gatherShader->setInt("count", (int)n);
+	glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 0, gatherSSBO[0]);
+	glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 1, gatherSSBO[1]);
+	glDispatchCompute((GLuint)((n + 63) / 64), 1, 1); // see local_size in gather_positions.cs.glsl
+	glMemoryBarrier(GL_BUFFER_UPDATE_BARRIER_BIT);
+	endStage();
+
+	beginStage("readback");
+	glBindBuffer(GL_SHADER_STORAGE_BUFFER, gatherSSBO[1]);
+	auto positions = (const glm::vec4*)glMapBufferRange(GL_SHADER_STORAGE_BUFFER, 0, n * sizeof(glm::vec4), GL_MAP_READ_BIT);
+	if (!positions) {
+		glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0);
+		throw std::runtime_error("Error: could not map the gathered positions!");
+	}
+	std::copy(positions, positions + n, xyz);
+	glUnmapBuffer(GL_SHADER_STORAGE_BUFFER);
+	glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0);
+	endStage();
+	timings.bytes_read_back += n * sizeof(glm::vec4);
+}
+
+unsigned int AOS::generateOGLTexture(const void* data, int w, int h, int c, PIXTYPE type)
 {
 	unsigned int textureID;
 	glGenTextures(1, &textureID);
-	uploadOGLTexture(textureID, img);
+	uploadOGLTexture(textureID, data, w, h, c, type);
 
 	return textureID;
 }
 
-void AOS::uploadOGLTexture(unsigned int textureID, Image img)
+// upload an interleaved (HWC) buffer directly, i.e. without any conversion on the CPU
+// (allocate = false uploads into the existing storage of the texture, which has to have the same size and format)
+void AOS::uploadOGLTexture(unsigned int textureID, const void* data, int w, int h, int c, PIXTYPE type, bool allocate)
 {
-	GLenum format, internal;
-	if (img.c == 1) {
-		internal = GL_R16F;
+	GLenum format, internal, gltype;
+	if (c == 1) 
 		format = GL_RED;
-	}
-	else if (img.c == 3) {
-		internal = GL_RGB16F;
+	else if (c == 2) 
+		format = GL_RG;
+	else if (c == 3) 
 		format = GL_RGB;
-	}
-	else if (img.c == 4) {
-		internal = GL_RGBA16F;
+	else if (c == 4) 
 		format = GL_RGBA;
-	} else
+	else
 		throw std::runtime_error( "Error: number of channels not supported!" );
 
+	if (type == PIX_UINT8) {
+		internal = c == 1 ? GL_R8 : (c == 2 ? GL_RG8 : (c == 3 ? GL_RGB8 : GL_RGBA8));
+		gltype = GL_UNSIGNED_BYTE;
+	}
+	else {
+		internal = c == 1 ? GL_R16F : (c == 2 ? GL_RG16F : (c == 3 ? GL_RGB16F : GL_RGBA16F));
+		gltype = type == PIX_FLOAT16 ? GL_HALF_FLOAT : GL_FLOAT;
+	}
+
 	glBindTexture(GL_TEXTURE_2D, textureID);
-					
-	auto oglimg = prepare_image_ogl(img);
-	glTexImage2D(GL_TEXTURE_2D, 0, internal, img.w, img.h, 0, format, GL_FLOAT, oglimg.data);
-	free_image(oglimg);
+	
+	glPixelStorei(GL_UNPACK_ALIGNMENT, 1); // rows of 8-bit images are not necessarily 4-byte aligned
+	if (upload_pbo) // see addViewFromUploadBuffer
+		glBindBuffer(GL_PIXEL_UNPACK_BUFFER, upload_pbo);
+	if (allocate)
+		glTexImage2D(GL_TEXTURE_2D, 0, internal, w, h, 0, format, gltype, data);
+	else
+		glTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, w, h, format, gltype, data);
+	if (upload_pbo) {
+		glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0);
+		upload_pbo = 0;
+	}
+	timings.bytes_uploaded += (size_t)w * h * c * getPixelSize(type);
+	glPixelStorei(GL_UNPACK_ALIGNMENT, 4);
+	if (!allocate)
+		return;
 	//glGenerateMipmap(GL_TEXTURE_2D); // <- not supported in OpenGL ES!
 
 	glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE); // for this tutorial: use GL_CLAMP_TO_EDGE to prevent semi-transparent borders. Due to interpolation it takes texels from next repeat 
@@ -398,6 +2241,179 @@ void AOS::uploadOGLTexture(unsigned int textureID, Image img)
 	glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR);
 }
 
+size_t AOS::getPixelSize(PIXTYPE type)
+{
+	switch (type) {
+	case PIX_UINT8: return 1;
+	case PIX_FLOAT16: return 2;
+	case PIX_FLOAT32: return 4;
+	}
+	throw std::runtime_error("Error: pixel type not supported!");
+}
+
+void AOS::checkViewFormat(int c, PIXTYPE type)
+{
+	if (c < 1 || c > 4)
+		throw std::runtime_error("Error: number of channels not supported!");
+	getPixelSize(type); // throws for other pixel types
+}
+
+// stores the data of a view as texture or, for views under a texture budget, as CPU copy that is uploaded when a render needs it
+void AOS::updateResidency(View& v, const void* data, int w, int h, int c, PIXTYPE type)
+{
+	const bool managed = texture_budget > 0 && (v.ogl_id == 0 || !v.data.empty()); // views without a CPU copy stay pinned
+	const size_t gpu_bytes = getTextureSize(w, h, c, type);
+	if (v.ogl_id && (managed || v.w != w || v.h != h || v.c != c || (v.type == PIX_UINT8) != (type == PIX_UINT8))) 
+	{
+		releaseTexture(v.ogl_id, v.w, v.h, v.c, v.type); // managed views are uploaded again on demand
+		resident_bytes -= v.gpu_bytes;
+		v.ogl_id = 0;
+	}
+	v.w = w; v.h = h; v.c = c; v.type = type;
+	if (managed)
+	{
+		const unsigned char* bytes = (const unsigned char*)data;
+		v.data.assign(bytes, bytes + (size_t)w * h * c * getPixelSize(type));
+	}
+	else
+	{
+		if (v.ogl_id) { // same size and format, only upload the data
+			uploadOGLTexture(v.ogl_id, data, w, h, c, type, false);
+			resident_bytes -= v.gpu_bytes;
+		}
+		else
+			v.ogl_id = acquireTexture(data, w, h, c, type);
+		resident_bytes += gpu_bytes;
+	}
+	v.gpu_bytes = gpu_bytes;
+}
+
+// returns the texture of a view, uploading it from the CPU copy (and evicting least recently used textures) if it is not resident
+unsigned int AOS::residentTexture(unsigned int idx)
+{
+	View& v = ogl_imgs[idx];
+	v.last_used = ++residency_clock;
+	if (v.ogl_id == 0)
+	{
+		evictTextures(v.gpu_bytes);
+		v.ogl_id = acquireTexture(v.data.data(), v.w, v.h, v.c, v.type);
+		resident_bytes += v.gpu_bytes;
+		residency.uploads++;
+		residency.upload_bytes += v.gpu_bytes;
+	}
+	return v.ogl_id;
+}
+
+// evicts least recently used textures until additional bytes fit into the texture budget.
+// Pooled textures count against the budget, they are deleted first. Evicted textures are deleted as well instead of pooled.
+// Textures of views that were already drawn can be deleted, OpenGL keeps them alive until the pending draw calls are done.
+void AOS::evictTextures(size_t bytes)
+{
+	if (texture_budget == 0)
+		return;
+	trimTexturePool(resident_bytes + bytes < texture_budget ? texture_budget - resident_bytes - bytes : 0);
+	while (resident_bytes + bytes > texture_budget)
+	{
+		View* lru = NULL;
+		for (auto& v : ogl_imgs)
+			if (v.ogl_id && !v.data.empty() && (!lru || v.last_used < lru->last_used))
+				lru = &v;
+		if (!lru)
+			break; // only pinned textures left
+		deleteOGLTexture(lru->ogl_id);
+		lru->ogl_id = 0;
+		resident_bytes -= lru->gpu_bytes;
+		residency.evictions++;
+	}
+}
+
+void AOS::setTextureBudget(size_t bytes)
+{
+	texture_budget = bytes;
+	deleteViewArrays();
+	view_arrays_dirty = true;
+	if (bytes > 0)
+	{
+		evictTextures(0);
+		return;
+	}
+	// unlimited: upload all views and drop the CPU copies
+	for (unsigned int i = 0; i < ogl_imgs.size(); i++)
+	{
+		residentTexture(i);
+		std::vector<unsigned char>().swap(ogl_imgs[i].data);
+	}
+}
+
+ResidencyStats AOS::getResidencyStats() const
+{
+	ResidencyStats stats = residency;
+	stats.budget = texture_budget;
+	stats.resident_bytes = resident_bytes;
+	stats.views = (unsigned int)ogl_imgs.size();
+	stats.resident_views = 0;
+	for (const auto& v : ogl_imgs)
+		stats.resident_views += v.ogl_id != 0;
+	for (size_t bytes : mask_bytes) stats.group_bytes += bytes;
+	for (size_t bytes : undistort_bytes) stats.group_bytes += bytes;
+	stats.pool_budget = texture_pool_budget;
+	stats.pooled_bytes = texture_pool_bytes;
+	stats.pooled_textures = 0;
+	for (const auto& bucket : texture_pool)
+		stats.pooled_textures += (unsigned int)bucket.second.size();
+	return stats;
+}
+
+// texture with the data of a view: a pooled texture of the same size and format only gets the data uploaded, otherwise a texture is allocated
+unsigned int AOS::acquireTexture(const void* data, int w, int h, int c, PIXTYPE type)
+{
+	auto bucket = texture_pool.find(std::make_tuple(w, h, c, type == PIX_UINT8));
+	if (bucket == texture_pool.end() || bucket->second.empty()) {
+		residency.allocations++;
+		return generateOGLTexture(data, w, h, c, type);
+	}
+	const unsigned int textureID = bucket->second.back();
+	bucket->second.pop_back();
+	texture_pool_bytes -= getTextureSize(w, h, c, type);
+	uploadOGLTexture(textureID, data, w, h, c, type, false);
+	residency.reuses++;
+	return textureID;
+}
+
+// keeps the texture of a view for reuse, or deletes it if the pool is full
+void AOS::releaseTexture(unsigned int textureID, int w, int h, int c, PIXTYPE type)
+{
+	const size_t bytes = getTextureSize(w, h, c, type);
+	if (texture_pool_bytes + bytes > texture_pool_budget) {
+		deleteOGLTexture(textureID);
+		return;
+	}
+	texture_pool[std::make_tuple(w, h, c, type == PIX_UINT8)].push_back(textureID);
+	texture_pool_bytes += bytes;
+}
+
+void AOS::setTexturePool(size_t bytes)
+{
+	texture_pool_budget = bytes;
+	trimTexturePool(bytes);
+}
+
+// deletes pooled textures until the pool holds at most bytes
+void AOS::trimTexturePool(size_t bytes)
+{
+	for (auto bucket = texture_pool.begin(); bucket != texture_pool.end() && texture_pool_bytes > bytes; )
+	{
+		const auto& key = bucket->first;
+		auto& textures = bucket->second;
+		while (!textures.empty() && texture_pool_bytes > bytes) {
+			deleteOGLTexture(textures.back());
+			textures.pop_back();
+			texture_pool_bytes -= getTextureSize(std::get<0>(key), std::get<1>(key), std::get<2>(key), std::get<3>(key) ? PIX_UINT8 : PIX_FLOAT16);
+		}
+		bucket = textures.empty() ? texture_pool.erase(bucket) : std::next(bucket);
+	}
+}
+
 void AOS::deleteOGLTexture(unsigned int texID)
 {
 	glBindTexture(GL_TEXTURE_2D, 0);
@@ -407,7 +2423,13 @@ void AOS::deleteOGLTexture(unsigned int texID)
 void AOS::initFrameBufferTexture(unsigned int* fbo, unsigned int* texture)
 {
 	glGenFramebuffers(1, fbo);
-	glBindFramebuffer(GL_FRAMEBUFFER, *fbo);
+	attachRenderTarget(*fbo, texture, GL_COLOR_ATTACHMENT0);
+}
+
+// creates a float texture of the render size and attaches it to fbo
+void AOS::attachRenderTarget(unsigned int fbo, unsigned int* texture, unsigned int attachment)
+{
+	glBindFramebuffer(GL_FRAMEBUFFER, fbo);
 	// position color buffer
 	glGenTextures(1, texture);
 	glBindTexture(GL_TEXTURE_2D, *texture);
@@ -421,7 +2443,7 @@ void AOS::initFrameBufferTexture(unsigned int* fbo, unsigned int* texture)
 #endif
 	glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST);
 	glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST);
-	glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, *texture, 0);
+	glFramebufferTexture2D(GL_FRAMEBUFFER, attachment, GL_TEXTURE_2D, *texture, 0);
 	if (glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE) {
 		std::cout << "Framebuffer not complete!" << std::endl;
 		throw std::runtime_error( "Error: framebuffer not complete!" );
@@ -429,37 +2451,188 @@ void AOS::initFrameBufferTexture(unsigned int* fbo, unsigned int* texture)
 	glBindFramebuffer(GL_FRAMEBUFFER, 0);
 }
 
+// copy all views into layers of texture arrays (only if views changed)
+// returns false if single-pass rendering is not possible, e.g., if the views have different sizes
+bool AOS::updateViewArrays()
+{
+	if (texture_budget > 0)
+		return false; // the texture arrays would keep all views on the GPU
+	if (!view_arrays_dirty)
+		return !view_arrays.empty() || ogl_imgs.empty();
+
+	deleteViewArrays();
+	view_arrays_dirty = false;
+	if (ogl_imgs.empty())
+		return true;
+
+	const int w = ogl_imgs[0].w, h = ogl_imgs[0].h;
+	for (const auto& v : ogl_imgs)
+		if (v.w != w || v.h != h || hasUndistortion(v.camera))
+			return false; // views need to have the same size, and undistorted layers would be filtered twice (when copied and when projected)
+
+	GLint max_layers;
+	glGetIntegerv(GL_MAX_ARRAY_TEXTURE_LAYERS, &max_layers);
+	view_array_layers = glm::min((unsigned int)max_layers, (unsigned int)ogl_imgs.size());
+	unsigned int num_arrays = ((unsigned int)ogl_imgs.size() + view_array_layers - 1) / view_array_layers;
+	view_arrays.resize(num_arrays);
+	glGenTextures(num_arrays, view_arrays.data());
+
+	GLint prev_fbo;
+	glGetIntegerv(GL_FRAMEBUFFER_BINDING, &prev_fbo);
+	if (fboCopy == 0)
+		glGenFramebuffers(1, &fboCopy);
+	glBindFramebuffer(GL_FRAMEBUFFER, fboCopy);
+	glViewport(0, 0, w, h);
+	glDisable(GL_BLEND);
+	copyLayerShader->use();
+	glActiveTexture(GL_TEXTURE0);
+	for (unsigned int a = 0; a < num_arrays; a++)
+	{
+		unsigned int layers = glm::min(view_array_layers, (unsigned int)ogl_imgs.size() - a * view_array_layers);
+		glBindTexture(GL_TEXTURE_2D_ARRAY, view_arrays[a]);
+		glTexStorage3D(GL_TEXTURE_2D_ARRAY, 1, GL_RGBA16F, w, h, layers);
+		glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE);
+		glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE);
+		glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_LINEAR);
+		glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR);
+
+		for (unsigned int l = 0; l < layers; l++)
+		{
+			const View& v = ogl_imgs[a * view_array_layers + l];
+			glFramebufferTextureLayer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, view_arrays[a], 0, l);
+			copyLayerShader->setFloat("viewScale", v.scale * v.adjust_scale);
+			copyLayerShader->setVec3("viewOffset", viewOffset(v));
+			bindGroupTexture(copyLayerShader, masks, v.mask, 1, "useMask");
+			glActiveTexture(GL_TEXTURE0);
+			glBindTexture(GL_TEXTURE_2D, v.ogl_id);
+			renderQuad();
+		}
+	}
+	glEnable(GL_BLEND);
+	glBindFramebuffer(GL_FRAMEBUFFER, prev_fbo);
+	glViewport(0, 0, render_width, render_height);
+	CHECK_GL_ERROR
+
+	return true;
+}
+
+void AOS::deleteViewArrays()
+{
+	if (!view_arrays.empty())
+		glDeleteTextures((GLsizei)view_arrays.size(), view_arrays.data());
+	view_arrays.clear();
+	view_arrays_dirty = true;
+}
 
-// loop through all pixels of the fbo and compute the minimum/maximum 
-unsigned int AOS::getMinMaxFromFBO(glm::vec4* fboData, const unsigned int fboSize, unsigned int& count, glm::vec4& minRGBA, glm::vec4& maxRGBA)
+// project the views with ids in a single pass per texture array (and per AOS_MAX_VIEWS_PER_PASS views)
+// the framebuffer and the shader (incl. uniforms that do not depend on the views) have to be set up by the caller, forward passes draw the DEM with projection and view
+void AOS::projectViewsSinglePass(Shader* shader, const std::vector<unsigned int>& ids, bool forward, const glm::mat4& projection, const glm::mat4& view)
 {
-	minRGBA.r = minRGBA.g = minRGBA.b = minRGBA.a = numeric_limits<float>::max();
-	maxRGBA.r = maxRGBA.g = maxRGBA.b = maxRGBA.a = numeric_limits<float>::min();
-	count = 0;
+	// per-view data in std140 layout: mat4 projViewMatrices[MAX]; vec4 viewLayers[MAX];
+	std::vector<glm::mat4> matrices(AOS_MAX_VIEWS_PER_PASS);
+	std::vector<glm::vec4> layers(AOS_MAX_VIEWS_PER_PASS);
+	if (viewUBO == 0) {
+		glGenBuffers(1, &viewUBO);
+		glBindBuffer(GL_UNIFORM_BUFFER, viewUBO);
+		glBufferData(GL_UNIFORM_BUFFER, AOS_MAX_VIEWS_PER_PASS * (sizeof(glm::mat4) + sizeof(glm::vec4)), NULL, GL_DYNAMIC_DRAW);
+	}
+	glBindBufferBase(GL_UNIFORM_BUFFER, 0, viewUBO);
 
-	for (int i = 0; i < fboSize; i++)
+	for (unsigned int a = 0; a < view_arrays.size(); a++)
 	{
-		auto px = fboData[i];
+		glActiveTexture(forward ? GL_TEXTURE0 : GL_TEXTURE1);
+		glBindTexture(GL_TEXTURE_2D_ARRAY, view_arrays[a]);
 
-		if (px.a > 0)
+		unsigned int n = 0;
+		for (size_t i = 0; i <= ids.size(); i++)
 		{
-			px.r /= px.a; px.g /= px.a; px.b /= px.a;
-			minRGBA = glm::min(minRGBA, px);
-			maxRGBA = glm::max(maxRGBA, px);
-			count++;
+			if (i < ids.size() && ids[i] / view_array_layers == a)
+			{
+				const View& v = ogl_imgs[ids[i]];
+				matrices[n] = projection_imgs * v.corr * v.pose;
+				layers[n] = glm::vec4((float)(ids[i] % view_array_layers));
+				n++;
+			}
+			if (n > 0 && (n == AOS_MAX_VIEWS_PER_PASS || i == ids.size()))
+			{
+				glBufferSubData(GL_UNIFORM_BUFFER, 0, n * sizeof(glm::mat4), matrices.data());
+				glBufferSubData(GL_UNIFORM_BUFFER, AOS_MAX_VIEWS_PER_PASS * sizeof(glm::mat4), n * sizeof(glm::vec4), layers.data());
+				shader->setInt("numViews", n);
+				if (forward)
+					drawDEM(*shader, projection, view, dem_transf);
+				else
+					renderQuad();
+				n = 0;
+			}
 		}
 	}
+}
+
+
+// minimum, maximum and mean of the last rendered integral, computed with a reduction on the GPU (only if the integral changed)
+// only the partial results of the work groups are read back, not the framebuffer
+const IntegralStats& AOS::getStats()
+{
+	if (!fbo_stats_dirty)
+		return fboStats;
+
+	ProfileScope profile(this, "getStats");
+	beginStage("stats");
+	const unsigned int groups_x = (render_width + 15) / 16, groups_y = (render_height + 15) / 16; // see local_size in integral_stats.cs.glsl
+	const size_t partials_size = (size_t)groups_x * groups_y * 4 * sizeof(glm::vec4);
+	if (statsSSBO == 0) {
+		glGenBuffers(1, &statsSSBO);
+		glBindBuffer(GL_SHADER_STORAGE_BUFFER, statsSSBO);
+		glBufferData(GL_SHADER_STORAGE_BUFFER, partials_size, NULL, GL_DYNAMIC_READ);
+	}
 
-	return count;
+	statsShader->use();
+	glActiveTexture(GL_TEXTURE0);
+	glBindTexture(GL_TEXTURE_2D, tIntegral);
+	statsShader->setInt("integral", 0);
+	glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 0, statsSSBO);
+	glDispatchCompute(groups_x, groups_y, 1);
+	glMemoryBarrier(GL_BUFFER_UPDATE_BARRIER_BIT);
+
+	// reduce the partial results of the work groups
+	glm::vec4 minRGBA(numeric_limits<float>::max()), maxRGBA(-numeric_limits<float>::max());
+	glm::dvec4 sum(0.0);
+	double count = 0.0;
+	glBindBuffer(GL_SHADER_STORAGE_BUFFER, statsSSBO);
+	auto partials = (const glm::vec4*)glMapBufferRange(GL_SHADER_STORAGE_BUFFER, 0, partials_size, GL_MAP_READ_BIT);
+	for (unsigned int i = 0; i < groups_x * groups_y; i++)
+	{
+		const glm::vec4* p = partials + 4 * i; // min, max, sum, count
+		if (p[3].x > 0) {
+			minRGBA = glm::min(minRGBA, p[0]);
+			maxRGBA = glm::max(maxRGBA, p[1]);
+			sum += glm::dvec4(p[2]);
+			count += p[3].x;
+		}
+	}
+	glUnmapBuffer(GL_SHADER_STORAGE_BUFFER);
+	glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0);
+	endStage();
+	timings.bytes_read_back += partials_size;
+
+	fboStats.count = (unsigned int)count;
+	if (fboStats.count > 0) {
+		fboStats.min = minRGBA;
+		fboStats.max = maxRGBA;
+		fboStats.mean = glm::vec4(sum / count);
+	}
+	else
+		fboStats.min = fboStats.max = fboStats.mean = glm::vec4(0.0f);
+	fbo_stats_dirty = false;
 
+	return fboStats;
 }
 
 
 // renderQuad() renders a 1x1 XY quad in NDC
+// the VAO is owned by the AOS instance, because VAOs are not shared between OpenGL contexts
 // -----------------------------------------
-unsigned int quadVAO = 0;
-unsigned int quadVBO;
-void renderQuad()
+void AOS::renderQuad()
 {
 	if (quadVAO == 0)
 	{
@@ -484,4 +2657,4 @@ void renderQuad()
 	glBindVertexArray(quadVAO);
 	glDrawArrays(GL_TRIANGLE_STRIP, 0, 4);
 	glBindVertexArray(0);
-}
+}
\ No newline at end of file
@@ -9,6 +9,7 @@
 #include <sstream>
 #include <algorithm>
 #include <string>
+#include <cstring>
 #include <nlohmann/json.hpp> 
 #include <glm/glm.hpp>
 #include <glm/gtc/type_ptr.hpp>
@@ -26,6 +27,7 @@ AOSGenerator::AOSGenerator(void)
 
 AOSGenerator::~AOSGenerator(void)
 {
+	joinWorkers(); // the upload buffers are released with the AOS object
 }
 
 glm::mat4 ParseMatrix(json::value_type jMat) // Matrice 3x4
@@ -66,6 +68,20 @@ glm::mat4 ParseMatrix(json::value_type jMat) // Matrice 3x4
 
 void AOSGenerator::Generate(AOS* aos, const std::string& jsonPoseFile, const std::string& imgFilePath, const std::string& maskFile, bool replaceExt)
 {
+	Start(aos, jsonPoseFile, imgFilePath, maskFile, replaceExt);
+	while (!Done())
+		Poll(true);
+}
+
+void AOSGenerator::Start(AOS* aos, const std::string& jsonPoseFile, const std::string& imgFilePath, const std::string& maskFile, bool replaceExt,
+	unsigned int threads, std::function<void(size_t, size_t)> progress)
+{
+	Stop();
+	this->aos = aos;
+	this->progress = progress;
+	jobs.clear();
+	next_job = next_view = loaded = 0;
+
 	std::ifstream poseStream(jsonPoseFile);
 	if ( poseStream.fail() )
 	{
@@ -77,59 +93,157 @@ void AOSGenerator::Generate(AOS* aos, const std::string& jsonPoseFile, const std
 	poseStream >> j; // parse json
 	poseStream.close();
 
-	Image alpha = make_empty_image();
-
+	if (maskFile.size() > 0)
+	{
+		Image alpha = load_image(maskFile.c_str(), 0, 0, 1); // load a single-channel alpha image
+		if (is_empty_image(alpha))
+			std::cout << "Could not read mask image: " << maskFile << std::endl;
+		else
+			aos->setMask(alpha); // one mask texture shared by all views instead of an alpha channel per view
+		free_image(alpha);
+	}
 
 	//std::cout << "images size: " << j["images"].size() << std::endl;
-	if (j["images"].size() > 0)
-	{
-		//lf = new Lightfield(j["images"].size());
-		auto jimg = j["images"];
-		for (auto i = 0; i < jimg.size(); ++i) {
-			auto m = ParseMatrix(jimg[i]["M3x4"]);
-
-			std::string fname = (jimg[i]["imagefile"]);
-			auto pose = m;
-
-			std::string name = fname;
-			if(replaceExt) name.replace(fname.find(".tiff"), strlen(".tiff"), ".png"); // this is a hack: if images are png images but they are named *.tiff in the poses file!
-			Image img = load_image( (imgFilePath + "/" + name).c_str(), 0, 0, 3 ); // make sure to load 3 channels!
-			if (!is_empty_image(img))
-			{
-				if (is_empty_image(alpha)) // lazy init the mask image
-				{
-					if (maskFile.size() > 0)
-						alpha = load_image(maskFile.c_str(), 0, 0, 1); // load a single-channel alpha image 
-					
-					if (is_empty_image(alpha))
-					{
-						alpha = make_uniform_image(img.w, img.h, 1, 1.0f); // all ones image
-						std::cout << "Could not read mask image: " << maskFile << std::endl;
-					}
-				}
-				Image imgs[] = { img,alpha };
-				Image tmp = merge_images_channels( imgs, 2);
-				aos->addView(tmp, pose, name);
-				free_image(tmp);
-			}
-			free_image(img);
+	auto jimg = j["images"];
+	for (auto i = 0; i < jimg.size(); ++i) {
+		Job job;
+		job.pose = ParseMatrix(jimg[i]["M3x4"]);
+		std::string fname = (jimg[i]["imagefile"]);
+		job.name = fname;
+		if(replaceExt) job.name.replace(fname.find(".tiff"), strlen(".tiff"), ".png"); // this is a hack: if images are png images but they are named *.tiff in the poses file!
+		job.file = imgFilePath + "/" + job.name;
+		jobs.push_back(job);
 
 #ifdef DEBUG_OUTPUT
-			// DEBUG
-			std::cout << "---------------------------------" << std::endl;
-			std::cout << ">> AOSGenerator::Generate << " << std::endl;
-			std::cout << "imgfilename: " << jimg[i]["imagefile"] << std::endl;
-			std::cout << "JSON-matrix: " << jimg[i]["M3x4"] << std::endl;
-			//std::cout << "matrix(parsed): " << glm::to_string(pose) << std::endl;
-			auto translation = glm::vec3(glm::inverse(m)[3]);
-			std::cout << "position: " << glm::to_string(translation) << "\n";
-			std::cout << "pose-matrix: " << glm::to_string(aos->getPose(aos->getViews() - 1)) << std::endl;
-			std::cout << "---------------------------------" << std::endl;
+		// DEBUG
+		std::cout << "---------------------------------" << std::endl;
+		std::cout << ">> AOSGenerator::Start << " << std::endl;
+		std::cout << "imgfilename: " << jimg[i]["imagefile"] << std::endl;
+		std::cout << "JSON-matrix: " << jimg[i]["M3x4"] << std::endl;
+		auto translation = glm::vec3(glm::inverse(job.pose)[3]);
+		std::cout << "position: " << glm::to_string(translation) << "\n";
+		std::cout << "---------------------------------" << std::endl;
 #endif
+	}
+
+	if (threads == 0)
+		threads = glm::max(1u, std::thread::hardware_concurrency());
+	threads = (unsigned int)glm::min((size_t)threads, jobs.size());
+	stopping = false;
+	for (unsigned int t = 0; t < 2 * threads; t++) // two buffers per worker, so a worker can decode while its previous image is uploaded
+		free_slots.push_back(t);
+	for (unsigned int t = 0; t < threads; t++)
+		workers.emplace_back(&AOSGenerator::decodeLoop, this);
+	dispatchJobs();
+}
+
+// hands jobs to the workers as long as there are free upload buffers (on the thread of the OpenGL context)
+void AOSGenerator::dispatchJobs()
+{
+	while (next_job < jobs.size() && !free_slots.empty())
+	{
+		Job& job = jobs[next_job++];
+		int c = 0;
+		if (!load_image_info(job.file.c_str(), &job.w, &job.h, &c)) {
+			std::lock_guard<std::mutex> lock(mutex);
+			job.done = true; // not readable, no buffer needed
+			continue;
 		}
+		job.slot = free_slots.back();
+		free_slots.pop_back();
+		job.dst = aos->mapUploadBuffer(job.slot, (size_t)job.w * job.h * 3);
+		{
+			std::lock_guard<std::mutex> lock(mutex);
+			queue.push_back(&job - jobs.data());
+		}
+		work_cv.notify_one();
+	}
+}
 
+void AOSGenerator::decodeLoop()
+{
+	while (true)
+	{
+		size_t idx;
+		{
+			std::unique_lock<std::mutex> lock(mutex);
+			work_cv.wait(lock, [this] { return stopping || !queue.empty(); });
+			if (stopping)
+				return;
+			idx = queue.front();
+			queue.pop_front();
+		}
+		Job& job = jobs[idx];
+		int w = 0, h = 0;
+		unsigned char* pixels = load_image_interleaved(job.file.c_str(), &w, &h, 3); // make sure to load 3 channels!
+		const bool ok = pixels && w == job.w && h == job.h;
+		if (ok)
+			std::memcpy(job.dst, pixels, (size_t)w * h * 3);
+		if (pixels)
+			free_image_interleaved(pixels);
+		{
+			std::lock_guard<std::mutex> lock(mutex);
+			job.ok = ok;
+			job.done = true;
+		}
+		done_cv.notify_all();
+	}
+}
+
+size_t AOSGenerator::Poll(bool wait)
+{
+	size_t added = 0;
+	while (!Done())
+	{
+		Job& job = jobs[next_view];
+		{
+			std::unique_lock<std::mutex> lock(mutex);
+			if (wait && added == 0)
+				done_cv.wait(lock, [&job] { return job.done; });
+			if (!job.done)
+				break;
+		}
+		if (job.ok) {
+			aos->addViewFromUploadBuffer(job.slot, job.w, job.h, 3, PIX_UINT8, job.pose, job.name); // views without alpha are stored with 3 channels
+			aos->setValueRange(aos->getViews() - 1, 255.0f); // colors in [0,1] like load_image, the exposure adjustment is left alone
+			added++;
+		}
+		else
+			std::cout << "Could not read image: " << job.file << std::endl;
+		if (job.dst)
+			free_slots.push_back(job.slot);
+		next_view++;
+		loaded++;
+		if (progress)
+			progress(loaded, jobs.size());
+		dispatchJobs();
 	}
+	if (Done() && !workers.empty()) {
+		joinWorkers();
+		aos->releaseUploadBuffers();
+	}
+	return added;
+}
 
-	free_image(alpha);
+void AOSGenerator::joinWorkers()
+{
+	{
+		std::lock_guard<std::mutex> lock(mutex);
+		stopping = true;
+	}
+	work_cv.notify_all();
+	for (auto& t : workers)
+		t.join();
+	workers.clear();
+	queue.clear();
+	free_slots.clear();
+}
 
+void AOSGenerator::Stop()
+{
+	const bool running = !workers.empty();
+	joinWorkers();
+	if (running && aos)
+		aos->releaseUploadBuffers(); // unmaps the buffers of the images that were not added
+	next_view = jobs.size();
 }
@@ -0,0 +1,255 @@
+#include <glad/glad.h> // holds all OpenGL type declarations
+
+#include <string>
+#include <vector>
+#include <iostream>
+#include <stdexcept>
+#include <algorithm>
+
+// headless OpenGL ES 3.1 contexts (without a window) for rendering on servers/CI
+// EGL is loaded at runtime, so the module can be built and imported without it (e.g. on Windows)
+// ---------------------------------------------------
+
+#ifndef _WIN32
+#include <dlfcn.h>
+#include <EGL/egl.h>
+#include <EGL/eglext.h>
+
+struct HeadlessContext {
+    EGLDisplay display = EGL_NO_DISPLAY;
+    EGLContext context = EGL_NO_CONTEXT;
+    EGLSurface surface = EGL_NO_SURFACE; // 1x1 pbuffer, only if surfaceless contexts are not supported
+    std::string backend;
+};
+
+void DestroyHeadlessContext(HeadlessContext* ctx);
+
+// EGL functions (resolved at runtime)
+struct EGLFunctions {
+    PFNEGLGETPROCADDRESSPROC GetProcAddress = nullptr;
+    PFNEGLGETERRORPROC GetError = nullptr;
+    PFNEGLGETDISPLAYPROC GetDisplay = nullptr;
+    PFNEGLINITIALIZEPROC Initialize = nullptr;
+    PFNEGLQUERYSTRINGPROC QueryString = nullptr;
+    PFNEGLBINDAPIPROC BindAPI = nullptr;
+    PFNEGLCHOOSECONFIGPROC ChooseConfig = nullptr;
+    PFNEGLCREATECONTEXTPROC CreateContext = nullptr;
+    PFNEGLDESTROYCONTEXTPROC DestroyContext = nullptr;
+    PFNEGLCREATEPBUFFERSURFACEPROC CreatePbufferSurface = nullptr;
+    PFNEGLDESTROYSURFACEPROC DestroySurface = nullptr;
+    PFNEGLMAKECURRENTPROC MakeCurrent = nullptr;
+    PFNEGLGETCURRENTCONTEXTPROC GetCurrentContext = nullptr;
+    // extensions
+    PFNEGLGETPLATFORMDISPLAYEXTPROC GetPlatformDisplayEXT = nullptr;
+    PFNEGLQUERYDEVICESEXTPROC QueryDevicesEXT = nullptr;
+    PFNEGLQUERYDEVICESTRINGEXTPROC QueryDeviceStringEXT = nullptr;
+};
+
+static const EGLFunctions& LoadEGL()
+{
+    static EGLFunctions egl;
+    if (egl.GetProcAddress)
+        return egl;
+
+    void* lib = dlopen("libEGL.so.1", RTLD_NOW | RTLD_GLOBAL);
+    if (!lib) lib = dlopen("libEGL.so", RTLD_NOW | RTLD_GLOBAL);
+    if (!lib)
+        throw std::runtime_error("Error: could not load libEGL, which is required for headless rendering!");
+
+    egl.GetProcAddress = (PFNEGLGETPROCADDRESSPROC)dlsym(lib, "eglGetProcAddress");
+    if (!egl.GetProcAddress)
+        throw std::runtime_error("Error: libEGL does not provide eglGetProcAddress!");
+    auto load = [&](const char* name) { void* f = dlsym(lib, name); return f ? f : (void*)egl.GetProcAddress(name); };
+    egl.GetError = (PFNEGLGETERRORPROC)load("eglGetError");
+    egl.GetDisplay = (PFNEGLGETDISPLAYPROC)load("eglGetDisplay");
+    egl.Initialize = (PFNEGLINITIALIZEPROC)load("eglInitialize");
+    egl.QueryString = (PFNEGLQUERYSTRINGPROC)load("eglQueryString");
+    egl.BindAPI = (PFNEGLBINDAPIPROC)load("eglBindAPI");
+    egl.ChooseConfig = (PFNEGLCHOOSECONFIGPROC)load("eglChooseConfig");
+    egl.CreateContext = (PFNEGLCREATECONTEXTPROC)load("eglCreateContext");
+    egl.DestroyContext = (PFNEGLDESTROYCONTEXTPROC)load("eglDestroyContext");
+    egl.CreatePbufferSurface = (PFNEGLCREATEPBUFFERSURFACEPROC)load("eglCreatePbufferSurface");
+    egl.DestroySurface = (PFNEGLDESTROYSURFACEPROC)load("eglDestroySurface");
+    egl.MakeCurrent = (PFNEGLMAKECURRENTPROC)load("eglMakeCurrent");
+    egl.GetCurrentContext = (PFNEGLGETCURRENTCONTEXTPROC)load("eglGetCurrentContext");
+    egl.GetPlatformDisplayEXT = (PFNEGLGETPLATFORMDISPLAYEXTPROC)egl.GetProcAddress("eglGetPlatformDisplayEXT");
+    egl.QueryDevicesEXT = (PFNEGLQUERYDEVICESEXTPROC)egl.GetProcAddress("eglQueryDevicesEXT");
+    egl.QueryDeviceStringEXT = (PFNEGLQUERYDEVICESTRINGEXTPROC)egl.GetProcAddress("eglQueryDeviceStringEXT");
+    return egl;
+}
+
+static bool HasExtension(const char* extensions, const std::string& name)
+{
+    if (!extensions)
+        return false;
+    std::string ext = std::string(" ") + extensions + " ";
+    return ext.find(" " + name + " ") != std::string::npos;
+}
+
+// returns the EGL devices that are (not) software renderers
+static std::vector<EGLDeviceEXT> QueryEGLDevices(const EGLFunctions& egl, bool software)
+{
+    std::vector<EGLDeviceEXT> devices;
+    if (!egl.QueryDevicesEXT)
+        return devices;
+    EGLint n = 0;
+    if (!egl.QueryDevicesEXT(0, nullptr, &n) || n <= 0)
+        return devices;
+    std::vector<EGLDeviceEXT> all(n);
+    egl.QueryDevicesEXT(n, all.data(), &n);
+    for (EGLint i = 0; i < n; i++) {
+        const char* ext = egl.QueryDeviceStringEXT ? egl.QueryDeviceStringEXT(all[i], EGL_EXTENSIONS) : nullptr;
+        if (HasExtension(ext, "EGL_MESA_device_software") == software)
+            devices.push_back(all[i]);
+    }
+    return devices;
+}
+
+static EGLDisplay OpenEGLDisplay(const EGLFunctions& egl, const std::string& backend, int device, std::string& opened)
+{
+    const char* client_ext = egl.QueryString(EGL_NO_DISPLAY, EGL_EXTENSIONS);
+    EGLDisplay display = EGL_NO_DISPLAY;
+
+    // 1. a GPU (or the software renderer) selected with EGL_EXT_platform_device
+    if ((backend == "auto" || backend == "device" || backend == "software") && egl.GetPlatformDisplayEXT && HasExtension(client_ext, "EGL_EXT_platform_device"))
+    {
+        auto devices = QueryEGLDevices(egl, backend == "software");
+        if (std::max(device, 0) >= (int)devices.size() && backend != "auto")
+            throw std::runtime_error("Error: EGL device " + std::to_string(std::max(device, 0)) + " not found (" + std::to_string(devices.size()) + " available)!");
+        if (!devices.empty() && device < (int)devices.size()) {
+            display = egl.GetPlatformDisplayEXT(EGL_PLATFORM_DEVICE_EXT, devices[device < 0 ? 0 : device], nullptr);
+            opened = backend == "software" ? "software" : "device";
+        }
+    }
+    else if (backend == "device" || backend == "software")
+        throw std::runtime_error("Error: EGL_EXT_platform_device is not supported, use the 'surfaceless' backend!");
+
+    // 2. Mesa's surfaceless platform
+    if (display == EGL_NO_DISPLAY && (backend == "auto" || backend == "surfaceless") && egl.GetPlatformDisplayEXT && HasExtension(client_ext, "EGL_MESA_platform_surfaceless"))
+    {
+        display = egl.GetPlatformDisplayEXT(EGL_PLATFORM_SURFACELESS_MESA, EGL_DEFAULT_DISPLAY, nullptr);
+        opened = "surfaceless";
+    }
+
+    // 3. default display (e.g. older drivers)
+    if (display == EGL_NO_DISPLAY && backend == "auto")
+    {
+        display = egl.GetDisplay(EGL_DEFAULT_DISPLAY);
+        opened = "default";
+    }
+
+    if (display == EGL_NO_DISPLAY)
+        throw std::runtime_error("Error: could not open an EGL display for the backend '" + backend + "'!");
+    return display;
+}
+
+// utility function to create a headless OpenGL ES 3.1 context. backend is 'auto', 'device' (GPU), 'software' (llvmpipe) or 'surfaceless'.
+// the context is current after creation.
+// ---------------------------------------------------
+HeadlessContext* CreateHeadlessContext(const char* backend = "auto", int device = -1)
+{
+    const auto& egl = LoadEGL();
+    auto ctx = new HeadlessContext();
+    std::string opened;
+    try {
+        ctx->display = OpenEGLDisplay(egl, backend, device, opened);
+        ctx->backend = opened;
+        EGLint major, minor;
+        if (!egl.Initialize(ctx->display, &major, &minor))
+            throw std::runtime_error("Error: could not initialize EGL (" + std::to_string(egl.GetError()) + ")!");
+
+        if (!egl.BindAPI(EGL_OPENGL_ES_API))
+            throw std::runtime_error("Error: OpenGL ES is not supported by EGL!");
+
+        const bool surfaceless = HasExtension(egl.QueryString(ctx->display, EGL_EXTENSIONS), "EGL_KHR_surfaceless_context");
+        const EGLint config_attribs[] = {
+            EGL_RENDERABLE_TYPE, EGL_OPENGL_ES3_BIT,
+            EGL_SURFACE_TYPE, surfaceless ? 0 : EGL_PBUFFER_BIT,
+            EGL_RED_SIZE, 8, EGL_GREEN_SIZE, 8, EGL_BLUE_SIZE, 8, EGL_ALPHA_SIZE, 8,
+            EGL_DEPTH_SIZE, 24,
+            EGL_NONE };
+        EGLConfig config;
+        EGLint num_configs = 0;
+        if (!egl.ChooseConfig(ctx->display, config_attribs, &config, 1, &num_configs) || num_configs < 1)
+            throw std::runtime_error("Error: no EGL config for OpenGL ES 3 found!");
+
+        const EGLint context_attribs[] = { EGL_CONTEXT_MAJOR_VERSION, 3, EGL_CONTEXT_MINOR_VERSION, 1, EGL_NONE };
+        ctx->context = egl.CreateContext(ctx->display, config, EGL_NO_CONTEXT, context_attribs);
+        if (ctx->context == EGL_NO_CONTEXT)
+            throw std::runtime_error("Error: could not create an OpenGL ES 3.1 context (" + std::to_string(egl.GetError()) + ")!");
+
+        if (!surfaceless) {
+            const EGLint pbuffer_attribs[] = { EGL_WIDTH, 1, EGL_HEIGHT, 1, EGL_NONE };
+            ctx->surface = egl.CreatePbufferSurface(ctx->display, config, pbuffer_attribs);
+        }
+        if (!egl.MakeCurrent(ctx->display, ctx->surface, ctx->surface, ctx->context))
+            throw std::runtime_error("Error: could not make the EGL context current!");
+    }
+    catch (...) {
+        DestroyHeadlessContext(ctx);
+        throw;
+    }
+
+    // glad: load all OpenGL function pointers
+    // ---------------------------------------
+#ifdef OPENGLES2
+    if (!gladLoadGLES2Loader((GLADloadproc)egl.GetProcAddress))
+#else
+    if (!gladLoadGLLoader((GLADloadproc)egl.GetProcAddress))
+#endif
+    {
+        DestroyHeadlessContext(ctx);
+        throw std::runtime_error("Failed to initialize GLAD");
+    }
+
+    return ctx;
+}
+
+// makes the context current in the calling thread (a context can only be current in one thread at a time)
+void MakeHeadlessContextCurrent(HeadlessContext* ctx)
+{
+    const auto& egl = LoadEGL();
+    if (!egl.MakeCurrent(ctx->display, ctx->surface, ctx->surface, ctx->context))
+        throw std::runtime_error("Error: could not make the EGL context current!");
+}
+
+bool IsHeadlessContextCurrent(HeadlessContext* ctx)
+{
+    return ctx->context != EGL_NO_CONTEXT && LoadEGL().GetCurrentContext() == ctx->context;
+}
+
+std::string GetHeadlessBackend(HeadlessContext* ctx)
+{
+    return ctx->backend;
+}
+
+void DestroyHeadlessContext(HeadlessContext* ctx)
+{
+    if (!ctx)
+        return;
+    const auto& egl = LoadEGL();
+    if (ctx->context != EGL_NO_CONTEXT) {
+        if (egl.GetCurrentContext() == ctx->context)
+            egl.MakeCurrent(ctx->display, EGL_NO_SURFACE, EGL_NO_SURFACE, EGL_NO_CONTEXT);
+        egl.DestroyContext(ctx->display, ctx->context);
+    }
+    if (ctx->surface != EGL_NO_SURFACE)
+        egl.DestroySurface(ctx->display, ctx->surface);
+    // note: the display is not terminated, because EGL displays are shared by the whole process (e.g. with other contexts or GLFW)
+    delete ctx;
+}
+
+#else // _WIN32
+
+struct HeadlessContext {};
+
+HeadlessContext* CreateHeadlessContext(const char* backend = "auto", int device = -1)
+{
+    throw std::runtime_error("Error: headless contexts (EGL) are not supported on Windows, use PyGlfwWindow!");
+}
+void MakeHeadlessContextCurrent(HeadlessContext* ctx) {}
+bool IsHeadlessContextCurrent(HeadlessContext* ctx) { return false; }
+std::string GetHeadlessBackend(HeadlessContext* ctx) { return ""; }
+void DestroyHeadlessContext(HeadlessContext* ctx) { delete ctx; }
+
+#endif
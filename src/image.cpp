@@ -1280,6 +1280,25 @@ Image load_image_stb(const char *filename, int channels)
     return im;
 }
 
+bool load_image_info(const char* filename, int* w, int* h, int* c)
+{
+    return stbi_info(filename, w, h, c) != 0;
+}
+
+unsigned char* load_image_interleaved(const char* filename, int* w, int* h, int channels)
+{
+    int c;
+    unsigned char* data = stbi_load(filename, w, h, &c, channels); // 8-bit HWC, no conversion to float
+    if (!data)
+        fprintf(stderr, "Cannot load Image \"%s\"\nSTB Reason: %s\n", filename, stbi_failure_reason());
+    return data;
+}
+
+void free_image_interleaved(unsigned char* data)
+{
+    stbi_image_free(data);
+}
+
 Image prepare_image_ogl(Image src, int channels/*=0*/)
 {
     auto c = src.c;
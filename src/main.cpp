@@ -113,6 +113,7 @@ int main(int argc, char** argv)
     std::string posesFile = "../data/F0/poses/poses_first30.json";
     std::string imgFolder = "../data/F0/images_ldr/";
     std::string maskImage = "";
+    std::string lightFieldFile = "";
     float demTranslationZ = 0.0f;
     bool tmp_replaceTiff = false;
     bool normalize = false; bool colormap = false;
@@ -128,6 +129,7 @@ int main(int argc, char** argv)
     app.add_option("-z,--ztranslDEM",  demTranslationZ, "Translate the DEM on the z axis.");
     app.add_option("-v,--view",  currView, "view index for startup");
     app.add_option("--mask", maskImage, "The path to the alpha mask image.");
+    app.add_option("--lf", lightFieldFile, "The path to a packed light field (*.aoslf) that is loaded instead of POSES, IMG and MASK.");
     CLI11_PARSE(app, argc, argv);
 
     bool replaceTiff = tmp_replaceTiff || (0==imgFolder.compare("../data/F0/images_ldr/")); // this makes sure that replaceTiff is true with the F0 ldr scene
@@ -136,10 +138,14 @@ int main(int argc, char** argv)
     std::cout << "Settings " << std::endl;
     std::cout << "  field of view: " << fovDegree << " (degrees) " << std::endl;
     std::cout << "  digital elevation model file: " << demFile << " " << std::endl;
-    std::cout << "  pose file: " << posesFile << " " << std::endl;
-    std::cout << "  image folder: " << imgFolder << " " << std::endl;
-    if(maskImage.size()>0) 
-        std::cout << "  mask image: " << maskImage << " " << std::endl;
+    if (lightFieldFile.size() > 0)
+        std::cout << "  packed light field: " << lightFieldFile << " " << std::endl;
+    else {
+        std::cout << "  pose file: " << posesFile << " " << std::endl;
+        std::cout << "  image folder: " << imgFolder << " " << std::endl;
+        if(maskImage.size()>0) 
+            std::cout << "  mask image: " << maskImage << " " << std::endl;
+    }
     std::cout << "  replace tiff: " << (replaceTiff ? "yes" : "no") << " " << std::endl;
     std::cout << "  z translation of the DEM: " << demTranslationZ << " " << std::endl;
     std::cout << "  startup view: " << currView << " " << std::endl;
@@ -187,10 +193,20 @@ int main(int argc, char** argv)
 
 	// load the light field (matrices, textures, names ...)
 	// -----------------------
-	AOSGenerator generator;
-    generator.Generate(lf, posesFile, imgFolder, maskImage, replaceTiff);
+    AOSGenerator generator;
+    if (lightFieldFile.size() > 0) {
+        lf->loadLightField(lightFieldFile); // memory-mapped, no JSON parsing or image decoding (the value range is applied if the file was packed with normalize)
+        std::cout << "LF with " << lf->getViews() << " views loaded!" << std::endl;
+    }
+    else {
+        // the images are decoded on worker threads and added while the render loop runs
+        generator.Start(lf, posesFile, imgFolder, maskImage, replaceTiff, 0, [](size_t loaded, size_t total) {
+            if (loaded == total) std::cout << "LF with " << total << " views loaded!" << std::endl;
+        });
+        while (!generator.Done() && (int)lf->getViews() <= currView) // wait for the startup view
+            generator.Poll(true);
+    }
 	CHECK_GL_ERROR
-    std::cout << "LF with " << lf->getViews() << " views loaded!" << std::endl;
 
 
 
@@ -200,6 +216,7 @@ int main(int argc, char** argv)
     std::vector<unsigned int> render_ids;
     for (unsigned int i = 0; i < lf->getSize(); i++)
             render_ids.push_back(i);
+    bool pinholeActive = false;
 
 
     // set the startup view
@@ -225,6 +242,14 @@ int main(int argc, char** argv)
         // input
         // -----
         processInput(window);
+
+        // views that were decoded since the last frame
+        if (!generator.Done()) {
+            const unsigned int prev_views = lf->getSize();
+            generator.Poll();
+            for (unsigned int i = prev_views; !pinholeActive && i < lf->getSize(); i++)
+                render_ids.push_back(i); // new views are part of the open aperture
+        }
         // GUI
         // ---------------------------------------------------
         if (gui) {
@@ -233,15 +258,16 @@ int main(int argc, char** argv)
             ImGui_ImplGlfw_NewFrame();
             ImGui::NewFrame();
 
-            // some settings
-            static bool pinholeActive = false;
-
             // 2. Show a simple window that we create ourselves. We use a Begin/End pair to created a named window.
             {   char buffer[512];
                 sprintf_s(buffer, 512, "%s (fps: %.1f)", APP_NAME, ImGui::GetIO().Framerate);
                 static bool open_window = true;
                 ImGui::Begin(APP_NAME, &open_window, ImGuiWindowFlags_NoBackground );
                 ImGui::Text("FPS: %.1f", ImGui::GetIO().Framerate);
+                if (!generator.Done()) {
+                    sprintf_s(buffer, 512, "%zu/%zu views", generator.Loaded(), generator.Total());
+                    ImGui::ProgressBar((float)generator.Loaded() / generator.Total(), ImVec2(-1, 0), buffer);
+                }
                 //ImGui::SliderFloat("gamma", &gamma, 0.1f, 5.0f);   // Edit 1 float using a slider from 0.0f to 1.0f
 
                 if (ImGui::TreeNode("Display"))
@@ -254,6 +280,10 @@ int main(int argc, char** argv)
                     {
                         ImGui::InputInt3("RGB formula", &colormapRGB.r);
                     }
+                    static bool singlePass = lf->getSinglePassRendering();
+                    if (ImGui::Checkbox("single pass", &singlePass))
+                        lf->setSinglePassRendering(singlePass);
+                    ImGui::SameLine(); HelpMarker("Accumulate all views in a single draw call using texture arrays. Faster with many views, but needs additional GPU memory.");
 
                     ImGui::TreePop();
                 }
@@ -337,8 +367,7 @@ int main(int argc, char** argv)
                         }
 
                         // update correction matrizes
-                        for (unsigned int i = 0; i < lf->getSize(); i++)
-                            lf->setPoseCorrection( i, translate,  glm::radians(rotate) );
+                        lf->setPoseCorrections( std::vector<glm::vec3>(lf->getSize(), translate), std::vector<glm::vec3>(lf->getSize(), glm::radians(rotate)) );
 
 
                         ImGui::TreePop();
@@ -410,6 +439,7 @@ int main(int argc, char** argv)
     // optional: de-allocate all resources once they've outlived their purpose:
     // ------------------------------------------------------------------------
     // -------------------------------------------------------------------------------
+    generator.Stop(); // the decoding threads write into buffers of the OpenGL context
 
     DestroyWindow();
     return 0;
@@ -15,6 +15,16 @@
 #include <assert.h>
 #include <float.h>
 #include <limits.h>
+#if defined(_WIN32)
+#define WIN32_LEAN_AND_MEAN
+#define NOMINMAX
+#include <windows.h>
+#else
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
 
 
 
@@ -872,3 +882,44 @@ unsigned long custom_hash(char *str)
 
     return hash;
 }
+
+void *map_file(const char *filename, size_t *size)
+{
+    void *data = NULL;
+    *size = 0;
+#if defined(_WIN32)
+    HANDLE file = CreateFileA(filename, GENERIC_READ, FILE_SHARE_READ, NULL, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (file == INVALID_HANDLE_VALUE) return NULL;
+    LARGE_INTEGER file_size;
+    if (GetFileSizeEx(file, &file_size) && file_size.QuadPart > 0) {
+        HANDLE mapping = CreateFileMappingA(file, NULL, PAGE_READONLY, 0, 0, NULL);
+        if (mapping) {
+            data = MapViewOfFile(mapping, FILE_MAP_READ, 0, 0, 0);
+            CloseHandle(mapping); // the view keeps the mapping alive
+        }
+        if (data) *size = (size_t)file_size.QuadPart;
+    }
+    CloseHandle(file);
+#else
+    int fd = open(filename, O_RDONLY);
+    if (fd < 0) return NULL;
+    struct stat st;
+    if (fstat(fd, &st) == 0 && st.st_size > 0) {
+        data = mmap(NULL, (size_t)st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+        if (data == MAP_FAILED) data = NULL;
+        else *size = (size_t)st.st_size;
+    }
+    close(fd); // the mapping stays valid
+#endif
+    return data;
+}
+
+void unmap_file(void *data, size_t size)
+{
+    if (!data) return;
+#if defined(_WIN32)
+    UnmapViewOfFile(data);
+#else
+    munmap(data, size);
+#endif
+}